@@ -0,0 +1,180 @@
+"""add_attachment_blobs_content_addressed_storage
+
+Revision ID: add_attachment_blobs
+Revises: add_email_thread_keys
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+import hashlib
+import logging
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_attachment_blobs'
+down_revision: Union[str, None] = 'add_email_thread_keys'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _sha256_of_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _copy_file(source: Path, target: Path) -> None:
+    """Copie atomique : le fichier cible n'est jamais visible partiellement écrit."""
+    tmp_path = target.parent / f".{target.name}.{uuid.uuid4().hex}.tmp"
+    try:
+        shutil.copy2(source, tmp_path)
+        os.replace(tmp_path, target)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    tables = inspector.get_table_names()
+
+    if 'attachment_blobs' not in tables:
+        op.create_table(
+            'attachment_blobs',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('company_id', sa.Integer(), nullable=False),
+            sa.Column('sha256', sa.String(length=64), nullable=False),
+            sa.Column('file_path', sa.String(), nullable=False),
+            sa.Column('file_size', sa.Integer(), nullable=False),
+            sa.Column('ref_count', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()' if conn.dialect.name == 'postgresql' else 'CURRENT_TIMESTAMP'), nullable=False),
+            sa.ForeignKeyConstraint(['company_id'], ['companies.id']),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('company_id', 'sha256', name='uq_attachment_blobs_company_sha256'),
+        )
+        op.create_index('ix_attachment_blobs_id', 'attachment_blobs', ['id'])
+
+    if 'message_attachments' not in tables:
+        return
+
+    existing_columns = [col['name'] for col in inspector.get_columns('message_attachments')]
+    existing_indexes = [idx['name'] for idx in inspector.get_indexes('message_attachments')]
+    if 'blob_id' not in existing_columns:
+        op.add_column('message_attachments', sa.Column('blob_id', sa.Integer(), nullable=True))
+    if 'ix_message_attachments_blob_id' not in existing_indexes:
+        op.create_index('ix_message_attachments_blob_id', 'message_attachments', ['blob_id'])
+    existing_fks = [fk['name'] for fk in inspector.get_foreign_keys('message_attachments')]
+    if conn.dialect.name == 'postgresql' and 'fk_message_attachments_blob_id' not in existing_fks:
+        op.create_foreign_key(
+            'fk_message_attachments_blob_id', 'message_attachments', 'attachment_blobs', ['blob_id'], ['id']
+        )
+
+    # Dédoublonnage des fichiers existants : chaque contenu est copié (une seule fois par entreprise)
+    # vers <company_id>/attachments/<sha256><ext> et les pièces jointes pointent vers ce blob.
+    # Les anciens fichiers restent en place tant que la migration n'est pas commitée : ils sont listés
+    # dans LEGACY_FILES_MANIFEST et supprimés ensuite par scripts/cleanup_legacy_attachments.py.
+    from app.core.config import settings
+    from app.core.attachment_store import LEGACY_FILES_MANIFEST
+    upload_dir = Path(settings.UPLOAD_DIR)
+    legacy_files = []
+
+    blobs_table = sa.table(
+        'attachment_blobs',
+        sa.column('id', sa.Integer),
+        sa.column('company_id', sa.Integer),
+        sa.column('sha256', sa.String),
+        sa.column('file_path', sa.String),
+        sa.column('file_size', sa.Integer),
+        sa.column('ref_count', sa.Integer),
+    )
+    blobs = {
+        (row.company_id, row.sha256): (row.id, row.file_path)
+        for row in conn.execute(sa.text("SELECT id, company_id, sha256, file_path FROM attachment_blobs"))
+    }
+    blob_by_source = {}  # ancien chemin -> (blob_id, nouveau chemin) : un fichier partagé par plusieurs lignes
+
+    attachments = conn.execute(sa.text("""
+        SELECT message_attachments.id, message_attachments.file_path, inbox_messages.company_id
+        FROM message_attachments
+        JOIN inbox_messages ON inbox_messages.id = message_attachments.message_id
+        WHERE message_attachments.blob_id IS NULL
+          AND message_attachments.file_path IS NOT NULL
+          AND message_attachments.file_path != ''
+          AND inbox_messages.company_id IS NOT NULL
+        ORDER BY message_attachments.id
+    """)).fetchall()
+
+    for attachment in attachments:
+        source_key = (attachment.company_id, attachment.file_path)
+        if source_key not in blob_by_source:
+            source = upload_dir / attachment.file_path
+            if not source.is_file():
+                continue
+            sha256 = _sha256_of_file(source)
+            blob = blobs.get((attachment.company_id, sha256))
+            if blob is None:
+                relative_target = f"{attachment.company_id}/attachments/{sha256}{source.suffix.lower()}"
+                target = upload_dir / relative_target
+                target.parent.mkdir(parents=True, exist_ok=True)
+                if not target.exists():
+                    _copy_file(source, target)
+                if target.resolve() != source.resolve():
+                    legacy_files.append(attachment.file_path)
+                result = conn.execute(blobs_table.insert().values(
+                    company_id=attachment.company_id,
+                    sha256=sha256,
+                    file_path=relative_target,
+                    file_size=target.stat().st_size,
+                    ref_count=0,
+                ))
+                blob = (result.inserted_primary_key[0], relative_target)
+                blobs[(attachment.company_id, sha256)] = blob
+            elif (upload_dir / blob[1]).resolve() != source.resolve():
+                # Copie redondante d'un contenu déjà stocké
+                legacy_files.append(attachment.file_path)
+            blob_by_source[source_key] = blob
+
+        blob_id, blob_path = blob_by_source[source_key]
+        conn.execute(
+            sa.text("UPDATE message_attachments SET blob_id = :blob_id, file_path = :file_path WHERE id = :id"),
+            {"blob_id": blob_id, "file_path": blob_path, "id": attachment.id}
+        )
+
+    # Compteurs de références
+    op.execute("""
+        UPDATE attachment_blobs
+        SET ref_count = (
+            SELECT COUNT(*) FROM message_attachments
+            WHERE message_attachments.blob_id = attachment_blobs.id
+        )
+    """)
+
+    if legacy_files:
+        with open(upload_dir / LEGACY_FILES_MANIFEST, "a") as manifest:
+            manifest.writelines(f"{file_path}\n" for file_path in legacy_files)
+        logging.getLogger("alembic.runtime.migration").info(
+            f"{len(legacy_files)} ancien(s) fichier(s) de pièces jointes à supprimer après la migration : "
+            "python scripts/cleanup_legacy_attachments.py"
+        )
+
+
+def downgrade() -> None:
+    # Les fichiers restent à leur emplacement adressé par contenu (file_path des pièces jointes conservé)
+    conn = op.get_bind()
+    if conn.dialect.name == 'postgresql':
+        op.drop_constraint('fk_message_attachments_blob_id', 'message_attachments', type_='foreignkey')
+    op.drop_index('ix_message_attachments_blob_id', table_name='message_attachments')
+    op.drop_column('message_attachments', 'blob_id')
+    op.drop_index('ix_attachment_blobs_id', table_name='attachment_blobs')
+    op.drop_table('attachment_blobs')
@@ -0,0 +1,57 @@
+"""add_auto_reply_jobs
+
+Revision ID: add_auto_reply_jobs
+Revises: add_inbox_counters
+Create Date: 2026-10-17 22:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_auto_reply_jobs'
+down_revision: Union[str, None] = 'add_inbox_counters'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    tables = inspector.get_table_names()
+
+    if 'auto_reply_jobs' not in tables:
+        now = sa.text('now()' if conn.dialect.name == 'postgresql' else 'CURRENT_TIMESTAMP')
+        op.create_table(
+            'auto_reply_jobs',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('company_id', sa.Integer(), nullable=False),
+            sa.Column('conversation_id', sa.Integer(), nullable=False),
+            sa.Column('message_id', sa.Integer(), nullable=False),
+            sa.Column('idempotency_key', sa.String(length=64), nullable=False),
+            sa.Column('mode', sa.String(length=20), nullable=False),
+            sa.Column('status', sa.String(length=20), nullable=False, server_default='pending'),
+            sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('available_at', sa.DateTime(timezone=True), server_default=now, nullable=False),
+            sa.Column('locked_at', sa.DateTime(timezone=True), nullable=True),
+            sa.Column('reply_content', sa.Text(), nullable=True),
+            sa.Column('last_error', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=now, nullable=False),
+            sa.ForeignKeyConstraint(['company_id'], ['companies.id']),
+            sa.ForeignKeyConstraint(['conversation_id'], ['conversations.id'], ondelete='CASCADE'),
+            sa.ForeignKeyConstraint(['message_id'], ['inbox_messages.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('idempotency_key', name='uq_auto_reply_jobs_idempotency_key'),
+        )
+        op.create_index('ix_auto_reply_jobs_id', 'auto_reply_jobs', ['id'])
+        op.create_index('ix_auto_reply_jobs_status_available', 'auto_reply_jobs', ['status', 'available_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_auto_reply_jobs_status_available', table_name='auto_reply_jobs')
+    op.drop_index('ix_auto_reply_jobs_id', table_name='auto_reply_jobs')
+    op.drop_table('auto_reply_jobs')
@@ -0,0 +1,61 @@
+"""add_billing_export_jobs
+
+Revision ID: add_billing_export_jobs
+Revises: add_document_sequences
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_billing_export_jobs'
+down_revision: Union[str, None] = 'add_document_sequences'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    tables = inspector.get_table_names()
+
+    if 'billing_export_jobs' not in tables:
+        now = sa.text('now()' if conn.dialect.name == 'postgresql' else 'CURRENT_TIMESTAMP')
+        op.create_table(
+            'billing_export_jobs',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('company_id', sa.Integer(), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=True),
+            sa.Column('document_type', sa.String(length=20), nullable=False),
+            sa.Column('filters', sa.JSON(), nullable=False),
+            sa.Column('document_ids', sa.JSON(), nullable=False),
+            sa.Column('status', sa.String(length=20), nullable=False, server_default='pending'),
+            sa.Column('total', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('processed', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('failed_documents', sa.JSON(), nullable=False),
+            sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('locked_at', sa.DateTime(timezone=True), nullable=True),
+            sa.Column('file_path', sa.String(length=500), nullable=True),
+            sa.Column('file_size', sa.BigInteger(), nullable=True),
+            sa.Column('last_error', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=now, nullable=False),
+            sa.Column('completed_at', sa.DateTime(timezone=True), nullable=True),
+            sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ondelete='CASCADE'),
+            sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='SET NULL'),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_billing_export_jobs_id', 'billing_export_jobs', ['id'])
+        op.create_index('ix_billing_export_jobs_company_id', 'billing_export_jobs', ['company_id'])
+        op.create_index('ix_billing_export_jobs_status', 'billing_export_jobs', ['status', 'locked_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_billing_export_jobs_status', table_name='billing_export_jobs')
+    op.drop_index('ix_billing_export_jobs_company_id', table_name='billing_export_jobs')
+    op.drop_index('ix_billing_export_jobs_id', table_name='billing_export_jobs')
+    op.drop_table('billing_export_jobs')
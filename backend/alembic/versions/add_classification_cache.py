@@ -0,0 +1,60 @@
+"""add_classification_cache_entries
+
+Revision ID: add_classification_cache
+Revises: add_rate_limit_buckets
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_classification_cache'
+down_revision: Union[str, None] = 'add_rate_limit_buckets'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    tables = inspector.get_table_names()
+
+    if 'classification_cache_entries' not in tables:
+        now = sa.text('now()' if conn.dialect.name == 'postgresql' else 'CURRENT_TIMESTAMP')
+        op.create_table(
+            'classification_cache_entries',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('company_id', sa.Integer(), nullable=False),
+            sa.Column('kind', sa.String(length=20), nullable=False),
+            sa.Column('config_version', sa.String(length=32), nullable=False),
+            sa.Column('sender', sa.String(length=255), nullable=False),
+            sa.Column('fingerprint', sa.BigInteger(), nullable=False),
+            sa.Column('result', sa.String(length=64), nullable=False),
+            sa.Column('hit_count', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=now, nullable=False),
+            sa.Column('last_used_at', sa.DateTime(timezone=True), server_default=now, nullable=False),
+            sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+            sa.ForeignKeyConstraint(['company_id'], ['companies.id']),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_classification_cache_entries_id', 'classification_cache_entries', ['id'])
+        op.create_index(
+            'ix_classification_cache_lookup', 'classification_cache_entries',
+            ['company_id', 'kind', 'config_version', 'sender']
+        )
+        op.create_index(
+            'ix_classification_cache_company_last_used', 'classification_cache_entries',
+            ['company_id', 'last_used_at']
+        )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_classification_cache_company_last_used', table_name='classification_cache_entries')
+    op.drop_index('ix_classification_cache_lookup', table_name='classification_cache_entries')
+    op.drop_index('ix_classification_cache_entries_id', table_name='classification_cache_entries')
+    op.drop_table('classification_cache_entries')
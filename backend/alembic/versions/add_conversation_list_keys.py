@@ -0,0 +1,68 @@
+"""add_conversation_list_keys
+
+Revision ID: add_conversation_list_keys
+Revises: add_inbox_search_index
+Create Date: 2026-10-17 19:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_conversation_list_keys'
+down_revision: Union[str, None] = 'add_inbox_search_index'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+FIRST_CLIENT_COLUMNS = ('first_client_name', 'first_client_email', 'first_client_phone')
+
+
+def upgrade() -> None:
+    # Vérifier si les colonnes existent déjà
+    conn = op.get_bind()
+    inspector = inspect(conn)
+
+    if 'conversations' not in inspector.get_table_names():
+        return
+
+    existing_columns = [col['name'] for col in inspector.get_columns('conversations')]
+    existing_indexes = [idx['name'] for idx in inspector.get_indexes('conversations')]
+
+    # Expéditeur du premier message client, dénormalisé sur la conversation
+    for column in FIRST_CLIENT_COLUMNS:
+        if column not in existing_columns:
+            op.add_column('conversations', sa.Column(column, sa.String(), nullable=True))
+
+    # Backfill depuis le plus ancien message client de chaque conversation
+    first_client_message = """
+        SELECT inbox_messages.{column} FROM inbox_messages
+        WHERE inbox_messages.conversation_id = conversations.id AND inbox_messages.is_from_client = true
+        ORDER BY inbox_messages.created_at, inbox_messages.id
+        LIMIT 1
+    """
+    op.execute(f"""
+        UPDATE conversations
+        SET first_client_name = ({first_client_message.format(column='from_name')}),
+            first_client_email = ({first_client_message.format(column='from_email')}),
+            first_client_phone = ({first_client_message.format(column='from_phone')})
+        WHERE first_client_name IS NULL AND first_client_email IS NULL AND first_client_phone IS NULL
+    """)
+
+    # Pagination par clé de la liste de l'inbox
+    if 'ix_conversations_company_last_message' not in existing_indexes:
+        op.create_index(
+            'ix_conversations_company_last_message',
+            'conversations',
+            ['company_id', 'last_message_at', 'id']
+        )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_conversations_company_last_message', table_name='conversations')
+    for column in reversed(FIRST_CLIENT_COLUMNS):
+        op.drop_column('conversations', column)
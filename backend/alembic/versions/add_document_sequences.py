@@ -0,0 +1,48 @@
+"""add_document_sequences
+
+Revision ID: add_document_sequences
+Revises: add_auto_reply_jobs
+Create Date: 2026-10-17 23:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_document_sequences'
+down_revision: Union[str, None] = 'add_auto_reply_jobs'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    tables = inspector.get_table_names()
+
+    if 'document_sequences' not in tables:
+        now = sa.text('now()' if conn.dialect.name == 'postgresql' else 'CURRENT_TIMESTAMP')
+        # Pas de backfill : chaque séquence repart du plus grand numéro émis à sa première utilisation
+        op.create_table(
+            'document_sequences',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('company_id', sa.Integer(), nullable=False),
+            sa.Column('doc_type', sa.String(length=20), nullable=False),
+            sa.Column('year', sa.Integer(), nullable=False),
+            sa.Column('config_version', sa.String(length=32), nullable=False),
+            sa.Column('last_value', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('updated_at', sa.DateTime(timezone=True), server_default=now, nullable=False),
+            sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('company_id', 'doc_type', 'year', 'config_version', name='uq_document_sequences_scope'),
+        )
+        op.create_index('ix_document_sequences_id', 'document_sequences', ['id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_document_sequences_id', table_name='document_sequences')
+    op.drop_table('document_sequences')
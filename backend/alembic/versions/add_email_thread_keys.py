@@ -0,0 +1,128 @@
+"""add_email_thread_keys_table
+
+Revision ID: add_email_thread_keys
+Revises: add_inbox_message_dedup_keys
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+import hashlib
+import re
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_email_thread_keys'
+down_revision: Union[str, None] = 'add_inbox_message_dedup_keys'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 1000
+SUBJECT_PREFIXES = ["re:", "fwd:", "fw:", "tr:", "aw:"]
+
+
+def _subject_key(subject):
+    """Même règle que app.core.email_threading.subject_thread_key (copiée : migration figée)."""
+    normalized = (subject or "").strip()
+    while True:
+        found = False
+        for prefix in SUBJECT_PREFIXES:
+            if normalized.lower().startswith(prefix):
+                normalized = normalized[len(prefix):].strip().lstrip(":").strip()
+                found = True
+                break
+        if not found:
+            break
+    normalized = re.sub(r"\s+", " ", normalized).strip().lower()
+    if not normalized:
+        return None
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    tables = inspector.get_table_names()
+
+    if 'email_thread_keys' not in tables:
+        op.create_table(
+            'email_thread_keys',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('company_id', sa.Integer(), nullable=False),
+            sa.Column('conversation_id', sa.Integer(), nullable=False),
+            sa.Column('key_type', sa.String(length=16), nullable=False),
+            sa.Column('thread_key', sa.String(), nullable=False),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()' if conn.dialect.name == 'postgresql' else 'CURRENT_TIMESTAMP'), nullable=True),
+            sa.ForeignKeyConstraint(['company_id'], ['companies.id']),
+            sa.ForeignKeyConstraint(['conversation_id'], ['conversations.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('company_id', 'key_type', 'thread_key', name='uq_email_thread_keys_company_type_key'),
+        )
+        op.create_index('ix_email_thread_keys_id', 'email_thread_keys', ['id'])
+        op.create_index('ix_email_thread_keys_conversation_id', 'email_thread_keys', ['conversation_id'])
+
+    if 'conversations' not in tables or 'inbox_messages' not in tables:
+        return
+
+    # Backfill : clés déjà connues (la conversation la plus ancienne conserve une clé partagée)
+    known = {
+        (row.company_id, row.key_type, row.thread_key)
+        for row in conn.execute(sa.text("SELECT company_id, key_type, thread_key FROM email_thread_keys"))
+    }
+    keys_table = sa.table(
+        'email_thread_keys',
+        sa.column('company_id', sa.Integer),
+        sa.column('conversation_id', sa.Integer),
+        sa.column('key_type', sa.String),
+        sa.column('thread_key', sa.String),
+    )
+    pending = []
+
+    def add_key(company_id, conversation_id, key_type, thread_key):
+        identity = (company_id, key_type, thread_key)
+        if not thread_key or identity in known:
+            return
+        known.add(identity)
+        pending.append({
+            "company_id": company_id,
+            "conversation_id": conversation_id,
+            "key_type": key_type,
+            "thread_key": thread_key,
+        })
+        if len(pending) >= BATCH_SIZE:
+            op.bulk_insert(keys_table, pending)
+            pending.clear()
+
+    # Message-IDs des emails reçus (déjà normalisés par add_inbox_message_dedup_keys)
+    messages = conn.execute(sa.text("""
+        SELECT inbox_messages.company_id, inbox_messages.conversation_id, inbox_messages.message_id
+        FROM inbox_messages
+        JOIN conversations ON conversations.id = inbox_messages.conversation_id
+        WHERE inbox_messages.message_id IS NOT NULL
+          AND inbox_messages.company_id IS NOT NULL
+          AND conversations.source = 'email'
+        ORDER BY inbox_messages.id
+    """))
+    for row in messages:
+        add_key(row.company_id, row.conversation_id, 'message_id', row.message_id)
+
+    # Sujets normalisés des conversations email
+    conversations = conn.execute(sa.text("""
+        SELECT id, company_id, subject FROM conversations
+        WHERE source = 'email' AND subject IS NOT NULL
+        ORDER BY id
+    """))
+    for row in conversations:
+        add_key(row.company_id, row.id, 'subject', _subject_key(row.subject))
+
+    if pending:
+        op.bulk_insert(keys_table, pending)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_email_thread_keys_conversation_id', table_name='email_thread_keys')
+    op.drop_index('ix_email_thread_keys_id', table_name='email_thread_keys')
+    op.drop_table('email_thread_keys')
@@ -0,0 +1,36 @@
+"""add_imap_failed_uid_attempts_to_inbox_integrations
+
+Revision ID: add_imap_failed_uid_attempts
+Revises: add_billing_export_jobs
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_imap_failed_uid_attempts'
+down_revision: Union[str, None] = 'add_billing_export_jobs'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Vérifier si la colonne existe déjà
+    conn = op.get_bind()
+    inspector = inspect(conn)
+
+    if 'inbox_integrations' in inspector.get_table_names():
+        existing_columns = [col['name'] for col in inspector.get_columns('inbox_integrations')]
+
+        # Échecs par UID au-delà du high-water mark (abandon après IMAP_UID_MAX_ATTEMPTS)
+        if 'imap_failed_uid_attempts' not in existing_columns:
+            op.add_column('inbox_integrations', sa.Column('imap_failed_uid_attempts', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('inbox_integrations', 'imap_failed_uid_attempts')
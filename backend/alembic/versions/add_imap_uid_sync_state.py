@@ -0,0 +1,41 @@
+"""add_imap_uid_sync_state_to_inbox_integrations
+
+Revision ID: add_imap_uid_sync_state
+Revises: add_onboarding_fields
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_imap_uid_sync_state'
+down_revision: Union[str, None] = 'add_onboarding_fields'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Vérifier si les colonnes existent déjà
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    
+    if 'inbox_integrations' in inspector.get_table_names():
+        existing_columns = [col['name'] for col in inspector.get_columns('inbox_integrations')]
+        
+        # UIDVALIDITY de INBOX lors de la dernière sync
+        if 'imap_uidvalidity' not in existing_columns:
+            op.add_column('inbox_integrations', sa.Column('imap_uidvalidity', sa.BigInteger(), nullable=True))
+        
+        # Plus grand UID déjà ingéré (high-water mark)
+        if 'imap_last_uid' not in existing_columns:
+            op.add_column('inbox_integrations', sa.Column('imap_last_uid', sa.BigInteger(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('inbox_integrations', 'imap_last_uid')
+    op.drop_column('inbox_integrations', 'imap_uidvalidity')
@@ -0,0 +1,66 @@
+"""add_inbox_counters
+
+Revision ID: add_inbox_counters
+Revises: add_conversation_list_keys
+Create Date: 2026-10-17 20:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_inbox_counters'
+down_revision: Union[str, None] = 'add_conversation_list_keys'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    tables = inspector.get_table_names()
+
+    if 'inbox_counters' not in tables:
+        now = sa.text('now()' if conn.dialect.name == 'postgresql' else 'CURRENT_TIMESTAMP')
+        op.create_table(
+            'inbox_counters',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('company_id', sa.Integer(), nullable=False),
+            sa.Column('folder_id', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('total', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('unread', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('urgent', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('to_answer', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('waiting', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('pending_approval', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('updated_at', sa.DateTime(timezone=True), server_default=now, nullable=False),
+            sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('company_id', 'folder_id', name='uq_inbox_counters_company_folder'),
+        )
+        op.create_index('ix_inbox_counters_id', 'inbox_counters', ['id'])
+
+        # Backfill depuis les conversations existantes (0 = sans dossier)
+        op.execute("""
+            INSERT INTO inbox_counters (company_id, folder_id, total, unread, urgent, to_answer, waiting, pending_approval)
+            SELECT
+                company_id,
+                COALESCE(folder_id, 0),
+                COUNT(*),
+                SUM(CASE WHEN unread_count > 0 THEN 1 ELSE 0 END),
+                SUM(CASE WHEN status = 'Urgent' OR is_urgent = true THEN 1 ELSE 0 END),
+                SUM(CASE WHEN status = 'À répondre' THEN 1 ELSE 0 END),
+                SUM(CASE WHEN status = 'En attente' THEN 1 ELSE 0 END),
+                SUM(CASE WHEN auto_reply_pending = true AND auto_reply_mode = 'approval' THEN 1 ELSE 0 END)
+            FROM conversations
+            GROUP BY company_id, COALESCE(folder_id, 0)
+        """)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_inbox_counters_id', table_name='inbox_counters')
+    op.drop_table('inbox_counters')
@@ -0,0 +1,92 @@
+"""add_company_id_and_message_id_to_inbox_messages
+
+Revision ID: add_inbox_message_dedup_keys
+Revises: add_imap_uid_sync_state
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_inbox_message_dedup_keys'
+down_revision: Union[str, None] = 'add_imap_uid_sync_state'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Vérifier si les colonnes existent déjà
+    conn = op.get_bind()
+    inspector = inspect(conn)
+
+    if 'inbox_messages' not in inspector.get_table_names():
+        return
+
+    existing_columns = [col['name'] for col in inspector.get_columns('inbox_messages')]
+    existing_indexes = [idx['name'] for idx in inspector.get_indexes('inbox_messages')]
+
+    # Entreprise dénormalisée depuis la conversation
+    if 'company_id' not in existing_columns:
+        op.add_column('inbox_messages', sa.Column('company_id', sa.Integer(), nullable=True))
+
+    # Message-ID normalisé (sans < > ni espaces)
+    if 'message_id' not in existing_columns:
+        op.add_column('inbox_messages', sa.Column('message_id', sa.String(), nullable=True))
+
+    # Backfill de company_id
+    op.execute("""
+        UPDATE inbox_messages
+        SET company_id = (SELECT conversations.company_id FROM conversations WHERE conversations.id = inbox_messages.conversation_id)
+        WHERE company_id IS NULL
+    """)
+
+    # Backfill du Message-ID normalisé (même règle que normalize_message_id).
+    # Seul le plus ancien message de chaque (company_id, Message-ID) est renseigné :
+    # les doublons historiques restent à NULL pour permettre l'index unique.
+    trim_func = 'btrim' if conn.dialect.name == 'postgresql' else 'trim'
+    normalized = f"{trim_func}({trim_func}({trim_func}(external_id), '<>'))"
+    op.execute(f"""
+        UPDATE inbox_messages
+        SET message_id = NULLIF({normalized}, '')
+        WHERE message_id IS NULL
+          AND source = 'email'
+          AND external_id IS NOT NULL
+          AND id IN (
+              SELECT MIN(id) FROM inbox_messages
+              WHERE source = 'email' AND external_id IS NOT NULL AND company_id IS NOT NULL
+              GROUP BY company_id, {normalized}
+          )
+    """)
+
+    if 'ix_inbox_messages_company_id' not in existing_indexes:
+        op.create_index('ix_inbox_messages_company_id', 'inbox_messages', ['company_id'])
+
+    # Un Message-ID par entreprise : dédoublonnage et threading par égalité indexée
+    if 'uq_inbox_messages_company_message_id' not in existing_indexes:
+        op.create_index(
+            'uq_inbox_messages_company_message_id',
+            'inbox_messages',
+            ['company_id', 'message_id'],
+            unique=True
+        )
+
+    existing_fks = [fk['name'] for fk in inspector.get_foreign_keys('inbox_messages')]
+    if conn.dialect.name == 'postgresql' and 'fk_inbox_messages_company_id' not in existing_fks:
+        op.create_foreign_key(
+            'fk_inbox_messages_company_id', 'inbox_messages', 'companies', ['company_id'], ['id']
+        )
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    if conn.dialect.name == 'postgresql':
+        op.drop_constraint('fk_inbox_messages_company_id', 'inbox_messages', type_='foreignkey')
+    op.drop_index('uq_inbox_messages_company_message_id', table_name='inbox_messages')
+    op.drop_index('ix_inbox_messages_company_id', table_name='inbox_messages')
+    op.drop_column('inbox_messages', 'message_id')
+    op.drop_column('inbox_messages', 'company_id')
@@ -0,0 +1,63 @@
+"""add_inbox_search_index
+
+Index plein texte de l'inbox :
+- PostgreSQL : colonnes search_vector (tsvector 'french') générées + index GIN
+  sur conversations.subject et inbox_messages.content ;
+- SQLite : tables FTS5 à contenu externe maintenues par triggers.
+Les colonnes générées ne sont pas déclarées dans les modèles (gérées par la base).
+
+Revision ID: add_inbox_search_index
+Revises: add_classification_jobs
+Create Date: 2026-10-17 19:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_inbox_search_index'
+down_revision: Union[str, None] = 'add_classification_jobs'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = inspect(conn)
+
+    if conn.dialect.name == 'postgresql':
+        if 'search_vector' not in [c['name'] for c in inspector.get_columns('inbox_messages')]:
+            op.execute(
+                "ALTER TABLE inbox_messages ADD COLUMN search_vector tsvector "
+                "GENERATED ALWAYS AS (to_tsvector('french', coalesce(content, ''))) STORED"
+            )
+        if 'search_vector' not in [c['name'] for c in inspector.get_columns('conversations')]:
+            op.execute(
+                "ALTER TABLE conversations ADD COLUMN search_vector tsvector "
+                "GENERATED ALWAYS AS (to_tsvector('french', coalesce(subject, ''))) STORED"
+            )
+        op.execute("CREATE INDEX IF NOT EXISTS ix_inbox_messages_search_vector ON inbox_messages USING gin (search_vector)")
+        op.execute("CREATE INDEX IF NOT EXISTS ix_conversations_search_vector ON conversations USING gin (search_vector)")
+    elif conn.dialect.name == 'sqlite':
+        from app.core.inbox_search import ensure_search_index
+        ensure_search_index(conn)
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    if conn.dialect.name == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_conversations_search_vector")
+        op.execute("DROP INDEX IF EXISTS ix_inbox_messages_search_vector")
+        op.execute("ALTER TABLE conversations DROP COLUMN IF EXISTS search_vector")
+        op.execute("ALTER TABLE inbox_messages DROP COLUMN IF EXISTS search_vector")
+    elif conn.dialect.name == 'sqlite':
+        for trigger in (
+            'inbox_messages_fts_ai', 'inbox_messages_fts_ad', 'inbox_messages_fts_au',
+            'conversations_fts_ai', 'conversations_fts_ad', 'conversations_fts_au',
+        ):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS inbox_messages_fts")
+        op.execute("DROP TABLE IF EXISTS conversations_fts")
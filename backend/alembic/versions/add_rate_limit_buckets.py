@@ -0,0 +1,38 @@
+"""add_rate_limit_buckets_for_openai_limiter
+
+Revision ID: add_rate_limit_buckets
+Revises: add_attachment_blobs
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_rate_limit_buckets'
+down_revision: Union[str, None] = 'add_attachment_blobs'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = inspect(conn)
+    tables = inspector.get_table_names()
+
+    if 'rate_limit_buckets' not in tables:
+        op.create_table(
+            'rate_limit_buckets',
+            sa.Column('key', sa.String(length=64), nullable=False),
+            sa.Column('tokens', sa.Float(), nullable=False),
+            sa.Column('refilled_at', sa.Float(), nullable=False),
+            sa.PrimaryKeyConstraint('key'),
+        )
+
+
+def downgrade() -> None:
+    op.drop_table('rate_limit_buckets')
@@ -0,0 +1,155 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import FileResponse
+from sqlalchemy.orm import Session
+from typing import List
+from pathlib import Path
+from app.db.session import get_db
+from app.db.models.billing_export_job import BillingExportJob
+from app.db.models.user import User
+from app.api.deps import get_current_active_user
+from app.api.schemas.billing_export import BillingExportCreate, BillingExportRead
+from app.core.billing_export import archive_filename, create_export_job, resume_export_job
+
+router = APIRouter(prefix="/billing/exports", tags=["billing-exports"])
+
+
+def _to_read(job: BillingExportJob) -> BillingExportRead:
+    return BillingExportRead(
+        id=job.id,
+        document_type=job.document_type,
+        filters=job.filters or {},
+        status=job.status,
+        total=job.total,
+        processed=job.processed,
+        progress=(job.processed / job.total) if job.total else (1.0 if job.status == "completed" else 0.0),
+        failed_documents=job.failed_documents or [],
+        file_size=job.file_size,
+        last_error=job.last_error,
+        created_at=job.created_at,
+        completed_at=job.completed_at,
+    )
+
+
+def _get_job(db: Session, job_id: int, current_user: User) -> BillingExportJob:
+    if current_user.company_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User is not attached to a company"
+        )
+    job = db.query(BillingExportJob).filter(
+        BillingExportJob.id == job_id,
+        BillingExportJob.company_id == current_user.company_id
+    ).first()
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Export not found"
+        )
+    return job
+
+
+@router.post("", response_model=BillingExportRead, status_code=status.HTTP_202_ACCEPTED)
+def create_billing_export(
+    payload: BillingExportCreate,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Lance l'export en lot des PDF (factures ou devis) d'une période.
+    L'archive est préparée en arrière-plan : suivre la progression avec GET /billing/exports/{id}.
+    """
+    if current_user.company_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User is not attached to a company"
+        )
+    try:
+        job = create_export_job(
+            db,
+            current_user.company_id,
+            current_user.id,
+            payload.document_type,
+            date_from=payload.date_from,
+            date_to=payload.date_to,
+            status=payload.status,
+            invoice_type=payload.invoice_type
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    db.commit()
+    db.refresh(job)
+    return _to_read(job)
+
+
+@router.get("", response_model=List[BillingExportRead])
+def list_billing_exports(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Récupère les 20 derniers exports de l'entreprise.
+    """
+    if current_user.company_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User is not attached to a company"
+        )
+    jobs = db.query(BillingExportJob).filter(
+        BillingExportJob.company_id == current_user.company_id
+    ).order_by(BillingExportJob.created_at.desc(), BillingExportJob.id.desc()).limit(20).all()
+    return [_to_read(job) for job in jobs]
+
+
+@router.get("/{job_id}", response_model=BillingExportRead)
+def get_billing_export(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Progression d'un export.
+    """
+    return _to_read(_get_job(db, job_id, current_user))
+
+
+@router.post("/{job_id}/resume", response_model=BillingExportRead)
+def resume_billing_export(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Relance un export en échec ; les PDF déjà générés sont conservés.
+    """
+    job = _get_job(db, job_id, current_user)
+    if not resume_export_job(db, job):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Export {job.status}: seul un export en échec peut être relancé"
+        )
+    db.commit()
+    db.refresh(job)
+    return _to_read(job)
+
+
+@router.get("/{job_id}/download")
+def download_billing_export(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Télécharge l'archive ZIP d'un export terminé (servie en flux depuis le disque).
+    """
+    job = _get_job(db, job_id, current_user)
+    if job.status == "expired":
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail="Export expiré, relancez un export")
+    if job.status != "completed" or not job.file_path:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Export en cours de préparation")
+    if not Path(job.file_path).exists():
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail="Archive introuvable, relancez un export")
+    return FileResponse(
+        path=job.file_path,
+        media_type="application/zip",
+        filename=archive_filename(job)
+    )
@@ -22,6 +22,7 @@ from app.api.deps import (
 )
 from app.db.models.user import User
 from app.core.config import settings
+from app.core.pdf_image_loader import invalidate_company_assets
 from sqlalchemy.orm.attributes import flag_modified
 from pydantic import BaseModel
 
@@ -547,6 +548,7 @@ async def upload_company_logo(
     company_settings.settings["company_info"]["logo_path"] = storage_path
     flag_modified(company_settings, "settings")
     db.commit()
+    invalidate_company_assets(current_user.company_id)
     
     return {
         "logo_path": storage_path,
@@ -751,6 +753,7 @@ async def upload_company_signature(
     from sqlalchemy.orm.attributes import flag_modified
     flag_modified(company_settings, "settings")
     db.commit()
+    invalidate_company_assets(current_user.company_id)
     
     return {
         "signature_path": storage_path,
@@ -1,15 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query, UploadFile, File, Form, Request, Body
 from fastapi import Request as FastAPIRequest
-from fastapi.responses import FileResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import or_, and_
+from sqlalchemy import or_, and_, func
 from typing import List, Optional, Union, Any
 from pydantic import BaseModel, model_validator
 from datetime import datetime
 import os
 import shutil
-import uuid
 import logging
+from email.utils import make_msgid
 from pathlib import Path
 from app.db.session import get_db
 from app.db.models.conversation import (
@@ -18,15 +19,33 @@ from app.db.models.conversation import (
     MessageAttachment,
     InboxFolder,
     InternalNote,
+    normalize_message_id,
 )
 from app.db.models.client import Client
 from app.core.encryption_service import get_encryption_service
 from app.db.models.user import User
 from app.db.models.inbox_integration import InboxIntegration
 from app.db.models.company_settings import CompanySettings
+from app.db.models.classification_cache import ClassificationCacheEntry
+from app.db.models.inbox_counter import merge_folder_counters
 from app.core.imap_service import delete_email_imap_async
 from app.core.smtp_service import send_email_smtp, get_smtp_config
+from app.core.email_threading import register_thread_keys
+from app.core.attachment_store import AttachmentStore, acquire_blobs, blob_for_path, purge_unreferenced_blobs, get_file_type
 from app.core.conversation_classifier import auto_classify_conversation_status
+from app.core.folder_rules import invalidate_folder_rules
+from app.core.classification_cache import classification_cache
+from app.core.local_folder_classifier import local_folder_classifier
+from app.core.inbox_search import search_conversations
+from app.core.inbox_counters import get_inbox_counters, stream_inbox_counters
+from app.core.inbox_events import EVENT_FOLDER_DELETED, publish_event, stream_inbox_events
+from app.core.conversation_list import (
+    InvalidCursorError,
+    conversation_list_query,
+    fetch_page,
+    parse_fields,
+    row_to_dict,
+)
 from app.core.vonage_service import VonageSMSService, get_vonage_credentials_and_sender
 from app.core.ai_reply_service import ai_reply_service
 from app.api.schemas.inbox import (
@@ -43,7 +62,7 @@ from app.api.schemas.inbox import (
     FolderRead,
     AttachmentRead,
 )
-from app.api.deps import get_current_active_user
+from app.api.deps import get_current_active_user, get_current_active_user_from_token_or_query
 from app.core.config import settings
 from app.db.retry import execute_with_retry
 
@@ -57,25 +76,16 @@ limiter = None  # type: ignore
 UPLOAD_DIR = Path(settings.UPLOAD_DIR)
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
-def get_file_type(filename: str) -> str:
-    """Détermine le type de fichier basé sur l'extension."""
-    ext = Path(filename).suffix.lower()
-    if ext in [".jpg", ".jpeg", ".png", ".gif", ".webp"]:
-        return "image"
-    elif ext == ".pdf":
-        return "pdf"
-    elif ext in [".doc", ".docx", ".xls", ".xlsx", ".txt", ".csv"]:
-        return "document"
-    else:
-        return "other"
-
 
 # ===== CONVERSATIONS =====
 
 @router.get("/conversations", response_model=List[ConversationRead])
 def get_conversations(
-    skip: int = Query(0, ge=0),
-    limit: int = Query(1000, ge=1, le=10000),  # Limite augmentée à 1000 par défaut (max 10000)
+    response: Response,
+    skip: int = Query(0, ge=0, description="Décalage dans les résultats d'une recherche"),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="Curseur de la page suivante (en-tête X-Next-Cursor de la page précédente)"),
+    fields: Optional[str] = Query(None, description="Champs à renvoyer, séparés par des virgules (tous par défaut)"),
     folder_id: Optional[int] = Query(None, description="Filtrer par dossier"),
     status: Optional[str] = Query(None, description="Filtrer par statut"),
     source: Optional[str] = Query(None, description="Filtrer par source"),
@@ -86,24 +96,30 @@ def get_conversations(
     """
     Récupère la liste des conversations de l'entreprise de l'utilisateur.
     Chaque entreprise voit uniquement ses propres conversations.
+    
+    Triée par dernière activité et paginée par curseur : l'en-tête X-Next-Cursor (absent sur
+    la dernière page) se repasse dans `cursor`. `fields` limite les colonnes lues et renvoyées.
     """
+    # `status` est ici le filtre de statut (masque fastapi.status)
     if current_user.company_id is None:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
+            status_code=400,
             detail="User is not attached to a company"
         )
     
-    # Base query : filtrer par company_id
-    query = db.query(Conversation).filter(Conversation.company_id == current_user.company_id)
+    try:
+        selected_fields = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Base query : colonnes demandées, filtrées par company_id
+    query = conversation_list_query(db, current_user.company_id, selected_fields)
     
     # Filtres optionnels
+    # Si folder_id n'est pas fourni, on retourne toutes les conversations (avec ou sans dossier) :
+    # c'est le frontend qui filtre ensuite selon activeFolderId
     if folder_id:
         query = query.filter(Conversation.folder_id == folder_id)
-    # Si folder_id n'est pas spécifié, on affiche uniquement les conversations sans dossier (inbox principal)
-    # Pour cela, on ne fait rien, car par défaut on veut toutes les conversations
-    # Mais si folder_id est explicitement None, on filtre pour folder_id IS NULL
-    # Note: Si folder_id est None (non fourni), on retourne toutes les conversations (avec ou sans dossier)
-    # C'est le frontend qui filtre ensuite selon activeFolderId
     
     if status:
         query = query.filter(Conversation.status == status)
@@ -111,109 +127,133 @@ def get_conversations(
     if source:
         query = query.filter(Conversation.source == source)
     
-    # Recherche dans sujet et messages - Optimisé avec EXISTS au lieu de sous-requête IN
+    # Recherche dans sujet et messages : index plein texte (résultats classés par pertinence, page
+    # appliquée par la recherche, extraits surlignés), ILIKE si l'index n'est pas encore créé
+    search_hits = None
     if search:
-        search_term = f"%{search.lower()}%"
-        # Utiliser EXISTS pour de meilleures performances que IN avec sous-requête
-        from sqlalchemy import exists
-        subquery = db.query(InboxMessage.conversation_id).filter(
-            InboxMessage.content.ilike(search_term)
-        ).exists()
-        query = query.filter(
-            or_(
-                Conversation.subject.ilike(search_term),
-                subquery
+        try:
+            search_hits = search_conversations(
+                db, current_user.company_id, search,
+                folder_id=folder_id, status=status, source=source, limit=limit, offset=skip
+            )
+            query = query.filter(Conversation.id.in_([hit.conversation_id for hit in search_hits]))
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"[INBOX SEARCH] Index plein texte indisponible, recherche ILIKE: {e}")
+            search_term = f"%{search.lower()}%"
+            subquery = db.query(InboxMessage.conversation_id).filter(
+                InboxMessage.conversation_id == Conversation.id,
+                InboxMessage.content.ilike(search_term)
+            ).exists()
+            query = query.filter(
+                or_(
+                    Conversation.subject.ilike(search_term),
+                    subquery
+                )
             )
-        )
-    
-    # Charger les relations nécessaires en une seule requête (eager loading)
-    from sqlalchemy.orm import joinedload
-    query = query.options(
-        joinedload(Conversation.client),
-        joinedload(Conversation.assigned_to),
-        joinedload(Conversation.folder)
-    )
     
-    # Trier par dernière activité avec retry pour gérer les erreurs SSL
+    # Page suivante par clé (last_message_at, id) avec retry pour gérer les erreurs SSL
     def _get_conversations():
-        return query.order_by(
-            Conversation.last_message_at.desc().nullslast(),
-            Conversation.created_at.desc()
-        ).offset(skip).limit(limit).all()
-    conversations = execute_with_retry(db, _get_conversations, max_retries=3, initial_delay=0.5, max_delay=2.0)
-    
-    # Récupérer tous les premiers messages clients en une seule requête (optimisation N+1)
-    conversation_ids = [conv.id for conv in conversations]
-    first_client_messages = {}
-    if conversation_ids:
-        # Requête optimisée : récupérer le premier message client pour chaque conversation
-        from sqlalchemy import func
-        from sqlalchemy.orm import aliased
-        
-        # Sous-requête pour trouver la date minimale pour chaque conversation
-        min_dates = (
-            db.query(
-                InboxMessage.conversation_id,
-                func.min(InboxMessage.created_at).label('min_date')
-            )
-            .filter(
-                InboxMessage.conversation_id.in_(conversation_ids),
-                InboxMessage.is_from_client == True
-            )
-            .group_by(InboxMessage.conversation_id)
-            .subquery()
-        )
-        
-        # Récupérer les messages correspondants
-        messages = db.query(InboxMessage).join(
-            min_dates,
-            and_(
-                InboxMessage.conversation_id == min_dates.c.conversation_id,
-                InboxMessage.created_at == min_dates.c.min_date,
-                InboxMessage.is_from_client == True
-            )
-        ).all()
-        
-        for msg in messages:
-            if msg.conversation_id not in first_client_messages:
-                first_client_messages[msg.conversation_id] = msg
+        if search_hits is not None:
+            return query.all(), None
+        return fetch_page(query, limit, cursor)
+    try:
+        rows, next_cursor = execute_with_retry(db, _get_conversations, max_retries=3, initial_delay=0.5, max_delay=2.0)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    # Enrichir avec les noms et récupérer email/téléphone du premier message du client
-    result = []
-    for conv in conversations:
-        first_client_message = first_client_messages.get(conv.id)
-        
-        conv_dict = {
-            "id": conv.id,
-            "company_id": conv.company_id,
-            "subject": conv.subject,
-            "status": conv.status,
-            "source": conv.source,
-            "client_id": conv.client_id,
-            "folder_id": conv.folder_id,
-            "assigned_to_id": conv.assigned_to_id,
-            "is_urgent": conv.is_urgent,
-            "ai_classified": conv.ai_classified,
-            "classification_confidence": conv.classification_confidence,
-            "auto_reply_sent": conv.auto_reply_sent,
-            "auto_reply_pending": conv.auto_reply_pending,
-            "auto_reply_mode": conv.auto_reply_mode,
-            "unread_count": conv.unread_count,
-            "last_message_at": conv.last_message_at,
-            "created_at": conv.created_at,
-            "updated_at": conv.updated_at,
-            "client_name": (
-                conv.client.name if conv.client 
-                else (first_client_message.from_name if first_client_message and first_client_message.from_name else None)
-            ),
-            "assigned_to_name": conv.assigned_to.full_name if conv.assigned_to else None,
-            "folder_name": conv.folder.name if conv.folder else None,
-            "client_email": first_client_message.from_email if first_client_message else None,
-            "client_phone": first_client_message.from_phone if first_client_message else None,
-        }
-        result.append(ConversationRead(**conv_dict))
+    search_snippets = {}
+    if search_hits is not None:
+        # Ordre de pertinence de la recherche
+        position = {hit.conversation_id: i for i, hit in enumerate(search_hits)}
+        rows.sort(key=lambda row: position[row.id])
+        search_snippets = {hit.conversation_id: hit.snippet for hit in search_hits}
     
-    return result
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    response.headers.update(headers)
+    
+    result = []
+    for row in rows:
+        conv_dict = row_to_dict(row, selected_fields)
+        if search_hits is not None:
+            conv_dict["search_snippet"] = search_snippets.get(row.id)
+        result.append(conv_dict)
+    
+    if selected_fields is not None:
+        # Projection : renvoyée telle quelle (ConversationRead exige tous les champs)
+        return JSONResponse(content=jsonable_encoder(result), headers=headers)
+    return [ConversationRead(**conv_dict) for conv_dict in result]
+
+
+@router.get("/counters", response_model=dict)
+def get_counters(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Compteurs des badges de l'inbox (total, non lues, urgentes, à répondre, en attente,
+    à valider) pour l'entreprise et par dossier ("none" = sans dossier).
+    """
+    if current_user.company_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User is not attached to a company"
+        )
+    return execute_with_retry(
+        db, lambda: get_inbox_counters(db, current_user.company_id),
+        max_retries=3, initial_delay=0.5, max_delay=2.0
+    )
+
+
+@router.get("/counters/stream")
+async def stream_counters(
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user_from_token_or_query)
+):
+    """
+    Flux Server-Sent Events des compteurs : évènement "counters" (même contenu que GET /inbox/counters)
+    à l'ouverture puis à chaque changement. Token accepté en paramètre `token` (EventSource).
+    """
+    if current_user.company_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User is not attached to a company"
+        )
+    company_id = current_user.company_id
+    # Le flux ouvre ses propres sessions courtes : ne pas garder la connexion de la requête
+    db.close()
+    return StreamingResponse(
+        stream_inbox_counters(company_id, is_disconnected=request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/events/stream")
+async def stream_events(
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user_from_token_or_query)
+):
+    """
+    Flux Server-Sent Events des évènements de l'inbox de l'entreprise (conversation.created,
+    message.added, conversation.folder_changed, conversation.updated, folder.deleted).
+    Token accepté en paramètre `token` (EventSource).
+    """
+    if current_user.company_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User is not attached to a company"
+        )
+    company_id = current_user.company_id
+    # Aucune requête SQL pendant le flux : libérer la connexion de la requête
+    db.close()
+    return StreamingResponse(
+        stream_inbox_events(company_id, is_disconnected=request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @router.get("/conversations/{conversation_id}", response_model=ConversationDetail)
@@ -430,6 +470,7 @@ def create_conversation(
         )
         if folder_id:
             conversation.folder_id = folder_id
+            conversation.ai_classified = True
             folder_was_assigned = True
             print(f"[INBOX CREATE] Conversation {conversation.id} classée automatiquement dans le dossier ID: {folder_id}")
     
@@ -620,6 +661,9 @@ def update_conversation(
     update_data = conversation_data.model_dump(exclude_unset=True)
     for field, value in update_data.items():
         setattr(conversation, field, value)
+    if "folder_id" in update_data:
+        # Dossier choisi par l'utilisateur : exemple fiable pour le classifieur local
+        conversation.ai_classified = False
     
     db.commit()
     db.refresh(conversation)
@@ -750,6 +794,9 @@ async def delete_conversation(
     db.delete(conversation)
     db.commit()
     
+    # Fichiers des pièces jointes qui ne sont plus référencées par aucun message
+    purge_unreferenced_blobs(db, current_user.company_id)
+    
     return
 
 
@@ -866,6 +913,7 @@ async def _delete_conversations_bulk_logic(
             continue
     
     db.commit()
+    purge_unreferenced_blobs(db, current_user.company_id)
     
     if errors:
         logger.warning(f"Erreurs lors de la suppression en masse: {errors}")
@@ -923,6 +971,7 @@ def delete_all_conversations(
         db.delete(conversation)
     
     db.commit()
+    purge_unreferenced_blobs(db, current_user.company_id)
     
     return {
         "message": f"{deleted_count} conversation(s) supprimée(s) avec succès",
@@ -980,6 +1029,8 @@ def create_message(
     attachments = []
     if message_data.attachments:
         for att_data in message_data.attachments:
+            # Fichier uploadé via /messages/upload : référence sur son blob
+            blob = blob_for_path(db, current_user.company_id, att_data.get("file_path"))
             attachment = MessageAttachment(
                 message_id=message.id,
                 name=att_data.get("name", ""),
@@ -987,6 +1038,7 @@ def create_message(
                 file_path=att_data.get("file_path", ""),
                 file_size=att_data.get("file_size", 0),
                 mime_type=att_data.get("mime_type"),
+                blob_id=blob.id if blob else None,
             )
             db.add(attachment)
             attachments.append(attachment)
@@ -1014,6 +1066,7 @@ def create_message(
         )
         if folder_id:
             conversation.folder_id = folder_id
+            conversation.ai_classified = True
             print(f"[INBOX ADD MESSAGE] Conversation {conversation.id} classée automatiquement dans le dossier ID: {folder_id}")
     
     # Si l'entreprise répond manuellement, réinitialiser auto_reply_sent pour permettre de nouvelles auto-réponses
@@ -1080,6 +1133,15 @@ def create_message(
                                         "filename": att.name
                                     })
                     
+                    # En-têtes de threading : Message-ID sortant + réponse au dernier email reçu
+                    last_received = db.query(InboxMessage.external_id).filter(
+                        InboxMessage.conversation_id == conversation_id,
+                        InboxMessage.is_from_client == True,
+                        InboxMessage.external_id.isnot(None)
+                    ).order_by(InboxMessage.created_at.desc()).first()
+                    in_reply_to = f"<{normalize_message_id(last_received.external_id)}>" if last_received else None
+                    outbound_message_id = make_msgid(domain=primary_integration.email_address.split("@")[-1])
+                    
                     # Envoyer l'email via SMTP
                     print(f"[INBOX] Envoi de l'email via SMTP de {primary_integration.email_address} à {to_email}")
                     send_email_smtp(
@@ -1092,9 +1154,16 @@ def create_message(
                         content=message_data.content,
                         use_tls=smtp_config["use_tls"],
                         attachments=smtp_attachments if smtp_attachments else None,
-                        from_name=message_data.from_name or current_user.full_name
+                        from_name=message_data.from_name or current_user.full_name,
+                        message_id=outbound_message_id,
+                        in_reply_to=in_reply_to,
+                        references=[in_reply_to] if in_reply_to else None
                     )
                     print(f"[INBOX] Email envoyé avec succès à {to_email}")
+                    
+                    # La réponse du client (In-Reply-To = ce Message-ID) retrouvera la conversation
+                    register_thread_keys(db, conversation.company_id, conversation.id, [outbound_message_id], conversation.subject)
+                    db.commit()
                 else:
                     print(f"[INBOX] Impossible d'envoyer l'email: destinataire non trouvé")
             else:
@@ -1273,20 +1342,15 @@ async def upload_attachment(
                 detail="Executable files are not allowed"
         )
     
-    # Générer un nom de fichier unique
-    unique_filename = f"{uuid.uuid4()}{file_ext}"
-    company_upload_dir = UPLOAD_DIR / str(current_user.company_id)
-    company_upload_dir.mkdir(parents=True, exist_ok=True)
-    file_path = company_upload_dir / unique_filename
-    
-    # Sauvegarder le fichier
-    with open(file_path, "wb") as f:
-        f.write(file_content)
+    # Sauvegarder le fichier dans le stockage adressé par contenu (une copie par contenu identique)
+    stored = AttachmentStore(current_user.company_id, max_size=0).store(file.filename, file.content_type, file_content)
+    blob = acquire_blobs(db, current_user.company_id, [stored])[stored["sha256"]]
+    db.commit()
     
     # Retourner les infos du fichier (sera associé au message lors de la création)
     return {
         "filename": file.filename,
-        "file_path": str(file_path.relative_to(UPLOAD_DIR)),
+        "file_path": blob.file_path,
         "file_type": get_file_type(file.filename),
         "file_size": file_size,
         "mime_type": file.content_type,
@@ -1455,6 +1519,7 @@ def reclassify_conversation(
     
     if folder_id:
         conversation.folder_id = folder_id
+        conversation.ai_classified = True
         db.commit()
         db.refresh(conversation)
         
@@ -1567,6 +1632,36 @@ def get_folders(
         )
 
 
+@router.get("/classification-cache/stats", response_model=dict)
+def get_classification_cache_stats(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Statistiques du cache des classifications IA : taux de hit et appels IA évités
+    (compteurs du processus) + entrées et hits cumulés de l'entreprise (en base),
+    et messages classés par le classifieur local sans appel IA.
+    """
+    if current_user.company_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User is not attached to a company"
+        )
+    
+    entries, hits = db.query(
+        func.count(ClassificationCacheEntry.id),
+        func.coalesce(func.sum(ClassificationCacheEntry.hit_count), 0)
+    ).filter(
+        ClassificationCacheEntry.company_id == current_user.company_id
+    ).one()
+    
+    return {
+        "process": classification_cache.stats(),
+        "company": {"entries": entries, "hits": int(hits)},
+        "local_classifier": local_folder_classifier.stats(),
+    }
+
+
 @router.post("/folders", response_model=FolderRead, status_code=status.HTTP_201_CREATED)
 def create_folder(
     folder_data: FolderCreate,
@@ -1602,6 +1697,7 @@ def create_folder(
     db.add(folder)
     db.commit()
     db.refresh(folder)
+    invalidate_folder_rules(current_user.company_id)
     
     logger.info(f"[FOLDER CREATE] Dossier créé: {folder.name} (ID: {folder.id})")
     logger.info(f"[FOLDER CREATE] ai_rules reçus: {folder_data.ai_rules}")
@@ -1669,6 +1765,7 @@ def update_folder(
     
     db.commit()
     db.refresh(folder)
+    invalidate_folder_rules(current_user.company_id)
     
     # Vérifier si autoClassify est activé maintenant
     new_ai_rules = folder.ai_rules or {}
@@ -1724,13 +1821,16 @@ def delete_folder(
             detail="Cannot delete system folders. System folders are protected."
         )
     
-    # Réinitialiser les conversations de ce dossier
+    # Réinitialiser les conversations de ce dossier (compteurs reportés sur "sans dossier")
     db.query(Conversation).filter(
         Conversation.folder_id == folder_id
     ).update({"folder_id": None})
+    merge_folder_counters(db, current_user.company_id, folder_id)
+    publish_event(db, current_user.company_id, EVENT_FOLDER_DELETED, folder_id=folder_id)
     
     db.delete(folder)
     db.commit()
+    invalidate_folder_rules(current_user.company_id)
     
     return
 
@@ -1803,7 +1903,7 @@ async def generate_ai_reply(
         conversation.client.name if conversation.client 
         else (first_client_message.from_name if first_client_message and first_client_message.from_name else None)
     )
-    reply = ai_reply_service.generate_reply(
+    reply = await ai_reply_service.generate_reply_async(
         conversation_messages=messages_data,
         client_name=client_name,
         custom_prompt=custom_prompt
@@ -1884,7 +1984,7 @@ async def summarize_conversation(
         )
     
     # Générer le résumé avec l'IA
-    summary = ai_reply_service.summarize_message(
+    summary = await ai_reply_service.summarize_message_async(
         conversation_messages=messages_data,
         custom_prompt=custom_prompt
     )
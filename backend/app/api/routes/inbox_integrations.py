@@ -1,29 +1,33 @@
 """
 Routes pour gérer les intégrations (IMAP, API externes) pour recevoir les messages.
 """
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
-from typing import Optional, List, Tuple
-from app.db.session import get_db
+from typing import Optional, List, Tuple, Set, Callable
+from app.db.session import get_db, SessionLocal
 from app.db.models.company import Company
 from app.db.models.inbox_integration import InboxIntegration
 from app.api.deps import get_current_active_user
-from app.core.imap_service import fetch_emails_async, get_message_ids_from_imap_async
+from app.core.imap_connection_pool import refresh_idle_watchers
+from app.core.imap_service import fetch_emails_async, fetch_emails_incremental_async, get_message_ids_from_imap_async, apply_uid_failures
 from app.core.conversation_classifier import auto_classify_conversation_status
-from app.core.folder_ai_classifier import classify_conversation_to_folder
+from app.core.email_ingest import find_existing_message_ids
+from app.core.email_threading import normalize_subject, find_thread_conversation, register_thread_keys
+from app.core.attachment_store import AttachmentStore, acquire_blobs, get_file_type
+from app.core.classification_queue import enqueue_classification
+from app.core.folder_rules import invalidate_folder_rules
 from app.core.ai_classifier_service import AIClassifierService
 from app.api.schemas.inbox_integration import (
     InboxIntegrationCreate,
     InboxIntegrationUpdate,
     InboxIntegrationRead
 )
-from datetime import datetime, timedelta
-from app.db.models.conversation import Conversation, InboxMessage, InboxFolder, MessageAttachment
+from datetime import datetime
+from app.db.models.conversation import Conversation, InboxMessage, InboxFolder, MessageAttachment, normalize_message_id
 from app.db.models.client import Client
 from app.db.models.company_settings import CompanySettings
 from pathlib import Path
-import uuid
 from app.core.config import settings
 from app.core.encryption_service import get_encryption_service
 from app.db.retry import execute_with_retry
@@ -34,58 +38,9 @@ router = APIRouter(prefix="/inbox/integrations", tags=["inbox-integrations"])
 UPLOAD_DIR = Path(settings.UPLOAD_DIR)
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
-def get_file_type(filename: str) -> str:
-    """Détermine le type de fichier basé sur l'extension."""
-    ext = Path(filename).suffix.lower()
-    if ext in [".jpg", ".jpeg", ".png", ".gif", ".webp"]:
-        return "image"
-    elif ext == ".pdf":
-        return "pdf"
-    elif ext in [".doc", ".docx", ".xls", ".xlsx", ".txt", ".csv"]:
-        return "document"
-    else:
-        return "other"
-
 
 # ===== FONCTIONS UTILITAIRES =====
 
-def normalize_message_id(message_id: str) -> str:
-    """
-    Normalise un Message-ID en enlevant les chevrons < > et les espaces.
-    """
-    if not message_id:
-        return ""
-    return message_id.strip().strip("<>").strip()
-
-def normalize_subject(subject: str) -> str:
-    """
-    Normalise un sujet d'email en enlevant les préfixes Re:, RE:, Fwd:, etc.
-    Exemples:
-    - "Re: Bonjour" -> "Bonjour"
-    - "RE: Re: Test" -> "Test"
-    - "Fwd: Re: Hello" -> "Hello"
-    """
-    if not subject:
-        return ""
-    
-    # Enlever les préfixes courants (insensible à la casse)
-    prefixes = ["re:", "fwd:", "fw:", "tr:", "aw:"]
-    normalized = subject.strip()
-    
-    while True:
-        found = False
-        for prefix in prefixes:
-            if normalized.lower().startswith(prefix):
-                normalized = normalized[len(prefix):].strip()
-                # Enlever aussi les deux-points et espaces au début
-                normalized = normalized.lstrip(":").strip()
-                found = True
-                break
-        if not found:
-            break
-    
-    return normalized.strip()
-
 def find_conversation_from_reply(
     db: Session,
     company_id: int,
@@ -95,84 +50,11 @@ def find_conversation_from_reply(
     from_email: Optional[str]
 ) -> Optional[Conversation]:
     """
-    Trouve une conversation existante en utilisant les en-têtes In-Reply-To ou References.
-    Utilisé pour regrouper les réponses dans la même conversation.
+    Trouve une conversation existante en utilisant les en-têtes In-Reply-To ou References,
+    puis le sujet normalisé. Utilisé pour regrouper les réponses dans la même conversation.
+    Une seule requête sur l'index de threading (email_thread_keys).
     """
-    # D'abord, essayer de trouver via In-Reply-To
-    if in_reply_to:
-        normalized_in_reply_to = normalize_message_id(in_reply_to)
-        # Chercher un message avec ce Message-ID comme external_id
-        replied_message = db.query(InboxMessage).join(Conversation).filter(
-            Conversation.company_id == company_id,
-            Conversation.source == "email",
-            or_(
-                InboxMessage.external_id == normalized_in_reply_to,
-                InboxMessage.external_id == in_reply_to,
-                InboxMessage.external_id == f"<{normalized_in_reply_to}>",
-                InboxMessage.external_id.like(f"%{normalized_in_reply_to}%")
-            )
-        ).first()
-        
-        if replied_message:
-            # Retourner la conversation du message auquel on répond
-            conversation = db.query(Conversation).filter(
-                Conversation.id == replied_message.conversation_id,
-                Conversation.company_id == company_id
-            ).first()
-            if conversation:
-                return conversation
-    
-    # Ensuite, essayer via References (première référence = message original)
-    if references and len(references) > 0:
-        first_reference = normalize_message_id(references[0])
-        # Chercher un message avec ce Message-ID comme external_id
-        def _get_referenced_message():
-            return db.query(InboxMessage).join(Conversation).filter(
-                Conversation.company_id == company_id,
-                Conversation.source == "email",
-                or_(
-                    InboxMessage.external_id == first_reference,
-                    InboxMessage.external_id == references[0],
-                    InboxMessage.external_id == f"<{first_reference}>",
-                    InboxMessage.external_id.like(f"%{first_reference}%")
-                )
-            ).first()
-        referenced_message = execute_with_retry(db, _get_referenced_message, max_retries=3, initial_delay=0.5, max_delay=2.0)
-        
-        if referenced_message:
-            def _get_conversation_from_referenced_message():
-                return db.query(Conversation).filter(
-                    Conversation.id == referenced_message.conversation_id,
-                    Conversation.company_id == company_id
-                ).first()
-            conversation = execute_with_retry(db, _get_conversation_from_referenced_message, max_retries=3, initial_delay=0.5, max_delay=2.0)
-            if conversation:
-                return conversation
-    
-    # Enfin, essayer de trouver via le sujet normalisé (sans Re:, etc.)
-    if normalized_subject:
-        def _get_conversation_by_normalized_subject():
-            return db.query(Conversation).filter(
-                Conversation.company_id == company_id,
-                Conversation.source == "email",
-                Conversation.subject == normalized_subject
-            ).first()
-        conversation = execute_with_retry(db, _get_conversation_by_normalized_subject, max_retries=3, initial_delay=0.5, max_delay=2.0)
-        if conversation:
-            return conversation
-        
-        # Aussi chercher avec le sujet original (au cas où)
-        def _get_conversation_by_subject_like():
-            return db.query(Conversation).filter(
-                Conversation.company_id == company_id,
-                Conversation.source == "email",
-                Conversation.subject.like(f"%{normalized_subject}%")
-            ).first()
-        conversation = execute_with_retry(db, _get_conversation_by_subject_like, max_retries=3, initial_delay=0.5, max_delay=2.0)
-        if conversation:
-            return conversation
-    
-    return None
+    return find_thread_conversation(db, company_id, in_reply_to, references, normalized_subject)
 
 def is_duplicate_message(db: Session, company_id: int, message_id: str, from_email: str, content: str, email_date: Optional[datetime] = None) -> bool:
     """
@@ -184,20 +66,31 @@ def is_duplicate_message(db: Session, company_id: int, message_id: str, from_ema
     
     normalized_id = normalize_message_id(message_id)
     
-    # Vérifier uniquement avec le Message-ID normalisé (vrais doublons uniquement)
-    existing = db.query(InboxMessage).join(Conversation).filter(
-        Conversation.company_id == company_id,
-        or_(
-            InboxMessage.external_id == normalized_id,
-            InboxMessage.external_id == message_id,
-            InboxMessage.external_id == f"<{normalized_id}>",
-            InboxMessage.external_id.like(f"%{normalized_id}%")
-        )
+    if not normalized_id:
+        return False
+    
+    # Vérifier uniquement avec le Message-ID normalisé (vrais doublons uniquement, recherche indexée)
+    existing = db.query(InboxMessage.id).filter(
+        InboxMessage.company_id == company_id,
+        InboxMessage.message_id == normalized_id
     ).first()
     
     # Si un message avec le même Message-ID existe déjà, c'est un vrai doublon
     return existing is not None
 
+def make_known_message_ids_checker(company_id: int) -> Callable[[List[str]], Set[str]]:
+    """
+    Callback de dédoublonnage passé au fetch IMAP (exécuté dans le thread IMAP).
+    Utilise sa propre session DB pour ne pas partager celle de l'appelant entre threads.
+    """
+    def _checker(message_ids: List[str]) -> Set[str]:
+        checker_db = SessionLocal()
+        try:
+            return find_existing_message_ids(checker_db, company_id, message_ids)
+        finally:
+            checker_db.close()
+    return _checker
+
 def detect_newsletter_or_spam(email_data: dict) -> Tuple[bool, str]:
     """
     Détecte si un email est une newsletter ou du spam.
@@ -245,6 +138,7 @@ def create_default_folders(db: Session, company_id: int):
     
     if created_count > 0:
         db.commit()
+        invalidate_folder_rules(company_id)
     
     return created_count
 
@@ -361,6 +255,7 @@ def create_integration(
     db.add(integration)
     db.commit()
     db.refresh(integration)
+    refresh_idle_watchers(db)
     
     # Masquer les secrets dans la réponse
     integration_dict = integration.__dict__.copy()
@@ -423,9 +318,16 @@ def update_integration(
             setattr(integration, field, encryption_service.encrypt(value))
         else:
             setattr(integration, field, value)
-    
+
+    # Changement de boîte : le high-water mark UID ne s'applique plus
+    if any(field in update_data for field in ['imap_server', 'imap_port', 'email_address']):
+        integration.imap_uidvalidity = None
+        integration.imap_last_uid = None
+        integration.imap_failed_uid_attempts = None
+
     db.commit()
     db.refresh(integration)
+    refresh_idle_watchers(db)
     
     # Masquer les secrets
     integration_dict = integration.__dict__.copy()
@@ -470,6 +372,7 @@ def delete_integration(
     
     db.delete(integration)
     db.commit()
+    refresh_idle_watchers(db)
     return
 
 
@@ -580,15 +483,20 @@ async def sync_integration(
         if integration.last_sync_at:
             since_hours = 6
         
-        emails = await fetch_emails_async(
+        # Incrémental par UID si un high-water mark existe, sinon fenêtre de dates
+        fetch_result = await fetch_emails_incremental_async(
             imap_server=integration.imap_server,
             imap_port=integration.imap_port or 993,
             email_address=integration.email_address,
             password=decrypted_password,
             company_code=company.code,
             use_ssl=integration.use_ssl if integration.use_ssl is not None else True,
-            since_hours=since_hours
+            since_hours=since_hours,
+            last_uid=integration.imap_last_uid,
+            uidvalidity=integration.imap_uidvalidity,
+            known_message_ids=make_known_message_ids_checker(company.id)
         )
+        emails = fetch_result["emails"]
         
         # Détecter et supprimer les emails supprimés depuis la boîte mail
         deleted_count = 0
@@ -770,7 +678,10 @@ async def sync_integration(
             print(f"[SYNC] Détection batch de {len(emails_without_client)} email(s) sans client...")
             try:
                 ai_service = AIClassifierService()
-                notification_results = ai_service.is_notification_email_batch(emails_without_client)
+                # Appel IA bloquant (create_chat_completion_sync) : dans un thread, pas sur la boucle d'évènements
+                notification_results = await asyncio.to_thread(
+                    ai_service.is_notification_email_batch, emails_without_client, company_id=company.id
+                )
                 notifications_count = sum(1 for v in notification_results.values() if v)
                 clients_count = len(notification_results) - notifications_count
                 print(f"[SYNC] ✅ Détection batch terminée: {notifications_count} notification(s), {clients_count} client(s)")
@@ -780,9 +691,6 @@ async def sync_integration(
                 for email_item in emails_without_client:
                     notification_results[email_item["email_id"]] = False
         
-        # ===== OPTIMISATION PHASE 1: Collecte des nouvelles conversations pour classification batch =====
-        new_conversations_for_classification = []  # Liste des nouvelles conversations à classifier en batch
-        
         # ===== OPTIMISATION PHASE 2: Batch commits =====
         # OPT 2: Traiter les emails par batch et commit par batch (15 emails par batch)
         BATCH_COMMIT_SIZE = 15
@@ -792,6 +700,10 @@ async def sync_integration(
         current_batch = []  # Emails du batch actuel
         
         for i, email_data in enumerate(unique_emails):
+            # SAVEPOINT par email : un échec n'annule que cet email, pas le reste du batch en cours
+            savepoint = None
+            created_client_email = None
+            normalized_message_id = None
             try:
                 # Préparer les données
                 message_id = email_data.get("message_id")
@@ -821,6 +733,8 @@ async def sync_integration(
                     print(f"[SYNC] ⚠️ Email filtré comme {filter_reason}: {email_data.get('subject', 'Sans sujet')[:50]} de {from_email}")
                     continue  # Skip cet email complètement
                 
+                savepoint = db.begin_nested()
+                
                 # Identifier ou créer le client (seulement si ce n'est pas une notification)
                 # OPT 3.1: Utiliser le cache préchargé au lieu d'une requête DB
                 # OPT 1.1: Utiliser les résultats de la détection batch
@@ -843,7 +757,8 @@ async def sync_integration(
                             content_preview = (email_data.get("content", "") or "")[:200]
                             
                             ai_service = AIClassifierService()
-                            is_real_client = ai_service.is_real_client_email(
+                            is_real_client = await asyncio.to_thread(
+                                ai_service.is_real_client_email,
                                 from_email=from_email,
                                 subject=subject,
                                 content_preview=content_preview,
@@ -862,6 +777,7 @@ async def sync_integration(
                                 db.flush()
                                 # Mettre à jour le cache pour les prochains emails
                                 existing_clients[from_email] = client
+                                created_client_email = from_email
                                 print(f"[SYNC] ✅ Nouveau client créé: {client.name} ({client.email})")
                             else:
                                 print(f"[SYNC] ⚠️ Email filtré (pas un vrai client): {from_email}")
@@ -876,40 +792,12 @@ async def sync_integration(
                 in_reply_to = email_data.get("in_reply_to")
                 references = email_data.get("references", [])
                 
-                conversation = None
-                
-                # D'abord, essayer de trouver via In-Reply-To ou References (pour les réponses)
-                if in_reply_to or references:
-                    conversation = find_conversation_from_reply(
-                        db,
-                        company.id,
-                        in_reply_to,
-                        references,
-                        normalized_subject,
-                        from_email
-                    )
-                    if conversation:
-                        print(f"[SYNC] Conversation trouvée via In-Reply-To/References: {conversation.id}")
-                
-                # Sinon, chercher par sujet (normalisé ou original)
-                if not conversation:
-                    if normalized_subject:
-                        conversation = db.query(Conversation).filter(
-                            Conversation.company_id == company.id,
-                            Conversation.source == "email",
-                            Conversation.subject == normalized_subject
-                        ).first()
-                    
-                    # Aussi chercher avec le sujet original
-                    if not conversation and subject:
-                        conversation = db.query(Conversation).filter(
-                            Conversation.company_id == company.id,
-                            Conversation.source == "email",
-                            Conversation.subject == subject
-                        ).first()
+                # Index de threading : In-Reply-To, toute la chaîne References puis hash du sujet (une requête)
+                conversation = find_thread_conversation(db, company.id, in_reply_to, references, subject)
+                if conversation:
+                    print(f"[SYNC] Conversation trouvée via l'index de threading: {conversation.id}")
                 
                 # Si aucune conversation trouvée, créer une nouvelle
-                is_new_conversation = False
                 if not conversation:
                     # Utiliser le sujet normalisé pour la nouvelle conversation
                     conversation_subject = normalized_subject if normalized_subject else subject
@@ -924,7 +812,6 @@ async def sync_integration(
                     )
                     db.add(conversation)
                     db.flush()
-                    is_new_conversation = True
                     print(f"[SYNC] ✅ Nouvelle conversation créée: ID={conversation.id} - Sujet='{conversation_subject[:50]}' - De={from_email}")
                 
                 # Normaliser le Message-ID avant de le stocker
@@ -934,6 +821,7 @@ async def sync_integration(
                 # Utiliser le contenu texte (déjà nettoyé du HTML) plutôt que le HTML brut
                 message = InboxMessage(
                     conversation_id=conversation.id,
+                    company_id=company.id,
                     from_name=email_data.get("from", {}).get("name", from_email or "Inconnu"),
                     from_email=from_email,
                     content=content,
@@ -950,46 +838,43 @@ async def sync_integration(
                 db.add(message)
                 db.flush()  # Pour obtenir l'ID du message
                 
+                # Index de threading : Message-ID reçu, Message-IDs référencés et sujet -> conversation
+                register_thread_keys(db, company.id, conversation.id, [message_id, in_reply_to] + list(references or []), subject)
+                
                 # Mettre à jour le cache des Message-IDs pour éviter les doublons dans la même sync
                 if normalized_message_id:
                     existing_message_ids.add(normalized_message_id)
                 
-                # Sauvegarder les pièces jointes
+                # Sauvegarder les pièces jointes (stockage adressé par contenu, une copie par fichier)
                 attachments_data = email_data.get("attachments", [])
                 if attachments_data:
-                    company_upload_dir = UPLOAD_DIR / str(company.id)
-                    company_upload_dir.mkdir(parents=True, exist_ok=True)
-                    
+                    attachment_store = AttachmentStore(company.id)
+                    stored_attachments = []
                     for att_data in attachments_data:
                         if not att_data.get("content"):
                             continue  # Skip si pas de contenu
-                        
                         filename = att_data.get("filename", "attachment")
-                        file_content = att_data.get("content")
-                        
-                        # Générer un nom de fichier unique
-                        file_ext = Path(filename).suffix or ""
-                        unique_filename = f"{uuid.uuid4()}{file_ext}"
-                        file_path = company_upload_dir / unique_filename
-                        
-                        # Sauvegarder le fichier
                         try:
-                            with open(file_path, "wb") as f:
-                                f.write(file_content)
-                            
-                            # Créer l'objet MessageAttachment
-                            attachment = MessageAttachment(
-                                message_id=message.id,
-                                name=filename,
-                                file_type=get_file_type(filename),
-                                file_path=str(file_path.relative_to(UPLOAD_DIR)),
-                                file_size=len(file_content),
-                                mime_type=att_data.get("content_type"),
-                            )
-                            db.add(attachment)
+                            stored = attachment_store.store(filename, att_data.get("content_type"), att_data["content"])
                         except Exception as e:
                             print(f"Erreur lors de la sauvegarde de la pièce jointe {filename}: {e}")
                             # Continue même si une pièce jointe échoue
+                            continue
+                        if not stored.get("too_large"):
+                            stored_attachments.append(stored)
+                    
+                    blobs = acquire_blobs(db, company.id, stored_attachments)
+                    for stored in stored_attachments:
+                        blob = blobs[stored["sha256"]]
+                        db.add(MessageAttachment(
+                            message_id=message.id,
+                            name=stored["filename"],
+                            file_type=get_file_type(stored["filename"]),
+                            file_path=blob.file_path,
+                            file_size=stored["file_size"],
+                            mime_type=stored.get("content_type"),
+                            blob_id=blob.id,
+                        ))
                 
                 db.flush()  # Flush pour sauvegarder les pièces jointes
                 
@@ -1002,17 +887,7 @@ async def sync_integration(
                     new_status = auto_classify_conversation_status(db, conversation, message)
                     conversation.status = new_status
                 
-                # OPT 1.2: Collecter les nouvelles conversations pour classification batch
-                # Au lieu de classifier immédiatement, on collecte pour un traitement batch à la fin
-                if is_new_conversation:
-                    new_conversations_for_classification.append({
-                        "conversation_id": conversation.id,
-                        "conversation": conversation,
-                        "message": message,
-                        "content": (message.content or "")[:500],
-                        "subject": conversation.subject or "",
-                        "from_email": message.from_email or message.from_phone or ""
-                    })
+                savepoint.commit()
                 
                 # OPT 2: Ajouter à la liste du batch au lieu de commit immédiat
                 current_batch.append({
@@ -1021,20 +896,17 @@ async def sync_integration(
                     "email_data": email_data
                 })
                 
-                # Commit par batch (tous les 15 emails)
+                # Commit par batch (tous les 15 emails), avec les jobs de classification en dossiers
+                # (classification IA et auto-réponse faites ensuite par la file de classification)
                 if len(current_batch) >= BATCH_COMMIT_SIZE:
                     try:
+                        db.flush()
+                        enqueue_classification(
+                            db, company.id, [(item["conversation"], item["message"]) for item in current_batch]
+                        )
                         db.commit()
                         print(f"[SYNC] ✅ Batch commit: {len(current_batch)} email(s) sauvegardé(s)")
                         
-                        # Traiter les auto-réponses pour ce batch
-                        for batch_item in current_batch:
-                            conv = batch_item["conversation"]
-                            msg = batch_item["message"]
-                            if conv.folder_id and msg.is_from_client:
-                                from app.core.auto_reply_service import trigger_auto_reply_if_needed
-                                trigger_auto_reply_if_needed(db, conv, msg)
-                        
                         processed += len(current_batch)
                         current_batch = []  # Réinitialiser le batch
                     except Exception as e:
@@ -1044,31 +916,35 @@ async def sync_integration(
                         for batch_item in current_batch:
                             errors.append({
                                 "email": batch_item["email_data"].get("from", {}).get("email"),
+                                "imap_uid": batch_item["email_data"].get("imap_uid"),
                                 "error": str(e)
                             })
                         current_batch = []
                 
             except Exception as e:
-                db.rollback()
+                # Annuler uniquement cet email (les emails du batch en cours restent à committer)
+                if savepoint is not None and savepoint.is_active:
+                    savepoint.rollback()
+                if created_client_email:
+                    existing_clients.pop(created_client_email, None)
+                if normalized_message_id:
+                    existing_message_ids.discard(normalized_message_id)
                 errors.append({
                     "email": email_data.get("from", {}).get("email"),
+                    "imap_uid": email_data.get("imap_uid"),
                     "error": str(e)
                 })
         
         # OPT 2: Commit le dernier batch s'il reste des emails
         if current_batch:
             try:
+                db.flush()
+                enqueue_classification(
+                    db, company.id, [(item["conversation"], item["message"]) for item in current_batch]
+                )
                 db.commit()
                 print(f"[SYNC] ✅ Batch commit final: {len(current_batch)} email(s) sauvegardé(s)")
                 
-                # Traiter les auto-réponses pour le dernier batch
-                for batch_item in current_batch:
-                    conv = batch_item["conversation"]
-                    msg = batch_item["message"]
-                    if conv.folder_id and msg.is_from_client:
-                        from app.core.auto_reply_service import trigger_auto_reply_if_needed
-                        trigger_auto_reply_if_needed(db, conv, msg)
-                
                 processed += len(current_batch)
             except Exception as e:
                 db.rollback()
@@ -1076,88 +952,21 @@ async def sync_integration(
                 for batch_item in current_batch:
                     errors.append({
                         "email": batch_item["email_data"].get("from", {}).get("email"),
+                        "imap_uid": batch_item["email_data"].get("imap_uid"),
                         "error": str(e)
                     })
         
-        # ===== OPTIMISATION PHASE 1: Classification batch des nouvelles conversations =====
-        # OPT 1.2: Classifier toutes les nouvelles conversations en un seul appel IA
-        if new_conversations_for_classification:
-            print(f"[SYNC] Classification batch de {len(new_conversations_for_classification)} nouvelle(s) conversation(s)...")
-            try:
-                # Récupérer les dossiers avec autoClassify activé
-                all_folders = db.query(InboxFolder).filter(
-                    InboxFolder.company_id == company.id
-                ).all()
-                
-                folders_with_ai = []
-                for folder in all_folders:
-                    filters = folder.ai_rules or {}
-                    if isinstance(filters, dict) and filters.get("autoClassify", False):
-                        folders_with_ai.append({
-                            "id": folder.id,
-                            "name": folder.name,
-                            "folder_type": getattr(folder, "folder_type", "general"),
-                            "ai_rules": filters
-                        })
-                
-                if folders_with_ai:
-                    # Préparer les messages pour le batch
-                    messages_for_batch = [
-                        {
-                            "conversation_id": item["conversation_id"],
-                            "content": item["content"],
-                            "subject": item["subject"],
-                            "from_email": item["from_email"]
-                        }
-                        for item in new_conversations_for_classification
-                    ]
-                    
-                    # Appeler la classification batch (un seul appel IA)
-                    ai_service = AIClassifierService()
-                    if ai_service and ai_service.enabled:
-                        batch_results = ai_service.classify_messages_batch(
-                            messages=messages_for_batch,
-                            folders=folders_with_ai,
-                            company_context=None
-                        )
-                        
-                        # Appliquer les résultats
-                        # IMPORTANT: Recharger les conversations depuis la DB car elles ont été commitées individuellement
-                        classified_count = 0
-                        conversation_ids_to_update = [
-                            item["conversation_id"]
-                            for item in new_conversations_for_classification
-                            if batch_results.get(item["conversation_id"])
-                        ]
-                        
-                        if conversation_ids_to_update:
-                            # Recharger les conversations depuis la DB pour les modifier
-                            conversations_to_update = db.query(Conversation).filter(
-                                Conversation.id.in_(conversation_ids_to_update)
-                            ).all()
-                            
-                            for conversation in conversations_to_update:
-                                folder_id = batch_results.get(conversation.id)
-                                if folder_id:
-                                    conversation.folder_id = folder_id
-                                    classified_count += 1
-                                    print(f"[SYNC] Nouvelle conversation {conversation.id} classée dans le dossier {folder_id}")
-                            
-                            if classified_count > 0:
-                                db.commit()  # Commit des classifications
-                                print(f"[SYNC] ✅ {classified_count} conversation(s) classée(s) en batch")
-                    else:
-                        print(f"[SYNC] ⚠️ Service IA non disponible, classification batch ignorée")
-                else:
-                    print(f"[SYNC] Aucun dossier avec autoClassify activé, classification batch ignorée")
-            except Exception as e:
-                print(f"[SYNC] Erreur lors de la classification batch: {e}")
-                import traceback
-                traceback.print_exc()
-                # Ne pas faire échouer la synchronisation si la classification échoue
-        
         # Mettre à jour les informations de synchronisation
         integration.last_sync_at = datetime.utcnow()
+        # High-water mark UID : les emails en échec restent au-delà pour être retentés
+        # (au plus IMAP_UID_MAX_ATTEMPTS fois par UID)
+        if fetch_result["uidvalidity"] is not None:
+            integration.imap_uidvalidity = fetch_result["uidvalidity"]
+            integration.imap_last_uid, integration.imap_failed_uid_attempts = apply_uid_failures(
+                fetch_result["max_uid"],
+                fetch_result["failed_uids"] + [error.get("imap_uid") for error in errors],
+                integration.imap_failed_uid_attempts if fetch_result["incremental"] else None
+            )
         if errors:
             integration.last_sync_status = "partial" if processed > 0 else "error"
             integration.last_sync_error = f"{len(errors)} erreur(s) lors de la synchronisation"
@@ -1167,46 +976,6 @@ async def sync_integration(
         
         db.commit()
         
-        # Reclassifier les conversations sans dossier après la synchronisation
-        # Cela permet de classer les conversations dans les bons dossiers même si les dossiers ont été créés/modifiés après
-        print(f"[SYNC] Reclassification des conversations sans dossier...")
-        try:
-            from app.core.folder_ai_classifier import reclassify_all_conversations
-            stats = reclassify_all_conversations(db=db, company_id=company.id, force=False)
-            print(f"[SYNC] Reclassification terminée: {stats.get('classified', 0)} conversation(s) classée(s)")
-            
-            # Déclencher l'auto-réponse pour les conversations nouvellement classées
-            if stats.get('classified', 0) > 0:
-                print(f"[SYNC] Déclenchement de l'auto-réponse pour les conversations nouvellement classées...")
-                from app.core.auto_reply_service import trigger_auto_reply_if_needed
-                
-                # Trouver les conversations qui viennent d'être classées (sans dossier avant, avec dossier maintenant)
-                # On récupère les conversations récemment mises à jour
-                recently_classified = db.query(Conversation).filter(
-                    Conversation.company_id == company.id,
-                    Conversation.folder_id.isnot(None),
-                    Conversation.updated_at >= datetime.utcnow() - timedelta(minutes=5)
-                ).all()
-                
-                auto_reply_triggered = 0
-                for conv in recently_classified:
-                    # Récupérer le dernier message du client
-                    last_message = db.query(InboxMessage).filter(
-                        InboxMessage.conversation_id == conv.id,
-                        InboxMessage.is_from_client == True
-                    ).order_by(InboxMessage.created_at.desc()).first()
-                    
-                    if last_message:
-                        trigger_auto_reply_if_needed(db, conv, last_message)
-                        auto_reply_triggered += 1
-                
-                print(f"[SYNC] Auto-réponse déclenchée pour {auto_reply_triggered} conversation(s)")
-        except Exception as e:
-            print(f"[SYNC] Erreur lors de la reclassification: {e}")
-            import traceback
-            traceback.print_exc()
-            # Ne pas faire échouer la synchronisation si la reclassification échoue
-        
         return {
             "status": "success",
             "processed": processed,
@@ -1316,7 +1085,8 @@ async def sync_imap_emails(
                     if not client:
                         ai_service = AIClassifierService()
                         content_preview = email_data.get("content", "")[:200] if email_data.get("content") else ""
-                        is_notification = ai_service.is_notification_email(
+                        is_notification = await asyncio.to_thread(
+                            ai_service.is_notification_email,
                             from_email=from_email,
                             subject=email_data.get("subject"),
                             content_preview=content_preview
@@ -1324,7 +1094,8 @@ async def sync_imap_emails(
                         
                         if not is_notification:
                             # Vérifier si c'est un vrai client (Option 6: Hybride IA + Liste noire)
-                            is_real_client = ai_service.is_real_client_email(
+                            is_real_client = await asyncio.to_thread(
+                                ai_service.is_real_client_email,
                                 from_email=from_email,
                                 subject=email_data.get("subject", ""),
                                 content_preview=content_preview,
@@ -1355,37 +1126,10 @@ async def sync_imap_emails(
                 in_reply_to = email_data.get("in_reply_to")
                 references = email_data.get("references", [])
                 
-                conversation = None
-                
-                # D'abord, essayer de trouver via In-Reply-To ou References (pour les réponses)
-                if in_reply_to or references:
-                    conversation = find_conversation_from_reply(
-                        db,
-                        company.id,
-                        in_reply_to,
-                        references,
-                        normalized_subject,
-                        from_email
-                    )
-                    if conversation:
-                        print(f"[SYNC] Conversation trouvée via In-Reply-To/References: {conversation.id}")
-                
-                # Sinon, chercher par sujet (normalisé ou original)
-                if not conversation:
-                    if normalized_subject:
-                        conversation = db.query(Conversation).filter(
-                            Conversation.company_id == company.id,
-                            Conversation.source == "email",
-                            Conversation.subject == normalized_subject
-                        ).first()
-                    
-                    # Aussi chercher avec le sujet original
-                    if not conversation and subject:
-                        conversation = db.query(Conversation).filter(
-                            Conversation.company_id == company.id,
-                            Conversation.source == "email",
-                            Conversation.subject == subject
-                        ).first()
+                # Index de threading : In-Reply-To, toute la chaîne References puis hash du sujet (une requête)
+                conversation = find_thread_conversation(db, company.id, in_reply_to, references, subject)
+                if conversation:
+                    print(f"[SYNC] Conversation trouvée via l'index de threading: {conversation.id}")
                 
                 # Si aucune conversation trouvée, créer une nouvelle
                 if not conversation:
@@ -1407,11 +1151,7 @@ async def sync_imap_emails(
                 # Vérifier si le message existe déjà (éviter les doublons)
                 message_id = email_data.get("message_id")
                 if message_id:
-                    existing_message = db.query(InboxMessage).filter(
-                        InboxMessage.external_id == message_id
-                    ).first()
-                    
-                    if existing_message:
+                    if is_duplicate_message(db, company.id, message_id, from_email, ""):
                         # Message déjà stocké, on le skip pour éviter les doublons
                         continue
                 
@@ -1420,6 +1160,7 @@ async def sync_imap_emails(
                 content = email_data.get("content", "")
                 message = InboxMessage(
                     conversation_id=conversation.id,
+                    company_id=company.id,
                     from_name=email_data.get("from", {}).get("name", from_email or "Inconnu"),
                     from_email=from_email,
                     content=content,
@@ -1434,9 +1175,14 @@ async def sync_imap_emails(
                 )
                 db.add(message)
                 
+                # Index de threading : Message-ID reçu, Message-IDs référencés et sujet -> conversation
+                register_thread_keys(db, company.id, conversation.id, [message_id, in_reply_to] + list(references or []), subject)
+                
                 conversation.last_message_at = datetime.utcnow()
                 conversation.unread_count += 1
                 
+                db.flush()
+                enqueue_classification(db, company.id, [(conversation, message)])
                 db.commit()
                 processed += 1
                 
@@ -1447,45 +1193,6 @@ async def sync_imap_emails(
                     "error": str(e)
                 })
         
-        # Reclassifier les conversations sans dossier après la synchronisation
-        # Cela permet de classer les conversations dans les bons dossiers même si les dossiers ont été créés/modifiés après
-        print(f"[SYNC IMAP] Reclassification des conversations sans dossier...")
-        try:
-            from app.core.folder_ai_classifier import reclassify_all_conversations
-            stats = reclassify_all_conversations(db=db, company_id=company.id, force=False)
-            print(f"[SYNC IMAP] Reclassification terminée: {stats.get('classified', 0)} conversation(s) classée(s)")
-            
-            # Déclencher l'auto-réponse pour les conversations nouvellement classées
-            if stats.get('classified', 0) > 0:
-                print(f"[SYNC IMAP] Déclenchement de l'auto-réponse pour les conversations nouvellement classées...")
-                from app.core.auto_reply_service import trigger_auto_reply_if_needed
-                
-                # Trouver les conversations qui viennent d'être classées (sans dossier avant, avec dossier maintenant)
-                recently_classified = db.query(Conversation).filter(
-                    Conversation.company_id == company.id,
-                    Conversation.folder_id.isnot(None),
-                    Conversation.updated_at >= datetime.utcnow() - timedelta(minutes=5)
-                ).all()
-                
-                auto_reply_triggered = 0
-                for conv in recently_classified:
-                    # Récupérer le dernier message du client
-                    last_message = db.query(InboxMessage).filter(
-                        InboxMessage.conversation_id == conv.id,
-                        InboxMessage.is_from_client == True
-                    ).order_by(InboxMessage.created_at.desc()).first()
-                    
-                    if last_message:
-                        trigger_auto_reply_if_needed(db, conv, last_message)
-                        auto_reply_triggered += 1
-                
-                print(f"[SYNC IMAP] Auto-réponse déclenchée pour {auto_reply_triggered} conversation(s)")
-        except Exception as e:
-            print(f"[SYNC IMAP] Erreur lors de la reclassification: {e}")
-            import traceback
-            traceback.print_exc()
-            # Ne pas faire échouer la synchronisation si la reclassification échoue
-        
         return {
             "status": "success",
             "processed": processed,
@@ -1552,13 +1259,15 @@ async def sync_all_integrations_endpoint(
         
         logger.info("🔄 Déclenchement de la synchronisation inbox via API...")
         
-        # Exécuter la synchronisation (la fonction est async)
-        await sync_all_integrations()
+        # Exécuter la synchronisation (la fonction est async, les intégrations tournent en parallèle)
+        sync_result = await sync_all_integrations()
         
         return {
             "success": True,
             "message": "Synchronisation inbox terminée avec succès",
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now().isoformat(),
+            "stats": (sync_result or {}).get("totals"),
+            "integrations": (sync_result or {}).get("integrations", [])
         }
         
     except ImportError as e:
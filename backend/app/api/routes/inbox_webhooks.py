@@ -6,7 +6,7 @@ from sqlalchemy.orm import Session
 from typing import Optional
 from datetime import datetime
 from app.db.session import get_db
-from app.db.models.conversation import Conversation, InboxMessage, MessageAttachment
+from app.db.models.conversation import Conversation, InboxMessage, MessageAttachment, normalize_message_id
 from app.db.models.client import Client
 from app.db.models.company import Company
 from app.db.models.inbox_integration import InboxIntegration
@@ -14,6 +14,7 @@ from app.api.schemas.inbox import MessageRead, AttachmentRead
 from app.core.config import settings
 from app.core.vonage_service import VonageSMSService
 from app.core.conversation_classifier import auto_classify_conversation_status
+from app.core.email_threading import find_thread_conversation, register_thread_keys
 import hmac
 import hashlib
 import json
@@ -121,6 +122,20 @@ async def receive_email_webhook(
                 detail="Company not found"
             )
         
+        # Webhook rejoué : le Message-ID est déjà stocké pour cette entreprise
+        normalized_message_id = normalize_message_id(data.get("message_id") or "")
+        if normalized_message_id:
+            existing_message = db.query(InboxMessage).filter(
+                InboxMessage.company_id == company.id,
+                InboxMessage.message_id == normalized_message_id
+            ).first()
+            if existing_message:
+                return {
+                    "status": "duplicate",
+                    "conversation_id": existing_message.conversation_id,
+                    "message_id": existing_message.id
+                }
+        
         # Identifier ou créer le client par email
         from_email = data.get("from", {}).get("email")
         client = None
@@ -143,15 +158,13 @@ async def receive_email_webhook(
         
         # Chercher une conversation existante ou en créer une nouvelle
         subject = data.get("subject", "")
-        conversation = None
+        in_reply_to = data.get("in_reply_to")
+        references = data.get("references") or []
+        if isinstance(references, str):
+            references = references.split()
         
-        if subject:
-            # Chercher par sujet (thread email)
-            conversation = db.query(Conversation).filter(
-                Conversation.company_id == company.id,
-                Conversation.subject == subject,
-                Conversation.source == "email"
-            ).first()
+        # Thread email : In-Reply-To, References puis sujet normalisé (table email_thread_keys)
+        conversation = find_thread_conversation(db, company.id, in_reply_to, references, subject)
         
         if not conversation:
             # Créer une nouvelle conversation
@@ -185,6 +198,7 @@ async def receive_email_webhook(
         )
         db.add(message)
         db.flush()
+        register_thread_keys(db, company.id, conversation.id, [data.get("message_id"), in_reply_to] + references, subject)
         
         # Traiter les attachments si présents
         attachments_data = data.get("attachments", [])
@@ -500,29 +514,14 @@ async def receive_sms_webhook(
             new_status = auto_classify_conversation_status(db, conversation, inbox_message)
             conversation.status = new_status
         
-        # Classification automatique dans un dossier avec les filtres (seulement pour les conversations sans dossier)
-        if conversation.folder_id is None:
-            from app.core.folder_ai_classifier import classify_conversation_to_folder
-            folder_id = classify_conversation_to_folder(
-                db=db,
-                conversation=conversation,
-                message=inbox_message,
-                company_id=integration.company_id
-            )
-            if folder_id:
-                conversation.folder_id = folder_id
-                print(f"[SMS WEBHOOK] ⚠️ Conversation {conversation.id} classée automatiquement dans le dossier ID: {folder_id} (ne sera PAS dans l'inbox principal)")
+        # Classification dans un dossier et auto-réponse : confiées à la file de classification
+        from app.core.classification_queue import enqueue_classification
+        enqueue_classification(db, integration.company_id, [(conversation, inbox_message)])
         
         db.commit()
         db.refresh(inbox_message)
         db.refresh(conversation)
         
-        # Traiter la réponse automatique si la conversation est dans un dossier
-        # IMPORTANT: Déclencher l'auto-réponse dès qu'un message entre dans un dossier avec auto-réponse activée
-        if conversation.folder_id and inbox_message.is_from_client:
-            from app.core.auto_reply_service import trigger_auto_reply_if_needed
-            trigger_auto_reply_if_needed(db, conversation, inbox_message)
-        
         folder_info = f" - Dossier ID={conversation.folder_id}" if conversation.folder_id else " - Pas de dossier (inbox principal)"
         print(f"[SMS WEBHOOK] ✅ Message SMS traité avec succès: Message-ID={message_id} - Conversation ID={conversation.id}{folder_info}")
         
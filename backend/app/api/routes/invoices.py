@@ -30,7 +30,14 @@ from app.core.invoice_audit_service import (
     log_invoice_creation, log_invoice_update, log_status_change,
     log_invoice_deletion, log_invoice_archival, log_credit_note_creation
 )
-from app.core.invoice_pdf_service import generate_invoice_pdf
+from app.core.pdf_cache import cached_pdf_response, invoice_pdf_cache_key
+from app.core.pdf_render_pool import (
+    PdfRenderQueueFull,
+    PdfRenderTimeout,
+    invoice_render_config,
+    render_invoice_pdf,
+    render_invoice_pdf_sync,
+)
 from app.db.models.invoice_audit import InvoiceAuditLog
 from app.core.smtp_service import send_email_smtp, get_smtp_config
 from app.db.models.inbox_integration import InboxIntegration
@@ -1662,11 +1669,12 @@ def get_related_documents(
 @router.get("/{invoice_id}/pdf")
 def get_invoice_pdf(
     invoice_id: int,
+    request: Request,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
-    Génère et retourne le PDF d'une facture.
+    Retourne le PDF d'une facture (rendu mis en cache par contenu, ETag / If-None-Match).
     """
     if current_user.company_id is None:
         raise HTTPException(
@@ -1701,23 +1709,8 @@ def get_invoice_pdf(
         CompanySettings.company_id == current_user.company_id
     ).first()
     
-    company_info = {}
-    design_config = {}
-    if company_settings and company_settings.settings:
-        company_info_data = company_settings.settings.get("company_info", {})
-        company_info = {
-            "address": company_info_data.get("address"),
-            "phone": company_info_data.get("phone"),
-            "email": company_info_data.get("email")
-        }
-        
-        # Récupérer le logo et la signature depuis les settings
-        billing_settings = company_settings.settings.get("billing", {})
-        quote_design = billing_settings.get("quote_design", {})
-        design_config = {
-            "logo_path": company_info_data.get("logo_path"),  # Logo depuis company_info
-            "signature_path": quote_design.get("signature_path")  # Signature depuis quote_design
-        }
+    # Coordonnées, logo et signature depuis les settings
+    company_info, design_config = invoice_render_config(company_settings.settings if company_settings else None)
     
     # Récupérer le devis d'origine si la facture provient d'un devis
     quote = None
@@ -1726,19 +1719,29 @@ def get_invoice_pdf(
         quote = db.query(Quote).filter(Quote.id == invoice.quote_id).first()
     
     try:
-        pdf_bytes = generate_invoice_pdf(invoice, client=client, company_info=company_info, quote=quote, design_config=design_config)
         # Adapter le nom du fichier selon le type (facture ou avoir)
         if invoice.invoice_type == InvoiceType.AVOIR:
             filename = f"avoir_{invoice.number}.pdf"
         else:
             filename = f"facture_{invoice.number}.pdf"
         
-        return Response(
-            content=pdf_bytes,
-            media_type="application/pdf",
-            headers={
-                "Content-Disposition": f'inline; filename="{filename}"'
-            }
+        cache_key = invoice_pdf_cache_key(invoice, client, company_info, design_config, quote)
+        return cached_pdf_response(
+            request,
+            cache_key,
+            lambda: render_invoice_pdf_sync(invoice, client=client, company_info=company_info, quote=quote, design_config=design_config),
+            filename
+        )
+    except PdfRenderQueueFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Trop de PDF en cours de génération, veuillez réessayer",
+            headers={"Retry-After": "5"}
+        )
+    except PdfRenderTimeout:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="La génération du PDF a pris trop de temps"
         )
     except ImportError as e:
         raise HTTPException(
@@ -1906,10 +1909,16 @@ async def send_invoice_email(
         pdf_path = invoices_dir / pdf_filename
         
         try:
-            pdf_bytes = generate_invoice_pdf(invoice, client=client, company_info=company_info, quote=quote, design_config=design_config)
+            pdf_bytes = await render_invoice_pdf(invoice, client=client, company_info=company_info, quote=quote, design_config=design_config)
             # Sauvegarder le PDF
             with open(pdf_path, "wb") as f:
                 f.write(pdf_bytes)
+        except PdfRenderQueueFull:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Trop de PDF en cours de génération, veuillez réessayer",
+                headers={"Retry-After": "5"}
+            )
         except Exception as e:
             logger.error(f"[SEND INVOICE EMAIL] Erreur lors de la génération du PDF: {e}", exc_info=True)
             raise HTTPException(
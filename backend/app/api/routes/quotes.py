@@ -26,9 +26,18 @@ from app.core.invoice_service import (
     generate_invoice_number, recalculate_invoice_totals, validate_invoice_totals
 )
 from app.core.numbering_service import (
-    get_numbering_config, format_document_number, parse_document_number, get_next_number
+    get_numbering_config, format_document_number, parse_document_number,
+    allocate_sequence_number, document_number_pattern
 )
 from app.core.quote_pdf_service import generate_quote_pdf
+from app.core.pdf_cache import cached_pdf_response, quote_pdf_cache_key
+from app.core.pdf_render_pool import (
+    PdfRenderQueueFull,
+    PdfRenderTimeout,
+    quote_design_config,
+    render_quote_pdf,
+    render_quote_pdf_sync,
+)
 from app.db.models.conversation import Conversation, InboxMessage, MessageAttachment
 from app.db.models.inbox_integration import InboxIntegration
 from app.core.smtp_service import send_email_smtp, get_smtp_config
@@ -63,8 +72,9 @@ def generate_quote_number(db: Session, company_id: int, last_failed_number: Opti
     """
     Génère un numéro de devis séquentiel inviolable selon la configuration de l'entreprise.
     
-    Le numéro est généré de manière séquentielle pour chaque entreprise et chaque année,
-    sans rupture dans la séquence. Gère les race conditions en vérifiant l'unicité.
+    Le numéro est attribué par la séquence de l'entreprise pour l'année (voir
+    allocate_sequence_number), sans rupture dans la séquence : la ligne de séquence reste
+    verrouillée jusqu'au commit, le devis doit être créé dans la même transaction.
     Utilise la configuration personnalisable de numérotation si disponible.
     
     Args:
@@ -81,108 +91,26 @@ def generate_quote_number(db: Session, company_id: int, last_failed_number: Opti
     company_settings = company_settings_obj.settings if company_settings_obj else None
     config = get_numbering_config(company_settings, "quotes")
     
-    # Si un numéro a échoué, on commence à partir de celui-ci + 1
+    # Si un numéro a échoué (numéro déjà pris hors séquence), repartir au-delà
+    at_least = None
     if last_failed_number:
-        try:
-            # Parser le numéro échoué avec la config actuelle
-            failed_number = parse_document_number(last_failed_number, config)
-            if failed_number is not None:
-                next_number = failed_number + 1
-                logger.info(f"[QUOTE NUMBER] Reprise après échec: dernier numéro tenté {last_failed_number}, prochain: {next_number}")
-            else:
-                # Si le parsing échoue, on continue avec la logique normale
-                last_failed_number = None
-        except (ValueError, IndexError):
-            last_failed_number = None
-    
-    # Si pas de numéro échoué, trouver le numéro maximum existant
-    if not last_failed_number:
-        # Construire le pattern pour chercher les numéros de cette année
-        # Utiliser la config pour construire le pattern
-        prefix = config.get("prefix", "DEV")
-        separator = config.get("separator", "-")
-        year_format = config.get("year_format", "YYYY")
-        year_str = str(current_year) if year_format == "YYYY" else str(current_year)[-2:]
-        
-        # Pattern pour LIKE: "DEV-2025-%" ou selon la config
-        pattern = f"{prefix}{separator}{year_str}{separator}%"
-        
-        # Récupérer tous les devis de cette année pour cette entreprise
-        quotes = db.query(Quote).filter(
+        failed_number = parse_document_number(last_failed_number, config)
+        if failed_number is not None:
+            at_least = failed_number + 1
+            logger.info(f"[QUOTE NUMBER] Reprise après échec: dernier numéro tenté {last_failed_number}, prochain: {at_least}")
+    
+    def existing_numbers():
+        pattern = document_number_pattern(current_year, config)
+        return [number for (number,) in db.query(Quote.number).filter(
             Quote.company_id == company_id,
             Quote.number.like(pattern)
-        ).all()
-        
-        quotes_numbers = [quote.number for quote in quotes]
-        
-        logger.info(f"[QUOTE NUMBER] Devis trouvés pour company_id={company_id}, année={current_year}: {len(quotes_numbers)} devis")
-        
-        if quotes_numbers:
-            # Parser tous les numéros existants avec la config actuelle
-            parsed_numbers = []
-            for quote_number in quotes_numbers:
-                parsed = parse_document_number(quote_number, config)
-                if parsed is not None:
-                    parsed_numbers.append(parsed)
-            
-            if parsed_numbers:
-                max_number = max(parsed_numbers)
-                # Utiliser get_next_number pour respecter le start_number
-                start_number = config.get("start_number", 1)
-                next_number = get_next_number(max_number, start_number, parsed_numbers)
-                logger.info(f"[QUOTE NUMBER] Numéros valides trouvés: {sorted(parsed_numbers)}, maximum: {max_number}, start_number: {start_number}, prochain: {next_number}")
-            else:
-                # Aucun numéro valide trouvé, utiliser le start_number
-                next_number = config.get("start_number", 1)
-        else:
-            # Aucun devis existant, utiliser le start_number
-            next_number = config.get("start_number", 1)
-            logger.info(f"[QUOTE NUMBER] Aucun devis existant pour company_id={company_id}, année={current_year}, démarrage à {next_number}")
-    else:
-        # Si on est dans le cas last_failed_number, next_number est déjà défini
-        pass
-    
-    # Boucle pour trouver un numéro disponible (gestion des race conditions)
-    max_attempts = 1000  # Limite de sécurité pour éviter les boucles infinies
-    attempt = 0
-    initial_next_number = next_number
-    
-    while attempt < max_attempts:
-        # Générer le nouveau numéro avec la configuration
-        number = format_document_number(current_year, next_number, config)
-        
-        # Vérifier l'unicité pour cette entreprise
-        from sqlalchemy import text
-        check_query = text("""
-            SELECT COUNT(*) 
-            FROM quotes 
-            WHERE company_id = :company_id 
-            AND number = :number
-        """)
-        
-        result = db.execute(check_query, {
-            "company_id": company_id,
-            "number": number
-        })
-        count = result.scalar()
-        
-        if count == 0:
-            # Numéro disponible pour cette entreprise
-            logger.info(f"[QUOTE NUMBER] Numéro généré: {number} (tentative {attempt + 1}) - disponible pour company_id={company_id}")
-            return number
-        
-        # Numéro déjà utilisé, incrémenter et réessayer
-        logger.warning(f"[QUOTE NUMBER] Numéro {number} déjà utilisé, incrémentation...")
-        next_number += 1
-        attempt += 1
-    
-    # Si on arrive ici, on a épuisé toutes les tentatives
-    # Générer un numéro avec timestamp pour éviter le conflit
-    timestamp = int(datetime.now().timestamp() * 1000) % 10000
-    # Utiliser le format par défaut en cas d'urgence
-    number = f"{config.get('prefix', 'DEV')}-{current_year}-{timestamp:03d}"
-    logger.warning(f"[QUOTE NUMBER] Épuisement des tentatives, utilisation d'un numéro avec timestamp: {number}")
+        )]
     
+    next_number = allocate_sequence_number(
+        db, company_id, "quotes", current_year, config, existing_numbers, at_least=at_least
+    )
+    number = format_document_number(current_year, next_number, config)
+    logger.info(f"[QUOTE NUMBER] Numéro généré: {number} pour company_id={company_id}")
     return number
 
 
@@ -636,7 +564,8 @@ def create_quote(
             quote_status = QuoteStatus.BROUILLON
             print(f"[QUOTE CREATE] Aucun statut fourni, utilisation du statut par défaut: {quote_status}")
         
-        # Boucle de retry pour gérer les race conditions sur le numéro de devis
+        # Boucle de retry si le numéro attribué par la séquence est déjà pris (numéro émis hors séquence) ;
+        # les créations simultanées sont sérialisées par la séquence et ne passent plus par ici
         max_retries = 10
         retry_count = 0
         quote = None
@@ -1110,11 +1039,12 @@ def update_quote(
 @router.get("/{quote_id}/pdf")
 def get_quote_pdf(
     quote_id: int,
+    request: Request,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
-    Génère et retourne le PDF d'un devis.
+    Retourne le PDF d'un devis (rendu mis en cache par contenu, ETag / If-None-Match).
     """
     import logging
     logger = logging.getLogger(__name__)
@@ -1152,100 +1082,61 @@ def get_quote_pdf(
         )
     
     try:
-        # SÉCURITÉ : Vérifier l'intégrité si le devis est signé
-        existing_signature = db.query(QuoteSignature).filter(
-            QuoteSignature.quote_id == quote_id
-        ).first()
-        
-        # Générer le PDF en mémoire
-        quotes_dir = Path(settings.UPLOAD_DIR) / str(current_user.company_id) / "quotes"
-        quotes_dir.mkdir(parents=True, exist_ok=True)
-        
-        pdf_filename = f"devis_{quote.number}_{uuid.uuid4().hex[:8]}.pdf"
-        pdf_path = quotes_dir / pdf_filename
-        
         # Récupérer la configuration de design depuis les settings
-        design_config = {}
         company_settings = db.query(CompanySettings).filter(
             CompanySettings.company_id == current_user.company_id
         ).first()
+        design_config = quote_design_config(company_settings.settings if company_settings else None)
         
-        if company_settings and company_settings.settings:
-            billing_settings = company_settings.settings.get("billing", {})
-            quote_design = billing_settings.get("quote_design", {})
-            company_info = company_settings.settings.get("company_info", {})
-            
-            # Toujours utiliser company_info.logo_path comme source unique de vérité
-            logo_path = company_info.get("logo_path")
-            
-            design_config = {
-                "primary_color": quote_design.get("primary_color", "#F97316"),
-                "secondary_color": quote_design.get("secondary_color", "#F0F0F0"),
-                "logo_path": logo_path,
-                "signature_path": quote_design.get("signature_path"),
-                "footer_text": quote_design.get("footer_text"),
-                "terms_text": quote_design.get("terms_text")
-            }
-        
-        # Générer le PDF avec la signature du client si elle existe
+        # NOTE : Pour un devis signé, on sert toujours le PDF rendu à partir des données actuelles pour garantir
+        # que le logo et les images sont à jour (le hash de signature est vérifié séparément si nécessaire)
         client_signature_path = quote.client_signature_path if hasattr(quote, 'client_signature_path') else None
-        try:
-            logger.info(f"[QUOTE PDF] Generating PDF for quote {quote_id}, client_signature_path: {client_signature_path}")
-            generate_quote_pdf(quote, client, company, str(pdf_path), design_config=design_config, client_signature_path=client_signature_path)
-            logger.info(f"[QUOTE PDF] PDF generated successfully at: {pdf_path}")
-        except Exception as pdf_error:
-            logger.error(f"[QUOTE PDF] Error generating PDF: {pdf_error}", exc_info=True)
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Erreur lors de la génération du PDF: {str(pdf_error)}"
-            )
         
-        # NOTE : Pour un devis signé, on sert toujours le PDF régénéré pour garantir que le logo et les images sont à jour
-        # Le hash de signature est vérifié séparément si nécessaire
-        # Ancien code (commenté) : servait le PDF archivé, mais cela causait des problèmes avec le logo après les corrections
-        # Le PDF archivé était créé avec l'ancien code et n'avait pas le logo visible.
-        # En servant toujours le PDF régénéré, on garantit que le logo et les images sont toujours corrects.
+        cache_key = quote_pdf_cache_key(
+            quote, client, company, company_settings.settings if company_settings else None,
+            design_config, client_signature_path
+        )
         
-        # Lire le PDF généré
-        try:
-            if not pdf_path.exists():
-                logger.error(f"[QUOTE PDF] Generated PDF file does not exist: {pdf_path}")
+        def render() -> bytes:
+            logger.info(f"[QUOTE PDF] Generating PDF for quote {quote_id}, client_signature_path: {client_signature_path}")
+            try:
+                pdf_bytes = render_quote_pdf_sync(
+                    quote, client, company,
+                    design_config=design_config,
+                    client_signature_path=client_signature_path,
+                    company_settings_data=company_settings.settings if company_settings else {}
+                )
+            except (PdfRenderQueueFull, PdfRenderTimeout):
+                raise
+            except Exception as pdf_error:
+                logger.error(f"[QUOTE PDF] Error generating PDF: {pdf_error}", exc_info=True)
                 raise HTTPException(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail=f"Le fichier PDF généré est introuvable: {pdf_path}"
+                    detail=f"Erreur lors de la génération du PDF: {str(pdf_error)}"
                 )
-        
-            logger.info(f"[QUOTE PDF] Reading PDF file: {pdf_path} (size: {pdf_path.stat().st_size} bytes)")
-            with open(pdf_path, "rb") as f:
-                pdf_bytes = f.read()
-            
             if not pdf_bytes:
-                logger.error(f"[QUOTE PDF] PDF file is empty: {pdf_path}")
+                logger.error(f"[QUOTE PDF] Generated PDF is empty for quote {quote_id}")
                 raise HTTPException(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                     detail="Le fichier PDF généré est vide"
                 )
-            
-            logger.info(f"[QUOTE PDF] PDF read successfully, {len(pdf_bytes)} bytes")
-            
-            # Optionnel: supprimer le fichier temporaire après lecture
-            # os.remove(pdf_path)
-            
-            return Response(
-                content=pdf_bytes,
-                media_type="application/pdf",
-                headers={
-                    "Content-Disposition": f'inline; filename="devis_{quote.number}.pdf"'
-                }
-            )
-        except HTTPException:
-            raise
-        except Exception as read_error:
-            logger.error(f"[QUOTE PDF] Error reading PDF file: {read_error}", exc_info=True)
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Erreur lors de la lecture du PDF: {str(read_error)}"
-            )
+            logger.info(f"[QUOTE PDF] PDF generated successfully, {len(pdf_bytes)} bytes")
+            return pdf_bytes
+        
+        return cached_pdf_response(request, cache_key, render, f"devis_{quote.number}.pdf")
+    except PdfRenderQueueFull as e:
+        logger.warning(f"[QUOTE PDF] {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Trop de PDF en cours de génération, veuillez réessayer",
+            headers={"Retry-After": "5"}
+        )
+    except PdfRenderTimeout as e:
+        logger.error(f"[QUOTE PDF] {e} (quote {quote_id})")
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="La génération du PDF a pris trop de temps"
+        )
     except ImportError as e:
         logger.error(f"[QUOTE PDF] Import error: {e}", exc_info=True)
         raise HTTPException(
@@ -1650,7 +1541,13 @@ def _send_quote_via_inbox(
     
     try:
         client_signature_path = quote.client_signature_path if hasattr(quote, 'client_signature_path') else None
-        generate_quote_pdf(quote, client, company, str(pdf_path), design_config=design_config, client_signature_path=client_signature_path)
+        pdf_bytes = render_quote_pdf_sync(
+            quote, client, company,
+            design_config=design_config,
+            client_signature_path=client_signature_path,
+            company_settings_data=company_settings_obj.settings if company_settings_obj else {}
+        )
+        pdf_path.write_bytes(pdf_bytes)
         print(f"[QUOTE SEND] ✅ PDF généré avec succès: {pdf_path}")
     except Exception as e:
         print(f"[QUOTE SEND] ❌ Erreur lors de la génération du PDF: {e}")
@@ -2068,7 +1965,19 @@ async def send_quote_email(
         
         try:
             client_signature_path = quote.client_signature_path if hasattr(quote, 'client_signature_path') else None
-            generate_quote_pdf(quote, client, company, str(pdf_path), design_config=design_config, client_signature_path=client_signature_path)
+            pdf_bytes = await render_quote_pdf(
+                quote, client, company,
+                design_config=design_config,
+                client_signature_path=client_signature_path,
+                company_settings_data=company_settings_obj.settings if company_settings_obj else {}
+            )
+            pdf_path.write_bytes(pdf_bytes)
+        except PdfRenderQueueFull:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Trop de PDF en cours de génération, veuillez réessayer",
+                headers={"Retry-After": "5"}
+            )
         except Exception as e:
             logger.error(f"[SEND EMAIL] Erreur lors de la génération du PDF: {e}", exc_info=True)
             raise HTTPException(
@@ -2424,13 +2333,23 @@ async def upload_client_signature(
             }
         
         # Générer PDF avant signature (sans signature client)
-        generate_quote_pdf(quote, client, company, str(temp_pdf_before), design_config=design_config, client_signature_path=None)
+        pdf_content_before = await render_quote_pdf(
+            quote, client, company,
+            design_config=design_config,
+            client_signature_path=None,
+            company_settings_data=company_settings_obj.settings if company_settings_obj else {}
+        )
+        temp_pdf_before.write_bytes(pdf_content_before)
         
         # Calculer le hash SHA-256 du PDF avant signature
-        with open(temp_pdf_before, "rb") as f:
-            pdf_content_before = f.read()
         document_hash_before = hashlib.sha256(pdf_content_before).hexdigest()
         
+    except PdfRenderQueueFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Trop de PDF en cours de génération, veuillez réessayer",
+            headers={"Retry-After": "5"}
+        )
     except Exception as e:
         # Nettoyer le fichier temporaire en cas d'erreur
         if temp_pdf_before.exists():
@@ -2514,11 +2433,15 @@ async def upload_client_signature(
     pdf_content_after = None
     
     try:
-        generate_quote_pdf(quote, client, company, str(temp_pdf_after), design_config=design_config, client_signature_path=relative_path)
+        pdf_content_after = await render_quote_pdf(
+            quote, client, company,
+            design_config=design_config,
+            client_signature_path=relative_path,
+            company_settings_data=company_settings_obj.settings if company_settings_obj else {}
+        )
+        temp_pdf_after.write_bytes(pdf_content_after)
         
         # Calculer le hash SHA-256 du PDF après signature
-        with open(temp_pdf_after, "rb") as f:
-            pdf_content_after = f.read()
         signature_hash = hashlib.sha256(pdf_content_after).hexdigest()
         
         # SÉCURITÉ : Archiver le PDF signé de manière sécurisée
@@ -3133,13 +3056,23 @@ async def sign_public_quote(
             }
         
         # Générer PDF avant signature (sans signature client)
-        generate_quote_pdf(quote, client, company, str(temp_pdf_before), design_config=design_config, client_signature_path=None)
+        pdf_content_before = await render_quote_pdf(
+            quote, client, company,
+            design_config=design_config,
+            client_signature_path=None,
+            company_settings_data=company_settings_obj.settings if company_settings_obj else {}
+        )
+        temp_pdf_before.write_bytes(pdf_content_before)
         
         # Calculer le hash SHA-256 du PDF avant signature
-        with open(temp_pdf_before, "rb") as f:
-            pdf_content_before = f.read()
         document_hash_before = hashlib.sha256(pdf_content_before).hexdigest()
         
+    except PdfRenderQueueFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Trop de PDF en cours de génération, veuillez réessayer",
+            headers={"Retry-After": "5"}
+        )
     except Exception as e:
         # Nettoyer le fichier temporaire en cas d'erreur
         if temp_pdf_before.exists():
@@ -3233,11 +3166,15 @@ async def sign_public_quote(
     pdf_content_after = None
     
     try:
-        generate_quote_pdf(quote, client, company, str(temp_pdf_after), design_config=design_config, client_signature_path=relative_path)
+        pdf_content_after = await render_quote_pdf(
+            quote, client, company,
+            design_config=design_config,
+            client_signature_path=relative_path,
+            company_settings_data=company_settings_obj.settings if company_settings_obj else {}
+        )
+        temp_pdf_after.write_bytes(pdf_content_after)
         
         # Calculer le hash SHA-256 du PDF après signature
-        with open(temp_pdf_after, "rb") as f:
-            pdf_content_after = f.read()
         signature_hash = hashlib.sha256(pdf_content_after).hexdigest()
         
         # SÉCURITÉ : Archiver le PDF signé de manière sécurisée
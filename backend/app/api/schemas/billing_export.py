@@ -0,0 +1,28 @@
+from pydantic import BaseModel, Field
+from datetime import date, datetime
+from typing import Optional, List, Literal
+
+
+# ==================== BILLING EXPORT SCHEMAS ====================
+
+class BillingExportCreate(BaseModel):
+    document_type: Literal["invoice", "quote"] = "invoice"
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    status: Optional[str] = Field(None, description="Statut des documents (ex: payée, accepté)")
+    invoice_type: Optional[str] = Field(None, description="facture ou avoir (factures uniquement)")
+
+
+class BillingExportRead(BaseModel):
+    id: int
+    document_type: str
+    filters: dict
+    status: str  # pending, running, completed, failed, expired
+    total: int
+    processed: int
+    progress: float  # 0 à 1
+    failed_documents: List[str] = []
+    file_size: Optional[int] = None
+    last_error: Optional[str] = None
+    created_at: datetime
+    completed_at: Optional[datetime] = None
@@ -150,6 +150,7 @@ class ConversationRead(ConversationBase):
     folder_name: Optional[str] = None
     client_email: Optional[str] = None  # Email du premier message du client
     client_phone: Optional[str] = None  # Téléphone du premier message du client
+    search_snippet: Optional[str] = None  # Extrait HTML (termes entourés de <mark>) quand la liste vient d'une recherche
     
     class Config:
         from_attributes = True
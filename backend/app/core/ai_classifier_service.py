@@ -4,20 +4,27 @@ en utilisant ChatGPT/OpenAI API.
 """
 import os
 import re
+import time
 import logging
 from typing import Dict, List, Optional, Tuple
 from app.core.config import settings
-from app.core.openai_throttle import throttle_openai_request
+from app.core.openai_client import create_chat_completion_sync
+from app.core.folder_rules import CompiledFolderRules
+from app.core.classification_cache import classification_cache, KIND_FOLDER, KIND_NOTIFICATION
+from app.core.local_folder_classifier import local_folder_classifier
+
+# Version du prompt de détection des notifications (change la clé du cache si le prompt évolue)
+NOTIFICATION_PROMPT_VERSION = "notification-v1"
 
 logger = logging.getLogger(__name__)
 
 # Import OpenAI avec gestion d'erreur
 try:
-    from openai import OpenAI
+    from openai import AsyncOpenAI
     OPENAI_AVAILABLE = True
 except ImportError as e:
     logger.error(f"OpenAI library not available: {e}")
-    OpenAI = None
+    AsyncOpenAI = None
     OPENAI_AVAILABLE = False
 
 
@@ -43,7 +50,7 @@ class AIClassifierService:
             try:
                 # Créer le client OpenAI
                 # Note: Si vous rencontrez une erreur 'proxies', essayez de créer le client sans arguments supplémentaires
-                self.client = OpenAI(api_key=api_key)
+                self.client = AsyncOpenAI(api_key=api_key)
                 # Test rapide pour vérifier que le client fonctionne
                 self.enabled = True
                 logger.info("✅ Service de classification IA initialisé avec succès")
@@ -65,7 +72,10 @@ class AIClassifierService:
         self,
         messages: List[Dict],  # Liste de messages avec conversation_id, content, subject, from_email
         folders: List[Dict],
-        company_context: Optional[str] = None
+        company_context: Optional[str] = None,
+        rules: Optional[CompiledFolderRules] = None,
+        company_id: Optional[int] = None,
+        raise_errors: bool = False
     ) -> Dict[int, Optional[int]]:
         """
         Classe plusieurs messages en un seul appel à l'IA.
@@ -74,6 +84,10 @@ class AIClassifierService:
             messages: Liste de dicts avec conversation_id, content, subject, from_email
             folders: Liste des dossiers disponibles avec leurs règles IA
             company_context: Contexte supplémentaire sur l'entreprise (optionnel)
+            rules: Règles compilées de ces dossiers (get_folder_rules), compilées ici si absentes
+            company_id: Entreprise (active le cache des classifications déjà faites par l'IA)
+            raise_errors: Relancer les erreurs de l'appel IA (429, réseau…) au lieu de retourner {}
+                (file de classification : les jobs sont alors replanifiés)
         
         Returns:
             Dict {conversation_id: folder_id} ou None si aucun dossier ne correspond
@@ -95,6 +109,9 @@ class AIClassifierService:
         if not messages:
             return {}
         
+        if rules is None:
+            rules = CompiledFolderRules(auto_classify_folders)
+        
         try:
             # Vérification directe basée sur l'expéditeur pour chaque message
             results = {}
@@ -108,18 +125,17 @@ class AIClassifierService:
                 
                 # Vérification directe par expéditeur (priorité 1)
                 if message_from:
-                    folder_id = self._check_sender_match(message_from, auto_classify_folders)
+                    folder_id = rules.match_sender(message_from)
                     if folder_id:
                         results[conversation_id] = folder_id
                         continue
                 
                 # Vérification directe par mots-clés dans contenu/sujet/expéditeur (priorité 2)
                 # Pour les règles explicites comme "tous les messages avec 'amazon' dans le contenu, l'objet et l'expéditeur"
-                folder_id = self._check_keyword_match(
-                    message_content=message_content,
-                    message_subject=message_subject,
-                    message_from=message_from or "",
-                    folders=auto_classify_folders
+                folder_id = rules.match_keywords(
+                    content=message_content,
+                    subject=message_subject,
+                    message_from=message_from or ""
                 )
                 if folder_id:
                     results[conversation_id] = folder_id
@@ -132,6 +148,28 @@ class AIClassifierService:
             if not messages_to_classify_ia:
                 return results
             
+            # Formes de messages déjà classées par l'IA (même expéditeur, contenu quasi identique)
+            cached = classification_cache.lookup(
+                company_id, KIND_FOLDER, rules.version, self._cache_items(messages_to_classify_ia)
+            )
+            for conversation_id, cached_result in cached.items():
+                results[conversation_id] = int(cached_result) if cached_result else None
+            messages_to_classify_ia = [
+                msg_data for msg_data in messages_to_classify_ia
+                if msg_data.get("conversation_id") not in cached
+            ]
+            
+            # Classifieur local appris sur les conversations déjà rangées (IA seulement sous le seuil de confiance)
+            local = local_folder_classifier.predict(company_id, rules, messages_to_classify_ia)
+            results.update(local)
+            messages_to_classify_ia = [
+                msg_data for msg_data in messages_to_classify_ia
+                if msg_data.get("conversation_id") not in local
+            ]
+            if not messages_to_classify_ia:
+                classification_cache.record_saved_call()
+                return results
+            
             # Construire le prompt pour tous les messages restants
             prompt = self._build_batch_classification_prompt(
                 messages=messages_to_classify_ia,
@@ -139,11 +177,10 @@ class AIClassifierService:
                 company_context=company_context
             )
             
-            # Throttle pour éviter les rate limits
-            throttle_openai_request()
-            
             # Un seul appel IA pour tous les messages
-            response = self.client.chat.completions.create(
+            started_at = time.monotonic()
+            response = create_chat_completion_sync(
+                self.client,
                 model="gpt-4o-mini",
                 messages=[
                     {
@@ -158,6 +195,7 @@ class AIClassifierService:
                 temperature=0.3,
                 max_tokens=500  # Plus de tokens pour traiter plusieurs messages
             )
+            classification_cache.record_ai_call(time.monotonic() - started_at)
             
             # Parser la réponse
             result = response.choices[0].message.content.strip()
@@ -166,6 +204,14 @@ class AIClassifierService:
             # Extraire les IDs des dossiers pour chaque conversation
             batch_results = self._parse_batch_classification_response(result, messages_to_classify_ia, auto_classify_folders)
             
+            # Mémoriser les réponses valides (dossier existant ou aucun dossier)
+            valid_folder_ids = {folder["id"] for folder in auto_classify_folders}
+            classification_cache.store(company_id, KIND_FOLDER, rules.version, [
+                (sender, text, batch_results[key] or "")
+                for key, sender, text in self._cache_items(messages_to_classify_ia)
+                if key in batch_results and (batch_results[key] is None or batch_results[key] in valid_folder_ids)
+            ])
+            
             # Combiner avec les résultats de vérification directe
             results.update(batch_results)
             
@@ -180,167 +226,21 @@ class AIClassifierService:
                 logger.error(f"Error during batch AI classification: {e}")
                 import traceback
                 traceback.print_exc()
+            if raise_errors:
+                raise
             return {}
     
-    def _check_sender_match(self, message_from: str, folders: List[Dict]) -> Optional[int]:
-        """Vérifie si l'expéditeur correspond à un dossier (sans appel IA)."""
-        if not message_from:
-            return None
-            
-        message_from_lower = message_from.lower()
-        
-        for folder in folders:
-            ai_rules = folder.get("ai_rules", {})
-            context = ai_rules.get("context", "") if ai_rules.get("context") else ""
-            
-            if not context:
-                continue
-            
-            context_lower = context.lower()
-            
-            # Chercher d'abord les patterns explicites d'expéditeur (priorité)
-            # Ex: "expéditeur contenant lokario" ou "from: lokario" ou "de lokario"
-            explicit_sender_patterns = re.findall(
-                r'(?:expéditeur|from|de|sender|envoyeur)[\s]+(?:contenant|containing|avec|with)?[\s]*([a-z0-9._%+-@]+)',
-                context_lower
+    @staticmethod
+    def _cache_items(messages: List[Dict]) -> List[Tuple[int, str, str]]:
+        """(clé, expéditeur, sujet + contenu) des messages, pour le cache des classifications."""
+        return [
+            (
+                msg_data.get("conversation_id"),
+                msg_data.get("from_email") or msg_data.get("from_phone") or "",
+                f"{msg_data.get('subject') or ''}\n{msg_data.get('content') or ''}"
             )
-            
-            # Chercher aussi les patterns avec ":" ou "="
-            explicit_sender_patterns2 = re.findall(
-                r'(?:expéditeur|from|de|sender|envoyeur)[\s:=\-]+([a-z0-9._%+-@]+)',
-                context_lower
-            )
-            
-            # Extraire tous les mots du context (minimum 3 caractères)
-            words = re.findall(r'\b[a-z]{3,}\b', context_lower)
-            
-            # Extraire les emails
-            emails = re.findall(r'\b([a-z0-9._%+-]+@[a-z0-9.-]+\.[a-z]{2,})\b', context_lower)
-            
-            # Combiner tous les mots-clés (priorité aux patterns explicites)
-            all_keywords = explicit_sender_patterns + explicit_sender_patterns2 + words + emails
-            
-            # Filtrer les mots courants
-            common_words = {'les', 'des', 'dans', 'pour', 'avec', 'sont', 'cette', 'tous', 'toutes', 'tout', 'toute', 'dans', 'pour', 'avec', 'mais', 'plus', 'peut', 'sont', 'sous', 'tout', 'tous', 'toutes', 'toute', 'mettre', 'mails', 'mail', 'en'}
-            all_keywords = [kw for kw in all_keywords if kw not in common_words]
-            
-            # Vérifier chaque mot-clé
-            for keyword in all_keywords:
-                keyword_clean = keyword.strip('.,;:!?()[]{}').lower()
-                if len(keyword_clean) >= 3:
-                    # Vérifier si le mot-clé est dans l'expéditeur (email ou nom)
-                    if keyword_clean in message_from_lower:
-                        logger.info(f"[AI CLASSIFIER] ✅ Correspondance directe trouvée: '{keyword_clean}' dans expéditeur '{message_from}' → dossier '{folder['name']}' (ID: {folder['id']})")
-                        return folder["id"]
-        
-        return None
-    
-    def _check_keyword_match(
-        self,
-        message_content: str,
-        message_subject: str,
-        message_from: str,
-        folders: List[Dict]
-    ) -> Optional[int]:
-        """
-        Vérifie si un message correspond à un dossier basé sur des mots-clés explicites
-        dans le contenu, le sujet ET l'expéditeur (sans appel IA).
-        
-        Exemple de contexte : "tous les messages avec 'amazon' dans le contenu, l'objet et l'expéditeur"
-        """
-        if not message_content and not message_subject and not message_from:
-            return None
-        
-        message_content_lower = message_content.lower()
-        message_subject_lower = message_subject.lower()
-        message_from_lower = message_from.lower()
-        
-        for folder in folders:
-            ai_rules = folder.get("ai_rules", {})
-            context = ai_rules.get("context", "") if ai_rules.get("context") else ""
-            
-            if not context:
-                continue
-            
-            context_lower = context.lower()
-            
-            # Détecter les patterns de mots-clés explicites
-            # Exemples :
-            # - "tous les messages avec 'amazon' dans le contenu, l'objet et l'expéditeur"
-            # - "messages contenant 'amazon' dans le contenu, sujet et expéditeur"
-            # - "avec 'amazon' dans contenu, objet, expéditeur"
-            
-            # Extraire les mots-clés entre guillemets ou après "avec/contenant"
-            # Pattern 1: "avec 'amazon'" ou "contenant 'amazon'" ou "avec amazon"
-            keyword_patterns = [
-                r"['\"]([a-z0-9._%+-@]{3,})['\"]",  # Entre guillemets
-                r"(?:avec|containing|contenant)\s+['\"]?([a-z0-9._%+-@]{3,})['\"]?\s+(?:dans|in)",  # Après "avec/contenant"
-            ]
-            
-            keywords_found = []
-            for pattern in keyword_patterns:
-                matches = re.findall(pattern, context_lower)
-                for keyword in matches:
-                    keyword_clean = keyword.strip("'\".,;:!?()[]{}").lower()
-                    if len(keyword_clean) >= 3 and keyword_clean not in keywords_found:
-                        # Filtrer les mots courants
-                        common_words = {'les', 'des', 'dans', 'pour', 'avec', 'sont', 'cette', 'tous', 'toutes', 'tout', 'toute', 'mais', 'plus', 'peut', 'sous', 'mettre', 'mails', 'mail', 'en', 'le', 'la', 'un', 'une', 'de', 'du', 'et', 'ou'}
-                        if keyword_clean not in common_words:
-                            keywords_found.append(keyword_clean)
-            
-            # Si on a trouvé des mots-clés, vérifier qu'ils sont dans les champs requis
-            if keywords_found:
-                # Détecter si le contexte exige TOUS les champs (contenu ET objet ET expéditeur)
-                # ou au moins UN champ (contenu OU objet OU expéditeur)
-                
-                # Vérifier la présence de "et" entre les champs (indique TOUS)
-                has_et = bool(re.search(r"(?:contenu|content|objet|subject|sujet).*?et.*?(?:objet|subject|sujet|expéditeur|sender|from)", context_lower))
-                has_and = bool(re.search(r"(?:contenu|content|objet|subject|sujet).*?and.*?(?:objet|subject|sujet|expéditeur|sender|from)", context_lower))
-                
-                # Vérifier si les 3 champs sont mentionnés (contenu, objet, expéditeur)
-                has_content = bool(re.search(r"(?:contenu|content)", context_lower))
-                has_subject = bool(re.search(r"(?:objet|subject|sujet)", context_lower))
-                has_sender = bool(re.search(r"(?:expéditeur|sender|from|de)", context_lower))
-                all_three_mentioned = has_content and has_subject and has_sender
-                
-                # Si les 3 champs sont mentionnés ET il y a "et/and", alors TOUS sont requis
-                requires_all = all_three_mentioned and (has_et or has_and)
-                
-                for keyword in keywords_found:
-                    # Vérifier la présence du mot-clé dans chaque champ
-                    in_content = keyword in message_content_lower
-                    in_subject = keyword in message_subject_lower
-                    in_from = keyword in message_from_lower if message_from else False
-                    
-                    # Si le contexte exige tous les champs, vérifier tous
-                    if requires_all:
-                        if in_content and in_subject and in_from:
-                            logger.info(
-                                f"[AI CLASSIFIER] ✅ Correspondance mot-clé '{keyword}' trouvée dans "
-                                f"contenu, sujet ET expéditeur → dossier '{folder['name']}' (ID: {folder['id']})"
-                            )
-                            return folder["id"]
-                    else:
-                        # Sinon, vérifier au moins un champ (ou tous si les 3 sont mentionnés)
-                        if all_three_mentioned:
-                            # Si les 3 sont mentionnés mais pas de "et", vérifier au moins 2 sur 3
-                            matches_count = sum([in_content, in_subject, in_from])
-                            if matches_count >= 2:
-                                logger.info(
-                                    f"[AI CLASSIFIER] ✅ Correspondance mot-clé '{keyword}' trouvée dans "
-                                    f"{matches_count}/3 champs (contenu/sujet/expéditeur) → dossier '{folder['name']}' (ID: {folder['id']})"
-                                )
-                                return folder["id"]
-                        else:
-                            # Si pas tous les champs mentionnés, vérifier au moins un
-                            if in_content or in_subject or in_from:
-                                logger.info(
-                                    f"[AI CLASSIFIER] ✅ Correspondance mot-clé '{keyword}' trouvée dans "
-                                    f"contenu/sujet/expéditeur → dossier '{folder['name']}' (ID: {folder['id']})"
-                                )
-                                return folder["id"]
-        
-        return None
+            for msg_data in messages
+        ]
     
     def _build_batch_classification_prompt(
         self,
@@ -454,7 +354,9 @@ class AIClassifierService:
         message_subject: Optional[str],
         message_from: Optional[str],
         folders: List[Dict],
-        company_context: Optional[str] = None
+        company_context: Optional[str] = None,
+        rules: Optional[CompiledFolderRules] = None,
+        company_id: Optional[int] = None
     ) -> Optional[int]:
         """
         Classe un message dans un dossier approprié en utilisant ChatGPT.
@@ -477,6 +379,8 @@ class AIClassifierService:
                         ...
                     ]
             company_context: Contexte supplémentaire sur l'entreprise (optionnel)
+            rules: Règles compilées de ces dossiers (get_folder_rules), compilées ici si absentes
+            company_id: Entreprise (active le cache des classifications déjà faites par l'IA)
         
         Returns:
             L'ID du dossier approprié, ou None si aucun dossier ne correspond
@@ -496,11 +400,31 @@ class AIClassifierService:
             return None
         
         # Vérification directe basée sur l'expéditeur (avant l'appel IA)
+        if rules is None:
+            rules = CompiledFolderRules(auto_classify_folders)
         if message_from:
-            folder_id = self._check_sender_match(message_from, auto_classify_folders)
+            folder_id = rules.match_sender(message_from)
             if folder_id:
                 return folder_id
         
+        # Forme de message déjà classée par l'IA
+        cache_items = [(0, message_from or "", f"{message_subject or ''}\n{message_content or ''}")]
+        cached = classification_cache.lookup(company_id, KIND_FOLDER, rules.version, cache_items)
+        if 0 in cached:
+            classification_cache.record_saved_call()
+            return int(cached[0]) if cached[0] else None
+        
+        # Classifieur local appris sur les conversations déjà rangées (IA seulement sous le seuil de confiance)
+        local = local_folder_classifier.predict(company_id, rules, [{
+            "conversation_id": 0,
+            "subject": message_subject,
+            "content": message_content,
+            "from_email": message_from
+        }])
+        if 0 in local:
+            classification_cache.record_saved_call()
+            return local[0]
+        
         try:
             # Préparer le prompt pour ChatGPT
             prompt = self._build_classification_prompt(
@@ -511,11 +435,10 @@ class AIClassifierService:
                 company_context=company_context
             )
             
-            # Throttle pour éviter les rate limits
-            throttle_openai_request()
-            
             # Appeler ChatGPT
-            response = self.client.chat.completions.create(
+            started_at = time.monotonic()
+            response = create_chat_completion_sync(
+                self.client,
                 model="gpt-4o-mini",  # Utiliser gpt-4o-mini pour réduire les coûts
                 messages=[
                     {
@@ -530,6 +453,7 @@ class AIClassifierService:
                 temperature=0.3,  # Plus déterministe
                 max_tokens=150
             )
+            classification_cache.record_ai_call(time.monotonic() - started_at)
             
             # Parser la réponse
             result = response.choices[0].message.content.strip()
@@ -537,6 +461,9 @@ class AIClassifierService:
             
             # Extraire l'ID du dossier
             folder_id = self._parse_classification_response(result, auto_classify_folders)
+            classification_cache.store(company_id, KIND_FOLDER, rules.version, [
+                (sender, text, folder_id or "") for _, sender, text in cache_items
+            ])
             
             if folder_id:
                 folder_name = next((f["name"] for f in auto_classify_folders if f["id"] == folder_id), "Inconnu")
@@ -678,11 +605,9 @@ Indicateurs VRAI CLIENT: email personnel, message personnalisé, demande spécif
 
 Réponds UNIQUEMENT: "client" ou "notification" """
             
-            # Throttle pour éviter les rate limits
-            throttle_openai_request()
-            
             # Appeler ChatGPT
-            response = self.client.chat.completions.create(
+            response = create_chat_completion_sync(
+                self.client,
                 model="gpt-4o-mini",
                 messages=[
                     {
@@ -730,7 +655,8 @@ Réponds UNIQUEMENT: "client" ou "notification" """
     
     def is_notification_email_batch(
         self,
-        emails: List[Dict[str, str]]
+        emails: List[Dict[str, str]],
+        company_id: Optional[int] = None
     ) -> Dict[str, bool]:
         """
         Détermine si plusieurs emails sont des notifications automatisées ou proviennent de vrais clients.
@@ -738,6 +664,7 @@ Réponds UNIQUEMENT: "client" ou "notification" """
         
         Args:
             emails: Liste de dicts avec 'from_email', 'subject', 'content_preview', et 'email_id' (identifiant unique)
+            company_id: Entreprise (active le cache des réponses déjà données par l'IA)
         
         Returns:
             Dict {email_id: is_notification} où is_notification est True si c'est une notification
@@ -786,6 +713,26 @@ Réponds UNIQUEMENT: "client" ou "notification" """
                 results[email_id] = False
             return results
         
+        # Emails quasi identiques déjà analysés par l'IA pour le même expéditeur
+        cache_items = [
+            (
+                email_data.get("email_id", email_data.get("from_email", "")),
+                email_data.get("from_email", ""),
+                f"{email_data.get('subject') or ''}\n{(email_data.get('content_preview') or '')[:200]}"
+            )
+            for email_data in emails_to_check_ia
+        ]
+        cached = classification_cache.lookup(company_id, KIND_NOTIFICATION, NOTIFICATION_PROMPT_VERSION, cache_items)
+        for email_id, cached_result in cached.items():
+            results[email_id] = cached_result == "notification"
+        emails_to_check_ia = [
+            email_data for email_data in emails_to_check_ia
+            if email_data.get("email_id", email_data.get("from_email", "")) not in cached
+        ]
+        if not emails_to_check_ia:
+            classification_cache.record_saved_call()
+            return results
+        
         try:
             # Construire le prompt batch
             prompt_parts = [
@@ -813,11 +760,10 @@ Réponds UNIQUEMENT: "client" ou "notification" """
             
             prompt = "\n".join(prompt_parts)
             
-            # Throttle pour éviter les rate limits
-            throttle_openai_request()
-            
             # Appeler ChatGPT
-            response = self.client.chat.completions.create(
+            started_at = time.monotonic()
+            response = create_chat_completion_sync(
+                self.client,
                 model="gpt-4o-mini",
                 messages=[
                     {
@@ -832,6 +778,7 @@ Réponds UNIQUEMENT: "client" ou "notification" """
                 temperature=0.2,  # Très déterministe
                 max_tokens=500  # Plus de tokens pour plusieurs emails
             )
+            classification_cache.record_ai_call(time.monotonic() - started_at)
             
             # Parser la réponse JSON
             result = response.choices[0].message.content.strip()
@@ -857,6 +804,18 @@ Réponds UNIQUEMENT: "client" ou "notification" """
                     # Si la valeur contient "notification", c'est une notification
                     is_notification = "notification" in str(value).lower()
                     results[email_id] = is_notification
+                
+                # Mémoriser uniquement les emails pour lesquels l'IA a répondu
+                answered_ids = {
+                    email_data.get("email_id", email_data.get("from_email", ""))
+                    for email_data in emails_to_check_ia
+                    if str(email_data.get("email_id", email_data.get("from_email", ""))) in batch_results
+                }
+                classification_cache.store(company_id, KIND_NOTIFICATION, NOTIFICATION_PROMPT_VERSION, [
+                    (sender, text, "notification" if results[email_id] else "client")
+                    for email_id, sender, text in cache_items
+                    if email_id in answered_ids
+                ])
                     
             except json.JSONDecodeError as e:
                 logger.error(f"Erreur lors du parsing JSON de la réponse batch: {e}. Réponse: {result}")
@@ -973,10 +932,8 @@ Indicateurs AUTRE TYPE DE CONTACT:
 Réponds UNIQUEMENT: "client" ou "autre"
 """
             
-            # Throttle pour éviter les rate limits
-            throttle_openai_request()
-            
-            response = self.client.chat.completions.create(
+            response = create_chat_completion_sync(
+                self.client,
                 model="gpt-4o-mini",
                 messages=[
                     {
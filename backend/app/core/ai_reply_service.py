@@ -5,17 +5,17 @@ import os
 import logging
 from typing import Optional, Dict, Any
 from app.core.config import settings
-from app.core.openai_throttle import throttle_openai_request
+from app.core.openai_client import create_chat_completion, create_chat_completion_sync
 
 logger = logging.getLogger(__name__)
 
 # Import OpenAI avec gestion d'erreur
 try:
-    from openai import OpenAI
+    from openai import AsyncOpenAI
     OPENAI_AVAILABLE = True
 except ImportError as e:
     logger.error(f"OpenAI library not available: {e}")
-    OpenAI = None
+    AsyncOpenAI = None
     OPENAI_AVAILABLE = False
 
 
@@ -39,7 +39,7 @@ class AIReplyService:
             self.client = None
         else:
             try:
-                self.client = OpenAI(api_key=api_key)
+                self.client = AsyncOpenAI(api_key=api_key)
                 self.enabled = True
                 logger.info("✅ Service de génération de réponses IA initialisé avec succès")
             except Exception as e:
@@ -47,6 +47,50 @@ class AIReplyService:
                 self.enabled = False
                 self.client = None
     
+    def _reply_request(
+        self,
+        conversation_messages: list,
+        custom_prompt: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Paramètres de l'appel OpenAI pour generate_reply (None si pas de prompt configuré)."""
+        # Construire le contexte de la conversation
+        messages_context = []
+        for msg in conversation_messages:
+            role = "assistant" if not msg.get("is_from_client", True) else "user"
+            content = msg.get("content", "")
+            if content:
+                messages_context.append({
+                    "role": role,
+                    "content": content
+                })
+        
+        # Vérifier qu'un prompt est configuré
+        if not custom_prompt or not custom_prompt.strip():
+            logger.error("Aucun prompt configuré pour générer une réponse. Veuillez configurer le prompt dans les paramètres.")
+            return None
+        
+        # Construire le prompt système
+        system_prompt = custom_prompt
+        
+        # Note: base_message n'est plus utilisé, le template est maintenant le prompt principal
+        # (gardé pour compatibilité mais ne sera plus appelé)
+        
+        logger.info(f"[AI REPLY SERVICE] Utilisation du prompt personnalisé: {repr(system_prompt[:200])}...")
+        
+        # Préparer les messages pour l'API
+        # Le prompt personnalisé est utilisé comme instruction système
+        # Les messages de conversation sont ajoutés comme contexte
+        api_messages = [
+            {"role": "system", "content": system_prompt}
+        ] + messages_context
+        
+        return {
+            "model": "gpt-4o-mini",  # Modèle plus économique
+            "messages": api_messages,
+            "temperature": 0.7,
+            "max_tokens": 500,
+        }
+    
     def generate_reply(
         self,
         conversation_messages: list,
@@ -56,6 +100,7 @@ class AIReplyService:
     ) -> Optional[str]:
         """
         Génère une réponse professionnelle basée sur les messages de la conversation.
+        Version bloquante (code synchrone) ; depuis une route async, utiliser generate_reply_async.
         
         Args:
             conversation_messages: Liste des messages de la conversation
@@ -71,58 +116,88 @@ class AIReplyService:
             return None
         
         try:
-            # Construire le contexte de la conversation
-            messages_context = []
-            for msg in conversation_messages:
-                role = "assistant" if not msg.get("is_from_client", True) else "user"
-                content = msg.get("content", "")
-                if content:
-                    messages_context.append({
-                        "role": role,
-                        "content": content
-                    })
-            
-            # Vérifier qu'un prompt est configuré
-            if not custom_prompt or not custom_prompt.strip():
-                logger.error("Aucun prompt configuré pour générer une réponse. Veuillez configurer le prompt dans les paramètres.")
+            params = self._reply_request(conversation_messages, custom_prompt)
+            if not params:
+                return None
+            response = create_chat_completion_sync(self.client, **params)
+            return self._reply_from_response(response)
+        except Exception as e:
+            logger.error(f"❌ Erreur lors de la génération de la réponse: {e}")
+            import traceback
+            traceback.print_exc()
+            return None
+    
+    async def generate_reply_async(
+        self,
+        conversation_messages: list,
+        client_name: Optional[str] = None,
+        custom_prompt: Optional[str] = None,
+        base_message: Optional[str] = None
+    ) -> Optional[str]:
+        """Version asynchrone de generate_reply (n'occupe pas l'event loop pendant l'appel)."""
+        if not self.enabled or not self.client:
+            logger.error("Service IA non disponible")
+            return None
+        
+        try:
+            params = self._reply_request(conversation_messages, custom_prompt)
+            if not params:
                 return None
-            
-            # Construire le prompt système
-            system_prompt = custom_prompt
-            
-            # Note: base_message n'est plus utilisé, le template est maintenant le prompt principal
-            # (gardé pour compatibilité mais ne sera plus appelé)
-            
-            logger.info(f"[AI REPLY SERVICE] Utilisation du prompt personnalisé: {repr(system_prompt[:200])}...")
-            
-            # Préparer les messages pour l'API
-            # Le prompt personnalisé est utilisé comme instruction système
-            # Les messages de conversation sont ajoutés comme contexte
-            api_messages = [
-                {"role": "system", "content": system_prompt}
-            ] + messages_context
-            
-            # Throttle pour éviter les rate limits
-            throttle_openai_request()
-            
-            # Appel à l'API OpenAI
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",  # Modèle plus économique
-                messages=api_messages,
-                temperature=0.7,
-                max_tokens=500
-            )
-            
-            reply = response.choices[0].message.content.strip()
-            logger.info(f"✅ Réponse IA générée avec succès ({len(reply)} caractères)")
-            return reply
-            
+            response = await create_chat_completion(self.client, **params)
+            return self._reply_from_response(response)
         except Exception as e:
             logger.error(f"❌ Erreur lors de la génération de la réponse: {e}")
             import traceback
             traceback.print_exc()
             return None
     
+    def _reply_from_response(self, response) -> str:
+        reply = response.choices[0].message.content.strip()
+        logger.info(f"✅ Réponse IA générée avec succès ({len(reply)} caractères)")
+        return reply
+    
+    def _summary_request(
+        self,
+        conversation_messages: list,
+        custom_prompt: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Paramètres de l'appel OpenAI pour summarize_message (None si pas de prompt configuré)."""
+        # Construire le contexte de la conversation
+        messages_text = []
+        for msg in conversation_messages:
+            sender = "Client" if msg.get("is_from_client", True) else "Entreprise"
+            content = msg.get("content", "")
+            if content:
+                messages_text.append(f"{sender}: {content}")
+        
+        conversation_text = "\n".join(messages_text)
+        
+        # Vérifier qu'un prompt est configuré
+        if not custom_prompt or not custom_prompt.strip():
+            logger.error("Aucun prompt configuré pour résumer. Veuillez configurer le prompt dans les paramètres.")
+            return None
+        
+        system_prompt = custom_prompt
+        logger.info(f"[AI REPLY SERVICE] Utilisation du prompt personnalisé pour résumé: {repr(system_prompt)}")
+        
+        # Préparer les messages pour l'API
+        # Le prompt personnalisé est utilisé comme instruction système
+        # La conversation est ajoutée comme contexte utilisateur
+        api_messages = [
+            {"role": "system", "content": system_prompt},
+            {
+                "role": "user",
+                "content": conversation_text
+            }
+        ]
+        
+        return {
+            "model": "gpt-4o-mini",  # Modèle plus économique
+            "messages": api_messages,
+            "temperature": 0.5,
+            "max_tokens": 200,
+        }
+    
     def summarize_message(
         self,
         conversation_messages: list,
@@ -130,6 +205,7 @@ class AIReplyService:
     ) -> Optional[str]:
         """
         Résume les messages de la conversation.
+        Version bloquante (code synchrone) ; depuis une route async, utiliser summarize_message_async.
         
         Args:
             conversation_messages: Liste des messages de la conversation
@@ -143,55 +219,43 @@ class AIReplyService:
             return None
         
         try:
-            # Construire le contexte de la conversation
-            messages_text = []
-            for msg in conversation_messages:
-                sender = "Client" if msg.get("is_from_client", True) else "Entreprise"
-                content = msg.get("content", "")
-                if content:
-                    messages_text.append(f"{sender}: {content}")
-            
-            conversation_text = "\n".join(messages_text)
-            
-            # Vérifier qu'un prompt est configuré
-            if not custom_prompt or not custom_prompt.strip():
-                logger.error("Aucun prompt configuré pour résumer. Veuillez configurer le prompt dans les paramètres.")
+            params = self._summary_request(conversation_messages, custom_prompt)
+            if not params:
+                return None
+            response = create_chat_completion_sync(self.client, **params)
+            return self._summary_from_response(response)
+        except Exception as e:
+            logger.error(f"❌ Erreur lors de la génération du résumé: {e}")
+            import traceback
+            traceback.print_exc()
+            return None
+    
+    async def summarize_message_async(
+        self,
+        conversation_messages: list,
+        custom_prompt: Optional[str] = None
+    ) -> Optional[str]:
+        """Version asynchrone de summarize_message (n'occupe pas l'event loop pendant l'appel)."""
+        if not self.enabled or not self.client:
+            logger.error("Service IA non disponible")
+            return None
+        
+        try:
+            params = self._summary_request(conversation_messages, custom_prompt)
+            if not params:
                 return None
-            
-            system_prompt = custom_prompt
-            logger.info(f"[AI REPLY SERVICE] Utilisation du prompt personnalisé pour résumé: {repr(system_prompt)}")
-            
-            # Préparer les messages pour l'API
-            # Le prompt personnalisé est utilisé comme instruction système
-            # La conversation est ajoutée comme contexte utilisateur
-            api_messages = [
-                {"role": "system", "content": system_prompt},
-                {
-                    "role": "user",
-                    "content": conversation_text
-                }
-            ]
-            
-            # Throttle pour éviter les rate limits
-            throttle_openai_request()
-            
-            # Appel à l'API OpenAI
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",  # Modèle plus économique
-                messages=api_messages,
-                temperature=0.5,
-                max_tokens=200
-            )
-            
-            summary = response.choices[0].message.content.strip()
-            logger.info(f"✅ Résumé IA généré avec succès ({len(summary)} caractères)")
-            return summary
-            
+            response = await create_chat_completion(self.client, **params)
+            return self._summary_from_response(response)
         except Exception as e:
             logger.error(f"❌ Erreur lors de la génération du résumé: {e}")
             import traceback
             traceback.print_exc()
             return None
+    
+    def _summary_from_response(self, response) -> str:
+        summary = response.choices[0].message.content.strip()
+        logger.info(f"✅ Résumé IA généré avec succès ({len(summary)} caractères)")
+        return summary
 
 
 # NOTE: La fonction generate_followup_message a été supprimée car les relances utilisent maintenant des templates
@@ -0,0 +1,227 @@
+"""
+Stockage des pièces jointes adressé par contenu (emails synchronisés et uploads).
+
+Chaque pièce jointe est écrite dès son décodage dans
+UPLOAD_DIR/<company_id>/attachments/<sha256><extension> puis libérée : la mémoire
+consommée par une synchronisation est bornée par le plus gros message, pas par la boîte.
+Le nom de fichier étant le hash du contenu, un même fichier reçu plusieurs fois
+n'est écrit qu'une fois par entreprise.
+
+En base, un AttachmentBlob par (entreprise, SHA-256) porte le compteur de références
+des MessageAttachment ; purge_unreferenced_blobs supprime les fichiers qui ne sont plus utilisés.
+Un contenu déjà présent voit la date de modification de son fichier rafraîchie à chaque écriture :
+le délai de grâce de la purge protège alors aussi un blob orphelin sur le point d'être réutilisé.
+"""
+import hashlib
+import logging
+import os
+import re
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.db.models.conversation import AttachmentBlob, MessageAttachment
+
+logger = logging.getLogger(__name__)
+
+# Chemin d'un fichier du stockage adressé par contenu : <company_id>/attachments/<sha256><ext>
+BLOB_PATH_RE = re.compile(r"^(\d+)/attachments/([0-9a-f]{64})(\.[^/]*)?$")
+
+# Délai de grâce avant purge d'un blob sans référence (upload pas encore rattaché à un message)
+UNREFERENCED_BLOB_GRACE = timedelta(hours=1)
+
+# Anciens fichiers recopiés dans le stockage adressé par contenu par la migration add_attachment_blobs,
+# supprimés après son commit par delete_migrated_legacy_files (chemins relatifs à UPLOAD_DIR, un par ligne)
+LEGACY_FILES_MANIFEST = ".legacy_attachments"
+
+
+def get_file_type(filename: str) -> str:
+    """Détermine le type de fichier basé sur l'extension."""
+    ext = Path(filename).suffix.lower()
+    if ext in [".jpg", ".jpeg", ".png", ".gif", ".webp"]:
+        return "image"
+    elif ext == ".pdf":
+        return "pdf"
+    elif ext in [".doc", ".docx", ".xls", ".xlsx", ".txt", ".csv"]:
+        return "document"
+    else:
+        return "other"
+
+
+class AttachmentStore:
+    """Écrit les pièces jointes d'une entreprise par hash de contenu, avec une taille maximale."""
+
+    def __init__(self, company_id: int, upload_dir: Optional[str] = None, max_size: Optional[int] = None):
+        self.company_id = company_id
+        self.upload_dir = Path(upload_dir or settings.UPLOAD_DIR)
+        self.max_size = max_size if max_size is not None else settings.IMAP_ATTACHMENT_MAX_SIZE
+        self.directory = self.upload_dir / str(company_id) / "attachments"
+
+    def exceeds_max_size(self, size: int) -> bool:
+        return self.max_size > 0 and size > self.max_size
+
+    def store(self, filename: str, content_type: Optional[str], payload: bytes) -> Dict:
+        """
+        Écrit le contenu (s'il n'existe pas déjà) et retourne les métadonnées de la pièce jointe :
+        {"filename", "content_type", "file_path" (relatif à UPLOAD_DIR), "file_size", "sha256", "content": None}.
+        Au-delà de la taille maximale, rien n'est écrit et "too_large" vaut True.
+        """
+        metadata = {
+            "filename": filename,
+            "content_type": content_type,
+            "file_size": len(payload),
+            "content": None,
+        }
+        if self.exceeds_max_size(len(payload)):
+            metadata["too_large"] = True
+            return metadata
+
+        digest = hashlib.sha256(payload).hexdigest()
+        file_path = self.directory / f"{digest}{Path(filename).suffix.lower()}"
+        if file_path.exists():
+            # Réutilisé : repousse le délai de grâce de purge_unreferenced_blobs
+            try:
+                os.utime(file_path)
+            except FileNotFoundError:
+                pass
+        if not file_path.exists():
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # Écriture atomique : un fichier partiel n'est jamais visible sous son nom final
+            tmp_path = self.directory / f".{digest}.{uuid.uuid4().hex}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(payload)
+                os.replace(tmp_path, file_path)
+            finally:
+                if tmp_path.exists():
+                    tmp_path.unlink()
+
+        metadata["sha256"] = digest
+        metadata["file_path"] = str(file_path.relative_to(self.upload_dir))
+        return metadata
+
+
+def acquire_blobs(db: Session, company_id: int, stored: List[Dict]) -> Dict[str, AttachmentBlob]:
+    """
+    Retourne {sha256: AttachmentBlob} pour les pièces jointes écrites par AttachmentStore.store,
+    en créant les blobs manquants (une requête IN + un flush). Le compteur de références est
+    incrémenté à l'insertion des MessageAttachment (blob_id renseigné).
+    """
+    by_sha = {item["sha256"]: item for item in stored if item.get("sha256") and item.get("file_path")}
+    if not by_sha:
+        return {}
+    blobs = {
+        blob.sha256: blob
+        for blob in db.query(AttachmentBlob).filter(
+            AttachmentBlob.company_id == company_id,
+            AttachmentBlob.sha256.in_(list(by_sha))
+        ).all()
+    }
+    upload_dir = Path(settings.UPLOAD_DIR)
+    new_blobs = []
+    for sha256, item in by_sha.items():
+        blob = blobs.get(sha256)
+        if blob is None:
+            blob = AttachmentBlob(
+                company_id=company_id,
+                sha256=sha256,
+                file_path=item["file_path"],
+                file_size=item.get("file_size") or 0,
+                ref_count=0,
+            )
+            blobs[sha256] = blob
+            new_blobs.append(blob)
+    if new_blobs:
+        db.add_all(new_blobs)
+        db.flush()
+    # Même contenu reçu sous une autre extension : le fichier du blob existant suffit
+    for item in stored:
+        blob = blobs.get(item.get("sha256"))
+        if blob is not None and item.get("file_path") and item["file_path"] != blob.file_path:
+            redundant = upload_dir / item["file_path"]
+            if redundant.exists():
+                redundant.unlink()
+    return blobs
+
+
+def blob_for_path(db: Session, company_id: int, file_path: Optional[str]) -> Optional[AttachmentBlob]:
+    """Blob correspondant à un chemin du stockage adressé par contenu (None pour les anciens chemins)."""
+    match = BLOB_PATH_RE.match(file_path or "")
+    if not match or int(match.group(1)) != company_id:
+        return None
+    return db.query(AttachmentBlob).filter(
+        AttachmentBlob.company_id == company_id,
+        AttachmentBlob.sha256 == match.group(2)
+    ).first()
+
+
+def purge_unreferenced_blobs(db: Session, company_id: Optional[int] = None) -> int:
+    """
+    Supprime les blobs sans référence (et leurs fichiers), hors délai de grâce des uploads récents
+    et des fichiers réécrits récemment (AttachmentStore.store). Commit la suppression des lignes
+    avant d'effacer les fichiers. Retourne le nombre de blobs purgés.
+    """
+    query = db.query(AttachmentBlob).filter(
+        AttachmentBlob.ref_count <= 0,
+        AttachmentBlob.created_at < datetime.utcnow() - UNREFERENCED_BLOB_GRACE
+    )
+    if company_id is not None:
+        query = query.filter(AttachmentBlob.company_id == company_id)
+    upload_dir = Path(settings.UPLOAD_DIR)
+    stored_before = time.time() - UNREFERENCED_BLOB_GRACE.total_seconds()
+
+    def _recently_stored(blob: AttachmentBlob) -> bool:
+        try:
+            return (upload_dir / blob.file_path).stat().st_mtime > stored_before
+        except FileNotFoundError:
+            return False
+
+    blobs = [blob for blob in query.all() if not _recently_stored(blob)]
+    if not blobs:
+        return 0
+    file_paths = [blob.file_path for blob in blobs]
+    for blob in blobs:
+        db.delete(blob)
+    db.commit()
+
+    for file_path in file_paths:
+        try:
+            (upload_dir / file_path).unlink()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"[ATTACHMENTS] Impossible de supprimer {file_path}: {e}")
+    return len(blobs)
+
+
+def delete_migrated_legacy_files(db: Session) -> int:
+    """
+    Supprime les anciens fichiers listés par la migration add_attachment_blobs, une fois celle-ci
+    commitée : un fichier encore référencé (migration annulée) est conservé. Retourne le nombre
+    de fichiers supprimés.
+    """
+    upload_dir = Path(settings.UPLOAD_DIR)
+    manifest = upload_dir / LEGACY_FILES_MANIFEST
+    if not manifest.exists():
+        return 0
+    file_paths = sorted({line.strip() for line in manifest.read_text().splitlines() if line.strip()})
+    referenced = set()
+    for start in range(0, len(file_paths), 500):
+        chunk = file_paths[start:start + 500]
+        for model in (MessageAttachment, AttachmentBlob):
+            referenced.update(path for (path,) in db.query(model.file_path).filter(model.file_path.in_(chunk)))
+
+    deleted = 0
+    for file_path in set(file_paths) - referenced:
+        try:
+            (upload_dir / file_path).unlink()
+            deleted += 1
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"[ATTACHMENTS] Impossible de supprimer {file_path}: {e}")
+    manifest.unlink()
+    return deleted
@@ -0,0 +1,365 @@
+"""
+File de travail persistante des réponses automatiques (génération IA + envoi SMTP / SMS).
+
+L'éligibilité est décidée une fois, à l'ingestion, sur des données déjà en mémoire : le message
+client qui vient d'arriver, le dossier de la conversation et la configuration auto_reply des
+dossiers conservée avec les règles compilées (app.core.folder_rules, cache par entreprise).
+La décision est enregistrée comme un AutoReplyJob dans la transaction de l'appelant ; la
+synchronisation et la classification ne bloquent plus sur l'IA ni sur les envois.
+
+Les workers (threads du serveur web et/ou scripts/auto_reply_worker.py) réclament les jobs
+disponibles, revérifient que le message est toujours le dernier de la conversation et que
+l'auto-réponse du dossier est toujours active (lue en base, pas dans le cache des règles), génèrent
+la réponse puis l'envoient (mode "auto", après le délai du dossier) ou la mettent en attente
+de validation (mode "approval").
+
+- Idempotence : clé unique conversation:message, une seule auto-réponse par message client
+  (INSERT ... ON CONFLICT DO NOTHING, ré-enfilage sans effet).
+- La réponse générée est enregistrée sur le job avant l'envoi : une nouvelle tentative ne
+  rappelle pas l'IA.
+- Au plus un envoi : le job passe en "sending" (commit) avant l'appel SMTP / SMS, puis en
+  "sent" avec le message enregistré dans la même transaction. Seul un échec avant l'envoi
+  (deliver_auto_reply retourne None) remet le job en "processing" pour être retenté ; un job
+  resté en "sending" (enregistrement ou commit en échec après l'envoi, worker mort pendant
+  l'envoi) passe en "failed" au lieu d'être renvoyé.
+- En cas d'échec : nouvel essai avec backoff, puis "failed" après AUTO_REPLY_JOB_MAX_ATTEMPTS ;
+  la réponse générée reste alors proposée dans la conversation (envoi manuel).
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import and_, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core import inbox_events  # noqa: F401  (écouteurs : évènements temps réel publiés au commit, worker dédié compris)
+from app.core.folder_rules import CompiledFolderRules, auto_reply_configs, get_folder_rules
+from app.db.models.auto_reply_job import AutoReplyJob
+from app.db.models.conversation import Conversation, InboxFolder, InboxMessage
+
+logger = logging.getLogger(__name__)
+
+# Backoff après échec : 60 s, 120 s, 240 s… plafonné à 30 min
+RETRY_BASE_SECONDS = 60
+RETRY_MAX_SECONDS = 1800
+# Pas d'auto-réponse si l'entreprise a répondu dans cet intervalle (boucles entre répondeurs)
+RECENT_REPLY_WINDOW = timedelta(minutes=2)
+
+_worker_threads: List[threading.Thread] = []
+_stop_event = threading.Event()
+
+
+def idempotency_key(conversation_id: int, message_id: int) -> str:
+    return f"{conversation_id}:{message_id}"
+
+
+def auto_reply_decision(
+    rules: CompiledFolderRules,
+    conversation: Conversation,
+    message: InboxMessage
+) -> Optional[Dict]:
+    """Configuration auto_reply à appliquer au message, ou None s'il n'appelle pas de réponse (aucune requête)."""
+    if not message.is_from_client or not conversation.folder_id:
+        return None
+    return rules.auto_replies.get(conversation.folder_id)
+
+
+def enqueue_auto_replies(
+    db: Session,
+    company_id: int,
+    items: Iterable[Tuple[Conversation, InboxMessage]],
+    rules: Optional[CompiledFolderRules] = None
+) -> int:
+    """
+    Crée les jobs d'auto-réponse des messages éligibles, dans la transaction de l'appelant
+    (aucun commit). Un message déjà enfilé est ignoré (clé d'idempotence).
+    Retourne le nombre de messages éligibles.
+    """
+    rules = rules or get_folder_rules(db, company_id)
+    if not rules.auto_replies:
+        return 0
+    now = datetime.utcnow()
+    rows = []
+    for conversation, message in items:
+        config = auto_reply_decision(rules, conversation, message)
+        if not config:
+            continue
+        # Mode "auto" avec délai : le job n'est disponible qu'à l'échéance
+        delay = (config.get("delay", 0) or 0) if config["mode"] == "auto" else 0
+        rows.append({
+            "company_id": company_id,
+            "conversation_id": conversation.id,
+            "message_id": message.id,
+            "idempotency_key": idempotency_key(conversation.id, message.id),
+            "mode": config["mode"],
+            "status": "pending",
+            "attempts": 0,
+            "available_at": now + timedelta(minutes=delay),
+            "created_at": now,
+        })
+    if not rows:
+        return 0
+
+    connection = db.connection()
+    insert = pg_insert if connection.dialect.name == "postgresql" else sqlite_insert
+    connection.execute(
+        insert(AutoReplyJob.__table__).on_conflict_do_nothing(index_elements=["idempotency_key"]),
+        rows
+    )
+    logger.info(f"[AUTO REPLY QUEUE] {len(rows)} auto-réponse(s) enfilée(s) pour l'entreprise {company_id}")
+    return len(rows)
+
+
+def enqueue_auto_reply(db: Session, conversation: Conversation, message: InboxMessage) -> bool:
+    """enqueue_auto_replies pour un seul message. Retourne True si une auto-réponse est prévue."""
+    return enqueue_auto_replies(db, conversation.company_id, [(conversation, message)]) > 0
+
+
+def claim_jobs(db: Session, limit: int) -> List[AutoReplyJob]:
+    """Réclame jusqu'à `limit` jobs disponibles et les passe en "processing"."""
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=settings.AUTO_REPLY_JOB_LOCK_TIMEOUT)
+
+    # Worker mort pendant un envoi : l'envoi a peut-être eu lieu, ne pas le refaire
+    db.query(AutoReplyJob).filter(
+        AutoReplyJob.status == "sending",
+        AutoReplyJob.locked_at < stale_before
+    ).update(
+        {"status": "failed", "locked_at": None, "last_error": "Envoi interrompu (worker arrêté), non renvoyé"},
+        synchronize_session=False
+    )
+
+    claimable = or_(
+        and_(AutoReplyJob.status == "pending", AutoReplyJob.available_at <= now),
+        and_(AutoReplyJob.status == "processing", AutoReplyJob.locked_at < stale_before)
+    )
+    query = db.query(AutoReplyJob.id).filter(claimable).order_by(
+        AutoReplyJob.available_at.asc(), AutoReplyJob.id.asc()
+    ).limit(limit)
+    if db.bind.dialect.name == "postgresql":
+        query = query.with_for_update(skip_locked=True)
+    candidate_ids = [row.id for row in query.all()]
+    if not candidate_ids:
+        db.commit()
+        return []
+
+    # UPDATE conditionnel : un job réclamé entre-temps par un autre worker n'est pas repris
+    db.query(AutoReplyJob).filter(AutoReplyJob.id.in_(candidate_ids), claimable).update(
+        {
+            "status": "processing",
+            "locked_at": now,
+            "attempts": AutoReplyJob.attempts + 1,
+        },
+        synchronize_session=False
+    )
+    db.commit()
+    return db.query(AutoReplyJob).filter(
+        AutoReplyJob.id.in_(candidate_ids),
+        AutoReplyJob.status == "processing",
+        AutoReplyJob.locked_at == now
+    ).all()
+
+
+def _skip_reason(db: Session, job: AutoReplyJob, conversation: Optional[Conversation]) -> Optional[str]:
+    """Raison de ne plus répondre au moment du traitement (délai écoulé, nouveaux messages), ou None."""
+    if conversation is None:
+        return "conversation supprimée"
+    last_message_id = db.query(InboxMessage.id).filter(
+        InboxMessage.conversation_id == conversation.id
+    ).order_by(InboxMessage.created_at.desc(), InboxMessage.id.desc()).limit(1).scalar()
+    if last_message_id != job.message_id:
+        # Un message plus récent a son propre job (client) ou vaut réponse (entreprise)
+        return "message plus récent dans la conversation"
+    recent_company_reply = db.query(InboxMessage.id).filter(
+        InboxMessage.conversation_id == conversation.id,
+        InboxMessage.is_from_client == False,
+        InboxMessage.created_at >= datetime.now() - RECENT_REPLY_WINDOW
+    ).first()
+    if recent_company_reply:
+        return "réponse récente de l'entreprise"
+    return None
+
+
+def _current_auto_reply_config(db: Session, conversation: Conversation) -> Optional[Dict]:
+    """
+    Configuration d'auto-réponse du dossier de la conversation, lue en base : le cache des règles
+    (par processus, FOLDER_RULES_CACHE_TTL) retarderait une désactivation faite ailleurs.
+    """
+    if conversation.folder_id is None:
+        return None
+    folder = db.query(InboxFolder).filter(
+        InboxFolder.id == conversation.folder_id,
+        InboxFolder.company_id == conversation.company_id
+    ).first()
+    return auto_reply_configs([folder]).get(folder.id) if folder else None
+
+
+def _skip_job(db: Session, job: AutoReplyJob, reason: str) -> str:
+    logger.info(f"[AUTO REPLY QUEUE] Job {job.id} ignoré (conversation {job.conversation_id}): {reason}")
+    job.status = "skipped"
+    job.locked_at = None
+    job.last_error = reason
+    db.commit()
+    return job.status
+
+
+def process_auto_reply_job(db: Session, job: AutoReplyJob) -> str:
+    """
+    Traite un job réclamé : vérification, génération (une fois), puis envoi ou mise en attente
+    de validation. Retourne le statut final du job ("sent", "awaiting_approval", "skipped").
+    Lève une exception en cas d'échec (job à replanifier).
+    """
+    from app.core.auto_reply_service import deliver_auto_reply, generate_auto_reply_content
+
+    conversation = db.query(Conversation).filter(Conversation.id == job.conversation_id).first()
+    reason = _skip_reason(db, job, conversation)
+    config = _current_auto_reply_config(db, conversation) if reason is None else None
+    if reason is None and not config:
+        reason = "auto-réponse désactivée ou conversation déplacée"
+    if reason:
+        return _skip_job(db, job, reason)
+
+    if not job.reply_content:
+        folder = db.query(InboxFolder).filter(InboxFolder.id == conversation.folder_id).first()
+        job.reply_content = generate_auto_reply_content(db, conversation, folder, config)
+        if not job.reply_content:
+            raise RuntimeError("Génération de la réponse impossible")
+        db.commit()
+
+    if job.mode == "approval":
+        conversation.auto_reply_pending = True
+        conversation.auto_reply_mode = "approval"
+        conversation.pending_auto_reply_content = job.reply_content
+        job.status = "awaiting_approval"
+        job.locked_at = None
+        db.commit()
+        return job.status
+
+    # Dernière vérification avant l'envoi (configuration modifiée pendant la génération)
+    if _current_auto_reply_config(db, conversation) is None:
+        return _skip_job(db, job, "auto-réponse désactivée ou conversation déplacée")
+
+    # Au plus un envoi : l'état "sending" est enregistré avant l'appel au fournisseur
+    job.status = "sending"
+    job.locked_at = datetime.utcnow()
+    db.commit()
+    auto_message = deliver_auto_reply(db, conversation, job.reply_content)
+    if auto_message is None:
+        # Rien n'a été envoyé : le job peut être retenté
+        db.rollback()
+        job.status = "processing"
+        db.commit()
+        raise RuntimeError("Envoi de la réponse automatique impossible")
+    conversation.auto_reply_mode = "auto"
+    conversation.auto_reply_pending = False
+    job.status = "sent"
+    job.locked_at = None
+    db.commit()
+    return job.status
+
+
+def _release_failed_job(db: Session, job_id: int, error: Exception) -> None:
+    """
+    Replanifie le job en échec (backoff exponentiel) ou le marque "failed" après le dernier essai ;
+    une réponse déjà générée est alors proposée dans la conversation pour un envoi manuel.
+    Un job encore en "sending" (échec après l'appel au fournisseur) passe en "failed" sans être renvoyé.
+    """
+    job = db.query(AutoReplyJob).filter(AutoReplyJob.id == job_id).first()
+    if job is None:
+        return
+    job.last_error = str(error)[:2000]
+    job.locked_at = None
+    if job.status == "sending":
+        job.status = "failed"
+        job.last_error = f"Envoi peut-être effectué, non renvoyé: {error}"[:2000]
+    elif job.attempts >= settings.AUTO_REPLY_JOB_MAX_ATTEMPTS:
+        job.status = "failed"
+        if job.reply_content:
+            conversation = db.query(Conversation).filter(Conversation.id == job.conversation_id).first()
+            if conversation is not None:
+                conversation.auto_reply_pending = True
+                conversation.auto_reply_mode = job.mode
+                conversation.pending_auto_reply_content = job.reply_content
+    else:
+        job.status = "pending"
+        delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** max(job.attempts - 1, 0))
+        job.available_at = datetime.utcnow() + timedelta(seconds=delay)
+    db.commit()
+
+
+def process_auto_reply_batch(db: Session, limit: Optional[int] = None) -> Dict[str, int]:
+    """
+    Traite un lot de jobs d'auto-réponse.
+    Retourne {"claimed", "sent", "awaiting_approval", "skipped", "failed"}.
+    """
+    stats = {"claimed": 0, "sent": 0, "awaiting_approval": 0, "skipped": 0, "failed": 0}
+    jobs = claim_jobs(db, limit or settings.AUTO_REPLY_QUEUE_BATCH_SIZE)
+    stats["claimed"] = len(jobs)
+    for job in jobs:
+        job_id = job.id
+        try:
+            stats[process_auto_reply_job(db, job)] += 1
+        except Exception as e:
+            db.rollback()
+            logger.error(f"[AUTO REPLY QUEUE] Erreur pour le job {job_id}: {e}", exc_info=True)
+            _release_failed_job(db, job_id, e)
+            stats["failed"] += 1
+    if jobs:
+        logger.info(
+            f"[AUTO REPLY QUEUE] {stats['claimed']} job(s): {stats['sent']} envoyée(s), "
+            f"{stats['awaiting_approval']} à valider, {stats['skipped']} ignorée(s), {stats['failed']} en échec"
+        )
+    return stats
+
+
+def run_auto_reply_worker(stop_event: Optional[threading.Event] = None, session_factory=None) -> None:
+    """
+    Boucle de worker : traite les lots tant qu'il y a des jobs, sinon attend
+    AUTO_REPLY_QUEUE_POLL_SECONDS.
+    """
+    if session_factory is None:
+        from app.db.session import SessionLocal
+        session_factory = SessionLocal
+    stop_event = stop_event or threading.Event()
+
+    while not stop_event.is_set():
+        claimed = 0
+        db = session_factory()
+        try:
+            claimed = process_auto_reply_batch(db)["claimed"]
+        except Exception as e:
+            db.rollback()
+            logger.error(f"[AUTO REPLY QUEUE] Erreur du worker: {e}", exc_info=True)
+        finally:
+            db.close()
+        if not claimed:
+            stop_event.wait(settings.AUTO_REPLY_QUEUE_POLL_SECONDS)
+
+
+def start_auto_reply_workers(count: Optional[int] = None) -> None:
+    """Démarre les threads d'auto-réponse du serveur web (AUTO_REPLY_WORKERS, idempotent)."""
+    if any(thread.is_alive() for thread in _worker_threads):
+        return
+    count = settings.AUTO_REPLY_WORKERS if count is None else count
+    _stop_event.clear()
+    for index in range(count):
+        thread = threading.Thread(
+            target=run_auto_reply_worker,
+            args=(_stop_event,),
+            name=f"auto-reply-worker-{index}",
+            daemon=True
+        )
+        thread.start()
+        _worker_threads.append(thread)
+    if count:
+        logger.info(f"[AUTO REPLY QUEUE] {count} worker(s) d'auto-réponse démarré(s)")
+
+
+def stop_auto_reply_workers(timeout: float = 5.0) -> None:
+    """Arrête les threads d'auto-réponse du serveur web."""
+    _stop_event.set()
+    for thread in _worker_threads:
+        thread.join(timeout)
+    _worker_threads.clear()
@@ -8,7 +8,7 @@ from app.db.models.conversation import Conversation, InboxMessage, InboxFolder
 from app.db.models.inbox_integration import InboxIntegration
 from app.db.models.company_settings import CompanySettings
 from app.core.ai_reply_service import ai_reply_service
-from app.core.smtp_service import send_email_smtp, get_smtp_config
+from app.core.smtp_service import EmailDeliveryUncertain, send_email_smtp, get_smtp_config
 from app.core.vonage_service import VonageSMSService
 from app.core.encryption_service import get_encryption_service
 from datetime import datetime, timedelta
@@ -191,10 +191,10 @@ def process_auto_reply(
                 logger.warning(f"[AUTO REPLY] Aucun dossier trouvé pour la conversation {conversation.id}")
                 return {"sent": False, "pending": False, "content": None}
             
-                folder = db.query(InboxFolder).filter(
+            folder = db.query(InboxFolder).filter(
                 InboxFolder.id == conversation.folder_id,
                 InboxFolder.company_id == conversation.company_id
-                ).first()
+            ).first()
             logger.info(f"[AUTO REPLY] Dossier récupéré: {folder.id if folder else None}")
         
         if not folder:
@@ -287,7 +287,7 @@ def _send_auto_reply_message(
     reply_content: str
 ) -> bool:
     """
-    Envoie le message de réponse automatique (email ou SMS).
+    Envoie le message de réponse automatique (email ou SMS) et l'enregistre dans la conversation.
     
     Args:
         db: Session de base de données
@@ -297,6 +297,54 @@ def _send_auto_reply_message(
     Returns:
         True si l'envoi a réussi, False sinon
     """
+    try:
+        auto_message = deliver_auto_reply(db, conversation, reply_content)
+        if auto_message is None:
+            return False
+        db.commit()
+        logger.info(f"[AUTO REPLY] Message enregistré dans la conversation (ID: {auto_message.id})")
+        return True
+    except Exception as e:
+        db.rollback()
+        logger.error(f"[AUTO REPLY] Erreur lors de l'envoi du message automatique: {e}", exc_info=True)
+        return False
+
+
+class AutoReplySentNotRecorded(Exception):
+    """
+    La réponse a (peut-être) été envoyée mais n'a pas pu être enregistrée, ou l'envoi a été
+    interrompu après transmission : elle ne doit pas être renvoyée.
+    """
+
+
+def _record_sent_auto_reply(db: Session, conversation: Conversation, auto_message: InboxMessage) -> InboxMessage:
+    """Ajoute la réponse envoyée à la conversation (flush) ; AutoReplySentNotRecorded en cas d'échec."""
+    try:
+        db.add(auto_message)
+        # Mettre à jour la date du dernier message
+        conversation.last_message_at = datetime.now()
+        db.flush()
+    except Exception as e:
+        raise AutoReplySentNotRecorded(f"Réponse envoyée mais non enregistrée: {e}") from e
+    return auto_message
+
+
+def deliver_auto_reply(
+    db: Session,
+    conversation: Conversation,
+    reply_content: str
+) -> Optional[InboxMessage]:
+    """
+    Envoie la réponse automatique (email ou SMS) et ajoute le message envoyé à la session,
+    sans commit : l'appelant l'enregistre dans la même transaction que son propre état.
+    
+    Returns:
+        Le message ajouté, ou None si rien n'a été envoyé (configuration manquante, échec du fournisseur)
+    
+    Raises:
+        AutoReplySentNotRecorded: l'envoi a eu lieu (ou a peut-être eu lieu) mais l'enregistrement
+            du message a échoué ou n'a pas été tenté
+    """
     try:
         if conversation.source == "email":
             # Récupérer la boîte mail principale pour l'envoi
@@ -308,7 +356,7 @@ def _send_auto_reply_message(
             
             if not primary_integration or not primary_integration.email_address or not primary_integration.email_password:
                 logger.error("[AUTO REPLY] Aucune boîte mail principale configurée pour l'envoi")
-                return False
+                return None
             
             # Récupérer l'email du client
             first_client_message = db.query(InboxMessage).filter(
@@ -319,7 +367,7 @@ def _send_auto_reply_message(
             
             if not first_client_message or not first_client_message.from_email:
                 logger.error("[AUTO REPLY] Impossible de trouver l'email du client pour l'envoi")
-                return False
+                return None
             
             # Décrypter le mot de passe
             encryption_service = get_encryption_service()
@@ -327,7 +375,7 @@ def _send_auto_reply_message(
             
             if not email_password:
                 logger.error("[AUTO REPLY] Impossible de décrypter le mot de passe de la boîte mail")
-                return False
+                return None
             
             # Récupérer la configuration SMTP à partir de l'adresse email
             smtp_config = get_smtp_config(primary_integration.email_address)
@@ -346,26 +394,18 @@ def _send_auto_reply_message(
                 from_name=None  # Utiliser le nom par défaut de l'email
             )
             
-            if success:
-                # Créer un message dans la conversation pour enregistrer la réponse
-                auto_message = InboxMessage(
-                    conversation_id=conversation.id,
-                    from_name=primary_integration.email_address.split("@")[0] or "Auto-Reply",
-                    from_email=primary_integration.email_address,
-                    content=reply_content,
-                    source="email",
-                    is_from_client=False,
-                    read=True
-                )
-                db.add(auto_message)
-                # Mettre à jour la date du dernier message
-                conversation.last_message_at = datetime.now()
-                db.commit()
-                db.refresh(auto_message)
-                db.refresh(conversation)
-                logger.info(f"[AUTO REPLY] Message enregistré dans la conversation (ID: {auto_message.id})")
-            
-            return success
+            if not success:
+                return None
+            # Créer un message dans la conversation pour enregistrer la réponse
+            return _record_sent_auto_reply(db, conversation, InboxMessage(
+                conversation_id=conversation.id,
+                from_name=primary_integration.email_address.split("@")[0] or "Auto-Reply",
+                from_email=primary_integration.email_address,
+                content=reply_content,
+                source="email",
+                is_from_client=False,
+                read=True
+            ))
             
         elif conversation.source == "sms":
             # Récupérer l'intégration SMS active
@@ -377,7 +417,7 @@ def _send_auto_reply_message(
             
             if not sms_integration or not sms_integration.api_key or not sms_integration.webhook_secret:
                 logger.error("[AUTO REPLY] Aucune intégration SMS configurée pour l'envoi")
-                return False
+                return None
             
             # Récupérer le numéro de téléphone du client
             first_client_message = db.query(InboxMessage).filter(
@@ -388,7 +428,7 @@ def _send_auto_reply_message(
             
             if not first_client_message or not first_client_message.from_phone:
                 logger.error("[AUTO REPLY] Impossible de trouver le numéro de téléphone du client pour l'envoi")
-                return False
+                return None
             
             # Décrypter les clés API
             encryption_service = get_encryption_service()
@@ -397,7 +437,7 @@ def _send_auto_reply_message(
             
             if not api_key or not api_secret:
                 logger.error("[AUTO REPLY] Impossible de décrypter les clés API SMS")
-                return False
+                return None
             
             # Envoyer le SMS via Vonage
             sms_service = VonageSMSService(api_key=api_key, api_secret=api_secret)
@@ -407,34 +447,30 @@ def _send_auto_reply_message(
                 from_number=sms_integration.phone_number
             )
             
-            if result.get("success"):
-                # Créer un message dans la conversation pour enregistrer la réponse
-                auto_message = InboxMessage(
-                    conversation_id=conversation.id,
-                    from_name=sms_integration.phone_number or "Auto-Reply",
-                    from_phone=sms_integration.phone_number,
-                    content=reply_content,
-                    source="sms",
-                    is_from_client=False,
-                    read=True
-                )
-                db.add(auto_message)
-                # Mettre à jour la date du dernier message
-                conversation.last_message_at = datetime.now()
-                db.commit()
-                db.refresh(auto_message)
-                db.refresh(conversation)
-                logger.info(f"[AUTO REPLY] Message SMS enregistré dans la conversation (ID: {auto_message.id})")
-            
-            return result.get("success", False)
+            if not result.get("success"):
+                return None
+            # Créer un message dans la conversation pour enregistrer la réponse
+            return _record_sent_auto_reply(db, conversation, InboxMessage(
+                conversation_id=conversation.id,
+                from_name=sms_integration.phone_number or "Auto-Reply",
+                from_phone=sms_integration.phone_number,
+                content=reply_content,
+                source="sms",
+                is_from_client=False,
+                read=True
+            ))
         
         else:
             logger.warning(f"[AUTO REPLY] Source de conversation non supportée pour l'envoi automatique: {conversation.source}")
-            return False
+            return None
             
+    except AutoReplySentNotRecorded:
+        raise
+    except EmailDeliveryUncertain as e:
+        raise AutoReplySentNotRecorded(f"Envoi incertain: {e}") from e
     except Exception as e:
         logger.error(f"[AUTO REPLY] Erreur lors de l'envoi du message automatique: {e}", exc_info=True)
-        return False
+        return None
 
 
 def trigger_auto_reply_if_needed(
@@ -445,33 +481,15 @@ def trigger_auto_reply_if_needed(
     """
     Déclenche l'auto-réponse si nécessaire après qu'un message entre dans un dossier.
     Cette fonction doit être appelée après qu'un dossier soit assigné à une conversation.
+    L'éligibilité est décidée sur la configuration du dossier en cache ; la génération et l'envoi
+    sont confiés aux workers de la file d'auto-réponse (app.core.auto_reply_dispatcher).
     
     Args:
         db: Session de base de données
         conversation: La conversation
         message: Le message qui vient d'être ajouté
     """
-    # Vérifier que la conversation est dans un dossier et que le message vient du client
-    if not conversation.folder_id or not message.is_from_client:
-        return
-    
-    # Récupérer le dossier
-    folder = db.query(InboxFolder).filter(
-        InboxFolder.id == conversation.folder_id,
-        InboxFolder.company_id == conversation.company_id
-    ).first()
-    
-    if not folder:
-        return
-    
-    # Vérifier que l'auto-réponse est activée
-    auto_reply_config = folder.auto_reply or {}
-    if not auto_reply_config.get("enabled", False):
-        return
-    
-    # Déclencher l'auto-réponse
-    logger.info(f"[AUTO REPLY] Déclenchement auto-réponse pour conversation {conversation.id} dans dossier {folder.name}")
-    result = process_auto_reply(db, conversation, folder)
-    logger.info(f"[AUTO REPLY] Résultat: {result}")
-    db.refresh(conversation)
-    db.expire(conversation, ['messages'])
+    from app.core.auto_reply_dispatcher import enqueue_auto_reply
+
+    if enqueue_auto_reply(db, conversation, message):
+        db.commit()
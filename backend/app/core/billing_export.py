@@ -0,0 +1,671 @@
+"""
+Exports en lot des PDF de factures et de devis d'une période (archive ZIP pour l'expert-comptable).
+
+La création (create_export_job) fige la liste des documents filtrés (période, statut, type de
+facture). Un worker (thread du serveur web et/ou scripts/billing_export_worker.py) réclame le job :
+- rend les PDF en parallèle dans le pool de rendu (BILLING_EXPORT_CONCURRENCY rendus en vol,
+  cache des PDF réutilisé) et écrit chacun dès qu'il est prêt dans le répertoire de travail du
+  job (un fichier par document) ; la progression est enregistrée après chaque lot ;
+- assemble l'archive en flux (PDF un par un, recapitulatif.csv et, pour les factures,
+  FEC_ventes.txt : écritures du journal des ventes sur des comptes génériques à adapter) ;
+- supprime les fichiers de travail. La route de téléchargement sert l'archive en flux.
+
+Reprise : un export "running" sans progression depuis BILLING_EXPORT_JOB_LOCK_TIMEOUT (worker
+mort) est réclamé à nouveau, les PDF déjà écrits ne sont pas rendus une seconde fois ; un export
+"failed" peut être relancé (resume_export_job). Les archives expirent après
+BILLING_EXPORT_RETENTION_HOURS.
+"""
+import csv
+import io
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session, joinedload, selectinload
+from app.core.config import settings
+from app.core.pdf_cache import PdfCache, get_pdf_cache, invoice_pdf_cache_key, quote_pdf_cache_key
+from app.core.pdf_render_pool import (
+    PdfRenderPool,
+    PdfRenderQueueFull,
+    invoice_render_config,
+    pdf_render_pool,
+    quote_design_config,
+    submit_invoice_pdf,
+    submit_quote_pdf,
+)
+from app.db.models.billing import Invoice, InvoiceStatus, InvoiceType, Quote, QuoteStatus
+from app.db.models.billing_export_job import BillingExportJob
+from app.db.models.client import Client
+from app.db.models.company import Company
+from app.db.models.company_settings import CompanySettings
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_TYPES = ("invoice", "quote")
+# Pause avant de resoumettre un rendu quand le pool est plein (les routes restent prioritaires)
+QUEUE_FULL_RETRY_SECONDS = 0.5
+# Documents lus par requête lors de l'assemblage du récapitulatif
+SUMMARY_BATCH_SIZE = 500
+
+SUMMARY_HEADER = ["Type", "Numéro", "Date", "Client", "Statut", "Total HT", "TVA", "Total TTC", "Fichier"]
+FEC_HEADER = [
+    "JournalCode", "JournalLib", "EcritureNum", "EcritureDate", "CompteNum", "CompteLib",
+    "CompAuxNum", "CompAuxLib", "PieceRef", "PieceDate", "EcritureLib", "Debit", "Credit",
+    "EcritureLet", "DateLet", "ValidDate", "Montantdevise", "Idevise",
+]
+FEC_ACCOUNT_CLIENTS = ("411000", "Clients")
+FEC_ACCOUNT_SALES = ("706000", "Prestations de services")
+FEC_ACCOUNT_VAT = ("445710", "TVA collectée")
+
+_worker_threads: List[threading.Thread] = []
+_stop_event = threading.Event()
+
+
+class ExportStopped(Exception):
+    """Export interrompu (arrêt du worker ou job repris par un autre worker)."""
+
+
+class ExportLease:
+    """Verrou d'un export réclamé par ce worker : valeur de locked_at, renouvelée à chaque heartbeat."""
+
+    def __init__(self, locked_at: datetime):
+        self.locked_at = locked_at
+
+
+def export_directory() -> Path:
+    return Path(settings.BILLING_EXPORT_DIR or Path(settings.UPLOAD_DIR) / "exports")
+
+
+def _job_directory(job: BillingExportJob) -> Path:
+    return export_directory() / str(job.company_id) / f"export_{job.id}"
+
+
+def archive_filename(job: BillingExportJob) -> str:
+    """Nom de l'archive proposé au téléchargement."""
+    filters = job.filters or {}
+    period = "_".join(filter(None, [filters.get("date_from"), filters.get("date_to")])) or "tout"
+    return f"export_{'factures' if job.document_type == 'invoice' else 'devis'}_{period}.zip"
+
+
+def _document_date_column(document_type: str):
+    if document_type == "invoice":
+        return func.coalesce(Invoice.issue_date, Invoice.created_at)
+    return Quote.created_at
+
+
+def select_document_ids(
+    db: Session,
+    company_id: int,
+    document_type: str,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    status: Optional[str] = None,
+    invoice_type: Optional[str] = None
+) -> List[int]:
+    """
+    Documents à exporter, par date puis id (date d'émission des factures, de création des devis ;
+    date_to incluse). ValueError si un filtre est invalide.
+    """
+    if document_type not in DOCUMENT_TYPES:
+        raise ValueError(f"Type de document invalide: {document_type}")
+    model = Invoice if document_type == "invoice" else Quote
+    document_date = _document_date_column(document_type)
+
+    query = db.query(model.id).filter(model.company_id == company_id)
+    if document_type == "invoice":
+        query = query.filter(Invoice.deleted_at.is_(None))
+        if invoice_type:
+            try:
+                query = query.filter(Invoice.invoice_type == InvoiceType(invoice_type))
+            except ValueError:
+                raise ValueError(f"Type de facture invalide: {invoice_type}")
+    if status:
+        try:
+            status_enum = InvoiceStatus(status) if document_type == "invoice" else QuoteStatus(status)
+        except ValueError:
+            raise ValueError(f"Statut invalide: {status}")
+        query = query.filter(model.status == status_enum)
+    if date_from:
+        query = query.filter(document_date >= datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        query = query.filter(document_date < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+    return [row.id for row in query.order_by(document_date.asc(), model.id.asc()).all()]
+
+
+def create_export_job(
+    db: Session,
+    company_id: int,
+    user_id: Optional[int],
+    document_type: str,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    status: Optional[str] = None,
+    invoice_type: Optional[str] = None
+) -> BillingExportJob:
+    """
+    Crée un export en attente (liste des documents figée), dans la transaction de l'appelant
+    (aucun commit). ValueError si les filtres sont invalides ou l'export trop volumineux.
+    """
+    if date_from and date_to and date_from > date_to:
+        raise ValueError("La date de début doit précéder la date de fin")
+    document_ids = select_document_ids(db, company_id, document_type, date_from, date_to, status, invoice_type)
+    if len(document_ids) > settings.BILLING_EXPORT_MAX_DOCUMENTS:
+        raise ValueError(
+            f"{len(document_ids)} documents : l'export est limité à {settings.BILLING_EXPORT_MAX_DOCUMENTS}, réduisez la période"
+        )
+    job = BillingExportJob(
+        company_id=company_id,
+        user_id=user_id,
+        document_type=document_type,
+        filters={
+            "date_from": date_from.isoformat() if date_from else None,
+            "date_to": date_to.isoformat() if date_to else None,
+            "status": status,
+            "invoice_type": invoice_type,
+        },
+        document_ids=document_ids,
+        status="pending",
+        total=len(document_ids),
+        processed=0,
+        failed_documents=[],
+        attempts=0,
+        created_at=datetime.utcnow(),
+    )
+    db.add(job)
+    db.flush()
+    return job
+
+
+def resume_export_job(db: Session, job: BillingExportJob) -> bool:
+    """Relance un export en échec (les PDF déjà écrits sont conservés). Pas de commit."""
+    if job.status != "failed":
+        return False
+    job.status = "pending"
+    job.attempts = 0
+    job.locked_at = None
+    job.last_error = None
+    return True
+
+
+def claim_export_job(db: Session) -> Optional[BillingExportJob]:
+    """
+    Réclame le plus ancien export en attente (ou "running" abandonné par un worker mort) et le
+    passe en "running". Les exports abandonnés trop souvent passent en "failed".
+    """
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=settings.BILLING_EXPORT_JOB_LOCK_TIMEOUT)
+    stale = and_(BillingExportJob.status == "running", BillingExportJob.locked_at < stale_before)
+
+    db.query(BillingExportJob).filter(
+        stale, BillingExportJob.attempts >= settings.BILLING_EXPORT_JOB_MAX_ATTEMPTS
+    ).update(
+        {"status": "failed", "locked_at": None, "last_error": "Export interrompu trop de fois"},
+        synchronize_session=False
+    )
+    claimable = or_(BillingExportJob.status == "pending", stale)
+
+    query = db.query(BillingExportJob.id).filter(claimable).order_by(
+        BillingExportJob.created_at.asc(), BillingExportJob.id.asc()
+    ).limit(1)
+    if db.bind.dialect.name == "postgresql":
+        query = query.with_for_update(skip_locked=True)
+    row = query.first()
+    if row is None:
+        db.commit()
+        return None
+
+    # UPDATE conditionnel : un export réclamé entre-temps par un autre worker n'est pas repris
+    claimed = db.query(BillingExportJob).filter(BillingExportJob.id == row.id, claimable).update(
+        {"status": "running", "locked_at": now, "attempts": BillingExportJob.attempts + 1},
+        synchronize_session=False
+    )
+    db.commit()
+    if not claimed:
+        return None
+    return db.query(BillingExportJob).filter(BillingExportJob.id == row.id).first()
+
+
+def _heartbeat(db: Session, job_id: int, lease: ExportLease, **values) -> None:
+    """
+    Enregistre la progression et renouvelle le verrou ; ExportStopped si le job a été repris
+    par un autre worker.
+    """
+    now = datetime.utcnow()
+    updated = db.query(BillingExportJob).filter(
+        BillingExportJob.id == job_id,
+        BillingExportJob.status == "running",
+        BillingExportJob.locked_at == lease.locked_at
+    ).update({**values, "locked_at": now}, synchronize_session=False)
+    db.commit()
+    if not updated:
+        raise ExportStopped(f"Export {job_id} repris par un autre worker")
+    lease.locked_at = now
+
+
+def _safe_name(number: str) -> str:
+    return re.sub(r"[^\w.-]+", "_", number or "sans_numero")
+
+
+def _archive_name(job: BillingExportJob, document) -> str:
+    if job.document_type == "quote":
+        folder = "devis"
+    elif document.invoice_type == InvoiceType.AVOIR:
+        folder = "avoirs"
+    else:
+        folder = "factures"
+    return f"{folder}/{_safe_name(document.number)}.pdf"
+
+
+def _write_part(parts_dir: Path, document_id: int, data: bytes) -> None:
+    # Fichier temporaire propre à l'écriture : un worker qui a repris le job peut écrire le même PDF
+    tmp_path = parts_dir / f"{document_id}.pdf.{uuid.uuid4().hex}.tmp"
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, parts_dir / f"{document_id}.pdf")
+
+
+def _load_documents(db: Session, job: BillingExportJob, document_ids: List[int]) -> Dict[int, Any]:
+    model = Invoice if job.document_type == "invoice" else Quote
+    query = db.query(model).options(selectinload(model.lines))
+    if job.document_type == "invoice":
+        query = query.options(joinedload(Invoice.company))
+    return {
+        document.id: document
+        for document in query.filter(model.id.in_(document_ids), model.company_id == job.company_id).all()
+    }
+
+
+def _render_tasks(
+    db: Session,
+    job: BillingExportJob,
+    documents: List[Any],
+    settings_data: Optional[Dict[str, Any]],
+    pool: PdfRenderPool
+) -> List[Tuple[Any, str, Callable[[], Future]]]:
+    """[(document, clé de cache, soumission du rendu)] d'un lot de documents."""
+    clients = {
+        client.id: client
+        for client in db.query(Client).filter(
+            Client.id.in_({document.client_id for document in documents}),
+            Client.company_id == job.company_id
+        ).all()
+    }
+    tasks = []
+    if job.document_type == "invoice":
+        company_info, design_config = invoice_render_config(settings_data)
+        quote_ids = {document.quote_id for document in documents if document.quote_id}
+        quotes = {quote.id: quote for quote in db.query(Quote).filter(Quote.id.in_(quote_ids)).all()} if quote_ids else {}
+        for invoice in documents:
+            client, quote = clients.get(invoice.client_id), quotes.get(invoice.quote_id)
+            tasks.append((
+                invoice,
+                invoice_pdf_cache_key(invoice, client, company_info, design_config, quote),
+                lambda invoice=invoice, client=client, quote=quote: submit_invoice_pdf(
+                    invoice, client, company_info, quote, design_config, pool=pool
+                )
+            ))
+    else:
+        company = db.query(Company).filter(Company.id == job.company_id).first()
+        design_config = quote_design_config(settings_data)
+        for quote in documents:
+            client = clients.get(quote.client_id)
+            tasks.append((
+                quote,
+                quote_pdf_cache_key(quote, client, company, settings_data, design_config, quote.client_signature_path),
+                lambda quote=quote, client=client: submit_quote_pdf(
+                    quote, client, company, design_config, quote.client_signature_path, settings_data, pool=pool
+                )
+            ))
+    return tasks
+
+
+def _submit(submit: Callable[[], Future], stop_event: Optional[threading.Event]) -> Future:
+    """Soumet un rendu, en attendant une place si le pool est plein."""
+    while True:
+        try:
+            return submit()
+        except PdfRenderQueueFull:
+            if stop_event is not None and stop_event.is_set():
+                raise ExportStopped("Arrêt du worker")
+            time.sleep(QUEUE_FULL_RETRY_SECONDS)
+
+
+def _render_batch(
+    db: Session,
+    job: BillingExportJob,
+    document_ids: List[int],
+    parts_dir: Path,
+    settings_data: Optional[Dict[str, Any]],
+    pool: PdfRenderPool,
+    cache: Optional[PdfCache],
+    stop_event: Optional[threading.Event]
+) -> List[str]:
+    """Rend un lot de documents (BILLING_EXPORT_CONCURRENCY en vol) ; retourne les numéros en échec."""
+    documents = _load_documents(db, job, document_ids)
+    pending = _render_tasks(db, job, [documents[i] for i in document_ids if i in documents], settings_data, pool)
+    concurrency = max(1, settings.BILLING_EXPORT_CONCURRENCY)
+    in_flight: Dict[Future, Tuple[Any, str, float]] = {}
+    failed: List[str] = []
+
+    while pending or in_flight:
+        while pending and len(in_flight) < concurrency:
+            document, key, submit = pending.pop(0)
+            cached = cache.get(key) if cache else None
+            if cached:
+                _write_part(parts_dir, document.id, cached)
+                continue
+            in_flight[_submit(submit, stop_event)] = (document, key, time.monotonic() + pool.timeout)
+        if not in_flight:
+            continue
+        done, _ = wait(list(in_flight), timeout=1.0, return_when=FIRST_COMPLETED)
+        now = time.monotonic()
+        for future, (document, key, deadline) in list(in_flight.items()):
+            if future in done:
+                del in_flight[future]
+                try:
+                    data = future.result()
+                except Exception as e:
+                    logger.error(f"[BILLING EXPORT] Rendu de {document.number} en échec (export {job.id}): {e}")
+                    failed.append(document.number)
+                    continue
+                _write_part(parts_dir, document.id, data)
+                if cache and data:
+                    cache.put(key, data)
+            elif now > deadline:
+                future.cancel()
+                del in_flight[future]
+                logger.error(f"[BILLING EXPORT] Rendu de {document.number} trop long (export {job.id})")
+                failed.append(document.number)
+    return failed
+
+
+def _format_amount(amount) -> str:
+    return f"{Decimal(amount or 0):.2f}".replace(".", ",")
+
+
+def _fec_lines(invoice: Invoice, client_name: str) -> List[List[str]]:
+    """Écritures du journal des ventes d'une facture (avoir : sens inversé)."""
+    issued = invoice.issue_date or invoice.created_at
+    day = issued.strftime("%Y%m%d") if issued else ""
+    total_ttc = Decimal(invoice.total_ttc if invoice.total_ttc is not None else invoice.amount or 0)
+    subtotal_ht = Decimal(invoice.subtotal_ht if invoice.subtotal_ht is not None else total_ttc)
+    total_tax = Decimal(invoice.total_tax or 0)
+    credit_note = invoice.invoice_type == InvoiceType.AVOIR or total_ttc < 0
+    label = f"{'Avoir' if credit_note else 'Facture'} {invoice.number} {client_name}".strip()
+
+    def entry(account: Tuple[str, str], amount: Decimal, debit: bool, aux: bool = False) -> List[str]:
+        return [
+            "VE", "Ventes", invoice.number, day, account[0], account[1],
+            f"C{invoice.client_id}" if aux else "", client_name if aux else "",
+            invoice.number, day, label,
+            _format_amount(abs(amount)) if debit else "0,00",
+            "0,00" if debit else _format_amount(abs(amount)),
+            "", "", day, "", "",
+        ]
+
+    lines = [
+        entry(FEC_ACCOUNT_CLIENTS, total_ttc, debit=not credit_note, aux=True),
+        entry(FEC_ACCOUNT_SALES, subtotal_ht, debit=credit_note),
+    ]
+    if total_tax:
+        lines.append(entry(FEC_ACCOUNT_VAT, total_tax, debit=credit_note))
+    return lines
+
+
+def _write_archive(
+    db: Session,
+    job: BillingExportJob,
+    parts_dir: Path,
+    archive_path: Path,
+    lease: ExportLease,
+    stop_event: Optional[threading.Event] = None
+) -> None:
+    """
+    Assemble l'archive : PDF écrits (un par un, en flux), récapitulatif CSV et FEC des factures.
+    Heartbeat après chaque lot de documents (un long assemblage n'est pas pris pour un worker
+    mort) ; l'archive est écrite dans un fichier temporaire propre à ce worker, puis renommée.
+    """
+    job_id, company_id, document_type = job.id, job.company_id, job.document_type
+    model = Invoice if document_type == "invoice" else Quote
+    ids = list(job.document_ids or [])
+    summary_rows: List[List[str]] = []
+    fec_rows: List[List[str]] = []
+    tmp_path = archive_path.with_name(f"{archive_path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+            for start in range(0, len(ids), SUMMARY_BATCH_SIZE):
+                if stop_event is not None and stop_event.is_set():
+                    raise ExportStopped("Arrêt du worker")
+                batch_ids = ids[start:start + SUMMARY_BATCH_SIZE]
+                documents = {
+                    document.id: document
+                    for document in db.query(model).filter(model.id.in_(batch_ids), model.company_id == company_id).all()
+                }
+                clients = {
+                    client.id: client.name
+                    for client in db.query(Client).filter(Client.id.in_({d.client_id for d in documents.values()})).all()
+                }
+                for document_id in batch_ids:
+                    document = documents.get(document_id)
+                    if document is None:
+                        continue
+                    part_path = parts_dir / f"{document_id}.pdf"
+                    name = _archive_name(job, document)
+                    if part_path.exists():
+                        archive.write(part_path, name)
+                    else:
+                        name = "rendu en échec"
+                    client_name = getattr(document, "client_name", None) or clients.get(document.client_id) or ""
+                    if document_type == "invoice":
+                        kind = "Avoir" if document.invoice_type == InvoiceType.AVOIR else "Facture"
+                        issued = document.issue_date or document.created_at
+                    else:
+                        kind, issued = "Devis", document.created_at
+                    summary_rows.append([
+                        kind,
+                        document.number,
+                        issued.strftime("%d/%m/%Y") if issued else "",
+                        client_name,
+                        document.status.value if document.status else "",
+                        _format_amount(document.subtotal_ht),
+                        _format_amount(document.total_tax),
+                        _format_amount(document.total_ttc if document.total_ttc is not None else document.amount),
+                        name,
+                    ])
+                    if document_type == "invoice" and document.status != InvoiceStatus.BROUILLON:
+                        fec_rows.extend(_fec_lines(document, client_name))
+                _heartbeat(db, job_id, lease)
+
+            with io.TextIOWrapper(archive.open("recapitulatif.csv", "w"), encoding="utf-8-sig", newline="") as summary_file:
+                writer = csv.writer(summary_file, delimiter=";")
+                writer.writerow(SUMMARY_HEADER)
+                writer.writerows(summary_rows)
+            if document_type == "invoice":
+                with io.TextIOWrapper(archive.open("FEC_ventes.txt", "w"), encoding="utf-8", newline="") as fec_file:
+                    writer = csv.writer(fec_file, delimiter="\t")
+                    writer.writerow(FEC_HEADER)
+                    writer.writerows(fec_rows)
+        os.replace(tmp_path, archive_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def process_export_job(
+    db: Session,
+    job: BillingExportJob,
+    pool: Optional[PdfRenderPool] = None,
+    cache: Optional[PdfCache] = None,
+    stop_event: Optional[threading.Event] = None,
+    lease: Optional[ExportLease] = None
+) -> None:
+    """
+    Exécute un export réclamé : rendu des PDF manquants par lots (progression enregistrée après
+    chaque lot), assemblage de l'archive, puis "completed". ExportStopped si le worker s'arrête.
+    `lease` : verrou posé par claim_export_job, tenu à jour à chaque heartbeat.
+    """
+    pool = pool or pdf_render_pool
+    if cache is None and settings.PDF_CACHE_ENABLED:
+        cache = get_pdf_cache()
+    lease = lease or ExportLease(job.locked_at)
+    job_id = job.id
+    job_dir = _job_directory(job)
+    parts_dir = job_dir / "parts"
+    parts_dir.mkdir(parents=True, exist_ok=True)
+
+    company_settings = db.query(CompanySettings).filter(CompanySettings.company_id == job.company_id).first()
+    settings_data = company_settings.settings if company_settings else None
+
+    document_ids = list(job.document_ids or [])
+    written = {int(path.stem) for path in parts_dir.glob("*.pdf")}
+    remaining = [document_id for document_id in document_ids if document_id not in written]
+    if written:
+        logger.info(f"[BILLING EXPORT] Reprise de l'export {job.id}: {len(document_ids) - len(remaining)}/{len(document_ids)} PDF déjà écrits")
+
+    failed: List[str] = []
+    batch_size = max(1, settings.BILLING_EXPORT_CONCURRENCY) * 2
+    for start in range(0, len(remaining), batch_size):
+        if stop_event is not None and stop_event.is_set():
+            raise ExportStopped("Arrêt du worker")
+        batch = remaining[start:start + batch_size]
+        failed += _render_batch(db, job, batch, parts_dir, settings_data, pool, cache, stop_event)
+        _heartbeat(
+            db, job_id, lease,
+            processed=len(document_ids) - len(remaining) + start + len(batch),
+            failed_documents=failed
+        )
+
+    archive_path = job_dir / archive_filename(job)
+    _write_archive(db, job, parts_dir, archive_path, lease, stop_event)
+    _heartbeat(
+        db, job_id, lease,
+        status="completed",
+        processed=len(document_ids),
+        failed_documents=failed,
+        file_path=str(archive_path),
+        file_size=archive_path.stat().st_size,
+        completed_at=datetime.utcnow(),
+        last_error=None
+    )
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    logger.info(
+        f"[BILLING EXPORT] Export {job.id} terminé: {len(document_ids)} document(s), "
+        f"{len(failed)} en échec, {archive_path.stat().st_size} octets"
+    )
+
+
+def _release_job(db: Session, job_id: int, lease: ExportLease, error: Optional[Exception] = None) -> None:
+    """
+    Remet un export interrompu en attente (reprise) ; "failed" après le dernier essai.
+    Sans effet si le job a été repris par un autre worker (locked_at différent du verrou tenu).
+    """
+    job = db.query(BillingExportJob).filter(
+        BillingExportJob.id == job_id,
+        BillingExportJob.status == "running",
+        BillingExportJob.locked_at == lease.locked_at
+    ).with_for_update().first()
+    if job is None:
+        db.commit()
+        return
+    job.locked_at = None
+    if error is None:
+        job.status = "pending"
+    else:
+        job.last_error = str(error)[:2000]
+        job.status = "failed" if job.attempts >= settings.BILLING_EXPORT_JOB_MAX_ATTEMPTS else "pending"
+    db.commit()
+
+
+def expire_exports(db: Session) -> int:
+    """Supprime les archives plus anciennes que BILLING_EXPORT_RETENTION_HOURS ; retourne leur nombre."""
+    expired_before = datetime.utcnow() - timedelta(hours=settings.BILLING_EXPORT_RETENTION_HOURS)
+    jobs = db.query(BillingExportJob).filter(
+        or_(
+            and_(BillingExportJob.status == "completed", BillingExportJob.completed_at < expired_before),
+            and_(BillingExportJob.status == "failed", BillingExportJob.created_at < expired_before)
+        )
+    ).all()
+    for job in jobs:
+        shutil.rmtree(_job_directory(job), ignore_errors=True)
+        job.status = "expired"
+        job.file_path = None
+    db.commit()
+    return len(jobs)
+
+
+def process_next_export(db: Session, pool: Optional[PdfRenderPool] = None, stop_event: Optional[threading.Event] = None) -> bool:
+    """Réclame et exécute un export ; retourne False si aucun export n'était en attente."""
+    job = claim_export_job(db)
+    if job is None:
+        return False
+    job_id = job.id
+    lease = ExportLease(job.locked_at)
+    try:
+        process_export_job(db, job, pool=pool, stop_event=stop_event, lease=lease)
+    except ExportStopped as e:
+        db.rollback()
+        logger.info(f"[BILLING EXPORT] Export {job_id} interrompu: {e}")
+        _release_job(db, job_id, lease)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"[BILLING EXPORT] Erreur de l'export {job_id}: {e}", exc_info=True)
+        _release_job(db, job_id, lease, e)
+    return True
+
+
+def run_billing_export_worker(stop_event: Optional[threading.Event] = None, session_factory=None) -> None:
+    """
+    Boucle de worker : exécute les exports les uns après les autres ; sans export en attente,
+    supprime les archives expirées puis attend BILLING_EXPORT_POLL_SECONDS.
+    """
+    if session_factory is None:
+        from app.db.session import SessionLocal
+        session_factory = SessionLocal
+    stop_event = stop_event or threading.Event()
+
+    while not stop_event.is_set():
+        processed = False
+        db = session_factory()
+        try:
+            processed = process_next_export(db, stop_event=stop_event)
+            if not processed:
+                expire_exports(db)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"[BILLING EXPORT] Erreur du worker: {e}", exc_info=True)
+        finally:
+            db.close()
+        if not processed:
+            stop_event.wait(settings.BILLING_EXPORT_POLL_SECONDS)
+
+
+def start_billing_export_worker() -> None:
+    """Démarre le worker des exports dans un thread du serveur web (idempotent)."""
+    if any(thread.is_alive() for thread in _worker_threads):
+        return
+    _stop_event.clear()
+    thread = threading.Thread(
+        target=run_billing_export_worker,
+        args=(_stop_event,),
+        name="billing-export-worker",
+        daemon=True
+    )
+    thread.start()
+    _worker_threads.append(thread)
+    logger.info("[BILLING EXPORT] Worker des exports démarré")
+
+
+def stop_billing_export_worker(timeout: float = 5.0) -> None:
+    """Arrête le worker des exports du serveur web (l'export en cours reprendra au redémarrage)."""
+    _stop_event.set()
+    for thread in _worker_threads:
+        thread.join(timeout)
+    _worker_threads.clear()
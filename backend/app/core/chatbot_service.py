@@ -8,18 +8,18 @@ from typing import Optional, Dict, Any, List
 from sqlalchemy.orm import Session
 from app.core.config import settings
 from app.core.chatbot_context_service import build_company_context
-from app.core.openai_throttle import throttle_openai_request
+from app.core.openai_client import create_chat_completion
 from app.db.models.chatbot import ChatbotConversation, ChatbotMessage
 
 logger = logging.getLogger(__name__)
 
 # Import OpenAI avec gestion d'erreur
 try:
-    from openai import OpenAI
+    from openai import AsyncOpenAI
     OPENAI_AVAILABLE = True
 except ImportError as e:
     logger.error(f"OpenAI library not available: {e}")
-    OpenAI = None
+    AsyncOpenAI = None
     OPENAI_AVAILABLE = False
 
 
@@ -43,7 +43,7 @@ class ChatbotService:
             self.client = None
         else:
             try:
-                self.client = OpenAI(api_key=api_key)
+                self.client = AsyncOpenAI(api_key=api_key)
                 self.enabled = True
                 logger.info("✅ Service chatbot ChatGPT initialisé avec succès")
             except Exception as e:
@@ -329,11 +329,9 @@ Rappelle-toi : tu as accès aux VRAIES données de l'entreprise. Utilise-les pou
             
             logger.info(f"[CHATBOT] Envoi de {len(api_messages)} messages à ChatGPT (modèle: {model})")
             
-            # Throttle pour éviter les rate limits
-            throttle_openai_request()
-            
-            # Appeler l'API OpenAI
-            response = self.client.chat.completions.create(
+            # Appeler l'API OpenAI (limiteur RPM/TPM, sans bloquer l'event loop)
+            response = await create_chat_completion(
+                self.client,
                 model=model,
                 messages=api_messages,
                 max_tokens=max_tokens,
@@ -0,0 +1,249 @@
+"""
+Cache persistant des résultats de classification IA (dossiers, notifications).
+
+Les expéditeurs automatisés (Amazon, PayPal, newsletters…) envoient chaque jour des emails
+quasi identiques : seuls les numéros de commande, dates ou montants changent. Chaque résultat
+IA est mémorisé sous la clé (entreprise, type, version de configuration, expéditeur) avec une
+empreinte SimHash 64 bits du sujet + contenu normalisés ; un message dont l'empreinte est à
+moins de CLASSIFICATION_CACHE_MAX_DISTANCE bits d'une entrée du même expéditeur réutilise le
+résultat sans appel IA.
+
+Les entrées expirent après CLASSIFICATION_CACHE_TTL_SECONDS et, au-delà de
+CLASSIFICATION_CACHE_MAX_ENTRIES par entreprise, les moins récemment utilisées sont évincées.
+Les compteurs (hits, appels IA évités, latence économisée) sont exposés par stats().
+"""
+import hashlib
+import logging
+import re
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Hashable, List, Optional, Tuple
+from sqlalchemy import func
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+KIND_FOLDER = "folder"
+KIND_NOTIFICATION = "notification"
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_DIGITS_RE = re.compile(r"\d+")
+_SHINGLE_SIZE = 3
+_MASK_64 = (1 << 64) - 1
+
+
+def _normalize_tokens(text: str) -> List[str]:
+    # Chiffres ramenés à "0" : numéros de commande, dates et montants ne changent pas la forme
+    return _TOKEN_RE.findall(_DIGITS_RE.sub("0", (text or "").lower()))
+
+
+def simhash(text: str) -> int:
+    """Empreinte SimHash 64 bits (non signée) des shingles de 3 mots du texte normalisé."""
+    tokens = _normalize_tokens(text)
+    if len(tokens) >= _SHINGLE_SIZE:
+        features = [" ".join(tokens[i:i + _SHINGLE_SIZE]) for i in range(len(tokens) - _SHINGLE_SIZE + 1)]
+    else:
+        features = tokens
+    weights = [0] * 64
+    for feature in features:
+        value = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin((a ^ b) & _MASK_64).count("1")
+
+
+def _to_signed(value: int) -> int:
+    """Empreinte non signée -> entier signé 64 bits (colonne BIGINT)."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _to_unsigned(value: int) -> int:
+    return value & _MASK_64
+
+
+class ClassificationCache:
+    """Cache des classifications en base, avec compteurs de performance par processus."""
+
+    def __init__(self, session_factory=None):
+        self._session_factory = session_factory
+        self._lock = threading.Lock()
+        self._counters = {"lookups": 0, "hits": 0, "ai_calls": 0, "ai_calls_saved": 0, "ai_seconds": 0.0}
+
+    @property
+    def enabled(self) -> bool:
+        return settings.CLASSIFICATION_CACHE_ENABLED
+
+    def _session(self):
+        if self._session_factory is None:
+            from app.db.session import SessionLocal
+            self._session_factory = SessionLocal
+        return self._session_factory()
+
+    def lookup(
+        self,
+        company_id: Optional[int],
+        kind: str,
+        config_version: str,
+        items: List[Tuple[Hashable, str, str]]
+    ) -> Dict[Hashable, str]:
+        """
+        `items` : [(clé, expéditeur, texte)]. Retourne {clé: résultat} pour les messages dont une
+        forme proche (même expéditeur, empreinte à distance <= seuil) est en cache et non expirée.
+        """
+        if not self.enabled or company_id is None or not items:
+            return {}
+        from app.db.models.classification_cache import ClassificationCacheEntry
+
+        senders = {(sender or "").lower() for _, sender, _ in items}
+        results = {}
+        db = self._session()
+        try:
+            now = datetime.utcnow()
+            entries_by_sender: Dict[str, list] = {}
+            for entry in db.query(ClassificationCacheEntry).filter(
+                ClassificationCacheEntry.company_id == company_id,
+                ClassificationCacheEntry.kind == kind,
+                ClassificationCacheEntry.config_version == config_version,
+                ClassificationCacheEntry.sender.in_(list(senders)),
+                ClassificationCacheEntry.expires_at > now
+            ).all():
+                entries_by_sender.setdefault(entry.sender, []).append(entry)
+
+            hit_ids = []
+            max_distance = settings.CLASSIFICATION_CACHE_MAX_DISTANCE
+            for key, sender, text in items:
+                candidates = entries_by_sender.get((sender or "").lower())
+                if not candidates:
+                    continue
+                fingerprint = simhash(text)
+                distance, best = min(
+                    ((hamming_distance(fingerprint, _to_unsigned(entry.fingerprint)), entry) for entry in candidates),
+                    key=lambda candidate: candidate[0]
+                )
+                if distance <= max_distance:
+                    results[key] = best.result
+                    hit_ids.append(best.id)
+
+            if hit_ids:
+                # Mise à jour LRU (une entrée peut servir plusieurs messages du lot)
+                for entry_id, hits in Counter(hit_ids).items():
+                    db.query(ClassificationCacheEntry).filter(ClassificationCacheEntry.id == entry_id).update(
+                        {"hit_count": ClassificationCacheEntry.hit_count + hits, "last_used_at": now},
+                        synchronize_session=False
+                    )
+                db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"[CLASSIFICATION CACHE] Lecture du cache impossible: {e}")
+            results = {}
+        finally:
+            db.close()
+
+        with self._lock:
+            self._counters["lookups"] += len(items)
+            self._counters["hits"] += len(results)
+        return results
+
+    def store(
+        self,
+        company_id: Optional[int],
+        kind: str,
+        config_version: str,
+        items: List[Tuple[str, str, str]]
+    ) -> None:
+        """Mémorise les résultats IA : `items` = [(expéditeur, texte, résultat)]. Évince ensuite (TTL, LRU)."""
+        if not self.enabled or company_id is None or not items:
+            return
+        from app.db.models.classification_cache import ClassificationCacheEntry
+
+        db = self._session()
+        try:
+            now = datetime.utcnow()
+            expires_at = now + timedelta(seconds=settings.CLASSIFICATION_CACHE_TTL_SECONDS)
+            db.add_all([
+                ClassificationCacheEntry(
+                    company_id=company_id,
+                    kind=kind,
+                    config_version=config_version,
+                    sender=(sender or "").lower()[:255],
+                    fingerprint=_to_signed(simhash(text)),
+                    result=str(result),
+                    hit_count=0,
+                    created_at=now,
+                    last_used_at=now,
+                    expires_at=expires_at,
+                )
+                for sender, text, result in items
+            ])
+            db.flush()
+            self._evict(db, company_id, now)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"[CLASSIFICATION CACHE] Écriture du cache impossible: {e}")
+        finally:
+            db.close()
+
+    def _evict(self, db, company_id: int, now: datetime) -> None:
+        from app.db.models.classification_cache import ClassificationCacheEntry
+
+        db.query(ClassificationCacheEntry).filter(
+            ClassificationCacheEntry.company_id == company_id,
+            ClassificationCacheEntry.expires_at <= now
+        ).delete(synchronize_session=False)
+
+        max_entries = settings.CLASSIFICATION_CACHE_MAX_ENTRIES
+        count = db.query(func.count(ClassificationCacheEntry.id)).filter(
+            ClassificationCacheEntry.company_id == company_id
+        ).scalar() or 0
+        if count <= max_entries:
+            return
+        evicted_ids = [
+            row.id for row in db.query(ClassificationCacheEntry.id).filter(
+                ClassificationCacheEntry.company_id == company_id
+            ).order_by(
+                ClassificationCacheEntry.last_used_at.asc(), ClassificationCacheEntry.id.asc()
+            ).limit(count - max_entries).all()
+        ]
+        db.query(ClassificationCacheEntry).filter(
+            ClassificationCacheEntry.id.in_(evicted_ids)
+        ).delete(synchronize_session=False)
+
+    def record_ai_call(self, seconds: float) -> None:
+        """Compte un appel IA effectué (et sa durée, pour estimer la latence économisée)."""
+        with self._lock:
+            self._counters["ai_calls"] += 1
+            self._counters["ai_seconds"] += seconds
+
+    def record_saved_call(self) -> None:
+        """Compte un appel IA évité (tous les messages de la requête servis par le cache)."""
+        with self._lock:
+            self._counters["ai_calls_saved"] += 1
+
+    def stats(self) -> Dict:
+        """Compteurs du processus : taux de hit, appels IA évités et latence économisée (estimée)."""
+        with self._lock:
+            counters = dict(self._counters)
+        average_call = counters["ai_seconds"] / counters["ai_calls"] if counters["ai_calls"] else 0.0
+        return {
+            "lookups": counters["lookups"],
+            "hits": counters["hits"],
+            "misses": counters["lookups"] - counters["hits"],
+            "hit_rate": round(counters["hits"] / counters["lookups"], 4) if counters["lookups"] else 0.0,
+            "ai_calls": counters["ai_calls"],
+            "ai_calls_saved": counters["ai_calls_saved"],
+            "average_ai_call_seconds": round(average_call, 3),
+            "estimated_seconds_saved": round(average_call * counters["ai_calls_saved"], 1),
+        }
+
+
+classification_cache = ClassificationCache()
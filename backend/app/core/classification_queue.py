@@ -0,0 +1,285 @@
+"""
+File de travail persistante pour la classification IA des conversations dans les dossiers.
+
+L'ingestion (sync IMAP, webhooks) ne classe plus en ligne : elle commit la conversation avec
+folder_id NULL et crée un ClassificationJob dans la même transaction. Les workers
+(thread du serveur web et/ou scripts/classification_worker.py) réclament les jobs en attente
+de toutes les entreprises, les regroupent par entreprise en lots pour classify_messages_batch,
+appliquent les dossiers puis enfilent les auto-réponses (app.core.auto_reply_dispatcher).
+
+- Réclamation : UPDATE conditionnel (et FOR UPDATE SKIP LOCKED sous PostgreSQL), plusieurs
+  workers peuvent tourner en parallèle sans traiter deux fois un job.
+- Un job "processing" dont le worker est mort est repris après CLASSIFICATION_JOB_LOCK_TIMEOUT.
+- En cas d'erreur : nouvel essai avec backoff exponentiel, puis "failed" après
+  CLASSIFICATION_JOB_MAX_ATTEMPTS tentatives.
+- Un job terminé est supprimé : le dossier est appliqué, le job supprimé et l'auto-réponse
+  enfilée dans la même transaction (génération et envoi par les workers d'auto-réponse).
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core import inbox_events  # noqa: F401  (écouteurs : évènements temps réel publiés au commit, worker dédié compris)
+from app.db.models.classification_job import ClassificationJob
+from app.db.models.conversation import Conversation, InboxMessage
+
+logger = logging.getLogger(__name__)
+
+# Messages par appel IA (même taille de lot que reclassify_all_conversations)
+AI_BATCH_SIZE = 10
+# Backoff après échec : 30 s, 60 s, 120 s… plafonné à 10 min
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 600
+
+_worker_threads: List[threading.Thread] = []
+_stop_event = threading.Event()
+
+
+def enqueue_classification(db: Session, company_id: int, items: Iterable[Tuple[Conversation, InboxMessage]]) -> int:
+    """
+    Crée les jobs de classification des messages clients fournis, dans la transaction de
+    l'appelant (aucun commit). Un job encore en attente pour la conversation est réutilisé
+    et pointe désormais vers le message le plus récent. Retourne le nombre de jobs créés.
+    """
+    latest: Dict[int, InboxMessage] = {}
+    for conversation, message in items:
+        if message.is_from_client:
+            latest[conversation.id] = message
+    if not latest:
+        return 0
+
+    pending = {
+        job.conversation_id: job
+        for job in db.query(ClassificationJob).filter(
+            ClassificationJob.conversation_id.in_(list(latest)),
+            ClassificationJob.status == "pending"
+        ).all()
+    }
+    now = datetime.utcnow()
+    created = 0
+    for conversation_id, message in latest.items():
+        job = pending.get(conversation_id)
+        if job:
+            job.message_id = message.id
+            continue
+        db.add(ClassificationJob(
+            company_id=company_id,
+            conversation_id=conversation_id,
+            message_id=message.id,
+            status="pending",
+            attempts=0,
+            available_at=now,
+            created_at=now,
+        ))
+        created += 1
+    return created
+
+
+def claim_jobs(db: Session, limit: int) -> List[ClassificationJob]:
+    """Réclame jusqu'à `limit` jobs disponibles (toutes entreprises confondues) et les passe en "processing"."""
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=settings.CLASSIFICATION_JOB_LOCK_TIMEOUT)
+    claimable = or_(
+        and_(ClassificationJob.status == "pending", ClassificationJob.available_at <= now),
+        and_(ClassificationJob.status == "processing", ClassificationJob.locked_at < stale_before)
+    )
+
+    query = db.query(ClassificationJob.id).filter(claimable).order_by(
+        ClassificationJob.available_at.asc(), ClassificationJob.id.asc()
+    ).limit(limit)
+    if db.bind.dialect.name == "postgresql":
+        query = query.with_for_update(skip_locked=True)
+    candidate_ids = [row.id for row in query.all()]
+    if not candidate_ids:
+        db.commit()
+        return []
+
+    # UPDATE conditionnel : un job réclamé entre-temps par un autre worker n'est pas repris
+    db.query(ClassificationJob).filter(ClassificationJob.id.in_(candidate_ids), claimable).update(
+        {
+            "status": "processing",
+            "locked_at": now,
+            "attempts": ClassificationJob.attempts + 1,
+        },
+        synchronize_session=False
+    )
+    db.commit()
+    return db.query(ClassificationJob).filter(
+        ClassificationJob.id.in_(candidate_ids),
+        ClassificationJob.status == "processing",
+        ClassificationJob.locked_at == now
+    ).all()
+
+
+def _classify_company_jobs(db: Session, company_id: int, jobs: List[ClassificationJob]) -> List[Tuple[Conversation, InboxMessage]]:
+    """
+    Classe les conversations des jobs d'une entreprise (lots de AI_BATCH_SIZE messages).
+    Retourne les couples (conversation, message) classés dans un dossier. Pas de commit.
+    """
+    from app.core.folder_ai_classifier import get_ai_classifier_service
+    from app.core.folder_rules import get_folder_rules
+
+    conversations = {
+        conversation.id: conversation
+        for conversation in db.query(Conversation).filter(
+            Conversation.id.in_([job.conversation_id for job in jobs]),
+            Conversation.company_id == company_id
+        ).all()
+    }
+    message_ids = [job.message_id for job in jobs if job.message_id]
+    messages = {
+        message.id: message
+        for message in db.query(InboxMessage).filter(InboxMessage.id.in_(message_ids)).all()
+    } if message_ids else {}
+
+    targets = []
+    for job in jobs:
+        conversation = conversations.get(job.conversation_id)
+        message = messages.get(job.message_id)
+        if conversation and message:
+            targets.append((conversation, message))
+
+    to_classify = [(conversation, message) for conversation, message in targets if not conversation.folder_id]
+    if to_classify:
+        rules = get_folder_rules(db, company_id)
+        ai_service = get_ai_classifier_service()
+        if rules.ai_folders and ai_service and ai_service.enabled:
+            valid_folder_ids = {folder["id"] for folder in rules.ai_folders}
+            for i in range(0, len(to_classify), AI_BATCH_SIZE):
+                batch = to_classify[i:i + AI_BATCH_SIZE]
+                results = ai_service.classify_messages_batch(
+                    messages=[
+                        {
+                            "conversation_id": conversation.id,
+                            "content": (message.content or "")[:500],
+                            "subject": (conversation.subject or "") if conversation.source == "email" else "",
+                            "from_email": message.from_email or "",
+                            "from_phone": message.from_phone or ""
+                        }
+                        for conversation, message in batch
+                    ],
+                    folders=rules.ai_folders,
+                    company_context=None,
+                    rules=rules,
+                    company_id=company_id,
+                    raise_errors=True
+                ) or {}
+                for conversation, _ in batch:
+                    folder_id = results.get(conversation.id)
+                    if not folder_id or folder_id not in valid_folder_ids:
+                        continue
+                    # Ne pas écraser un dossier choisi manuellement pendant la classification
+                    updated = db.query(Conversation).filter(
+                        Conversation.id == conversation.id,
+                        Conversation.folder_id.is_(None)
+                    ).update({"folder_id": folder_id, "ai_classified": True}, synchronize_session=False)
+                    if updated:
+                        conversation.folder_id = folder_id
+                        conversation.ai_classified = True
+
+    return [(conversation, message) for conversation, message in targets if conversation.folder_id]
+
+
+def _release_failed_jobs(db: Session, job_ids: List[int], error: Exception) -> None:
+    """Replanifie les jobs en échec (backoff exponentiel) ou les marque "failed" après le dernier essai."""
+    now = datetime.utcnow()
+    for job in db.query(ClassificationJob).filter(ClassificationJob.id.in_(job_ids)).all():
+        job.last_error = str(error)[:2000]
+        job.locked_at = None
+        if job.attempts >= settings.CLASSIFICATION_JOB_MAX_ATTEMPTS:
+            job.status = "failed"
+        else:
+            job.status = "pending"
+            delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** max(job.attempts - 1, 0))
+            job.available_at = now + timedelta(seconds=delay)
+    db.commit()
+
+
+def process_classification_batch(db: Session, limit: Optional[int] = None) -> Dict[str, int]:
+    """
+    Traite un lot de jobs : réclamation, classification par entreprise, suppression des jobs
+    terminés et mise en file des auto-réponses. Retourne {"claimed", "classified", "auto_replies", "failed"}.
+    """
+    from app.core.auto_reply_dispatcher import enqueue_auto_replies
+
+    stats = {"claimed": 0, "classified": 0, "auto_replies": 0, "failed": 0}
+    jobs = claim_jobs(db, limit or settings.CLASSIFICATION_QUEUE_BATCH_SIZE)
+    stats["claimed"] = len(jobs)
+
+    jobs_by_company: Dict[int, List[ClassificationJob]] = {}
+    for job in jobs:
+        jobs_by_company.setdefault(job.company_id, []).append(job)
+
+    for company_id, company_jobs in jobs_by_company.items():
+        job_ids = [job.id for job in company_jobs]
+        try:
+            classified = _classify_company_jobs(db, company_id, company_jobs)
+            db.query(ClassificationJob).filter(ClassificationJob.id.in_(job_ids)).delete(synchronize_session=False)
+            auto_replies = enqueue_auto_replies(db, company_id, classified)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"[CLASSIFICATION QUEUE] Erreur pour l'entreprise {company_id} ({len(job_ids)} job(s)): {e}", exc_info=True)
+            _release_failed_jobs(db, job_ids, e)
+            stats["failed"] += len(job_ids)
+            continue
+        stats["classified"] += len(classified)
+        stats["auto_replies"] += auto_replies
+
+    if jobs:
+        logger.info(
+            f"[CLASSIFICATION QUEUE] {stats['claimed']} job(s) traité(s): {stats['classified']} conversation(s) "
+            f"dans un dossier, {stats['auto_replies']} auto-réponse(s) enfilée(s), {stats['failed']} en échec"
+        )
+    return stats
+
+
+def run_classification_worker(stop_event: Optional[threading.Event] = None, session_factory=None) -> None:
+    """
+    Boucle de worker : traite les lots tant qu'il y a des jobs, sinon attend
+    CLASSIFICATION_QUEUE_POLL_SECONDS (délai maximal avant la prise en charge d'un nouveau job).
+    """
+    if session_factory is None:
+        from app.db.session import SessionLocal
+        session_factory = SessionLocal
+    stop_event = stop_event or threading.Event()
+
+    while not stop_event.is_set():
+        claimed = 0
+        db = session_factory()
+        try:
+            claimed = process_classification_batch(db)["claimed"]
+        except Exception as e:
+            db.rollback()
+            logger.error(f"[CLASSIFICATION QUEUE] Erreur du worker: {e}", exc_info=True)
+        finally:
+            db.close()
+        if not claimed:
+            stop_event.wait(settings.CLASSIFICATION_QUEUE_POLL_SECONDS)
+
+
+def start_classification_worker() -> None:
+    """Démarre le worker de classification dans un thread du serveur web (idempotent)."""
+    if any(thread.is_alive() for thread in _worker_threads):
+        return
+    _stop_event.clear()
+    thread = threading.Thread(
+        target=run_classification_worker,
+        args=(_stop_event,),
+        name="classification-worker",
+        daemon=True
+    )
+    thread.start()
+    _worker_threads.append(thread)
+    logger.info("[CLASSIFICATION QUEUE] Worker de classification démarré")
+
+
+def stop_classification_worker(timeout: float = 5.0) -> None:
+    """Arrête le worker de classification du serveur web."""
+    _stop_event.set()
+    for thread in _worker_threads:
+        thread.join(timeout)
+    _worker_threads.clear()
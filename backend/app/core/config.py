@@ -46,8 +46,59 @@ class Settings(BaseSettings):
     # Configuration cron jobs
     CRON_SECRET: Optional[str] = None  # Secret pour protéger les endpoints cron (ex: pour relances automatiques)
     
+    # Configuration de la synchronisation IMAP périodique (scheduler multi-entreprises)
+    IMAP_SYNC_MAX_CONCURRENCY: int = 10  # Nombre maximum d'intégrations synchronisées en parallèle
+    IMAP_SYNC_MAX_PER_HOST: int = 4  # Nombre maximum de connexions simultanées vers un même serveur IMAP
+    IMAP_SYNC_TIMEOUT_SECONDS: int = 180  # Durée maximale de synchronisation d'une intégration
+    IMAP_FETCH_BATCH_SIZE: int = 200  # Nombre d'UIDs par requête FETCH d'en-têtes
+    IMAP_FETCH_BODY_BATCH_SIZE: int = 25  # Nombre d'UIDs par requête FETCH de corps complets (RFC822)
+    IMAP_FETCH_BODY_BATCH_BYTES: int = 8 * 1024 * 1024  # Taille cumulée max (RFC822.SIZE) d'un lot de corps en mode streaming
+    IMAP_ATTACHMENT_MAX_SIZE: int = 25 * 1024 * 1024  # Pièces jointes plus grosses ignorées lors de la sync (0 = pas de limite)
+    IMAP_UID_MAX_ATTEMPTS: int = 5  # Échecs (téléchargement, parsing, ingestion) après lesquels un UID est abandonné au lieu de retenir le high-water mark
+    IMAP_INGEST_CHUNK_SIZE: int = 100  # Nombre d'emails insérés puis commités ensemble lors de l'ingestion
+    IMAP_POOL_IDLE_TIMEOUT_SECONDS: int = 600  # Fermeture des connexions IMAP du pool inutilisées depuis ce délai
+    IMAP_POOL_NOOP_AFTER_SECONDS: int = 60  # Vérification NOOP d'une connexion réutilisée au-delà de ce délai d'inactivité
+    IMAP_POOL_MAX_CONNECTIONS: int = 200  # Nombre maximum de connexions IMAP conservées dans le pool
+    IMAP_IDLE_ENABLED: bool = False  # Mode push IMAP IDLE (une connexion dédiée par intégration active, dans un seul processus)
+    IMAP_IDLE_RENEW_SECONDS: int = 25 * 60  # Renouvellement de la commande IDLE (< 29 min, RFC 2177)
+    IMAP_IDLE_DEBOUNCE_SECONDS: int = 5  # Regroupement des notifications IDLE rapprochées avant de lancer une sync
+    IMAP_IDLE_RECONCILE_SECONDS: int = 60  # Réalignement des watchers IDLE sur les intégrations actives (et reprise du verrou de leader)
+    
     # Configuration OpenAI (pour classification IA)
     OPENAI_API_KEY: Optional[str] = None  # Clé API OpenAI pour ChatGPT
+    OPENAI_RPM_LIMIT: int = 500  # Requêtes par minute autorisées par le compte OpenAI
+    OPENAI_TPM_LIMIT: int = 200000  # Tokens par minute autorisés par le compte OpenAI
+    OPENAI_RATE_LIMIT_BACKEND: str = "memory"  # memory (par processus) ou database (seaux partagés entre workers)
+    FOLDER_RULES_CACHE_TTL: int = 300  # Durée de vie (s) des règles de dossiers compilées en cache (autres workers)
+    CLASSIFICATION_CACHE_ENABLED: bool = True  # Réutiliser les classifications IA des messages quasi identiques
+    CLASSIFICATION_CACHE_TTL_SECONDS: int = 7 * 24 * 3600  # Durée de validité d'un résultat mis en cache
+    CLASSIFICATION_CACHE_MAX_ENTRIES: int = 5000  # Entrées par entreprise au-delà desquelles les moins utilisées sont évincées
+    CLASSIFICATION_CACHE_MAX_DISTANCE: int = 3  # Distance de Hamming max (bits sur 64) entre empreintes SimHash
+    LOCAL_CLASSIFIER_ENABLED: bool = True  # Classifieur local (n-grammes hachés, plus proche centroïde) avant l'appel IA
+    LOCAL_CLASSIFIER_MIN_EXAMPLES: int = 20  # Conversations rangées minimum pour apprendre un dossier
+    LOCAL_CLASSIFIER_MAX_EXAMPLES: int = 500  # Conversations les plus récentes retenues par dossier
+    LOCAL_CLASSIFIER_MIN_SIMILARITY: float = 0.35  # Similarité cosinus minimale avec le centroïde retenu
+    LOCAL_CLASSIFIER_MIN_CONFIDENCE: float = 0.15  # Écart minimal avec le 2e centroïde (sinon appel IA)
+    LOCAL_CLASSIFIER_RETRAIN_SECONDS: int = 3600  # Réapprentissage périodique (déplacements manuels, nouveaux emails)
+    LOCAL_CLASSIFIER_NEGATIVE_TTL_SECONDS: int = 300  # Nouvel essai après un apprentissage sans modèle (exemples insuffisants, erreur)
+    CLASSIFICATION_WORKER_ENABLED: bool = True  # Worker de la file de classification dans le serveur web (thread)
+    CLASSIFICATION_QUEUE_BATCH_SIZE: int = 50  # Jobs réclamés par lot (toutes entreprises confondues)
+    CLASSIFICATION_QUEUE_POLL_SECONDS: float = 2.0  # Attente entre deux scrutations quand la file est vide
+    CLASSIFICATION_JOB_MAX_ATTEMPTS: int = 5  # Tentatives avant de passer un job en "failed"
+    CLASSIFICATION_JOB_LOCK_TIMEOUT: int = 300  # Secondes avant de reprendre un job "processing" (worker mort)
+
+    # Auto-réponses (file persistante : génération IA et envoi SMTP/SMS hors de l'ingestion)
+    AUTO_REPLY_WORKERS: int = 4  # Threads d'envoi dans le serveur web (0 = désactivé, workers dédiés uniquement)
+    AUTO_REPLY_QUEUE_BATCH_SIZE: int = 5  # Jobs réclamés à la fois par un thread
+    AUTO_REPLY_QUEUE_POLL_SECONDS: float = 2.0  # Attente entre deux scrutations quand la file est vide
+    AUTO_REPLY_JOB_MAX_ATTEMPTS: int = 3  # Tentatives (génération ou envoi) avant de passer un job en "failed"
+    AUTO_REPLY_JOB_LOCK_TIMEOUT: int = 300  # Secondes avant de reprendre un job "processing" (un job "sending" passe en "failed")
+    
+    # Évènements temps réel de l'inbox (flux SSE des évènements et des compteurs)
+    INBOX_EVENTS_BACKEND: Optional[str] = None  # local (processus courant) ou postgres (pg_notify/LISTEN, multi-workers) ; par défaut postgres si la base l'est et que LISTEN est possible
+    INBOX_EVENTS_LISTEN_URL: Optional[str] = None  # Connexion LISTEN si DATABASE_URL passe par un pooler en mode transaction
+    INBOX_EVENTS_HEARTBEAT_SECONDS: float = 15.0  # Commentaire SSE keepalive (proxies, load balancers) et relecture des compteurs
+    INBOX_COUNTERS_RECONCILE_SECONDS: float = 300.0  # Recalcul complet des compteurs d'une entreprise à la lecture, au plus une fois par intervalle (0 = désactivé)
     
     # Configuration Stripe
     STRIPE_SECRET_KEY: Optional[str] = None  # Clé secrète Stripe
@@ -66,6 +117,26 @@ class Settings(BaseSettings):
     SUPABASE_URL: Optional[str] = None  # URL de votre projet Supabase (ex: https://xxx.supabase.co)
     SUPABASE_SERVICE_ROLE_KEY: Optional[str] = None  # Service Role Key (pour accès admin au Storage)
     SUPABASE_STORAGE_BUCKET: str = "company-assets"  # Nom du bucket pour les fichiers d'entreprise
+
+    # Cache des PDF rendus (devis, factures), adressé par le contenu
+    PDF_CACHE_ENABLED: bool = True
+    PDF_CACHE_DIR: Optional[str] = None  # Par défaut : UPLOAD_DIR/pdf_cache
+    PDF_CACHE_MAX_BYTES: int = 512 * 1024 * 1024  # Taille maximale sur disque (éviction LRU au-delà)
+    PDF_CACHE_REMOTE_MAX_BYTES: int = 2 * 1024 * 1024 * 1024  # Taille maximale dans Supabase Storage (0 = pas de copie distante)
+    PDF_ASSET_CACHE_MAX_BYTES: int = 64 * 1024 * 1024  # Logos et signatures redimensionnés gardés en mémoire (par processus)
+    PDF_RENDER_WORKERS: int = 2  # Processus de rendu des PDF (0 = threads du processus web)
+    PDF_RENDER_MAX_PENDING: int = 32  # Rendus en cours ou en attente au-delà desquels les routes répondent 503
+    PDF_RENDER_TIMEOUT_SECONDS: float = 60.0  # Délai maximal d'un rendu
+    
+    # Exports en lot des PDF (archive ZIP des factures / devis d'une période)
+    BILLING_EXPORT_WORKER_ENABLED: bool = True  # Worker des exports dans le serveur web (thread)
+    BILLING_EXPORT_DIR: Optional[str] = None  # Par défaut : UPLOAD_DIR/exports
+    BILLING_EXPORT_CONCURRENCY: int = 4  # Rendus simultanés d'un export (pris sur PDF_RENDER_MAX_PENDING)
+    BILLING_EXPORT_MAX_DOCUMENTS: int = 5000  # Documents maximum par export
+    BILLING_EXPORT_POLL_SECONDS: float = 5.0  # Attente entre deux scrutations quand aucun export n'est en attente
+    BILLING_EXPORT_JOB_LOCK_TIMEOUT: int = 300  # Secondes sans progression avant de reprendre un export "running" (worker mort)
+    BILLING_EXPORT_JOB_MAX_ATTEMPTS: int = 3  # Reprises automatiques avant de passer un export en "failed"
+    BILLING_EXPORT_RETENTION_HOURS: int = 48  # Archives supprimées (export "expired") après ce délai
     
     # Configuration Vonage (compte centralisé pour SMS)
     VONAGE_API_KEY: Optional[str] = None  # API Key du compte Vonage centralisé
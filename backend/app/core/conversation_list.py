@@ -0,0 +1,141 @@
+"""
+Liste des conversations de l'inbox : pagination par clé et projection de colonnes.
+
+La liste est triée par dernière activité (last_message_at DESC, id DESC) et paginée par
+curseur sur ce couple (index ix_conversations_company_last_message) : chaque page coûte
+O(taille de page) quel que soit son rang, là où un OFFSET relit toutes les lignes précédentes.
+Les conversations sans last_message_at viennent après, triées par id.
+
+Seules les colonnes demandées sont lues (pas d'objets ORM ni de relations chargées) ; les
+noms du client, de l'assigné et du dossier sont des jointures externes ajoutées seulement
+si ces champs sont demandés, l'expéditeur du premier message client est dénormalisé
+sur la conversation (first_client_*).
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Query, Session, aliased
+
+from app.db.models.client import Client
+from app.db.models.conversation import Conversation, InboxFolder
+from app.db.models.user import User
+
+
+class InvalidCursorError(ValueError):
+    """Curseur de pagination illisible ou falsifié."""
+
+
+_Assignee = aliased(User)
+_Folder = aliased(InboxFolder)
+
+# Champs de ConversationRead -> (expression, jointure externe requise)
+LIST_FIELDS = {
+    "id": (Conversation.id, None),
+    "company_id": (Conversation.company_id, None),
+    "subject": (Conversation.subject, None),
+    "status": (Conversation.status, None),
+    "source": (Conversation.source, None),
+    "client_id": (Conversation.client_id, None),
+    "folder_id": (Conversation.folder_id, None),
+    "assigned_to_id": (Conversation.assigned_to_id, None),
+    "is_urgent": (Conversation.is_urgent, None),
+    "ai_classified": (Conversation.ai_classified, None),
+    "classification_confidence": (Conversation.classification_confidence, None),
+    "auto_reply_sent": (Conversation.auto_reply_sent, None),
+    "auto_reply_pending": (Conversation.auto_reply_pending, None),
+    "auto_reply_mode": (Conversation.auto_reply_mode, None),
+    "unread_count": (Conversation.unread_count, None),
+    "last_message_at": (Conversation.last_message_at, None),
+    "created_at": (Conversation.created_at, None),
+    "updated_at": (Conversation.updated_at, None),
+    # Client rattaché, sinon nom de l'expéditeur du premier message client
+    "client_name": (func.coalesce(Client.name, Conversation.first_client_name), "client"),
+    "assigned_to_name": (_Assignee.full_name, "assigned_to"),
+    "folder_name": (_Folder.name, "folder"),
+    "client_email": (Conversation.first_client_email, None),
+    "client_phone": (Conversation.first_client_phone, None),
+}
+
+_JOINS = {
+    "client": (Client, Client.id == Conversation.client_id),
+    "assigned_to": (_Assignee, _Assignee.id == Conversation.assigned_to_id),
+    "folder": (_Folder, _Folder.id == Conversation.folder_id),
+}
+
+# Toujours lus : clés du curseur
+_KEY_FIELDS = ("id", "last_message_at")
+
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """'id,subject' -> ['id', 'subject'] (None = tous les champs). ValueError si un champ est inconnu."""
+    if not fields:
+        return None
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in LIST_FIELDS]
+    if unknown:
+        raise ValueError(f"Champs inconnus : {', '.join(unknown)}")
+    return names
+
+
+def encode_cursor(row) -> str:
+    """Curseur opaque (base64 url) de la dernière ligne d'une page."""
+    last_message_at = row.last_message_at.isoformat() if row.last_message_at else None
+    payload = json.dumps({"t": last_message_at, "id": row.id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], int]:
+    """Curseur -> (last_message_at, id) de la dernière ligne vue."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        last_message_at = datetime.fromisoformat(payload["t"]) if payload["t"] else None
+        return last_message_at, int(payload["id"])
+    except (binascii.Error, ValueError, TypeError, KeyError, UnicodeDecodeError) as e:
+        raise InvalidCursorError("Curseur de pagination invalide") from e
+
+
+def conversation_list_query(db: Session, company_id: int, fields: Optional[Iterable[str]] = None) -> Query:
+    """Requête sur les seules colonnes des champs demandés (+ clés du curseur), jointures à la demande."""
+    names = list(dict.fromkeys([*_KEY_FIELDS, *(fields or LIST_FIELDS)]))
+    query = db.query(*[LIST_FIELDS[name][0].label(name) for name in names]).select_from(Conversation)
+    for join in dict.fromkeys(LIST_FIELDS[name][1] for name in names if LIST_FIELDS[name][1]):
+        query = query.outerjoin(*_JOINS[join])
+    return query.filter(Conversation.company_id == company_id)
+
+
+def fetch_page(query: Query, limit: int, cursor: Optional[str] = None) -> Tuple[List, Optional[str]]:
+    """
+    Page suivant `cursor` (première page si None). Retourne (lignes, curseur suivant ou None).
+    Deux segments pour que chaque tri suive l'index : conversations datées (last_message_at, id)
+    puis conversations sans date (id).
+    """
+    after_time, after_id = decode_cursor(cursor) if cursor else (None, None)
+    rows: List = []
+    if after_id is None or after_time is not None:
+        dated = query.filter(Conversation.last_message_at.isnot(None))
+        if after_id is not None:
+            dated = dated.filter(or_(
+                Conversation.last_message_at < after_time,
+                and_(Conversation.last_message_at == after_time, Conversation.id < after_id)
+            ))
+        rows = dated.order_by(Conversation.last_message_at.desc(), Conversation.id.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        undated = query.filter(Conversation.last_message_at.is_(None))
+        if after_id is not None and after_time is None:
+            undated = undated.filter(Conversation.id < after_id)
+        rows += undated.order_by(Conversation.id.desc()).limit(limit + 1 - len(rows)).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+
+def row_to_dict(row, fields: Optional[Iterable[str]] = None) -> Dict:
+    """Ligne -> dict limité aux champs demandés."""
+    mapping = row._mapping
+    return {name: mapping[name] for name in (fields or LIST_FIELDS)}
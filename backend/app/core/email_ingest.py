@@ -0,0 +1,367 @@
+"""
+Ingestion par lots des emails parsés (synchronisation IMAP).
+
+Au lieu d'une série de requêtes + un commit par email, chaque lot :
+- élimine les doublons en une requête IN sur (company_id, message_id),
+- charge / crée les clients en une requête IN + un flush,
+- résout les conversations (In-Reply-To, References, sujet) en une requête sur email_thread_keys,
+- insère conversations, messages et pièces jointes (stockage adressé par contenu) en quelques flush groupés,
+- commit une fois par lot (IMAP_INGEST_CHUNK_SIZE emails), avec les jobs de classification des
+  conversations (classification IA et auto-réponse faites ensuite par la file de classification).
+Si un lot échoue, ses emails sont réingérés un par un pour isoler l'email fautif.
+"""
+import logging
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.attachment_store import AttachmentStore, acquire_blobs, get_file_type
+from app.core.conversation_classifier import auto_classify_conversation_status
+from app.core.classification_queue import enqueue_classification
+from app.core.email_threading import (
+    chunked,
+    normalize_subject,
+    reply_message_keys,
+    subject_thread_key,
+    lookup_thread_keys,
+    pick_thread_target,
+    thread_key_rows,
+    save_thread_keys,
+)
+from app.db.models.client import Client
+from app.db.models.conversation import Conversation, InboxMessage, MessageAttachment, normalize_message_id
+
+logger = logging.getLogger(__name__)
+
+
+def find_existing_message_ids(db: Session, company_id: int, message_ids: List[str]) -> Set[str]:
+    """
+    Retourne, parmi les Message-IDs fournis, ceux déjà stockés pour l'entreprise (normalisés).
+    Une requête IN par lot de 500, au lieu d'une requête par email.
+    """
+    normalized_ids = list({normalize_message_id(mid) for mid in message_ids if mid})
+    existing = set()
+    for chunk in chunked(normalized_ids):
+        rows = db.query(InboxMessage.message_id).filter(
+            InboxMessage.company_id == company_id,
+            InboxMessage.message_id.in_(chunk)
+        ).all()
+        existing.update(row.message_id for row in rows)
+    return existing
+
+
+def load_clients_by_email(db: Session, company_id: int, emails: List[str]) -> Dict[str, Client]:
+    """Charge les clients de l'entreprise correspondant aux adresses fournies (requêtes IN)."""
+    clients = {}
+    for chunk in chunked(list({e for e in emails if e})):
+        for client in db.query(Client).filter(
+            Client.company_id == company_id,
+            Client.email.in_(chunk)
+        ).all():
+            clients.setdefault(client.email, client)
+    return clients
+
+
+def _thread_keys(email_data: Dict) -> Tuple[List[str], Optional[str]]:
+    """Clés de threading d'un email : Message-IDs référencés (par priorité) et hash du sujet."""
+    message_keys = reply_message_keys(email_data.get("in_reply_to"), email_data.get("references"))
+    return message_keys, subject_thread_key(email_data.get("subject"))
+
+
+class EmailIngestPipeline:
+    """
+    Ingère une liste d'emails parsés pour une entreprise / une intégration.
+
+    `email_filter(email_data) -> (is_filtered, reason)` permet d'écarter newsletters / spam.
+    Si `enqueue_classification` est vrai, chaque lot crée les jobs de classification de ses
+    conversations (app.core.classification_queue) dans sa transaction.
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        company_id: int,
+        integration_id: Optional[int] = None,
+        email_filter: Optional[Callable[[Dict], Tuple[bool, str]]] = None,
+        enqueue_classification: bool = False,
+        chunk_size: Optional[int] = None,
+    ):
+        self.db = db
+        self.company_id = company_id
+        self.integration_id = integration_id
+        self.email_filter = email_filter
+        self.enqueue_classification = enqueue_classification
+        self.chunk_size = chunk_size or settings.IMAP_INGEST_CHUNK_SIZE
+        self.attachment_store = AttachmentStore(company_id)
+        # Mode streaming (add / flush) : emails en attente et statistiques cumulées
+        self._buffer = []
+        self.result = {"processed": 0, "created": 0, "errors": 0, "skipped": 0, "failed_uids": [], "ingested": []}
+
+    def ingest(self, emails: List[Dict]) -> Dict:
+        """
+        Ingère les emails et retourne les statistiques :
+        {"processed", "created", "errors", "skipped", "failed_uids", "ingested": [(conversation, message)]}
+        """
+        result = {"processed": 0, "created": 0, "errors": 0, "skipped": 0, "failed_uids": [], "ingested": []}
+
+        # Doublons internes au lot (même Message-ID récupéré deux fois)
+        seen_ids = set()
+        unique_emails = []
+        for email_data in emails:
+            normalized_id = normalize_message_id(email_data.get("message_id") or "")
+            if normalized_id:
+                if normalized_id in seen_ids:
+                    result["skipped"] += 1
+                    continue
+                seen_ids.add(normalized_id)
+            unique_emails.append(email_data)
+
+        for chunk in chunked(unique_emails, self.chunk_size):
+            self._ingest_chunk(chunk, result)
+        return result
+
+    def add(self, email_data: Dict) -> None:
+        """
+        Mode streaming : met l'email en attente et ingère dès qu'un lot complet est atteint.
+        Utilisable comme callback `on_email` de fetch_emails_incremental.
+        """
+        self._buffer.append(email_data)
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> Dict:
+        """Ingère les emails en attente et retourne les statistiques cumulées (self.result)."""
+        if self._buffer:
+            emails, self._buffer = self._buffer, []
+            chunk_result = self.ingest(emails)
+            for key in ("processed", "created", "errors", "skipped"):
+                self.result[key] += chunk_result[key]
+            self.result["failed_uids"].extend(chunk_result["failed_uids"])
+            self.result["ingested"].extend(chunk_result["ingested"])
+        return self.result
+
+    def _ingest_chunk(self, chunk: List[Dict], result: Dict) -> None:
+        try:
+            ingested, skipped = self._process_chunk(chunk)
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            if len(chunk) > 1:
+                # Isoler l'email fautif : réingestion un par un
+                logger.warning(f"[INGEST] Échec du lot de {len(chunk)} email(s) ({e}), réingestion unitaire")
+                for email_data in chunk:
+                    self._ingest_chunk([email_data], result)
+                return
+            logger.error(f"[INGEST] Erreur lors du traitement d'un email: {e}", exc_info=True)
+            result["errors"] += 1
+            result["failed_uids"].append(chunk[0].get("imap_uid"))
+            return
+
+        result["skipped"] += skipped
+        result["created"] += len(ingested)
+        result["processed"] += len(ingested)
+        result["ingested"].extend(ingested)
+
+    def _process_chunk(self, chunk: List[Dict]) -> Tuple[List[Tuple[Conversation, InboxMessage]], int]:
+        db = self.db
+        skipped = 0
+
+        # 1. Doublons déjà en base : une requête IN
+        existing_ids = find_existing_message_ids(db, self.company_id, [e.get("message_id") for e in chunk])
+        candidates = []
+        for email_data in chunk:
+            normalized_id = normalize_message_id(email_data.get("message_id") or "")
+            if normalized_id and normalized_id in existing_ids:
+                skipped += 1
+                continue
+            if self.email_filter:
+                is_filtered, reason = self.email_filter(email_data)
+                if is_filtered:
+                    logger.info(f"[INGEST] Email filtré comme {reason}: {(email_data.get('subject') or 'Sans sujet')[:50]}")
+                    skipped += 1
+                    continue
+            candidates.append(email_data)
+        if not candidates:
+            return [], skipped
+
+        # 2. Clients : une requête IN, puis création groupée des manquants
+        from_emails = [e.get("from", {}).get("email") for e in candidates]
+        clients = load_clients_by_email(db, self.company_id, from_emails)
+        new_clients = []
+        for email_data in candidates:
+            from_email = email_data.get("from", {}).get("email")
+            if from_email and from_email not in clients:
+                client = Client(
+                    company_id=self.company_id,
+                    name=email_data.get("from", {}).get("name", from_email.split("@")[0]),
+                    email=from_email,
+                    type="Client"
+                )
+                clients[from_email] = client
+                new_clients.append(client)
+
+        # 3. Conversations existantes : une requête sur l'index de threading pour tout le lot
+        conversations_by_message_id, conversations_by_subject = self._load_thread_targets(candidates)
+
+        if new_clients:
+            db.add_all(new_clients)
+            db.flush()
+
+        # 4. Messages (+ nouvelles conversations) en mémoire, un seul flush pour les conversations
+        now = datetime.utcnow()
+        new_conversations = []
+        pending = []
+        for email_data in candidates:
+            from_email = email_data.get("from", {}).get("email")
+            client = clients.get(from_email) if from_email else None
+            message_keys, subject_key = _thread_keys(email_data)
+            subject = email_data.get("subject", "") or ""
+
+            conversation = pick_thread_target(message_keys, subject_key, conversations_by_message_id, conversations_by_subject)
+
+            if conversation is None:
+                conversation = Conversation(
+                    company_id=self.company_id,
+                    client_id=client.id if client else None,
+                    subject=normalize_subject(subject) or subject,
+                    status="À répondre",
+                    source="email",
+                    unread_count=0,
+                    last_message_at=now,
+                )
+                new_conversations.append(conversation)
+
+            normalized_message_id = normalize_message_id(email_data.get("message_id") or "") or None
+            # Un email plus loin dans le même lot retrouvera cette conversation
+            for key in ([normalized_message_id] if normalized_message_id else []) + message_keys:
+                conversations_by_message_id.setdefault(key, conversation)
+            if subject_key:
+                conversations_by_subject.setdefault(subject_key, conversation)
+            pending.append((email_data, conversation, normalized_message_id))
+
+        if new_conversations:
+            db.add_all(new_conversations)
+            db.flush()
+
+        # Index de threading : Message-ID reçu, Message-IDs référencés et sujet -> conversation
+        thread_rows = []
+        for email_data, conversation, normalized_message_id in pending:
+            message_keys, _ = _thread_keys(email_data)
+            thread_rows.extend(thread_key_rows(
+                self.company_id, conversation.id, [normalized_message_id] + message_keys, email_data.get("subject")
+            ))
+        save_thread_keys(db, thread_rows)
+
+        messages = []
+        for email_data, conversation, normalized_message_id in pending:
+            from_email = email_data.get("from", {}).get("email")
+            external_metadata = {
+                "to": email_data.get("to"),
+                "imap_uid": email_data.get("imap_uid"),
+            }
+            if self.integration_id is not None:
+                external_metadata["integration_id"] = self.integration_id
+            message = InboxMessage(
+                conversation_id=conversation.id,
+                company_id=self.company_id,
+                from_name=email_data.get("from", {}).get("name", from_email or "Inconnu"),
+                from_email=from_email,
+                content=email_data.get("content", ""),
+                source="email",
+                is_from_client=True,
+                read=False,
+                external_id=normalized_message_id,
+                external_metadata=external_metadata,
+                created_at=now,
+            )
+            messages.append(message)
+            conversation.last_message_at = now
+            conversation.unread_count = (conversation.unread_count or 0) + 1
+
+        db.add_all(messages)
+        db.flush()
+
+        # 5. Pièces jointes : un flush pour tout le lot
+        attachments = self._save_attachments([(email_data, message) for (email_data, _, _), message in zip(pending, messages)])
+        if attachments:
+            db.add_all(attachments)
+            db.flush()
+
+        # 6. Statut (calcul en mémoire : message client tout juste reçu) et jobs de classification
+        ingested = []
+        for (_, conversation, _), message in zip(pending, messages):
+            if conversation.status not in ["Archivé", "Spam", "Urgent"]:
+                conversation.status = auto_classify_conversation_status(db, conversation, message)
+            ingested.append((conversation, message))
+        if self.enqueue_classification:
+            enqueue_classification(db, self.company_id, ingested)
+
+        return ingested, skipped
+
+    def _load_thread_targets(self, emails: List[Dict]) -> Tuple[Dict[str, Conversation], Dict[str, Conversation]]:
+        """Charge les conversations référencées par les emails du lot (index de threading)."""
+        db = self.db
+        message_keys, subject_keys = set(), set()
+        for email_data in emails:
+            keys, subject_key = _thread_keys(email_data)
+            message_keys.update(keys)
+            if subject_key:
+                subject_keys.add(subject_key)
+
+        ids_by_message_id, ids_by_subject = lookup_thread_keys(db, self.company_id, message_keys, subject_keys)
+
+        conversations = {}
+        conversation_ids = list(set(ids_by_message_id.values()) | set(ids_by_subject.values()))
+        for chunk in chunked(conversation_ids):
+            for conversation in db.query(Conversation).filter(Conversation.id.in_(chunk)).all():
+                conversations[conversation.id] = conversation
+
+        conversations_by_message_id = {
+            key: conversations[cid] for key, cid in ids_by_message_id.items() if cid in conversations
+        }
+        conversations_by_subject = {
+            key: conversations[cid] for key, cid in ids_by_subject.items() if cid in conversations
+        }
+        return conversations_by_message_id, conversations_by_subject
+
+    def _save_attachments(self, pending: List[Tuple[Dict, InboxMessage]]) -> List[MessageAttachment]:
+        """
+        Pièces jointes du lot dans le stockage adressé par contenu : un blob par SHA-256
+        (une requête IN + un flush pour tout le lot), MessageAttachment.blob_id renseigné.
+        """
+        stored = []
+        for email_data, message in pending:
+            for att_data in email_data.get("attachments", []) or []:
+                filename = att_data.get("filename", "attachment")
+                if att_data.get("too_large"):
+                    logger.info(f"[INGEST] Pièce jointe {filename} ignorée ({att_data.get('file_size')} octets)")
+                    continue
+                if not att_data.get("file_path"):
+                    # Contenu binaire (mode non streaming) : écriture par hash de contenu
+                    if not att_data.get("content"):
+                        continue
+                    try:
+                        att_data = self.attachment_store.store(filename, att_data.get("content_type"), att_data["content"])
+                    except Exception as e:
+                        logger.warning(f"[INGEST] Erreur lors de la sauvegarde de la pièce jointe {filename}: {e}")
+                        continue
+                    if att_data.get("too_large"):
+                        continue
+                stored.append((att_data, message))
+
+        blobs = acquire_blobs(self.db, self.company_id, [att_data for att_data, _ in stored])
+        attachments = []
+        for att_data, message in stored:
+            filename = att_data.get("filename", "attachment")
+            blob = blobs.get(att_data.get("sha256"))
+            attachments.append(MessageAttachment(
+                message_id=message.id,
+                name=filename,
+                file_type=get_file_type(filename),
+                file_path=blob.file_path if blob else att_data["file_path"],
+                file_size=att_data.get("file_size") or 0,
+                mime_type=att_data.get("content_type"),
+                blob_id=blob.id if blob else None,
+            ))
+        return attachments
+
@@ -0,0 +1,221 @@
+"""
+Résolution des fils de discussion email via la table email_thread_keys.
+
+Chaque Message-ID connu (emails reçus et envoyés) et le hash du sujet normalisé
+pointent vers une conversation. Une seule requête indexée résout In-Reply-To,
+toute la chaîne References et le sujet, quel que soit le nombre de conversations.
+"""
+import hashlib
+import re
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple, TypeVar
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+from app.db.models.conversation import Conversation, EmailThreadKey, normalize_message_id
+
+KEY_TYPE_MESSAGE_ID = "message_id"
+KEY_TYPE_SUBJECT = "subject"
+
+# Taille des requêtes IN (limite de paramètres des SGBD)
+IN_QUERY_CHUNK_SIZE = 500
+
+# Cible d'un fil : ID de conversation ou Conversation, selon l'appelant
+ThreadTarget = TypeVar("ThreadTarget")
+
+
+def normalize_subject(subject: str) -> str:
+    """
+    Normalise un sujet d'email en enlevant les préfixes Re:, RE:, Fwd:, etc.
+    Exemples:
+    - "Re: Bonjour" -> "Bonjour"
+    - "RE: Re: Test" -> "Test"
+    - "Fwd: Re: Hello" -> "Hello"
+    """
+    if not subject:
+        return ""
+
+    # Enlever les préfixes courants (insensible à la casse)
+    prefixes = ["re:", "fwd:", "fw:", "tr:", "aw:"]
+    normalized = subject.strip()
+
+    while True:
+        found = False
+        for prefix in prefixes:
+            if normalized.lower().startswith(prefix):
+                normalized = normalized[len(prefix):].strip()
+                # Enlever aussi les deux-points et espaces au début
+                normalized = normalized.lstrip(":").strip()
+                found = True
+                break
+        if not found:
+            break
+
+    return normalized.strip()
+
+
+def subject_thread_key(subject: Optional[str]) -> Optional[str]:
+    """Hash SHA-256 du sujet normalisé (sans Re:/Fwd:, espaces compactés, en minuscules)."""
+    normalized = re.sub(r"\s+", " ", normalize_subject(subject or "")).strip().lower()
+    if not normalized:
+        return None
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def reply_message_keys(in_reply_to: Optional[str], references: Optional[List[str]]) -> List[str]:
+    """
+    Message-IDs référencés par un email, par ordre de priorité :
+    In-Reply-To, puis References du plus récent au plus ancien.
+    """
+    keys = []
+    for raw in [in_reply_to] + list(reversed(references or [])):
+        key = normalize_message_id(raw or "")
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+
+def chunked(values: List, size: int = IN_QUERY_CHUNK_SIZE):
+    """Découpe une liste en lots (requêtes IN de taille bornée)."""
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def lookup_thread_keys(
+    db: Session,
+    company_id: int,
+    message_keys: Iterable[str],
+    subject_keys: Iterable[str],
+) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """
+    Retourne ({message_id: conversation_id}, {hash_sujet: conversation_id}) pour les clés connues.
+    Une requête par lot de 500 clés ; seules les conversations email existantes sont retenues.
+    """
+    message_keys = list({k for k in message_keys if k})
+    subject_keys = list({k for k in subject_keys if k})
+    by_message_id, by_subject = {}, {}
+    size = max(len(message_keys), len(subject_keys), 1)
+    for start in range(0, size, IN_QUERY_CHUNK_SIZE):
+        message_chunk = message_keys[start:start + IN_QUERY_CHUNK_SIZE]
+        subject_chunk = subject_keys[start:start + IN_QUERY_CHUNK_SIZE]
+        predicates = []
+        if message_chunk:
+            predicates.append(and_(EmailThreadKey.key_type == KEY_TYPE_MESSAGE_ID, EmailThreadKey.thread_key.in_(message_chunk)))
+        if subject_chunk:
+            predicates.append(and_(EmailThreadKey.key_type == KEY_TYPE_SUBJECT, EmailThreadKey.thread_key.in_(subject_chunk)))
+        if not predicates:
+            break
+        rows = db.query(EmailThreadKey.key_type, EmailThreadKey.thread_key, EmailThreadKey.conversation_id).join(
+            Conversation, Conversation.id == EmailThreadKey.conversation_id
+        ).filter(
+            EmailThreadKey.company_id == company_id,
+            Conversation.source == "email",
+            or_(*predicates)
+        ).all()
+        for row in rows:
+            target = by_message_id if row.key_type == KEY_TYPE_MESSAGE_ID else by_subject
+            target[row.thread_key] = row.conversation_id
+    return by_message_id, by_subject
+
+
+def pick_thread_target(
+    message_keys: List[str],
+    subject_key: Optional[str],
+    by_message_id: Mapping[str, ThreadTarget],
+    by_subject: Mapping[str, ThreadTarget],
+) -> Optional[ThreadTarget]:
+    """
+    Choisit la conversation : premier Message-ID référencé connu, sinon le sujet.
+    Retourne la valeur des tables de correspondance telle quelle (ID de conversation pour
+    find_thread_conversation, Conversation pour l'ingestion par lots).
+    """
+    for key in message_keys:
+        if key in by_message_id:
+            return by_message_id[key]
+    if subject_key and subject_key in by_subject:
+        return by_subject[subject_key]
+    return None
+
+
+def find_thread_conversation(
+    db: Session,
+    company_id: int,
+    in_reply_to: Optional[str],
+    references: Optional[List[str]],
+    subject: Optional[str],
+) -> Optional[Conversation]:
+    """Résout la conversation d'un email en une requête (In-Reply-To, References, sujet)."""
+    message_keys = reply_message_keys(in_reply_to, references)
+    subject_key = subject_thread_key(subject)
+    if not message_keys and not subject_key:
+        return None
+    by_message_id, by_subject = lookup_thread_keys(db, company_id, message_keys, [subject_key] if subject_key else [])
+    conversation_id = pick_thread_target(message_keys, subject_key, by_message_id, by_subject)
+    if conversation_id is None:
+        return None
+    return db.query(Conversation).filter(
+        Conversation.id == conversation_id,
+        Conversation.company_id == company_id
+    ).first()
+
+
+def thread_key_rows(
+    company_id: int,
+    conversation_id: int,
+    message_ids: Iterable[Optional[str]] = (),
+    subject: Optional[str] = None,
+) -> List[Dict]:
+    """Lignes email_thread_keys à enregistrer pour un message / une conversation."""
+    rows = []
+    for message_id in message_ids:
+        key = normalize_message_id(message_id or "")
+        if key:
+            rows.append({"company_id": company_id, "conversation_id": conversation_id,
+                         "key_type": KEY_TYPE_MESSAGE_ID, "thread_key": key})
+    subject_key = subject_thread_key(subject)
+    if subject_key:
+        rows.append({"company_id": company_id, "conversation_id": conversation_id,
+                     "key_type": KEY_TYPE_SUBJECT, "thread_key": subject_key})
+    return rows
+
+
+def save_thread_keys(db: Session, rows: List[Dict]) -> None:
+    """
+    Insère les clés de threading en ignorant celles déjà connues (la première conversation
+    associée à une clé la conserve). INSERT ... ON CONFLICT DO NOTHING groupé.
+    """
+    unique_rows = list({(r["company_id"], r["key_type"], r["thread_key"]): r for r in rows}.values())
+    if not unique_rows:
+        return
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        insert = None
+
+    if insert is not None:
+        for chunk in chunked(unique_rows):
+            db.execute(insert(EmailThreadKey).values(chunk).on_conflict_do_nothing(
+                index_elements=["company_id", "key_type", "thread_key"]
+            ))
+        return
+
+    # Autres SGBD : filtrer les clés existantes puis insérer
+    for chunk in chunked(unique_rows):
+        existing = set(db.query(EmailThreadKey.company_id, EmailThreadKey.key_type, EmailThreadKey.thread_key).filter(
+            or_(*[and_(EmailThreadKey.company_id == r["company_id"], EmailThreadKey.key_type == r["key_type"],
+                       EmailThreadKey.thread_key == r["thread_key"]) for r in chunk])
+        ).all())
+        db.add_all([EmailThreadKey(**r) for r in chunk if (r["company_id"], r["key_type"], r["thread_key"]) not in existing])
+    db.flush()
+
+
+def register_thread_keys(
+    db: Session,
+    company_id: int,
+    conversation_id: int,
+    message_ids: Iterable[Optional[str]] = (),
+    subject: Optional[str] = None,
+) -> None:
+    """Enregistre les Message-IDs (et le sujet) d'un message reçu ou envoyé pour une conversation."""
+    save_thread_keys(db, thread_key_rows(company_id, conversation_id, message_ids, subject))
@@ -5,8 +5,10 @@ en utilisant l'IA (GPT-4o-mini) pour une meilleure précision.
 import logging
 from typing import Optional, List, Dict
 from sqlalchemy.orm import Session
-from app.db.models.conversation import Conversation, InboxMessage, InboxFolder
+from app.db.models.conversation import Conversation, InboxMessage
 from app.core.ai_classifier_service import AIClassifierService
+from app.core.folder_rules import get_folder_rules
+from app.core.reclassification import iter_conversation_pages, load_page_messages, bulk_assign_folders, message_payload
 
 logger = logging.getLogger(__name__)
 
@@ -47,21 +49,9 @@ def classify_conversation_to_folder(
             logger.debug("[AI CLASSIFIER] Service IA non disponible, message non classé")
             return None
         
-        # Récupérer les dossiers avec autoClassify activé
-        all_folders = db.query(InboxFolder).filter(
-            InboxFolder.company_id == company_id
-        ).all()
-        
-        folders_with_ai = []
-        for folder in all_folders:
-            filters = folder.ai_rules or {}
-            if isinstance(filters, dict) and filters.get("autoClassify", False):
-                folders_with_ai.append({
-                    "id": folder.id,
-                    "name": folder.name,
-                    "folder_type": getattr(folder, "folder_type", "general"),
-                    "ai_rules": filters
-                })
+        # Dossiers avec autoClassify activé (règles compilées, en cache par entreprise)
+        rules = get_folder_rules(db, company_id)
+        folders_with_ai = rules.ai_folders
         
         if not folders_with_ai:
             logger.debug("[AI CLASSIFIER] Aucun dossier avec autoClassify activé")
@@ -78,7 +68,9 @@ def classify_conversation_to_folder(
             message_subject=message_subject,
             message_from=message_from,
             folders=folders_with_ai,
-            company_context=None
+            company_context=None,
+            rules=rules,
+            company_id=company_id
         )
         
         if folder_id:
@@ -99,12 +91,14 @@ def classify_conversation_to_folder(
 def reclassify_all_conversations(db: Session, company_id: int, force: bool = False, batch_size: int = 10) -> dict:
     """
     Reclasse toutes les conversations d'une entreprise en utilisant l'IA (avec batch processing).
+    Les conversations sont parcourues par pages (app.core.reclassification) : une requête de
+    messages et un UPDATE groupé par page, mémoire constante.
     
     Args:
         db: Session de base de données
         company_id: ID de l'entreprise
         force: Si True, reclasse même les conversations déjà dans un dossier
-        batch_size: Nombre de conversations à traiter par batch (réduit les coûts)
+        batch_size: Nombre de conversations à traiter par appel IA (réduit les coûts)
     
     Returns:
         Dict avec les statistiques de classification (classées, non_classées, erreurs)
@@ -125,154 +119,67 @@ def reclassify_all_conversations(db: Session, company_id: int, force: bool = Fal
             logger.warning("[AI CLASSIFIER] Service IA non disponible, reclassification ignorée")
             return stats
         
-        # Récupérer toutes les conversations
-        query = db.query(Conversation).filter(Conversation.company_id == company_id)
-        if not force:
-            query = query.filter(Conversation.folder_id.is_(None))
-        
-        conversations = query.all()
-        stats["total"] = len(conversations)
-        
-        if stats["total"] == 0:
-            return stats
-        
-        logger.info(f"[AI CLASSIFIER] {stats['total']} conversation(s) à reclasser")
-        
-        # Récupérer les dossiers avec autoClassify activé
-        all_folders = db.query(InboxFolder).filter(
-            InboxFolder.company_id == company_id
-        ).all()
-        
-        folders_with_ai = []
-        for folder in all_folders:
-            filters = folder.ai_rules or {}
-            if isinstance(filters, dict) and filters.get("autoClassify", False):
-                folders_with_ai.append({
-                    "id": folder.id,
-                    "name": folder.name,
-                    "folder_type": getattr(folder, "folder_type", "general"),
-                    "ai_rules": filters
-                })
+        # Dossiers avec autoClassify activé (règles compilées, en cache par entreprise)
+        rules = get_folder_rules(db, company_id)
+        folders_with_ai = rules.ai_folders
         
         if not folders_with_ai:
             logger.debug("[AI CLASSIFIER] Aucun dossier avec autoClassify activé")
             return stats
         
-        # Traiter par batch pour optimiser les coûts
-        for i in range(0, len(conversations), batch_size):
-            batch = conversations[i:i + batch_size]
+        valid_folder_ids = {f["id"] for f in folders_with_ai}
+        
+        for page in iter_conversation_pages(db, company_id, force=force):
+            stats["total"] += len(page)
+            page_messages = load_page_messages(db, [conversation.id for conversation in page])
             
-            # Préparer les messages pour l'IA
+            # Premier message client (plus fiable pour l'expéditeur), sinon dernier message
             messages_data = []
-            for conversation in batch:
-                # Récupérer le premier message client (plus fiable pour l'expéditeur)
-                first_client_message = db.query(InboxMessage).filter(
-                    InboxMessage.conversation_id == conversation.id,
-                    InboxMessage.is_from_client == True
-                ).order_by(InboxMessage.created_at.asc()).first()
-                
-                # Si pas de message client, prendre le dernier message
-                if not first_client_message:
-                    first_client_message = db.query(InboxMessage).filter(
-                        InboxMessage.conversation_id == conversation.id
-                    ).order_by(InboxMessage.created_at.desc()).first()
-                
-                if not first_client_message:
-                    continue
-                
-                # Utiliser l'expéditeur du premier message client (plus fiable)
-                from_email = first_client_message.from_email or ""
-                from_phone = first_client_message.from_phone or ""
-                
-                messages_data.append({
-                    "conversation_id": conversation.id,
-                    "content": (first_client_message.content or "")[:500],  # Tronquer pour économiser
-                    "subject": conversation.subject or "" if conversation.source == "email" else "",
-                    "from_email": from_email,
-                    "from_phone": from_phone
-                })
-            
-            if not messages_data:
-                continue
+            for conversation in page:
+                first_client_message, last_message = page_messages.get(conversation.id, (None, None))
+                message = first_client_message or last_message
+                if message:
+                    messages_data.append(message_payload(conversation, message))
             
-            try:
-                # Appel IA batch (plus économique que plusieurs appels individuels)
-                batch_results = ai_service.classify_messages_batch(
-                    messages=messages_data,
-                    folders=folders_with_ai,
-                    company_context=None
-                )
-                
-                # Créer un set des folder_ids valides pour validation rapide
-                valid_folder_ids = {f["id"] for f in folders_with_ai}
+            assignments = {}
+            for i in range(0, len(messages_data), batch_size):
+                batch = messages_data[i:i + batch_size]
+                try:
+                    # Appel IA batch (plus économique que plusieurs appels individuels)
+                    batch_results = ai_service.classify_messages_batch(
+                        messages=batch,
+                        folders=folders_with_ai,
+                        company_context=None,
+                        rules=rules,
+                        company_id=company_id
+                    )
+                except Exception as e:
+                    logger.error(f"[AI CLASSIFIER] Erreur lors du traitement batch: {e}")
+                    stats["errors"] += len(batch)
+                    continue
                 
-                # Appliquer les résultats avec validation
+                batch_ids = {msg_data["conversation_id"] for msg_data in batch}
                 for conversation_id, folder_id in batch_results.items():
-                    # Vérifier que la conversation existe et appartient à la bonne entreprise
-                    conversation = db.query(Conversation).filter(
-                        Conversation.id == conversation_id,
-                        Conversation.company_id == company_id  # Vérification de sécurité
-                    ).first()
-                    
-                    if not conversation:
-                        logger.warning(f"[AI CLASSIFIER] Conversation {conversation_id} introuvable ou n'appartient pas à l'entreprise {company_id}")
+                    if conversation_id not in batch_ids or not folder_id:
+                        continue
+                    # VALIDATION CRITIQUE : dossier existant de l'entreprise, autoClassify activé
+                    if folder_id not in valid_folder_ids:
+                        logger.warning(f"[AI CLASSIFIER] Folder ID {folder_id} invalide pour la conversation {conversation_id} (n'existe pas ou autoClassify désactivé)")
                         stats["errors"] += 1
                         continue
-                    
-                    if folder_id:
-                        # VALIDATION CRITIQUE : Vérifier que le folder_id est valide
-                        if folder_id not in valid_folder_ids:
-                            logger.warning(f"[AI CLASSIFIER] Folder ID {folder_id} invalide pour la conversation {conversation_id} (n'existe pas ou autoClassify désactivé)")
-                            stats["errors"] += 1
-                            continue
-                        
-                        # Vérifier que le dossier existe toujours et appartient à l'entreprise
-                        folder = db.query(InboxFolder).filter(
-                            InboxFolder.id == folder_id,
-                            InboxFolder.company_id == company_id
-                        ).first()
-                        
-                        if not folder:
-                            logger.warning(f"[AI CLASSIFIER] Dossier {folder_id} introuvable ou n'appartient pas à l'entreprise {company_id}")
-                            stats["errors"] += 1
-                            continue
-                        
-                        # Vérifier que autoClassify est toujours activé
-                        folder_ai_rules = folder.ai_rules or {}
-                        if not isinstance(folder_ai_rules, dict) or not folder_ai_rules.get("autoClassify", False):
-                            logger.warning(f"[AI CLASSIFIER] Dossier {folder_id} n'a plus autoClassify activé")
-                            stats["errors"] += 1
-                            continue
-                        
-                        # Tout est OK, appliquer la classification
-                        conversation.folder_id = folder_id
-                        stats["classified"] += 1
-                        logger.debug(f"[AI CLASSIFIER] Conversation {conversation_id} classée dans le dossier {folder_id} ({folder.name})")
-                    else:
-                        stats["not_classified"] += 1
-                
+                    assignments[conversation_id] = folder_id
+            
+            try:
+                bulk_assign_folders(db, company_id, assignments)
                 db.commit()
-                logger.info(f"[AI CLASSIFIER] Batch {i//batch_size + 1}: {len(batch_results)} conversation(s) traitée(s)")
-                
+                stats["classified"] += len(assignments)
             except Exception as e:
                 db.rollback()
-                logger.error(f"[AI CLASSIFIER] Erreur lors du traitement batch: {e}")
-                stats["errors"] += len(messages_data)
-                import traceback
-                traceback.print_exc()
+                logger.error(f"[AI CLASSIFIER] Erreur lors de l'enregistrement des dossiers: {e}")
+                stats["errors"] += len(assignments)
         
-        # Calculer les non classées : total - classées - erreurs
-        # Note: Les erreurs sont déjà comptées dans la boucle, pas besoin de les soustraire deux fois
         stats["not_classified"] = stats["total"] - stats["classified"] - stats["errors"]
         
-        # Vérification de cohérence
-        if stats["total"] != stats["classified"] + stats["not_classified"] + stats["errors"]:
-            logger.warning(
-                f"[AI CLASSIFIER] Incohérence dans les stats: "
-                f"total={stats['total']}, classified={stats['classified']}, "
-                f"not_classified={stats['not_classified']}, errors={stats['errors']}"
-            )
-        
         logger.info(
             f"[AI CLASSIFIER] Reclassification terminée: "
             f"{stats['classified']} classée(s), {stats['not_classified']} non classée(s), {stats['errors']} erreur(s)"
@@ -286,4 +193,3 @@ def reclassify_all_conversations(db: Session, company_id: int, force: bool = Fal
         traceback.print_exc()
         stats["errors"] = stats["total"]
         return stats
-
@@ -0,0 +1,427 @@
+"""
+Règles de classement des dossiers compilées par entreprise (sans accès base par message).
+
+Les dossiers avec autoClassify sont compilés une fois en :
+- automates d'Aho-Corasick (mots-clés des filtres, fragments d'expéditeur, mots-clés
+  extraits du contexte IA) : tous les mots-clés sont cherchés en un seul passage sur le texte ;
+- ensembles hachés d'adresses et de domaines expéditeurs ;
+- liste des dossiers triée par priorité.
+La configuration d'auto-réponse des dossiers est conservée avec les règles : l'éligibilité
+d'un message à l'auto-réponse se décide sans requête (app.core.auto_reply_dispatcher).
+
+Le résultat est mis en cache par entreprise (get_folder_rules) et invalidé à chaque
+création / modification / suppression de dossier (invalidate_folder_rules). La durée de vie
+FOLDER_RULES_CACHE_TTL borne le délai de prise en compte dans les autres workers.
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.db.models.conversation import InboxFolder
+
+logger = logging.getLogger(__name__)
+
+# Mots courants ignorés lors de l'extraction des mots-clés du contexte IA
+SENDER_COMMON_WORDS = {
+    'les', 'des', 'dans', 'pour', 'avec', 'sont', 'cette', 'tous', 'toutes', 'tout', 'toute',
+    'mais', 'plus', 'peut', 'sous', 'mettre', 'mails', 'mail', 'en'
+}
+KEYWORD_COMMON_WORDS = SENDER_COMMON_WORDS | {'le', 'la', 'un', 'une', 'de', 'du', 'et', 'ou'}
+
+_EXPLICIT_SENDER_RE = re.compile(
+    r'(?:expéditeur|from|de|sender|envoyeur)[\s]+(?:contenant|containing|avec|with)?[\s]*([a-z0-9._%+-@]+)'
+)
+_EXPLICIT_SENDER_RE2 = re.compile(r'(?:expéditeur|from|de|sender|envoyeur)[\s:=\-]+([a-z0-9._%+-@]+)')
+_WORD_RE = re.compile(r'\b[a-z]{3,}\b')
+_EMAIL_RE = re.compile(r'\b([a-z0-9._%+-]+@[a-z0-9.-]+\.[a-z]{2,})\b')
+_QUOTED_KEYWORD_RE = re.compile(r"['\"]([a-z0-9._%+-@]{3,})['\"]")
+_INTRODUCED_KEYWORD_RE = re.compile(r"(?:avec|containing|contenant)\s+['\"]?([a-z0-9._%+-@]{3,})['\"]?\s+(?:dans|in)")
+_FIELDS_ET_RE = re.compile(r"(?:contenu|content|objet|subject|sujet).*?et.*?(?:objet|subject|sujet|expéditeur|sender|from)")
+_FIELDS_AND_RE = re.compile(r"(?:contenu|content|objet|subject|sujet).*?and.*?(?:objet|subject|sujet|expéditeur|sender|from)")
+_CONTENT_RE = re.compile(r"(?:contenu|content)")
+_SUBJECT_RE = re.compile(r"(?:objet|subject|sujet)")
+_SENDER_RE = re.compile(r"(?:expéditeur|sender|from|de)")
+_FULL_ADDRESS_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+
+def normalize_phone(phone: str) -> str:
+    """Normalise un numéro de téléphone pour comparaison (chiffres et +)."""
+    if not phone:
+        return ""
+    return re.sub(r'[^\d+]', '', phone)
+
+
+class KeywordAutomaton:
+    """
+    Automate d'Aho-Corasick : retrouve en un passage toutes les occurrences (sous-chaînes)
+    d'un ensemble de mots-clés. Chaque mot-clé distinct reçoit un identifiant entier.
+    Une fois compilé (build), l'automate est en lecture seule et partageable entre threads.
+    """
+
+    def __init__(self, keywords: Iterable[str] = ()):
+        self.keywords: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[int, ...]] = [()]
+        self._built = False
+        self._build_lock = threading.Lock()
+        for keyword in keywords:
+            self.add(keyword)
+
+    def add(self, keyword: str) -> Optional[int]:
+        """Ajoute un mot-clé (avant la première recherche) et retourne son identifiant."""
+        if not keyword:
+            return None
+        if keyword in self._ids:
+            return self._ids[keyword]
+        if self._built:
+            raise RuntimeError("KeywordAutomaton déjà compilé")
+        keyword_id = len(self.keywords)
+        self.keywords.append(keyword)
+        self._ids[keyword] = keyword_id
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+                self._goto[state][char] = next_state
+            state = next_state
+        self._out[state] = self._out[state] + (keyword_id,)
+        return keyword_id
+
+    def id_of(self, keyword: str) -> Optional[int]:
+        return self._ids.get(keyword)
+
+    def build(self) -> None:
+        """Compile l'automate (idempotent) ; plus aucun mot-clé ne peut être ajouté ensuite."""
+        if self._built:
+            return
+        with self._build_lock:
+            if not self._built:
+                self._build()
+
+    def _build(self) -> None:
+        # Liens d'échec en largeur ; les sorties héritent de celles du suffixe le plus long
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+        self._built = True
+
+    def search(self, text: str) -> Set[int]:
+        """Identifiants des mots-clés présents dans le texte."""
+        return set(self.search_fields([text]))
+
+    def search_fields(self, fields: Sequence[str]) -> Dict[int, Set[int]]:
+        """
+        Recherche dans plusieurs champs en un seul passage :
+        {identifiant du mot-clé: indices des champs qui le contiennent}.
+        """
+        self.build()
+        found: Dict[int, Set[int]] = {}
+        if not self.keywords:
+            return found
+        goto, fail, out = self._goto, self._fail, self._out
+        for field_index, text in enumerate(fields):
+            state = 0
+            for char in text or "":
+                while state and char not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(char, 0)
+                for keyword_id in out[state]:
+                    found.setdefault(keyword_id, set()).add(field_index)
+        return found
+
+
+class _FilterRule:
+    """Règles de filtrage ("filters" dans ai_rules) d'un dossier, compilées."""
+
+    def __init__(self, folder: Dict, filter_rules: Dict, keywords: KeywordAutomaton, senders: KeywordAutomaton):
+        self.folder_id = folder["id"]
+        self.folder_name = folder["name"]
+        self.match_all = filter_rules.get("match_type", "any") == "all"
+
+        raw_keywords = filter_rules.get("keywords", []) or []
+        self.has_keywords = bool(raw_keywords)
+        # En mode "all", une entrée vide ne peut jamais être trouvée
+        self.keywords_complete = all(raw_keywords)
+        self.keyword_location = filter_rules.get("keywords_location", "any")
+        self.keyword_ids = tuple({keywords.add(k.lower()) for k in raw_keywords if k})
+
+        raw_emails = [e.lower() for e in filter_rules.get("sender_email", []) or [] if e]
+        self.has_sender_emails = bool(filter_rules.get("sender_email"))
+        # Adresses complètes : égalité (ensemble haché) ; fragments ("@amazon", "facture") : sous-chaîne
+        self.sender_addresses = frozenset(e for e in raw_emails if _FULL_ADDRESS_RE.match(e))
+        self.sender_fragment_ids = tuple({senders.add(e) for e in raw_emails if e not in self.sender_addresses})
+
+        self.has_sender_domains = bool(filter_rules.get("sender_domain"))
+        self.sender_domains = frozenset(d.lower() for d in filter_rules.get("sender_domain", []) or [] if d)
+
+        self.has_sender_phones = bool(filter_rules.get("sender_phone"))
+        self.sender_phones = tuple(normalize_phone(p) for p in filter_rules.get("sender_phone", []) or [] if p)
+
+    def matches(
+        self,
+        keyword_fields: Dict[int, Set[int]],
+        sender_fragments: Set[int],
+        from_email: str,
+        from_domain: str,
+        from_phone: str
+    ) -> bool:
+        combine = all if self.match_all else any
+        conditions = []
+
+        if self.has_keywords:
+            if self.keyword_location == "subject":
+                wanted = {0}
+            elif self.keyword_location == "content":
+                wanted = {1}
+            else:
+                wanted = {0, 1}
+            found = [keyword_id for keyword_id in self.keyword_ids if keyword_fields.get(keyword_id, set()) & wanted]
+            if self.match_all:
+                conditions.append(self.keywords_complete and len(found) == len(self.keyword_ids))
+            else:
+                conditions.append(bool(found))
+
+        if self.has_sender_emails:
+            checks = [from_email == address for address in self.sender_addresses]
+            checks += [fragment_id in sender_fragments for fragment_id in self.sender_fragment_ids]
+            conditions.append(combine(checks))
+
+        if self.has_sender_domains:
+            if self.match_all:
+                conditions.append(self.sender_domains <= {from_domain})
+            else:
+                conditions.append(from_domain in self.sender_domains)
+
+        if self.has_sender_phones:
+            conditions.append(combine(phone in from_phone for phone in self.sender_phones))
+
+        if not conditions:
+            return False
+        return combine(conditions)
+
+
+class _ContextRule:
+    """Mots-clés extraits du contexte IA d'un dossier (correspondances directes sans appel IA)."""
+
+    def __init__(self, folder: Dict, context: str, sender_keywords: KeywordAutomaton, context_keywords: KeywordAutomaton):
+        self.folder_id = folder["id"]
+        self.folder_name = folder["name"]
+        context_lower = context.lower()
+
+        # Correspondance par expéditeur : patterns explicites, mots et emails du contexte
+        candidates = (
+            _EXPLICIT_SENDER_RE.findall(context_lower)
+            + _EXPLICIT_SENDER_RE2.findall(context_lower)
+            + _WORD_RE.findall(context_lower)
+            + _EMAIL_RE.findall(context_lower)
+        )
+        sender_ids = []
+        for keyword in candidates:
+            if keyword in SENDER_COMMON_WORDS:
+                continue
+            keyword_clean = keyword.strip('.,;:!?()[]{}').lower()
+            if len(keyword_clean) >= 3:
+                keyword_id = sender_keywords.add(keyword_clean)
+                if keyword_id not in sender_ids:
+                    sender_ids.append(keyword_id)
+        self.sender_ids = frozenset(sender_ids)
+
+        # Correspondance par mots-clés explicites ("avec 'amazon' dans le contenu, l'objet et l'expéditeur")
+        keyword_ids = []
+        for pattern in (_QUOTED_KEYWORD_RE, _INTRODUCED_KEYWORD_RE):
+            for keyword in pattern.findall(context_lower):
+                keyword_clean = keyword.strip("'\".,;:!?()[]{}").lower()
+                if len(keyword_clean) >= 3 and keyword_clean not in KEYWORD_COMMON_WORDS:
+                    keyword_id = context_keywords.add(keyword_clean)
+                    if keyword_id not in keyword_ids:
+                        keyword_ids.append(keyword_id)
+        self.keyword_ids = tuple(keyword_ids)
+
+        has_fields_conjunction = bool(_FIELDS_ET_RE.search(context_lower) or _FIELDS_AND_RE.search(context_lower))
+        self.all_three_mentioned = bool(
+            _CONTENT_RE.search(context_lower) and _SUBJECT_RE.search(context_lower) and _SENDER_RE.search(context_lower)
+        )
+        # Les 3 champs mentionnés avec "et/and" : le mot-clé doit être présent dans tous
+        self.requires_all = self.all_three_mentioned and has_fields_conjunction
+
+
+class CompiledFolderRules:
+    """Règles de classement compilées des dossiers autoClassify d'une entreprise."""
+
+    def __init__(self, folders: List[Dict], auto_replies: Optional[Dict[int, Dict]] = None):
+        """
+        `folders` : [{"id", "name", "folder_type", "ai_rules"}] des dossiers avec autoClassify.
+        `auto_replies` : {folder_id: configuration auto_reply} des dossiers avec auto-réponse active.
+        """
+        self.ai_folders = folders
+        self.auto_replies = auto_replies or {}
+        # Empreinte de la configuration : toute modification des dossiers invalide le cache des classifications
+        self.version = hashlib.sha256(
+            json.dumps([[f["id"], f["name"], f.get("ai_rules")] for f in folders], sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()[:32]
+
+        self._filter_keywords = KeywordAutomaton()
+        self._filter_senders = KeywordAutomaton()
+        with_priority = []
+        for folder in folders:
+            filter_rules = (folder.get("ai_rules") or {}).get("filters") or {}
+            if filter_rules:
+                priority = folder["ai_rules"].get("priority", 999)  # Plus petit = plus prioritaire
+                with_priority.append((priority, _FilterRule(folder, filter_rules, self._filter_keywords, self._filter_senders)))
+        with_priority.sort(key=lambda item: item[0])
+        self.filter_rules = [rule for _, rule in with_priority]
+
+        self._sender_keywords = KeywordAutomaton()
+        self._context_keywords = KeywordAutomaton()
+        self.context_rules = [
+            _ContextRule(folder, folder["ai_rules"]["context"], self._sender_keywords, self._context_keywords)
+            for folder in folders
+            if (folder.get("ai_rules") or {}).get("context")
+        ]
+        # Compilation immédiate : les règles mises en cache sont lues par plusieurs threads
+        for automaton in (self._filter_keywords, self._filter_senders, self._sender_keywords, self._context_keywords):
+            automaton.build()
+
+    def match_filters(
+        self,
+        subject: str,
+        content: str,
+        from_email: str,
+        from_phone: str
+    ) -> Optional[int]:
+        """Premier dossier (par priorité) dont les filtres correspondent au message, ou None."""
+        if not self.filter_rules:
+            return None
+        from_email = (from_email or "").lower()
+        from_domain = from_email.split("@")[-1] if "@" in from_email else ""
+        keyword_fields = self._filter_keywords.search_fields([(subject or "").lower(), (content or "").lower()])
+        sender_fragments = self._filter_senders.search(from_email)
+        normalized_phone = normalize_phone(from_phone or "")
+        for rule in self.filter_rules:
+            if rule.matches(keyword_fields, sender_fragments, from_email, from_domain, normalized_phone):
+                logger.info(f"[FOLDER FILTER] Message classé automatiquement dans le dossier '{rule.folder_name}' (ID: {rule.folder_id}) via filtres")
+                return rule.folder_id
+        return None
+
+    def match_sender(self, message_from: str) -> Optional[int]:
+        """Dossier dont un mot-clé du contexte figure dans l'expéditeur, ou None."""
+        if not message_from or not self.context_rules:
+            return None
+        found = self._sender_keywords.search(message_from.lower())
+        if not found:
+            return None
+        for rule in self.context_rules:
+            if rule.sender_ids & found:
+                logger.info(f"[AI CLASSIFIER] ✅ Correspondance directe trouvée dans expéditeur '{message_from}' → dossier '{rule.folder_name}' (ID: {rule.folder_id})")
+                return rule.folder_id
+        return None
+
+    def match_keywords(self, content: str, subject: str, message_from: str) -> Optional[int]:
+        """
+        Dossier dont un mot-clé explicite du contexte est présent dans le contenu, le sujet
+        et/ou l'expéditeur selon la formulation du contexte, ou None.
+        """
+        if not content and not subject and not message_from:
+            return None
+        if not self.context_rules:
+            return None
+        found = self._context_keywords.search_fields([
+            (content or "").lower(), (subject or "").lower(), (message_from or "").lower()
+        ])
+        if not found:
+            return None
+        for rule in self.context_rules:
+            for keyword_id in rule.keyword_ids:
+                fields = found.get(keyword_id)
+                if not fields:
+                    continue
+                if rule.requires_all:
+                    matched = len(fields) == 3
+                elif rule.all_three_mentioned:
+                    # Les 3 champs mentionnés sans "et" : au moins 2 sur 3
+                    matched = len(fields) >= 2
+                else:
+                    matched = True
+                if matched:
+                    logger.info(
+                        f"[AI CLASSIFIER] ✅ Correspondance mot-clé '{self._context_keywords.keywords[keyword_id]}' trouvée "
+                        f"dans {len(fields)}/3 champs (contenu/sujet/expéditeur) → dossier '{rule.folder_name}' (ID: {rule.folder_id})"
+                    )
+                    return rule.folder_id
+        return None
+
+
+def auto_classify_folders(folders: Iterable[InboxFolder]) -> List[Dict]:
+    """Dossiers avec autoClassify activé, au format attendu par le classifieur IA."""
+    result = []
+    for folder in folders:
+        rules = folder.ai_rules or {}
+        if isinstance(rules, dict) and rules.get("autoClassify", False):
+            result.append({
+                "id": folder.id,
+                "name": folder.name,
+                "folder_type": getattr(folder, "folder_type", "general"),
+                "ai_rules": rules
+            })
+    return result
+
+
+def auto_reply_configs(folders: Iterable[InboxFolder]) -> Dict[int, Dict]:
+    """Configuration auto_reply des dossiers dont l'auto-réponse est active (mode auto ou approval)."""
+    result = {}
+    for folder in folders:
+        config = folder.auto_reply or {}
+        if isinstance(config, dict) and config.get("enabled", False) and config.get("mode", "none") in ("auto", "approval"):
+            result[folder.id] = dict(config)
+    return result
+
+
+# Cache par entreprise : company_id -> (instant de compilation, règles)
+_cache: Dict[int, Tuple[float, CompiledFolderRules]] = {}
+_cache_lock = threading.Lock()
+
+
+def get_folder_rules(db: Session, company_id: int) -> CompiledFolderRules:
+    """Règles compilées et auto-réponses de l'entreprise (une requête puis compilation au premier appel, cache ensuite)."""
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(company_id)
+    if cached and now - cached[0] < settings.FOLDER_RULES_CACHE_TTL:
+        return cached[1]
+
+    folders = db.query(InboxFolder).filter(
+        InboxFolder.company_id == company_id
+    ).order_by(InboxFolder.id.asc()).all()
+    rules = CompiledFolderRules(auto_classify_folders(folders), auto_reply_configs(folders))
+    with _cache_lock:
+        _cache[company_id] = (now, rules)
+    return rules
+
+
+def invalidate_folder_rules(company_id: Optional[int] = None) -> None:
+    """Oublie les règles compilées d'une entreprise (ou de toutes)."""
+    with _cache_lock:
+        if company_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(company_id, None)
@@ -0,0 +1,545 @@
+"""
+Pool de connexions IMAP persistantes et surveillance IMAP IDLE.
+
+- ImapConnectionPool : réutilise une session IMAP authentifiée par boîte mail
+  (plus de handshake TLS + LOGIN à chaque sync / détection de suppression / suppression).
+  Les connexions inactives sont vérifiées par NOOP avant réutilisation et fermées après
+  IMAP_POOL_IDLE_TIMEOUT_SECONDS.
+- ImapIdleWatcher : thread qui garde une connexion dédiée en IDLE sur INBOX et déclenche
+  un callback dès que le serveur signale un nouveau message (EXISTS). Les watchers tournent
+  dans un seul processus (verrou de leader) et suivent les intégrations actives
+  (réalignement périodique et à chaque création, modification ou suppression d'intégration).
+"""
+import hashlib
+import imaplib
+import logging
+import select
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ImapConnectionPool:
+    """
+    Pool thread-safe de connexions IMAP authentifiées, une par boîte mail.
+    Une connexion n'est utilisée que par un seul thread à la fois (acquire / release).
+    """
+
+    def __init__(
+        self,
+        idle_timeout_seconds: Optional[float] = None,
+        noop_after_seconds: Optional[float] = None,
+        max_connections: Optional[int] = None,
+    ):
+        self.idle_timeout_seconds = idle_timeout_seconds or settings.IMAP_POOL_IDLE_TIMEOUT_SECONDS
+        self.noop_after_seconds = noop_after_seconds or settings.IMAP_POOL_NOOP_AFTER_SECONDS
+        self.max_connections = max_connections or settings.IMAP_POOL_MAX_CONNECTIONS
+        self._entries: Dict[Tuple, Dict] = {}
+        self._by_connection: Dict[int, Tuple[Tuple, Dict]] = {}
+        self._lock = threading.Lock()
+        self.stats = {"opened": 0, "reused": 0, "discarded": 0}
+
+    @staticmethod
+    def _key(imap_server: str, imap_port: int, email_address: str, password: str, use_ssl: bool) -> Tuple:
+        # Le hash du mot de passe fait partie de la clé : un changement de mot de passe
+        # ouvre une nouvelle session au lieu de réutiliser l'ancienne.
+        password_hash = hashlib.sha256((password or "").encode("utf-8")).hexdigest()
+        return ((imap_server or "").lower(), int(imap_port or 993), (email_address or "").lower(), bool(use_ssl), password_hash)
+
+    def acquire(
+        self,
+        imap_server: str,
+        imap_port: int,
+        email_address: str,
+        password: str,
+        use_ssl: bool = True,
+        timeout: Optional[float] = None,
+    ) -> imaplib.IMAP4:
+        """
+        Retourne une connexion authentifiée pour cette boîte mail (réutilisée si possible).
+        Doit toujours être suivie d'un appel à release().
+        """
+        key = self._key(imap_server, imap_port, email_address, password, use_ssl)
+        with self._lock:
+            evicted = self._evict_locked()
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = {"mail": None, "lock": threading.Lock(), "last_used": 0.0}
+                self._entries[key] = entry
+        # LOGOUT réseau hors du verrou du pool
+        for evicted_mail in evicted:
+            self._logout_quietly(evicted_mail)
+
+        wait = timeout if timeout is not None else settings.IMAP_SYNC_TIMEOUT_SECONDS
+        if not entry["lock"].acquire(timeout=wait):
+            raise Exception(f"Connexion IMAP {email_address} occupée depuis plus de {wait}s")
+
+        try:
+            mail = entry["mail"]
+            if mail is not None and not self._is_alive(mail, entry["last_used"]):
+                self._logout_quietly(mail)
+                mail = None
+            if mail is None:
+                from app.core.imap_service import connect_imap
+                mail = connect_imap(imap_server, imap_port, email_address, password, use_ssl)
+                self.stats["opened"] += 1
+            else:
+                self.stats["reused"] += 1
+            entry["mail"] = mail
+            with self._lock:
+                self._by_connection[id(mail)] = (key, entry)
+            return mail
+        except Exception:
+            entry["mail"] = None
+            entry["lock"].release()
+            raise
+
+    def release(self, mail: Optional[imaplib.IMAP4], discard: bool = False) -> None:
+        """Rend la connexion au pool (ou la ferme si discard=True ou si elle est déconnectée)."""
+        if mail is None:
+            return
+        with self._lock:
+            key, entry = self._by_connection.pop(id(mail), (None, None))
+            # Entrée retirée du pool pendant l'utilisation (close_all) : la connexion est fermée
+            pooled = entry is not None and self._entries.get(key) is entry
+        if entry is None:
+            self._logout_quietly(mail)
+            return
+
+        if discard or not pooled or getattr(mail, "state", None) == "LOGOUT":
+            self._logout_quietly(mail)
+            entry["mail"] = None
+            self.stats["discarded"] += 1
+        entry["last_used"] = time.monotonic()
+        entry["lock"].release()
+
+    def close_all(self) -> None:
+        """
+        Ferme toutes les connexions (arrêt de l'application). Les entrées sont retirées du pool
+        sous son verrou, les LOGOUT faits après : comme release(), on ne prend jamais le verrou
+        d'une connexion en tenant celui du pool. Une connexion en cours d'utilisation est fermée
+        par son release().
+        """
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            if not entry["lock"].acquire(blocking=False):
+                continue
+            try:
+                mail, entry["mail"] = entry["mail"], None
+                if mail is not None:
+                    self._logout_quietly(mail)
+            finally:
+                entry["lock"].release()
+
+    def _is_alive(self, mail: imaplib.IMAP4, last_used: float) -> bool:
+        if getattr(mail, "state", None) not in ("AUTH", "SELECTED"):
+            return False
+        if time.monotonic() - last_used < self.noop_after_seconds:
+            return True
+        try:
+            status, _ = mail.noop()
+            return status == "OK"
+        except Exception:
+            return False
+
+    def _evict_locked(self) -> List[imaplib.IMAP4]:
+        """
+        Retire les connexions inactives et respecte la taille maximale du pool (LRU).
+        Retourne les connexions à fermer, par l'appelant, une fois le verrou du pool relâché.
+        """
+        evicted = []
+        now = time.monotonic()
+        for key, entry in list(self._entries.items()):
+            if entry["mail"] is not None and now - entry["last_used"] > self.idle_timeout_seconds:
+                evicted.extend(self._remove_entry_locked(key))
+        if len(self._entries) >= self.max_connections:
+            for key, _ in sorted(self._entries.items(), key=lambda item: item[1]["last_used"]):
+                if len(self._entries) < self.max_connections:
+                    break
+                evicted.extend(self._remove_entry_locked(key))
+        return evicted
+
+    def _remove_entry_locked(self, key: Tuple) -> List[imaplib.IMAP4]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return []
+        # Ne jamais fermer une connexion en cours d'utilisation (sans attendre : verrou du pool tenu)
+        if not entry["lock"].acquire(blocking=False):
+            return []
+        try:
+            del self._entries[key]
+            mail, entry["mail"] = entry["mail"], None
+            return [mail] if mail is not None else []
+        finally:
+            entry["lock"].release()
+
+    @staticmethod
+    def _logout_quietly(mail: imaplib.IMAP4) -> None:
+        try:
+            mail.logout()
+        except Exception:
+            pass
+
+
+# Pool global du processus
+imap_pool = ImapConnectionPool()
+
+
+class ImapIdleWatcher(threading.Thread):
+    """
+    Garde une connexion IMAP dédiée en IDLE sur INBOX et appelle `on_new_mail(integration_id)`
+    quand le serveur annonce de nouveaux messages. La commande IDLE est renouvelée
+    toutes les IMAP_IDLE_RENEW_SECONDS (< 29 min, RFC 2177) et la connexion est rouverte
+    après une erreur.
+    """
+
+    def __init__(
+        self,
+        integration_id: int,
+        imap_server: str,
+        imap_port: int,
+        email_address: str,
+        password: str,
+        use_ssl: bool,
+        on_new_mail: Callable[[int], None],
+    ):
+        super().__init__(name=f"imap-idle-{integration_id}", daemon=True)
+        self.integration_id = integration_id
+        self.imap_server = imap_server
+        self.imap_port = imap_port
+        self.email_address = email_address
+        self.password = password
+        self.use_ssl = use_ssl
+        self.on_new_mail = on_new_mail
+        self.fingerprint: Optional[Tuple] = None
+        self._stop_event = threading.Event()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def run(self) -> None:
+        backoff = 5
+        while not self._stop_event.is_set():
+            mail = None
+            try:
+                from app.core.imap_service import connect_imap
+                mail = connect_imap(self.imap_server, self.imap_port, self.email_address, self.password, self.use_ssl)
+                if b"IDLE" not in b" ".join(c.encode() if isinstance(c, str) else c for c in mail.capabilities):
+                    logger.info(f"[IMAP IDLE] {self.email_address} ne supporte pas IDLE, surveillance arrêtée")
+                    return
+                mail.select("INBOX")
+                backoff = 5
+                while not self._stop_event.is_set():
+                    if self._idle_once(mail):
+                        logger.info(f"[IMAP IDLE] Nouveau message signalé pour l'intégration {self.integration_id}")
+                        try:
+                            self.on_new_mail(self.integration_id)
+                        except Exception as e:
+                            logger.error(f"[IMAP IDLE] Erreur du callback pour l'intégration {self.integration_id}: {e}", exc_info=True)
+            except Exception as e:
+                logger.warning(f"[IMAP IDLE] Connexion perdue pour {self.email_address}: {e} (nouvel essai dans {backoff}s)")
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, 300)
+            finally:
+                if mail is not None:
+                    ImapConnectionPool._logout_quietly(mail)
+
+    def _idle_once(self, mail: imaplib.IMAP4) -> bool:
+        """
+        Un cycle IDLE : attend une notification EXISTS, la fin du délai de renouvellement
+        ou l'arrêt du watcher. Retourne True si de nouveaux messages sont arrivés.
+        imaplib (< 3.14) ne gère pas IDLE : la commande est envoyée à la main.
+        """
+        tag = mail._new_tag()
+        mail.send(tag + b" IDLE\r\n")
+        line = mail.readline()
+        if not line.startswith(b"+"):
+            raise Exception(f"IDLE refusé: {line!r}")
+
+        new_mail = False
+        deadline = time.monotonic() + settings.IMAP_IDLE_RENEW_SECONDS
+        sock = mail.socket()
+        while not self._stop_event.is_set() and time.monotonic() < deadline:
+            # Données éventuellement déjà en tampon (SSL) ou socket prêt en lecture
+            pending = getattr(sock, "pending", lambda: 0)()
+            if not pending:
+                readable, _, _ = select.select([sock], [], [], 1.0)
+                if not readable:
+                    continue
+            line = mail.readline()
+            if not line:
+                raise EOFError("Connexion IDLE fermée par le serveur")
+            if b"EXISTS" in line.upper():
+                new_mail = True
+                break
+
+        mail.send(b"DONE\r\n")
+        # Lire jusqu'à la réponse taguée de fin d'IDLE
+        while True:
+            line = mail.readline()
+            if not line:
+                raise EOFError("Connexion IDLE fermée par le serveur")
+            if line.startswith(tag):
+                break
+            if b"EXISTS" in line.upper():
+                new_mail = True
+        return new_mail
+
+
+class DebouncedSyncTrigger:
+    """
+    Regroupe les notifications IDLE rapprochées d'une même intégration :
+    une seule synchronisation est lancée après `delay_seconds` de calme,
+    et jamais deux synchronisations simultanées pour la même intégration.
+    """
+
+    def __init__(self, sync_func: Callable[[int], None], delay_seconds: Optional[float] = None):
+        self.sync_func = sync_func
+        self.delay_seconds = delay_seconds if delay_seconds is not None else settings.IMAP_IDLE_DEBOUNCE_SECONDS
+        self._timers: Dict[int, threading.Timer] = {}
+        self._running: Dict[int, bool] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, integration_id: int) -> None:
+        with self._lock:
+            timer = self._timers.get(integration_id)
+            if timer is not None:
+                timer.cancel()
+            timer = threading.Timer(self.delay_seconds, self._run, args=(integration_id,))
+            timer.daemon = True
+            self._timers[integration_id] = timer
+            timer.start()
+
+    def _run(self, integration_id: int) -> None:
+        with self._lock:
+            self._timers.pop(integration_id, None)
+            if self._running.get(integration_id):
+                # Une sync est déjà en cours : la relancer après elle
+                rerun = True
+            else:
+                rerun = False
+                self._running[integration_id] = True
+        if rerun:
+            self(integration_id)
+            return
+        try:
+            self.sync_func(integration_id)
+        except Exception as e:
+            logger.error(f"[IMAP IDLE] Erreur de synchronisation pour l'intégration {integration_id}: {e}", exc_info=True)
+        finally:
+            with self._lock:
+                self._running[integration_id] = False
+
+
+# Clé du verrou consultatif PostgreSQL désignant le processus qui surveille les boîtes en IDLE
+IDLE_LEADER_LOCK_KEY = 72419001
+
+_idle_watchers: Dict[int, ImapIdleWatcher] = {}
+_idle_watchers_lock = threading.Lock()
+# Callback des watchers, défini seulement dans le processus leader (None ailleurs)
+_idle_callback: Optional[Callable[[int], None]] = None
+_idle_stop = threading.Event()
+_idle_thread: Optional[threading.Thread] = None
+
+
+class IdleLeaderLock:
+    """
+    Un seul processus (worker uvicorn ou script) garde les connexions IDLE :
+    pg_try_advisory_lock sur une connexion dédiée, tenue ouverte tant que le processus est leader.
+    Le verrou est libéré à la fermeture de la connexion (processus arrêté ou mort) et repris
+    par un autre processus. Hors PostgreSQL (SQLite, développement), toujours acquis.
+    """
+
+    def __init__(self):
+        self._connection = None
+
+    def acquire(self) -> bool:
+        """True si ce processus est (ou devient) leader."""
+        if self._connection is not None:
+            try:
+                self._connection.cursor().execute("SELECT 1")
+                return True
+            except Exception:
+                # Connexion perdue : le verrou l'est aussi
+                self.release()
+        from app.db.session import is_sqlite
+        if is_sqlite:
+            return True
+        connection = self._connect()
+        connection.autocommit = True
+        cursor = connection.cursor()
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", (IDLE_LEADER_LOCK_KEY,))
+        if cursor.fetchone()[0]:
+            self._connection = connection
+            return True
+        connection.close()
+        return False
+
+    def release(self) -> None:
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+
+    @staticmethod
+    def _connect():
+        # Verrou de session : connexion directe ou en mode session, comme l'écoute des évènements de l'inbox
+        if settings.INBOX_EVENTS_LISTEN_URL:
+            import psycopg2
+            return psycopg2.connect(settings.INBOX_EVENTS_LISTEN_URL.replace("postgresql+psycopg2://", "postgresql://"))
+        from app.db.session import engine
+        connection = engine.raw_connection()
+        connection.detach()
+        return connection.dbapi_connection
+
+
+def _watcher_fingerprint(integration) -> Tuple:
+    """Paramètres de connexion d'une intégration : le watcher est recréé s'ils changent."""
+    return (
+        integration.imap_server, integration.imap_port or 993, integration.email_address,
+        integration.email_password, integration.use_ssl if integration.use_ssl is not None else True,
+    )
+
+
+def _stop_watchers(integration_ids) -> None:
+    for integration_id in integration_ids:
+        watcher = _idle_watchers.pop(integration_id, None)
+        if watcher is not None:
+            watcher.stop()
+
+
+def reconcile_idle_watchers(db=None) -> int:
+    """
+    Aligne les watchers sur les intégrations IMAP actives : démarre les manquants, arrête ceux
+    des intégrations supprimées ou désactivées, recrée ceux dont la boîte ou le mot de passe a changé.
+    Appelé périodiquement par le leader et par les routes des intégrations (sans effet hors du
+    processus leader, qui se réaligne alors au tour suivant). Retourne le nombre de watchers démarrés.
+    """
+    on_new_mail = _idle_callback
+    if on_new_mail is None:
+        return 0
+
+    from app.db.session import SessionLocal
+    from app.db.models.inbox_integration import InboxIntegration
+    from app.core.encryption_service import get_encryption_service
+
+    owns_session = db is None
+    db = db or SessionLocal()
+    started = 0
+    try:
+        integrations = {
+            integration.id: integration
+            for integration in db.query(InboxIntegration).filter(
+                InboxIntegration.integration_type == "imap",
+                InboxIntegration.is_active == True
+            ).all()
+            if integration.imap_server and integration.email_address and integration.email_password
+        }
+        with _idle_watchers_lock:
+            _stop_watchers([
+                integration_id for integration_id, watcher in _idle_watchers.items()
+                if integration_id not in integrations
+                or watcher.fingerprint != _watcher_fingerprint(integrations[integration_id])
+                or not watcher.is_alive()
+            ])
+            encryption_service = get_encryption_service()
+            for integration_id, integration in integrations.items():
+                if integration_id in _idle_watchers:
+                    continue
+                watcher = ImapIdleWatcher(
+                    integration_id=integration_id,
+                    imap_server=integration.imap_server,
+                    imap_port=integration.imap_port or 993,
+                    email_address=integration.email_address,
+                    password=encryption_service.decrypt(integration.email_password),
+                    use_ssl=integration.use_ssl if integration.use_ssl is not None else True,
+                    on_new_mail=on_new_mail,
+                )
+                watcher.fingerprint = _watcher_fingerprint(integration)
+                watcher.start()
+                _idle_watchers[integration_id] = watcher
+                started += 1
+    finally:
+        if owns_session:
+            db.close()
+
+    if started:
+        logger.info(f"[IMAP IDLE] {started} watcher(s) IDLE démarré(s)")
+    return started
+
+
+def refresh_idle_watchers(db=None) -> None:
+    """Réalignement après une modification d'intégration (routes) : une erreur est journalisée, pas propagée."""
+    try:
+        reconcile_idle_watchers(db)
+    except Exception as e:
+        logger.warning(f"[IMAP IDLE] Réalignement des watchers impossible: {e}")
+
+
+def run_idle_watchers(on_new_mail: Callable[[int], None], stop_event: threading.Event) -> None:
+    """
+    Boucle du processus leader : prend le verrou, réaligne les watchers toutes les
+    IMAP_IDLE_RECONCILE_SECONDS, et les arrête s'il perd le verrou ou à l'arrêt.
+    """
+    global _idle_callback
+    lock = IdleLeaderLock()
+    try:
+        while not stop_event.is_set():
+            try:
+                leader = lock.acquire()
+            except Exception as e:
+                logger.warning(f"[IMAP IDLE] Verrou de leader indisponible: {e}")
+                leader = False
+            if leader:
+                _idle_callback = on_new_mail
+                try:
+                    reconcile_idle_watchers()
+                except Exception as e:
+                    logger.error(f"[IMAP IDLE] Erreur de réalignement des watchers: {e}", exc_info=True)
+            elif _idle_callback is not None:
+                logger.info("[IMAP IDLE] Verrou de leader perdu, arrêt des watchers")
+                _idle_callback = None
+                with _idle_watchers_lock:
+                    _stop_watchers(list(_idle_watchers))
+            stop_event.wait(settings.IMAP_IDLE_RECONCILE_SECONDS)
+    finally:
+        _idle_callback = None
+        with _idle_watchers_lock:
+            _stop_watchers(list(_idle_watchers))
+        lock.release()
+
+
+def start_idle_watchers(on_new_mail: Callable[[int], None]) -> bool:
+    """
+    Démarre la boucle des watchers IDLE dans un thread (si IMAP_IDLE_ENABLED). Chaque processus
+    web la démarre, un seul (le leader) garde les connexions. Retourne True si la boucle est lancée.
+    """
+    global _idle_thread
+    if not settings.IMAP_IDLE_ENABLED:
+        return False
+    if _idle_thread is not None and _idle_thread.is_alive():
+        return True
+    _idle_stop.clear()
+    _idle_thread = threading.Thread(
+        target=run_idle_watchers, args=(on_new_mail, _idle_stop), name="imap-idle-leader", daemon=True
+    )
+    _idle_thread.start()
+    return True
+
+
+def stop_idle_watchers() -> None:
+    """Arrête la boucle et tous les watchers IDLE (libère le verrou de leader)."""
+    global _idle_thread
+    _idle_stop.set()
+    if _idle_thread is not None:
+        _idle_thread.join(5.0)
+        _idle_thread = None
+    with _idle_watchers_lock:
+        _stop_watchers(list(_idle_watchers))
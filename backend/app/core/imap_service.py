@@ -5,18 +5,24 @@ import imaplib
 import email
 from email.message import Message
 from email.header import decode_header
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Callable, Set, Tuple
 from datetime import datetime, timedelta
 import base64
 import re
 from html import unescape
 from app.core.config import settings
+from app.core.imap_connection_pool import imap_pool
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import uuid
 
-executor = ThreadPoolExecutor(max_workers=2)
+# Dimensionné sur la concurrence du scheduler de sync pour ne pas sérialiser les fetchs IMAP
+executor = ThreadPoolExecutor(max_workers=max(2, settings.IMAP_SYNC_MAX_CONCURRENCY))
+
+
+class ImapFetchCancelled(Exception):
+    """Fetch interrompu à la demande de l'appelant (délai de synchronisation dépassé)."""
 
 
 def decode_mime_words(s: str) -> str:
@@ -58,9 +64,13 @@ def clean_html_to_text(html: str) -> str:
     return text
 
 
-def parse_email_message(msg: Message) -> Dict:
+def parse_email_message(msg: Message, attachment_store=None) -> Dict:
     """
     Parse un email et retourne un dictionnaire avec les informations extraites.
+    
+    Avec un `attachment_store` (AttachmentStore), chaque pièce jointe est écrite sur disque dès
+    son décodage et seules ses métadonnées (file_path, file_size, sha256) sont retournées ;
+    sans, le contenu binaire est retourné dans "content".
     """
     # Sujet
     subject = decode_mime_words(str(msg.get("Subject", "")))
@@ -179,6 +189,11 @@ def parse_email_message(msg: Message) -> Dict:
                 filename = part.get_filename()
                 if filename:
                     decoded_filename = decode_mime_words(filename)
+                    if attachment_store is not None:
+                        stored = _store_attachment(part, decoded_filename, attachment_store)
+                        if stored:
+                            attachments.append(stored)
+                        continue
                     try:
                         # Télécharger le contenu binaire de la pièce jointe
                         attachment_data = part.get_payload(decode=True)
@@ -214,144 +229,532 @@ def parse_email_message(msg: Message) -> Dict:
     }
 
 
-def fetch_emails_imap(
+def _store_attachment(part: Message, filename: str, attachment_store) -> Optional[Dict]:
+    """
+    Décode une pièce jointe et l'écrit via l'AttachmentStore (le contenu décodé est libéré aussitôt).
+    Une pièce jointe manifestement trop grosse (taille encodée) n'est même pas décodée.
+    """
+    content_type = part.get_content_type()
+    raw_payload = part.get_payload()
+    if isinstance(raw_payload, str):
+        encoding = str(part.get("Content-Transfer-Encoding", "")).lower()
+        estimated_size = len(raw_payload) * 3 // 4 if encoding == "base64" else len(raw_payload)
+        if attachment_store.exceeds_max_size(estimated_size):
+            print(f"[IMAP] Pièce jointe {filename} ignorée (~{estimated_size} octets)")
+            return {"filename": filename, "content_type": content_type, "file_size": estimated_size,
+                    "content": None, "too_large": True}
+    try:
+        attachment_data = part.get_payload(decode=True)
+        if not attachment_data:
+            return None
+        return attachment_store.store(filename, content_type, attachment_data)
+    except Exception as e:
+        print(f"Erreur lors de l'enregistrement de la pièce jointe {filename}: {e}")
+        return {"filename": filename, "content_type": content_type, "content": None}
+
+
+def connect_imap(
     imap_server: str,
     imap_port: int,
     email_address: str,
     password: str,
-    company_code: str,
-    use_ssl: bool = True,
-    since_hours: Optional[int] = None
-) -> List[Dict]:
+    use_ssl: bool = True
+) -> imaplib.IMAP4:
     """
-    Récupère les nouveaux emails depuis un serveur IMAP.
+    Ouvre une connexion IMAP et s'authentifie.
+    Lève une Exception avec un message explicite en cas d'échec d'authentification.
     """
-    mail = None
+    # Nettoyer le mot de passe (supprimer les espaces pour Gmail)
+    cleaned_password = password.replace(" ", "").strip()
+    
+    print(f"[IMAP] Connexion à {imap_server}:{imap_port} (SSL: {use_ssl})")
+    if use_ssl:
+        mail = imaplib.IMAP4_SSL(imap_server, imap_port)
+    else:
+        mail = imaplib.IMAP4(imap_server, imap_port)
+    
+    print(f"[IMAP] Connexion établie, authentification pour {email_address}")
     try:
-        # Nettoyer le mot de passe (supprimer les espaces pour Gmail)
-        cleaned_password = password.replace(" ", "").strip()
+        login_result = mail.login(email_address, cleaned_password)
+        print(f"[IMAP] Authentification réussie: {login_result}")
+    except imaplib.IMAP4.error as e:
+        error_str = str(e)
+        error_msg = f"Erreur d'authentification IMAP pour {email_address}: {error_str}"
+        print(f"[IMAP] {error_msg}")
+        try:
+            mail.logout()
+        except:
+            pass
         
-        print(f"[IMAP] Connexion à {imap_server}:{imap_port} (SSL: {use_ssl})")
-        if use_ssl:
-            mail = imaplib.IMAP4_SSL(imap_server, imap_port)
-        else:
-            mail = imaplib.IMAP4(imap_server, imap_port)
+        # Messages d'erreur spécifiques pour Gmail
+        if "gmail.com" in imap_server.lower():
+            if "535" in error_str or "not accepted" in error_str.lower():
+                raise Exception(
+                    f"Erreur d'authentification Gmail. "
+                    f"Vérifiez que:\n"
+                    f"1. Vous utilisez un mot de passe d'application (pas votre mot de passe Gmail)\n"
+                    f"2. L'authentification à 2 facteurs est activée\n"
+                    f"3. Le mot de passe d'application est correct (16 caractères sans espaces)\n"
+                    f"Détails: {error_str}"
+                )
+            elif "connection" in error_str.lower() or "timeout" in error_str.lower():
+                raise Exception(
+                    f"Impossible de se connecter à Gmail. "
+                    f"Vérifiez votre connexion internet et que Gmail IMAP est activé. "
+                    f"Détails: {error_str}"
+                )
         
-        print(f"[IMAP] Connexion établie, authentification pour {email_address}")
+        raise Exception(f"Échec de l'authentification: {error_str}")
+    
+    return mail
+
+
+def get_uidvalidity(mail: imaplib.IMAP4, folder: str = "INBOX") -> Optional[int]:
+    """
+    Retourne l'UIDVALIDITY du dossier sélectionné.
+    Utilise la réponse non sollicitée du SELECT, sinon interroge STATUS.
+    """
+    try:
+        # Sur une connexion réutilisée (pool), les réponses non sollicitées s'accumulent :
+        # la dernière correspond au SELECT le plus récent.
+        typ, data = mail.response("UIDVALIDITY")
+        if data and data[-1]:
+            return int(data[-1])
+    except Exception:
+        pass
+    try:
+        typ, data = mail.status(folder, "(UIDVALIDITY)")
+        if typ == "OK" and data and data[0]:
+            raw = data[0].decode("utf-8", errors="ignore") if isinstance(data[0], bytes) else str(data[0])
+            match = re.search(r'UIDVALIDITY\s+(\d+)', raw, re.IGNORECASE)
+            if match:
+                return int(match.group(1))
+    except Exception as e:
+        print(f"[IMAP] Impossible de lire UIDVALIDITY: {e}")
+    return None
+
+
+def _uid_search(mail: imaplib.IMAP4, criteria: str) -> List[int]:
+    """Exécute un UID SEARCH et retourne la liste des UIDs (entiers, triés)."""
+    status, messages = mail.uid("SEARCH", None, criteria)
+    if status != "OK" or not messages or not messages[0]:
+        return []
+    return sorted(int(uid) for uid in messages[0].split() if uid.isdigit())
+
+
+def build_uid_sets(uids: List[int], batch_size: int) -> List[str]:
+    """
+    Découpe une liste d'UIDs en lots d'au plus `batch_size` UIDs,
+    chaque lot étant exprimé en message-set IMAP compact (ex: "100:150,152,160:170").
+    """
+    sorted_uids = sorted(set(int(uid) for uid in uids))
+    batch_size = max(1, batch_size)
+    uid_sets = []
+    for i in range(0, len(sorted_uids), batch_size):
+        batch = sorted_uids[i:i + batch_size]
+        ranges = []
+        range_start = prev = batch[0]
+        for uid in batch[1:]:
+            if uid == prev + 1:
+                prev = uid
+                continue
+            ranges.append(f"{range_start}:{prev}" if range_start != prev else str(range_start))
+            range_start = prev = uid
+        ranges.append(f"{range_start}:{prev}" if range_start != prev else str(range_start))
+        uid_sets.append(",".join(ranges))
+    return uid_sets
+
+
+def expand_uid_set(uid_set: str) -> List[int]:
+    """UIDs couverts par un message-set IMAP produit par build_uid_sets (ex: "100:102,105")."""
+    uids = []
+    for part in uid_set.split(","):
+        start, _, end = part.partition(":")
+        uids.extend(range(int(start), int(end or start) + 1))
+    return uids
+
+
+def parse_uid_fetch_response(msg_data) -> Dict[int, bytes]:
+    """
+    Associe chaque UID à son contenu dans la réponse d'un UID FETCH multi-messages.
+    Selon les serveurs, l'attribut UID est avant le littéral ("1 (UID 42 RFC822 {n}")
+    ou après (élément suivant " UID 42)").
+    """
+    results = {}
+    pending = None
+    for item in msg_data or []:
+        if isinstance(item, tuple) and len(item) >= 2:
+            header = item[0].decode("utf-8", errors="ignore") if isinstance(item[0], bytes) else str(item[0])
+            match = re.search(r'UID\s+(\d+)', header, re.IGNORECASE)
+            if match:
+                results[int(match.group(1))] = item[1]
+                pending = None
+            else:
+                pending = item[1]
+        elif isinstance(item, bytes) and pending is not None:
+            match = re.search(rb'UID\s+(\d+)', item, re.IGNORECASE)
+            if match:
+                results[int(match.group(1))] = pending
+            pending = None
+    return results
+
+
+def fetch_message_ids_by_uid(mail: imaplib.IMAP4, uids: List[int], raise_on_error: bool = False) -> Dict[int, str]:
+    """
+    Récupère le Message-ID (normalisé, sans chevrons) de chaque UID,
+    par lots de IMAP_FETCH_BATCH_SIZE en une requête UID FETCH par lot.
+    BODY.PEEK ne modifie pas le flag \\Seen.
+    
+    Avec raise_on_error=True, un lot en échec interrompt tout (résultat partiel interdit,
+    utile pour la détection des suppressions).
+    """
+    message_ids = {}
+    for uid_set in build_uid_sets(uids, settings.IMAP_FETCH_BATCH_SIZE):
         try:
-            login_result = mail.login(email_address, cleaned_password)
-            print(f"[IMAP] Authentification réussie: {login_result}")
-        except imaplib.IMAP4.error as e:
-            error_str = str(e)
-            error_msg = f"Erreur d'authentification IMAP pour {email_address}: {error_str}"
-            print(f"[IMAP] {error_msg}")
-            
-            # Messages d'erreur spécifiques pour Gmail
-            if "gmail.com" in imap_server.lower():
-                if "535" in error_str or "not accepted" in error_str.lower():
-                    raise Exception(
-                        f"Erreur d'authentification Gmail. "
-                        f"Vérifiez que:\n"
-                        f"1. Vous utilisez un mot de passe d'application (pas votre mot de passe Gmail)\n"
-                        f"2. L'authentification à 2 facteurs est activée\n"
-                        f"3. Le mot de passe d'application est correct (16 caractères sans espaces)\n"
-                        f"Détails: {error_str}"
-                    )
-                elif "connection" in error_str.lower() or "timeout" in error_str.lower():
-                    raise Exception(
-                        f"Impossible de se connecter à Gmail. "
-                        f"Vérifiez votre connexion internet et que Gmail IMAP est activé. "
-                        f"Détails: {error_str}"
-                    )
-            
-            raise Exception(f"Échec de l'authentification: {error_str}")
+            status, msg_data = mail.uid("FETCH", uid_set, "(BODY.PEEK[HEADER.FIELDS (MESSAGE-ID)])")
+            if status != "OK":
+                raise Exception(f"Réponse FETCH inattendue: {status}")
+        except Exception as e:
+            print(f"[IMAP] Erreur lors de la récupération des en-têtes du lot {uid_set}: {e}")
+            if raise_on_error:
+                raise
+            continue
+        for uid, header_data in parse_uid_fetch_response(msg_data).items():
+            header_str = header_data.decode("utf-8", errors="ignore") if isinstance(header_data, bytes) else str(header_data)
+            match = re.search(r'Message-ID:\s*<?([^\s>]+)>?', header_str, re.IGNORECASE)
+            if match:
+                message_ids[uid] = match.group(1).strip()
+    return message_ids
+
+
+def fetch_message_sizes_by_uid(mail: imaplib.IMAP4, uids: List[int]) -> Dict[int, int]:
+    """Récupère la taille (RFC822.SIZE) de chaque UID, par lots de IMAP_FETCH_BATCH_SIZE."""
+    sizes = {}
+    for uid_set in build_uid_sets(uids, settings.IMAP_FETCH_BATCH_SIZE):
+        try:
+            status, msg_data = mail.uid("FETCH", uid_set, "(RFC822.SIZE)")
+        except Exception as e:
+            print(f"[IMAP] Erreur lors de la récupération des tailles du lot {uid_set}: {e}")
+            continue
+        for item in msg_data or []:
+            line = item[0] if isinstance(item, tuple) else item
+            if not isinstance(line, bytes):
+                continue
+            uid_match = re.search(rb'UID\s+(\d+)', line, re.IGNORECASE)
+            size_match = re.search(rb'RFC822\.SIZE\s+(\d+)', line, re.IGNORECASE)
+            if uid_match and size_match:
+                sizes[int(uid_match.group(1))] = int(size_match.group(1))
+    return sizes
+
+
+def build_size_bounded_uid_sets(
+    uids: List[int],
+    sizes: Dict[int, int],
+    max_bytes: int,
+    max_count: int
+) -> List[str]:
+    """
+    Découpe les UIDs en lots dont la taille cumulée ne dépasse pas `max_bytes`
+    (un message plus gros que la limite forme un lot à lui seul), et d'au plus `max_count` UIDs.
+    Les UIDs de taille inconnue sont comptés comme dépassant la limite.
+    """
+    uid_sets = []
+    batch, batch_bytes = [], 0
+    for uid in sorted(set(int(uid) for uid in uids)):
+        size = sizes.get(uid, max_bytes + 1)
+        if batch and (batch_bytes + size > max_bytes or len(batch) >= max_count):
+            uid_sets.extend(build_uid_sets(batch, len(batch)))
+            batch, batch_bytes = [], 0
+        batch.append(uid)
+        batch_bytes += size
+    if batch:
+        uid_sets.extend(build_uid_sets(batch, len(batch)))
+    return uid_sets
+
+
+def fetch_emails_incremental(
+    imap_server: str,
+    imap_port: int,
+    email_address: str,
+    password: str,
+    company_code: str,
+    use_ssl: bool = True,
+    since_hours: Optional[int] = None,
+    last_uid: Optional[int] = None,
+    uidvalidity: Optional[int] = None,
+    known_message_ids: Optional[Callable[[List[str]], Set[str]]] = None,
+    on_email: Optional[Callable[[Dict], None]] = None,
+    attachment_store=None,
+    should_stop: Optional[Callable[[], bool]] = None
+) -> Dict:
+    """
+    Récupère les nouveaux emails depuis un serveur IMAP en mode incrémental.
+    
+    Si `last_uid` et `uidvalidity` sont fournis et que l'UIDVALIDITY du serveur n'a pas changé,
+    seuls les messages d'UID > last_uid sont téléchargés (UID SEARCH UID n:*).
+    Sinon (première sync, ou UIDVALIDITY modifié), repli sur la fenêtre de dates
+    (since_hours, ou 14 jours par défaut).
+    
+    Si `known_message_ids` est fourni, les Message-IDs sont d'abord récupérés par lots
+    (en-têtes uniquement) et la fonction reçoit la liste des Message-IDs normalisés ;
+    elle retourne ceux déjà stockés, dont le corps n'est alors pas téléchargé.
+    
+    Mode streaming (`on_email` fourni) : chaque email parsé est passé à `on_email` dès son
+    parsing au lieu d'être accumulé ("emails" est alors vide), les pièces jointes sont écrites
+    via `attachment_store`, et les corps sont récupérés par lots bornés en octets
+    (IMAP_FETCH_BODY_BATCH_BYTES, d'après RFC822.SIZE).
+    
+    Annulation coopérative : `should_stop` est consulté avant chaque lot et chaque email ; s'il
+    retourne True, le fetch s'arrête (ImapFetchCancelled) et libère la connexion. Le fetch tourne
+    dans un thread que l'annulation de la coroutine appelante n'interrompt pas.
+    
+    Returns:
+        {
+            "emails": liste des emails parsés (chacun avec "imap_uid" = UID IMAP),
+            "uidvalidity": UIDVALIDITY courant du dossier INBOX,
+            "last_uid": nouveau high-water mark (plus grand UID vu, ou juste avant le premier échec),
+            "max_uid": plus grand UID vu (high-water mark sans tenir compte des échecs),
+            "failed_uids": UIDs dont le téléchargement ou le parsing a échoué, ou absents de la réponse
+                           du serveur (retentés à la prochaine sync, voir apply_uid_failures),
+            "incremental": True si la recherche par UID a été utilisée
+        }
+    """
+    mail = None
+    discard_connection = True
+    
+    def check_stop():
+        if should_stop is not None and should_stop():
+            raise ImapFetchCancelled(f"Fetch IMAP interrompu pour {email_address}")
+    
+    try:
+        mail = imap_pool.acquire(imap_server, imap_port, email_address, password, use_ssl)
         
         print(f"[IMAP] Sélection de la boîte INBOX")
         select_result = mail.select("INBOX")
         print(f"[IMAP] INBOX sélectionné: {select_result}")
         
-        # Calculer la date depuis laquelle récupérer les emails
-        # Si since_hours est fourni, utiliser cette période (en heures)
-        # Sinon, utiliser 14 jours par défaut (pour la première sync)
-        if since_hours is not None:
-            since_date = datetime.utcnow() - timedelta(hours=since_hours)
+        current_uidvalidity = get_uidvalidity(mail)
+        incremental = (
+            last_uid is not None
+            and uidvalidity is not None
+            and current_uidvalidity is not None
+            and int(uidvalidity) == current_uidvalidity
+        )
+        
+        if incremental:
+            # Mode incrémental : uniquement les UIDs au-delà du high-water mark
+            print(f"[IMAP] Recherche incrémentale des UIDs > {last_uid} (UIDVALIDITY={current_uidvalidity})")
+            # "n:*" renvoie toujours au moins le dernier message, même si son UID < n : on filtre
+            uids = [uid for uid in _uid_search(mail, f"UID {int(last_uid) + 1}:*") if uid > int(last_uid)]
         else:
-            since_date = datetime.utcnow() - timedelta(days=14)
-        
-        # Formater la date au format IMAP (DD-MMM-YYYY) - format: "01-Jan-2024"
-        date_str = since_date.strftime("%d-%b-%Y")
-        
-        # Chercher tous les emails (lus et non lus) depuis la date calculée
-        days_ago = (datetime.utcnow() - since_date).days
-        hours_ago = (datetime.utcnow() - since_date).total_seconds() / 3600
-        period_str = f"{days_ago} jours" if days_ago >= 1 else f"{int(hours_ago)} heures"
-        print(f"[IMAP] Recherche des emails depuis le {date_str} ({period_str})")
-        search_criteria = f'(SINCE {date_str})'
-        status, messages = mail.search(None, search_criteria)
-        email_ids = messages[0].split() if messages[0] else []
-        print(f"[IMAP] {len(email_ids)} email(s) trouvé(s) ({period_str})")
+            if last_uid is not None and uidvalidity is not None:
+                print(f"[IMAP] UIDVALIDITY modifié ({uidvalidity} -> {current_uidvalidity}), repli sur la fenêtre de dates")
+            
+            # Calculer la date depuis laquelle récupérer les emails
+            # Si since_hours est fourni, utiliser cette période (en heures)
+            # Sinon, utiliser 14 jours par défaut (pour la première sync)
+            if since_hours is not None:
+                since_date = datetime.utcnow() - timedelta(hours=since_hours)
+            else:
+                since_date = datetime.utcnow() - timedelta(days=14)
+            
+            # Formater la date au format IMAP (DD-MMM-YYYY) - format: "01-Jan-2024"
+            date_str = since_date.strftime("%d-%b-%Y")
+            
+            # Chercher tous les emails (lus et non lus) depuis la date calculée
+            days_ago = (datetime.utcnow() - since_date).days
+            hours_ago = (datetime.utcnow() - since_date).total_seconds() / 3600
+            period_str = f"{days_ago} jours" if days_ago >= 1 else f"{int(hours_ago)} heures"
+            print(f"[IMAP] Recherche des emails depuis le {date_str} ({period_str})")
+            uids = _uid_search(mail, f'(SINCE {date_str})')
+        
+        print(f"[IMAP] {len(uids)} email(s) trouvé(s)")
+        
+        check_stop()
+        # 1) En-têtes d'abord (Message-ID), par lots, pour écarter les doublons sans télécharger les corps
+        uids_to_fetch = uids
+        if uids and known_message_ids is not None:
+            message_ids_by_uid = fetch_message_ids_by_uid(mail, uids)
+            already_known = set()
+            try:
+                already_known = known_message_ids(
+                    [mid for mid in message_ids_by_uid.values() if mid]
+                ) or set()
+            except Exception as e:
+                print(f"[IMAP] Erreur lors de la vérification des doublons, téléchargement complet: {e}")
+            uids_to_fetch = [
+                uid for uid in uids
+                if not message_ids_by_uid.get(uid) or message_ids_by_uid[uid] not in already_known
+            ]
+            print(f"[IMAP] {len(uids) - len(uids_to_fetch)} doublon(s) écarté(s) sur les en-têtes, {len(uids_to_fetch)} corps à télécharger")
         
+        # 2) Corps complets, par lots, uniquement pour les messages retenus
         parsed_emails = []
+        parsed_count = 0
+        failed_uids = []
         
-        for email_id in email_ids:
+        if on_email is not None and uids_to_fetch:
+            body_uid_sets = build_size_bounded_uid_sets(
+                uids_to_fetch,
+                fetch_message_sizes_by_uid(mail, uids_to_fetch),
+                settings.IMAP_FETCH_BODY_BATCH_BYTES,
+                settings.IMAP_FETCH_BODY_BATCH_SIZE
+            )
+        else:
+            body_uid_sets = build_uid_sets(uids_to_fetch, settings.IMAP_FETCH_BODY_BATCH_SIZE)
+        
+        for uid_set in body_uid_sets:
+            check_stop()
+            requested = expand_uid_set(uid_set)
             try:
-                # Récupérer l'email
-                status, msg_data = mail.fetch(email_id, "(RFC822)")
-                email_body = msg_data[0][1]
-                
-                # Parser l'email
-                msg = email.message_from_bytes(email_body)
-                parsed = parse_email_message(msg)
-                
-                # Ajouter le company_code pour le webhook
-                parsed["company_code"] = company_code
-                
-                # Ajouter l'UID IMAP pour pouvoir supprimer l'email plus tard
-                # email_id est en bytes, on le décode en string
-                parsed["imap_uid"] = email_id.decode('utf-8') if isinstance(email_id, bytes) else str(email_id)
-                
-                parsed_emails.append(parsed)
-                
-                # Marquer comme lu (optionnel)
-                # mail.store(email_id, '+FLAGS', '\\Seen')
-                
+                status, msg_data = mail.uid("FETCH", uid_set, "(RFC822)")
+                if status != "OK":
+                    raise Exception(f"Réponse FETCH inattendue: {status}")
+                bodies_by_uid = parse_uid_fetch_response(msg_data)
+                del msg_data
             except Exception as e:
-                print(f"Erreur lors du traitement de l'email {email_id}: {e}")
+                print(f"Erreur lors de la récupération du lot {uid_set}: {e}")
+                failed_uids.extend(str(uid) for uid in requested)
                 continue
+            
+            # UIDs demandés absents de la réponse (message supprimé entre-temps, réponse tronquée)
+            missing = [uid for uid in requested if uid not in bodies_by_uid]
+            if missing:
+                print(f"[IMAP] {len(missing)} UID(s) absent(s) de la réponse du lot {uid_set}")
+                failed_uids.extend(str(uid) for uid in missing)
+            
+            for uid in sorted(bodies_by_uid):
+                check_stop()
+                try:
+                    # Parser l'email (le corps brut est libéré dès qu'il est parsé)
+                    msg = email.message_from_bytes(bodies_by_uid.pop(uid))
+                    parsed = parse_email_message(msg, attachment_store=attachment_store)
+                    del msg
+                    
+                    # Ajouter le company_code pour le webhook
+                    parsed["company_code"] = company_code
+                    
+                    # Ajouter l'UID IMAP (stable entre les sessions, contrairement au numéro de séquence)
+                    parsed["imap_uid"] = str(uid)
+                    
+                    parsed_count += 1
+                    if on_email is not None:
+                        on_email(parsed)
+                    else:
+                        parsed_emails.append(parsed)
+                    
+                except Exception as e:
+                    print(f"Erreur lors du traitement de l'email UID {uid}: {e}")
+                    failed_uids.append(str(uid))
+                    continue
         
-        if mail:
-            try:
-                mail.close()
-            except:
-                pass
-            try:
-                mail.logout()
-            except:
-                pass
+        # Connexion rendue au pool (pas de logout) pour la prochaine synchronisation
+        discard_connection = False
+        
+        # Nouveau high-water mark : plus grand UID vu sur le serveur, sans dépasser
+        # le premier message en échec (retenté à la prochaine sync)
+        max_uid = max(uids) if uids else (int(last_uid) if incremental else None)
+        new_last_uid = compute_uid_high_water_mark(max_uid, failed_uids)
         
-        print(f"[IMAP] {len(parsed_emails)} email(s) parsé(s) avec succès")
-        return parsed_emails
+        if failed_uids:
+            print(f"[IMAP] {len(failed_uids)} email(s) en échec, retentés à la prochaine sync")
+        print(f"[IMAP] {parsed_count} email(s) parsé(s) avec succès (dernier UID: {new_last_uid})")
+        return {
+            "emails": parsed_emails,
+            "uidvalidity": current_uidvalidity,
+            "last_uid": new_last_uid,
+            "max_uid": max_uid,
+            "failed_uids": failed_uids,
+            "incremental": incremental,
+        }
         
+    except ImapFetchCancelled as e:
+        print(f"[IMAP] {e}")
+        raise
     except imaplib.IMAP4.error as e:
         error_msg = f"Erreur IMAP pour {email_address} ({imap_server}): {str(e)}"
         print(f"[IMAP] {error_msg}")
-        if mail:
-            try:
-                mail.logout()
-            except:
-                pass
         raise Exception(f"Erreur de connexion IMAP: {str(e)}")
     except Exception as e:
         error_msg = f"Erreur inattendue IMAP pour {email_address}: {str(e)}"
         print(f"[IMAP] {error_msg}")
         import traceback
         traceback.print_exc()
-        if mail:
-            try:
-                mail.logout()
-            except:
-                pass
         raise Exception(f"Erreur lors de la récupération des emails: {str(e)}")
+    finally:
+        imap_pool.release(mail, discard=discard_connection)
+
+
+def fetch_emails_imap(
+    imap_server: str,
+    imap_port: int,
+    email_address: str,
+    password: str,
+    company_code: str,
+    use_ssl: bool = True,
+    since_hours: Optional[int] = None
+) -> List[Dict]:
+    """
+    Récupère les nouveaux emails depuis un serveur IMAP (fenêtre de dates uniquement).
+    """
+    result = fetch_emails_incremental(
+        imap_server=imap_server,
+        imap_port=imap_port,
+        email_address=email_address,
+        password=password,
+        company_code=company_code,
+        use_ssl=use_ssl,
+        since_hours=since_hours
+    )
+    return result["emails"]
+
+
+def compute_uid_high_water_mark(
+    fetched_last_uid: Optional[int],
+    failed_uids: List[str]
+) -> Optional[int]:
+    """
+    Calcule le high-water mark à persister après traitement.
+    Si des emails ont échoué à l'ingestion, on s'arrête juste avant le plus petit UID en échec
+    pour qu'ils soient retentés à la prochaine sync.
+    """
+    if fetched_last_uid is None:
+        return None
+    failed = [int(uid) for uid in failed_uids if uid is not None and str(uid).isdigit()]
+    if failed:
+        return min(fetched_last_uid, min(failed) - 1)
+    return fetched_last_uid
+
+
+def apply_uid_failures(
+    fetched_last_uid: Optional[int],
+    failed_uids: List[str],
+    attempts: Optional[Dict[str, int]] = None,
+    max_attempts: Optional[int] = None
+) -> Tuple[Optional[int], Dict[str, int]]:
+    """
+    High-water mark et compteurs de tentatives à persister après une sync.
+    Chaque UID en échec voit son compteur incrémenté ; au-delà de `max_attempts`
+    (IMAP_UID_MAX_ATTEMPTS) il est abandonné et ne retient plus le high-water mark
+    (sinon un message illisible ferait retélécharger tous les suivants à chaque sync).
+    Retourne (high-water mark, {uid: échecs} des UIDs encore au-delà du high-water mark).
+    """
+    max_attempts = max_attempts or settings.IMAP_UID_MAX_ATTEMPTS
+    attempts = attempts or {}
+    counts = {}
+    for uid in failed_uids:
+        if uid is None or not str(uid).isdigit():
+            continue
+        counts[str(uid)] = int(attempts.get(str(uid), 0)) + 1
+    abandoned = sorted((uid for uid, count in counts.items() if count >= max_attempts), key=int)
+    if abandoned:
+        print(f"[IMAP] UID(s) abandonné(s) après {max_attempts} échecs: {', '.join(abandoned)}")
+    high_water_mark = compute_uid_high_water_mark(
+        fetched_last_uid, [uid for uid, count in counts.items() if count < max_attempts]
+    )
+    if high_water_mark is not None:
+        counts = {uid: count for uid, count in counts.items() if int(uid) > high_water_mark}
+    return high_water_mark, counts
 
 
 def get_message_ids_from_imap(
@@ -371,18 +774,10 @@ def get_message_ids_from_imap(
         Liste des Message-IDs présents
     """
     mail = None
+    discard_connection = True
     try:
-        # Nettoyer le mot de passe (supprimer les espaces pour Gmail)
-        cleaned_password = password.replace(" ", "").strip()
-        
         print(f"[IMAP SYNC] Connexion à {imap_server}:{imap_port} (SSL: {use_ssl}) pour récupérer les Message-IDs")
-        if use_ssl:
-            mail = imaplib.IMAP4_SSL(imap_server, imap_port)
-        else:
-            mail = imaplib.IMAP4(imap_server, imap_port)
-        
-        print(f"[IMAP SYNC] Authentification pour {email_address}")
-        mail.login(email_address, cleaned_password)
+        mail = imap_pool.acquire(imap_server, imap_port, email_address, password, use_ssl)
         
         # Déterminer le dossier à utiliser
         is_gmail = "gmail.com" in imap_server.lower() or "gmail" in imap_server.lower()
@@ -438,45 +833,12 @@ def get_message_ids_from_imap(
         
         # Chercher tous les emails des 14 derniers jours
         print(f"[IMAP SYNC] Recherche des Message-IDs depuis le {date_str} (14 derniers jours) dans {folder_to_search}")
-        search_criteria = f'(SINCE {date_str})'
-        status, messages = mail.search(None, search_criteria)
-        email_ids = messages[0].split() if messages[0] else []
-        print(f"[IMAP SYNC] {len(email_ids)} email(s) trouvé(s) dans {folder_to_search}")
-        
-        message_ids = []
-        
-        # Pour chaque email, récupérer uniquement le Message-ID (sans charger tout l'email)
-        for email_id in email_ids:
-            try:
-                # Récupérer uniquement les en-têtes (plus rapide que RFC822)
-                status, msg_data = mail.fetch(email_id, "(BODY[HEADER.FIELDS (MESSAGE-ID)])")
-                if msg_data[0] and msg_data[0][1]:
-                    header_data = msg_data[0][1]
-                    if isinstance(header_data, bytes):
-                        header_str = header_data.decode('utf-8', errors='ignore')
-                    else:
-                        header_str = str(header_data)
-                    
-                    # Extraire le Message-ID de l'en-tête
-                    # Format: "Message-ID: <xxx@example.com>"
-                    message_id_match = re.search(r'Message-ID:\s*<(.+?)>', header_str, re.IGNORECASE)
-                    if message_id_match:
-                        message_id = message_id_match.group(1).strip()
-                        message_ids.append(message_id)
-                        print(f"[IMAP SYNC] Message-ID trouvé: {message_id[:50]}...")
-            except Exception as e:
-                print(f"[IMAP SYNC] Erreur lors de la récupération du Message-ID pour l'email {email_id}: {e}")
-                continue
+        uids = _uid_search(mail, f'(SINCE {date_str})')
+        print(f"[IMAP SYNC] {len(uids)} email(s) trouvé(s) dans {folder_to_search}")
         
-        if mail:
-            try:
-                mail.close()
-            except:
-                pass
-            try:
-                mail.logout()
-            except:
-                pass
+        # Récupérer uniquement les Message-IDs, par lots (une requête UID FETCH par lot)
+        message_ids = list(fetch_message_ids_by_uid(mail, uids, raise_on_error=True).values())
+        discard_connection = False
         
         print(f"[IMAP SYNC] {len(message_ids)} Message-ID(s) récupéré(s) depuis {folder_to_search}")
         return message_ids
@@ -486,14 +848,11 @@ def get_message_ids_from_imap(
         print(f"[IMAP SYNC] {error_msg}")
         import traceback
         traceback.print_exc()
-        if mail:
-            try:
-                mail.logout()
-            except:
-                pass
         # En cas d'erreur, retourner une liste vide plutôt que d'échouer complètement
         # Cela évite de supprimer des emails par erreur si la connexion IMAP échoue
         return []
+    finally:
+        imap_pool.release(mail, discard=discard_connection)
 
 
 def delete_email_imap(
@@ -509,18 +868,10 @@ def delete_email_imap(
     Retourne True si le déplacement a réussi, False sinon.
     """
     mail = None
+    discard_connection = True
     try:
-        # Nettoyer le mot de passe (supprimer les espaces pour Gmail)
-        cleaned_password = password.replace(" ", "").strip()
-        
         print(f"[IMAP DELETE] Connexion à {imap_server}:{imap_port} (SSL: {use_ssl})")
-        if use_ssl:
-            mail = imaplib.IMAP4_SSL(imap_server, imap_port)
-        else:
-            mail = imaplib.IMAP4(imap_server, imap_port)
-        
-        print(f"[IMAP DELETE] Authentification pour {email_address}")
-        mail.login(email_address, cleaned_password)
+        mail = imap_pool.acquire(imap_server, imap_port, email_address, password, use_ssl)
         
         print(f"[IMAP DELETE] Sélection de la boîte INBOX")
         mail.select("INBOX")
@@ -540,6 +891,7 @@ def delete_email_imap(
         
         if not email_ids:
             print(f"[IMAP DELETE] Aucun email trouvé avec ce Message-ID")
+            discard_connection = False
             return False
         
         # Trouver le dossier de corbeille (Trash)
@@ -689,8 +1041,7 @@ def delete_email_imap(
             print(f"[IMAP DELETE] ERREUR: Aucun dossier corbeille trouvé parmi les dossiers disponibles.")
             print(f"[IMAP DELETE] Dossiers disponibles: {available_folders}")
             print(f"[IMAP DELETE] L'email ne sera PAS supprimé pour éviter la perte de données.")
-            mail.close()
-            mail.logout()
+            discard_connection = False
             return False
         
         # Déplacer tous les emails trouvés vers la corbeille
@@ -769,8 +1120,7 @@ def delete_email_imap(
                     print(f"[IMAP DELETE] ERREUR: Aucun dossier corbeille trouvé. L'email n'a PAS été supprimé pour éviter la perte de données.")
                     print(f"[IMAP DELETE] Dossiers disponibles: {available_folders}")
                     # Retourner False pour indiquer l'échec
-                    mail.close()
-                    mail.logout()
+                    discard_connection = False
                     return False
             except Exception as e:
                 print(f"[IMAP DELETE] Erreur lors du déplacement de l'email {email_id}: {e}")
@@ -784,9 +1134,7 @@ def delete_email_imap(
             else:
                 print(f"[IMAP DELETE] {moved_count} email(s) supprimé(s) définitivement")
         
-        mail.close()
-        mail.logout()
-        
+        discard_connection = False
         return moved_count > 0
         
     except Exception as e:
@@ -794,12 +1142,9 @@ def delete_email_imap(
         print(f"[IMAP DELETE] {error_msg}")
         import traceback
         traceback.print_exc()
-        if mail:
-            try:
-                mail.logout()
-            except:
-                pass
         return False
+    finally:
+        imap_pool.release(mail, discard=discard_connection)
 
 
 async def fetch_emails_async(
@@ -826,6 +1171,42 @@ async def fetch_emails_async(
     )
 
 
+async def fetch_emails_incremental_async(
+    imap_server: str,
+    imap_port: int,
+    email_address: str,
+    password: str,
+    company_code: str,
+    use_ssl: bool = True,
+    since_hours: Optional[int] = None,
+    last_uid: Optional[int] = None,
+    uidvalidity: Optional[int] = None,
+    known_message_ids: Optional[Callable[[List[str]], Set[str]]] = None,
+    on_email: Optional[Callable[[Dict], None]] = None,
+    attachment_store=None,
+    should_stop: Optional[Callable[[], bool]] = None
+) -> Dict:
+    """Version asynchrone de fetch_emails_incremental."""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        executor,
+        fetch_emails_incremental,
+        imap_server,
+        imap_port,
+        email_address,
+        password,
+        company_code,
+        use_ssl,
+        since_hours,
+        last_uid,
+        uidvalidity,
+        known_message_ids,
+        on_email,
+        attachment_store,
+        should_stop
+    )
+
+
 async def delete_email_imap_async(
     imap_server: str,
     imap_port: int,
@@ -0,0 +1,113 @@
+"""
+Planificateur de synchronisation IMAP multi-entreprises.
+Lance plusieurs synchronisations d'intégrations en parallèle, avec un plafond global,
+un plafond par serveur IMAP et un délai maximal par intégration.
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Pool de threads dédié : chaque synchronisation tourne dans son propre thread
+# (avec sa propre session DB) pour ne pas bloquer l'event loop pendant les requêtes DB.
+sync_executor = ThreadPoolExecutor(
+    max_workers=max(1, settings.IMAP_SYNC_MAX_CONCURRENCY),
+    thread_name_prefix="imap-sync"
+)
+
+EMPTY_SYNC_STATS = {"processed": 0, "created": 0, "errors": 0, "skipped": 0}
+
+
+def _host_key(imap_server: Optional[str]) -> str:
+    """Clé de regroupement par serveur IMAP (insensible à la casse)."""
+    return (imap_server or "").strip().lower() or "unknown"
+
+
+async def run_integration_syncs(
+    integrations: List[Dict],
+    sync_func: Callable[[int, float], Dict],
+    max_concurrency: Optional[int] = None,
+    max_per_host: Optional[int] = None,
+    timeout_seconds: Optional[float] = None,
+) -> List[Dict]:
+    """
+    Synchronise plusieurs intégrations en parallèle.
+
+    Args:
+        integrations: Liste de dicts {"id", "imap_server", "email_address"}
+        sync_func: Fonction bloquante `sync_func(integration_id, timeout_seconds) -> stats`,
+            exécutée dans un thread du pool. Elle doit ouvrir sa propre session DB
+            et respecter le délai fourni.
+        max_concurrency: Nombre maximum de synchronisations simultanées
+        max_per_host: Nombre maximum de synchronisations simultanées par serveur IMAP
+        timeout_seconds: Délai maximal par intégration
+
+    Returns:
+        Une entrée par intégration : stats de sync + durées (attente, exécution).
+    """
+    max_concurrency = max_concurrency or settings.IMAP_SYNC_MAX_CONCURRENCY
+    max_per_host = max_per_host or settings.IMAP_SYNC_MAX_PER_HOST
+    timeout_seconds = timeout_seconds or settings.IMAP_SYNC_TIMEOUT_SECONDS
+
+    loop = asyncio.get_running_loop()
+    global_semaphore = asyncio.Semaphore(max_concurrency)
+    host_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    async def _run_one(integration: Dict) -> Dict:
+        host = _host_key(integration.get("imap_server"))
+        host_semaphore = host_semaphores.setdefault(host, asyncio.Semaphore(max_per_host))
+        queued_at = time.monotonic()
+
+        # Le créneau hôte est pris avant le créneau global : une intégration qui attend
+        # un serveur saturé n'occupe pas de place dans le pool global.
+        async with host_semaphore:
+            async with global_semaphore:
+                started_at = time.monotonic()
+                result = {
+                    "integration_id": integration["id"],
+                    "email_address": integration.get("email_address"),
+                    "imap_server": host,
+                    "timed_out": False,
+                }
+                try:
+                    stats = await loop.run_in_executor(
+                        sync_executor, sync_func, integration["id"], timeout_seconds
+                    )
+                except Exception as e:
+                    logger.error(f"[SYNC SCHEDULER] Erreur pour l'intégration {integration['id']}: {e}", exc_info=True)
+                    stats = dict(EMPTY_SYNC_STATS, errors=1)
+
+                stats = stats or dict(EMPTY_SYNC_STATS)
+                result.update(stats)
+                result["timed_out"] = bool(stats.get("timed_out", False))
+                result["queued_seconds"] = round(started_at - queued_at, 3)
+                result["duration_seconds"] = round(time.monotonic() - started_at, 3)
+                return result
+
+    pass_started_at = time.monotonic()
+    results = await asyncio.gather(*(_run_one(integration) for integration in integrations))
+
+    logger.info(
+        f"[SYNC SCHEDULER] {len(results)} intégration(s) synchronisée(s) en "
+        f"{time.monotonic() - pass_started_at:.2f}s (concurrence={max_concurrency}, par hôte={max_per_host})"
+    )
+    return list(results)
+
+
+def summarize_sync_results(results: List[Dict]) -> Dict:
+    """Agrège les stats par intégration en un total global."""
+    totals = dict(EMPTY_SYNC_STATS)
+    totals["timed_out"] = 0
+    for result in results:
+        for key in EMPTY_SYNC_STATS:
+            totals[key] += result.get(key, 0) or 0
+        if result.get("timed_out"):
+            totals["timed_out"] += 1
+    durations = [r.get("duration_seconds", 0.0) for r in results]
+    totals["slowest_seconds"] = max(durations) if durations else 0.0
+    totals["total_seconds"] = round(sum(durations), 3)
+    return totals
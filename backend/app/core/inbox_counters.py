@@ -0,0 +1,123 @@
+"""
+Compteurs de l'inbox (badges) : lecture et flux Server-Sent Events de leurs changements.
+
+Les compteurs (table inbox_counters) sont tenus à jour dans la transaction qui modifie les
+conversations (voir app/db/models/inbox_counter.py). Les lire coûte une requête sur quelques
+lignes (une par dossier) : le frontend n'a plus à recharger la liste des conversations pour
+rafraîchir ses badges. Le flux relit ces lignes sur les évènements de l'inbox (app.core.inbox_events)
+et n'émet qu'en cas de changement.
+
+Les deltas sont calculés depuis les valeurs en mémoire de chaque transaction : deux modifications
+concurrentes de la même conversation peuvent appliquer chacune le leur et faire dériver un
+compteur. La lecture recalcule donc les compteurs de l'entreprise depuis les conversations au
+plus une fois par INBOX_COUNTERS_RECONCILE_SECONDS (par processus) ; une dérive ne dure pas.
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import AsyncIterator, Callable, Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.inbox_events import InboxEventHub, inbox_event_hub
+from app.db.models.inbox_counter import COUNTER_FIELDS, NO_FOLDER, InboxCounter, recompute_inbox_counters
+
+logger = logging.getLogger(__name__)
+
+# Attente après un évènement pour regrouper une rafale (synchro IMAP) en une seule lecture
+COALESCE_SECONDS = 0.2
+MAX_COALESCE_SECONDS = 1.0
+
+# Dernier recalcul complet par entreprise (horloge monotone, processus courant)
+_reconciled_at: Dict[int, float] = {}
+
+
+def _reconcile_due(company_id: int) -> bool:
+    """True si les compteurs de l'entreprise doivent être recalculés (intervalle écoulé depuis le dernier recalcul)."""
+    interval = settings.INBOX_COUNTERS_RECONCILE_SECONDS
+    if not interval:
+        return False
+    now = time.monotonic()
+    last = _reconciled_at.setdefault(company_id, now)
+    return now - last >= interval
+
+
+def get_inbox_counters(db: Session, company_id: int) -> Dict:
+    """
+    Compteurs de l'entreprise : {"totals": {...}, "folders": {"none" | folder_id: {...}}}.
+    Initialisés depuis les conversations à la première lecture si l'entreprise n'en a pas encore,
+    puis recalculés périodiquement (réconciliation des dérives, voir l'en-tête du module).
+    """
+    rows = db.query(InboxCounter).filter(InboxCounter.company_id == company_id).all()
+    if not rows or _reconcile_due(company_id):
+        recompute_inbox_counters(db, company_id)
+        db.commit()
+        _reconciled_at[company_id] = time.monotonic()
+        rows = db.query(InboxCounter).filter(InboxCounter.company_id == company_id).all()
+
+    totals = dict.fromkeys(COUNTER_FIELDS, 0)
+    folders = {}
+    for row in sorted(rows, key=lambda row: row.folder_id):
+        values = {field: getattr(row, field) for field in COUNTER_FIELDS}
+        folders["none" if row.folder_id == NO_FOLDER else str(row.folder_id)] = values
+        for field in COUNTER_FIELDS:
+            totals[field] += values[field]
+    return {"totals": totals, "folders": folders}
+
+
+def _format_event(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+async def stream_inbox_counters(
+    company_id: int,
+    is_disconnected: Optional[Callable] = None,
+    session_factory=None,
+    hub: Optional[InboxEventHub] = None,
+    heartbeat_seconds: Optional[float] = None
+) -> AsyncIterator[str]:
+    """
+    Flux SSE : un évènement "counters" à l'ouverture puis, s'ils ont changé, après chaque
+    évènement de l'inbox de l'entreprise (rafale regroupée en une lecture). Sans évènement, relecture
+    au rythme du keepalive (filet de sécurité) et commentaire keepalive si rien n'a changé.
+    Une session courte par lecture (aucune connexion tenue entre deux lectures).
+    """
+    if session_factory is None:
+        from app.db.session import SessionLocal
+        session_factory = SessionLocal
+    hub = hub or inbox_event_hub
+    heartbeat_seconds = heartbeat_seconds or settings.INBOX_EVENTS_HEARTBEAT_SECONDS
+
+    def _read():
+        db = session_factory()
+        try:
+            return get_inbox_counters(db, company_id)
+        finally:
+            db.close()
+
+    loop = asyncio.get_running_loop()
+    subscription = hub.subscribe(company_id)
+    last = None
+    try:
+        while True:
+            if is_disconnected is not None and await is_disconnected():
+                return
+            try:
+                counters = await loop.run_in_executor(None, _read)
+            except Exception as e:
+                logger.warning(f"[INBOX COUNTERS] Lecture des compteurs impossible (company {company_id}): {e}")
+                counters = last
+            if counters != last:
+                last = counters
+                yield _format_event("counters", counters)
+            elif counters is not None:
+                yield ": keepalive\n\n"
+            # Attendre un évènement, puis vider la rafale (au plus MAX_COALESCE_SECONDS) avant de relire
+            if await subscription.get(heartbeat_seconds) is not None:
+                deadline = loop.time() + MAX_COALESCE_SECONDS
+                while loop.time() < deadline and await subscription.get(COALESCE_SECONDS) is not None:
+                    pass
+    finally:
+        hub.unsubscribe(subscription)
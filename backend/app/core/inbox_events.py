@@ -0,0 +1,379 @@
+"""
+Évènements temps réel de l'inbox : hub pub/sub par entreprise, diffusé en Server-Sent Events.
+
+Les évènements sont produits au flush de la session (écouteur ORM ci-dessous), quel que soit
+le chemin d'ingestion (webhooks email/WhatsApp/SMS, synchro IMAP, routes de l'inbox) :
+- conversation.created : nouvelle conversation ;
+- message.added : nouveau message dans une conversation ;
+- conversation.folder_changed : conversations déplacées vers un dossier (folder_id None = sans dossier) ;
+- conversation.updated : statut, urgence, non-lus ou auto-réponse modifiés ;
+- folder.deleted : dossier supprimé, ses conversations passent sans dossier (publié par la route).
+Ils ne partent qu'au commit de la transaction (rien en cas de rollback).
+
+Backends (INBOX_EVENTS_BACKEND) :
+- "local" : diffusion aux abonnés du processus courant uniquement ;
+- "postgres" : pg_notify dans la transaction (délivré par PostgreSQL au commit), chaque
+  processus écoute le canal (LISTEN) et redistribue à ses abonnés. Plusieurs workers uvicorn
+  et les workers de classification partagent ainsi le même flux. Les évènements d'un flush
+  partent en une notification par entreprise (découpée sous la limite de pg_notify), pas une
+  par message. LISTEN n'est pas disponible derrière un pooler en mode transaction :
+  INBOX_EVENTS_LISTEN_URL permet alors d'écouter sur une connexion directe ou en mode session.
+Sans INBOX_EVENTS_BACKEND, "postgres" est choisi quand DATABASE_URL est PostgreSQL et que
+LISTEN est possible (pas de pooler en mode transaction, ou INBOX_EVENTS_LISTEN_URL défini) ;
+sinon "local", et les workers ne voient alors que leurs propres évènements.
+"""
+import asyncio
+import json
+import logging
+import select as select_module
+import threading
+from collections import deque
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db.models.conversation import Conversation, InboxMessage
+
+logger = logging.getLogger(__name__)
+
+EVENT_CONVERSATION_CREATED = "conversation.created"
+EVENT_MESSAGE_ADDED = "message.added"
+EVENT_FOLDER_CHANGED = "conversation.folder_changed"
+EVENT_CONVERSATION_UPDATED = "conversation.updated"
+EVENT_FOLDER_DELETED = "folder.deleted"
+
+NOTIFY_CHANNEL = "inbox_events"
+# Évènements en attente par abonné ; au-delà les plus anciens sont abandonnés (client trop lent)
+SUBSCRIBER_BUFFER = 256
+# Conversations par évènement conversation.folder_changed (payload pg_notify < 8000 octets)
+FOLDER_CHANGED_BATCH = 500
+# Taille maximale d'une notification groupée (pg_notify refuse les payloads de 8000 octets et plus)
+NOTIFY_PAYLOAD_LIMIT = 7900
+# Colonnes dont la modification produit conversation.updated
+_UPDATED_FIELDS = ("status", "is_urgent", "unread_count", "auto_reply_pending", "auto_reply_sent")
+_PENDING_KEY = "inbox_events_pending"
+
+
+class Subscription:
+    """Abonnement d'un flux SSE aux évènements d'une entreprise (consommé dans sa boucle asyncio)."""
+
+    def __init__(self, company_id: int, loop: asyncio.AbstractEventLoop):
+        self.company_id = company_id
+        self.loop = loop
+        self._events = deque(maxlen=SUBSCRIBER_BUFFER)
+        self._ready = asyncio.Event()
+
+    def _push(self, payload: Dict) -> None:
+        self._events.append(payload)
+        self._ready.set()
+
+    async def get(self, timeout: float) -> Optional[Dict]:
+        """Prochain évènement, ou None si rien n'arrive dans le délai."""
+        if not self._events:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self._events.popleft()
+
+
+class InboxEventHub:
+    """Abonnés par entreprise ; dispatch appelable depuis n'importe quel thread."""
+
+    def __init__(self):
+        self._subscribers: Dict[int, set] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, company_id: int) -> Subscription:
+        subscription = Subscription(company_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.setdefault(company_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.company_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.company_id]
+
+    def dispatch(self, payload: Dict) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(payload["company_id"], ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._push, payload)
+            except RuntimeError:
+                # Boucle fermée : abonné mort
+                self.unsubscribe(subscription)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+class LocalEventBackend:
+    """Diffusion dans le processus courant, après le commit."""
+
+    def stage(self, session: Session, payload: Dict) -> None:
+        session.info.setdefault(_PENDING_KEY, []).append(payload)
+
+    def send_staged(self, session: Session) -> None:
+        """Appelé en fin de flush et avant le commit : rien à faire, la diffusion attend le commit."""
+        pass
+
+    def flush_committed(self, hub: InboxEventHub, session: Session) -> None:
+        for payload in session.info.pop(_PENDING_KEY, []):
+            hub.dispatch(payload)
+
+    def start(self, hub: InboxEventHub) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+
+class PostgresEventBackend(LocalEventBackend):
+    """pg_notify transactionnel + thread LISTEN qui redistribue aux abonnés du processus."""
+
+    def __init__(self, listen_url: Optional[str] = None):
+        self.listen_url = listen_url
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def send_staged(self, session: Session) -> None:
+        """Évènements en attente envoyés dans la transaction, une notification par entreprise."""
+        payloads = session.info.pop(_PENDING_KEY, None)
+        if not payloads:
+            return
+        connection = session.connection()
+        for notification in batch_notifications(payloads):
+            connection.execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {"channel": NOTIFY_CHANNEL, "payload": notification}
+            )
+
+    def flush_committed(self, hub: InboxEventHub, session: Session) -> None:
+        # Délivré par PostgreSQL, y compris à ce processus (thread LISTEN)
+        pass
+
+    def start(self, hub: InboxEventHub) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen, args=(hub,), name="inbox-events-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5.0)
+            self._thread = None
+
+    def _connect(self):
+        if self.listen_url:
+            import psycopg2
+            return psycopg2.connect(self.listen_url.replace("postgresql+psycopg2://", "postgresql://"))
+        from app.db.session import engine
+        # Connexion dédiée, sortie du pool (tenue ouverte pour LISTEN)
+        connection = engine.raw_connection()
+        connection.detach()
+        return connection.dbapi_connection
+
+    def _listen(self, hub: InboxEventHub) -> None:
+        delay = 1.0
+        while not self._stop.is_set():
+            connection = None
+            try:
+                connection = self._connect()
+                connection.autocommit = True
+                connection.cursor().execute(f"LISTEN {NOTIFY_CHANNEL}")
+                logger.info("[INBOX EVENTS] Écoute PostgreSQL démarrée")
+                delay = 1.0
+                while not self._stop.is_set():
+                    if select_module.select([connection], [], [], 1.0) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        notification = connection.notifies.pop(0)
+                        try:
+                            for payload in unpack_notification(notification.payload):
+                                hub.dispatch(payload)
+                        except (ValueError, KeyError) as e:
+                            logger.warning(f"[INBOX EVENTS] Notification illisible ignorée: {e}")
+            except Exception as e:
+                logger.warning(f"[INBOX EVENTS] Écoute PostgreSQL interrompue, nouvelle tentative dans {delay:.0f}s: {e}")
+                self._stop.wait(delay)
+                delay = min(delay * 2, 60.0)
+            finally:
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+
+
+def batch_notifications(payloads: List[Dict]) -> List[str]:
+    """
+    Payloads pg_notify groupant les évènements par entreprise :
+    {"company_id": ..., "events": [...]}, découpés sous NOTIFY_PAYLOAD_LIMIT octets.
+    """
+    by_company: Dict[int, List[str]] = {}
+    for payload in payloads:
+        data = {key: value for key, value in payload.items() if key != "company_id"}
+        by_company.setdefault(payload["company_id"], []).append(json.dumps(data, separators=(",", ":"), default=str))
+
+    notifications = []
+    for company_id, events in by_company.items():
+        prefix = f'{{"company_id":{company_id},"events":['
+        chunk: List[str] = []
+        size = len(prefix) + 2
+        for serialized in events:
+            length = len(serialized.encode()) + 1
+            if chunk and size + length > NOTIFY_PAYLOAD_LIMIT:
+                notifications.append(prefix + ",".join(chunk) + "]}")
+                chunk, size = [], len(prefix) + 2
+            chunk.append(serialized)
+            size += length
+        notifications.append(prefix + ",".join(chunk) + "]}")
+    return notifications
+
+
+def unpack_notification(raw: str) -> List[Dict]:
+    """Évènements d'une notification groupée (voir batch_notifications)."""
+    notification = json.loads(raw)
+    company_id = notification["company_id"]
+    return [{**payload, "company_id": company_id} for payload in notification["events"]]
+
+
+def _default_backend_name() -> str:
+    database_url = settings.DATABASE_URL.lower()
+    if not database_url.startswith("postgres"):
+        return "local"
+    # Pooler en mode transaction (port 6543) : LISTEN n'y reçoit rien sans connexion dédiée
+    if ":6543/" in database_url and not settings.INBOX_EVENTS_LISTEN_URL:
+        logger.warning(
+            "[INBOX EVENTS] DATABASE_URL passe par un pooler en mode transaction : évènements limités au "
+            "processus courant. Définissez INBOX_EVENTS_LISTEN_URL pour les partager entre workers."
+        )
+        return "local"
+    return "postgres"
+
+
+def _make_backend():
+    backend = settings.INBOX_EVENTS_BACKEND or _default_backend_name()
+    if backend == "postgres":
+        return PostgresEventBackend(settings.INBOX_EVENTS_LISTEN_URL)
+    return LocalEventBackend()
+
+
+inbox_event_hub = InboxEventHub()
+inbox_event_backend = _make_backend()
+
+
+def publish_event(session: Session, company_id: int, event_type: str, **data) -> None:
+    """Publie un évènement au commit de la session (pour les modifications hors ORM, ex. UPDATE groupés)."""
+    if company_id is None:
+        return
+    inbox_event_backend.stage(session, {"type": event_type, "company_id": company_id, **data})
+
+
+def publish_folder_changed(session: Session, company_id: int, conversation_ids: List[int], folder_id: Optional[int]) -> None:
+    """conversation.folder_changed, par lots (pg_notify limite la taille d'une notification)."""
+    for start in range(0, len(conversation_ids), FOLDER_CHANGED_BATCH):
+        publish_event(
+            session, company_id, EVENT_FOLDER_CHANGED,
+            conversation_ids=conversation_ids[start:start + FOLDER_CHANGED_BATCH], folder_id=folder_id
+        )
+
+
+def start_inbox_events() -> None:
+    """Démarre le backend (écoute PostgreSQL le cas échéant)."""
+    inbox_event_backend.start(inbox_event_hub)
+
+
+def stop_inbox_events() -> None:
+    inbox_event_backend.stop()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_inbox_events(session, flush_context):
+    """Évènements des conversations et messages écrits par ce flush."""
+    moved: Dict[tuple, List[int]] = {}
+    for instance in session.new:
+        if isinstance(instance, Conversation):
+            publish_event(
+                session, instance.company_id, EVENT_CONVERSATION_CREATED,
+                conversation_id=instance.id, folder_id=instance.folder_id, source=instance.source
+            )
+        elif isinstance(instance, InboxMessage):
+            publish_event(
+                session, instance.company_id, EVENT_MESSAGE_ADDED,
+                conversation_id=instance.conversation_id, message_id=instance.id, is_from_client=instance.is_from_client
+            )
+    for instance in session.dirty:
+        if not isinstance(instance, Conversation):
+            continue
+        state = inspect(instance)
+        if state.attrs.folder_id.history.has_changes():
+            moved.setdefault((instance.company_id, instance.folder_id), []).append(instance.id)
+        changed = [key for key in _UPDATED_FIELDS if state.attrs[key].history.has_changes()]
+        if changed:
+            publish_event(
+                session, instance.company_id, EVENT_CONVERSATION_UPDATED,
+                conversation_id=instance.id, fields=changed
+            )
+    for (company_id, folder_id), conversation_ids in moved.items():
+        publish_folder_changed(session, company_id, conversation_ids, folder_id)
+    inbox_event_backend.send_staged(session)
+
+
+@event.listens_for(Session, "before_commit")
+def _send_staged_events(session):
+    """Évènements publiés hors flush (UPDATE groupés, routes) : envoyés avant le commit."""
+    if session.info.get(_PENDING_KEY):
+        inbox_event_backend.send_staged(session)
+
+
+@event.listens_for(Session, "after_commit")
+def _dispatch_committed_events(session):
+    if session.info.get(_PENDING_KEY):
+        inbox_event_backend.flush_committed(inbox_event_hub, session)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_rolled_back_events(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def _format_event(event_type: str, data: Dict) -> str:
+    return f"event: {event_type}\ndata: {json.dumps(data, separators=(',', ':'), default=str)}\n\n"
+
+
+async def stream_inbox_events(
+    company_id: int,
+    is_disconnected: Optional[Callable] = None,
+    hub: Optional[InboxEventHub] = None,
+    heartbeat_seconds: Optional[float] = None
+) -> AsyncIterator[str]:
+    """Flux SSE des évènements de l'entreprise (un commentaire keepalive en l'absence d'évènement)."""
+    hub = hub or inbox_event_hub
+    heartbeat_seconds = heartbeat_seconds or settings.INBOX_EVENTS_HEARTBEAT_SECONDS
+    subscription = hub.subscribe(company_id)
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            if is_disconnected is not None and await is_disconnected():
+                return
+            payload = await subscription.get(heartbeat_seconds)
+            if payload is None:
+                yield ": keepalive\n\n"
+                continue
+            data = {key: value for key, value in payload.items() if key not in ("type", "company_id")}
+            yield _format_event(payload["type"], data)
+    finally:
+        hub.unsubscribe(subscription)
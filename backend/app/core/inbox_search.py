@@ -0,0 +1,270 @@
+"""
+Recherche plein texte dans l'inbox (sujets des conversations et contenus des messages).
+
+- PostgreSQL : colonnes `search_vector` (tsvector, configuration 'french') générées par la base
+  (GENERATED ALWAYS … STORED, toujours à jour sans code applicatif) et index GIN, créées par la
+  migration add_inbox_search_index.
+- SQLite (développement) : tables FTS5 à contenu externe (inbox_messages_fts, conversations_fts)
+  maintenues par triggers.
+
+La requête utilisateur est découpée en mots cherchés en préfixe (recherche au fil de la frappe).
+Les conversations sont classées par pertinence (sujet pondéré x2 + meilleur message) et
+chaque résultat porte un extrait HTML échappé où les termes trouvés sont entourés de <mark>.
+Le coût dépend du nombre de résultats (index inversé), pas de la taille de la boîte.
+"""
+import html
+import logging
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# Mots de la requête pris en compte
+MAX_QUERY_TERMS = 8
+# Marqueurs internes des extraits (remplacés par <mark> après échappement HTML)
+_START_MARK = "⟦"
+_STOP_MARK = "⟧"
+
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+
+@dataclass
+class SearchHit:
+    conversation_id: int
+    rank: float
+    snippet: Optional[str] = None
+
+
+def _terms(query: str) -> List[str]:
+    return _TERM_RE.findall((query or "").lower())[:MAX_QUERY_TERMS]
+
+
+def _highlight(raw: Optional[str]) -> Optional[str]:
+    """Échappe l'extrait (contenu d'email) puis remplace les marqueurs par <mark>."""
+    if not raw:
+        return None
+    escaped = html.escape(raw)
+    return escaped.replace(_START_MARK, "<mark>").replace(_STOP_MARK, "</mark>")
+
+
+def _filters_sql(folder_id: Optional[int], status: Optional[str], source: Optional[str], params: Dict) -> str:
+    clauses = []
+    if folder_id:
+        clauses.append("c.folder_id = :folder_id")
+        params["folder_id"] = folder_id
+    if status:
+        clauses.append("c.status = :status")
+        params["status"] = status
+    if source:
+        clauses.append("c.source = :source")
+        params["source"] = source
+    return "".join(f" AND {clause}" for clause in clauses)
+
+
+def search_conversations(
+    db: Session,
+    company_id: int,
+    query: str,
+    folder_id: Optional[int] = None,
+    status: Optional[str] = None,
+    source: Optional[str] = None,
+    limit: int = 50,
+    offset: int = 0
+) -> List[SearchHit]:
+    """Conversations de l'entreprise correspondant à la recherche, triées par pertinence, avec extrait."""
+    terms = _terms(query)
+    if not terms:
+        return []
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        return _search_postgresql(db, company_id, terms, folder_id, status, source, limit, offset)
+    if dialect == "sqlite":
+        return _search_sqlite(db, company_id, terms, folder_id, status, source, limit, offset)
+    raise NotImplementedError(f"Recherche plein texte non disponible pour {dialect}")
+
+
+def _search_postgresql(db, company_id, terms, folder_id, status, source, limit, offset) -> List[SearchHit]:
+    params = {
+        "company_id": company_id,
+        "tsquery": " & ".join(f"{term}:*" for term in terms),
+        "limit": limit,
+        "offset": offset,
+    }
+    filters = _filters_sql(folder_id, status, source, params)
+    rows = db.execute(text(f"""
+        WITH q AS (SELECT to_tsquery('french', :tsquery) AS query),
+        message_hits AS (
+            SELECT DISTINCT ON (m.conversation_id)
+                m.conversation_id, m.id AS message_id, ts_rank(m.search_vector, q.query) AS rank
+            FROM inbox_messages m, q
+            WHERE m.company_id = :company_id AND m.search_vector @@ q.query
+            ORDER BY m.conversation_id, rank DESC
+        ),
+        subject_hits AS (
+            SELECT c.id AS conversation_id, ts_rank(c.search_vector, q.query) AS rank
+            FROM conversations c, q
+            WHERE c.company_id = :company_id AND c.search_vector @@ q.query
+        ),
+        ids AS (
+            SELECT conversation_id FROM message_hits UNION SELECT conversation_id FROM subject_hits
+        )
+        SELECT c.id AS conversation_id, mh.message_id,
+               COALESCE(sh.rank, 0) * 2 + COALESCE(mh.rank, 0) AS rank
+        FROM ids
+        JOIN conversations c ON c.id = ids.conversation_id
+        LEFT JOIN message_hits mh ON mh.conversation_id = c.id
+        LEFT JOIN subject_hits sh ON sh.conversation_id = c.id
+        WHERE c.company_id = :company_id{filters}
+        ORDER BY rank DESC, c.last_message_at DESC NULLS LAST, c.id DESC
+        LIMIT :limit OFFSET :offset
+    """), params).all()
+    if not rows:
+        return []
+
+    # Extraits (ts_headline) uniquement pour la page retournée
+    headline_options = f"StartSel={_START_MARK}, StopSel={_STOP_MARK}, MaxWords=25, MinWords=10, MaxFragments=1"
+    message_ids = [row.message_id for row in rows if row.message_id]
+    subject_ids = [row.conversation_id for row in rows if not row.message_id]
+    snippets = {}
+    if message_ids:
+        for row in db.execute(text("""
+            SELECT m.conversation_id,
+                   ts_headline('french', m.content, to_tsquery('french', :tsquery), :options) AS snippet
+            FROM inbox_messages m WHERE m.id = ANY(:ids)
+        """), {"tsquery": params["tsquery"], "options": headline_options, "ids": message_ids}).all():
+            snippets[row.conversation_id] = row.snippet
+    if subject_ids:
+        for row in db.execute(text("""
+            SELECT c.id AS conversation_id,
+                   ts_headline('french', coalesce(c.subject, ''), to_tsquery('french', :tsquery), :options) AS snippet
+            FROM conversations c WHERE c.id = ANY(:ids)
+        """), {"tsquery": params["tsquery"], "options": headline_options, "ids": subject_ids}).all():
+            snippets[row.conversation_id] = row.snippet
+
+    return [SearchHit(row.conversation_id, float(row.rank), _highlight(snippets.get(row.conversation_id))) for row in rows]
+
+
+def _search_sqlite(db, company_id, terms, folder_id, status, source, limit, offset) -> List[SearchHit]:
+    params = {
+        "company_id": company_id,
+        "match": " ".join(f'"{term}"*' for term in terms),
+        "limit": limit,
+        "offset": offset,
+    }
+    filters = _filters_sql(folder_id, status, source, params)
+    # bm25() : plus petit = plus pertinent, d'où le signe inversé
+    rows = db.execute(text(f"""
+        WITH message_hits AS (
+            SELECT conversation_id, rowid AS message_id, -bm25(inbox_messages_fts) AS rank
+            FROM inbox_messages_fts
+            WHERE inbox_messages_fts MATCH :match AND company_id = :company_id
+        ),
+        best_messages AS (
+            SELECT conversation_id, message_id, MAX(rank) AS rank FROM message_hits GROUP BY conversation_id
+        ),
+        subject_hits AS (
+            SELECT rowid AS conversation_id, -bm25(conversations_fts) AS rank
+            FROM conversations_fts
+            WHERE conversations_fts MATCH :match AND company_id = :company_id
+        ),
+        ids AS (
+            SELECT conversation_id FROM best_messages UNION SELECT conversation_id FROM subject_hits
+        )
+        SELECT c.id AS conversation_id, bm.message_id AS message_id,
+               COALESCE(sh.rank, 0) * 2 + COALESCE(bm.rank, 0) AS rank
+        FROM ids
+        JOIN conversations c ON c.id = ids.conversation_id
+        LEFT JOIN best_messages bm ON bm.conversation_id = c.id
+        LEFT JOIN subject_hits sh ON sh.conversation_id = c.id
+        WHERE c.company_id = :company_id{filters}
+        ORDER BY rank DESC, c.last_message_at DESC, c.id DESC
+        LIMIT :limit OFFSET :offset
+    """), params).all()
+    if not rows:
+        return []
+
+    snippet_args = f"'{_START_MARK}', '{_STOP_MARK}', '…', 16"
+    snippets = {}
+    message_ids = [row.message_id for row in rows if row.message_id]
+    subject_ids = [row.conversation_id for row in rows if not row.message_id]
+    if message_ids:
+        placeholders = ", ".join(str(int(message_id)) for message_id in message_ids)
+        for row in db.execute(text(f"""
+            SELECT conversation_id, snippet(inbox_messages_fts, 0, {snippet_args}) AS snippet
+            FROM inbox_messages_fts WHERE inbox_messages_fts MATCH :match AND rowid IN ({placeholders})
+        """), {"match": params["match"]}).all():
+            snippets[row.conversation_id] = row.snippet
+    if subject_ids:
+        placeholders = ", ".join(str(int(conversation_id)) for conversation_id in subject_ids)
+        for row in db.execute(text(f"""
+            SELECT rowid AS conversation_id, snippet(conversations_fts, 0, {snippet_args}) AS snippet
+            FROM conversations_fts WHERE conversations_fts MATCH :match AND rowid IN ({placeholders})
+        """), {"match": params["match"]}).all():
+            snippets[row.conversation_id] = row.snippet
+
+    return [SearchHit(row.conversation_id, float(row.rank), _highlight(snippets.get(row.conversation_id))) for row in rows]
+
+
+# Index SQLite (FTS5 à contenu externe + triggers), aussi créés par la migration add_inbox_search_index
+SQLITE_INDEX_STATEMENTS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS inbox_messages_fts USING fts5("
+    "content, conversation_id UNINDEXED, company_id UNINDEXED, "
+    "content='inbox_messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS inbox_messages_fts_ai AFTER INSERT ON inbox_messages BEGIN "
+    "INSERT INTO inbox_messages_fts(rowid, content, conversation_id, company_id) "
+    "VALUES (new.id, new.content, new.conversation_id, new.company_id); END",
+    "CREATE TRIGGER IF NOT EXISTS inbox_messages_fts_ad AFTER DELETE ON inbox_messages BEGIN "
+    "INSERT INTO inbox_messages_fts(inbox_messages_fts, rowid, content, conversation_id, company_id) "
+    "VALUES ('delete', old.id, old.content, old.conversation_id, old.company_id); END",
+    "CREATE TRIGGER IF NOT EXISTS inbox_messages_fts_au AFTER UPDATE OF content, conversation_id, company_id "
+    "ON inbox_messages BEGIN "
+    "INSERT INTO inbox_messages_fts(inbox_messages_fts, rowid, content, conversation_id, company_id) "
+    "VALUES ('delete', old.id, old.content, old.conversation_id, old.company_id); "
+    "INSERT INTO inbox_messages_fts(rowid, content, conversation_id, company_id) "
+    "VALUES (new.id, new.content, new.conversation_id, new.company_id); END",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts USING fts5("
+    "subject, company_id UNINDEXED, "
+    "content='conversations', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS conversations_fts_ai AFTER INSERT ON conversations BEGIN "
+    "INSERT INTO conversations_fts(rowid, subject, company_id) VALUES (new.id, new.subject, new.company_id); END",
+    "CREATE TRIGGER IF NOT EXISTS conversations_fts_ad AFTER DELETE ON conversations BEGIN "
+    "INSERT INTO conversations_fts(conversations_fts, rowid, subject, company_id) "
+    "VALUES ('delete', old.id, old.subject, old.company_id); END",
+    "CREATE TRIGGER IF NOT EXISTS conversations_fts_au AFTER UPDATE OF subject, company_id ON conversations BEGIN "
+    "INSERT INTO conversations_fts(conversations_fts, rowid, subject, company_id) "
+    "VALUES ('delete', old.id, old.subject, old.company_id); "
+    "INSERT INTO conversations_fts(rowid, subject, company_id) VALUES (new.id, new.subject, new.company_id); END",
+]
+
+
+def ensure_search_index(bind) -> None:
+    """
+    Crée l'index plein texte SQLite s'il manque (bases créées par create_all, hors migrations).
+    `bind` : Engine (transaction dédiée) ou Connection (transaction de l'appelant, ex. migration).
+    Un index tout juste créé est reconstruit à partir des tables existantes. Sans effet sous
+    PostgreSQL : la colonne et l'index GIN n'y sont créés que par la migration.
+    """
+    if isinstance(bind, Engine):
+        with bind.begin() as conn:
+            _create_search_index(conn)
+    else:
+        _create_search_index(bind)
+
+
+def _create_search_index(conn) -> None:
+    if conn.dialect.name == "sqlite":
+        existing = {
+            row[0] for row in conn.execute(text(
+                "SELECT name FROM sqlite_master WHERE name IN ('inbox_messages_fts', 'conversations_fts')"
+            ))
+        }
+        for statement in SQLITE_INDEX_STATEMENTS:
+            conn.execute(text(statement))
+        if "inbox_messages_fts" not in existing:
+            conn.execute(text("INSERT INTO inbox_messages_fts(inbox_messages_fts) VALUES ('rebuild')"))
+        if "conversations_fts" not in existing:
+            conn.execute(text("INSERT INTO conversations_fts(conversations_fts) VALUES ('rebuild')"))
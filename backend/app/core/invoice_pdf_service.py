@@ -16,6 +16,7 @@ try:
     from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
     from reportlab.platypus import Paragraph, Spacer, Table, TableStyle, Image
     from reportlab.lib.enums import TA_LEFT, TA_RIGHT, TA_CENTER
+    from app.core.pdf_image_loader import load_image_for_pdf
     REPORTLAB_AVAILABLE = True
 except ImportError:
     REPORTLAB_AVAILABLE = False
@@ -85,38 +86,24 @@ def generate_invoice_pdf(invoice: Invoice, client=None, company_info: Optional[d
     if design_config:
         logo_path = design_config.get("logo_path")
     
-    # Normaliser le chemin du logo : enlever le préfixe "uploads" s'il existe déjà
-    if logo_path:
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.info(f"[INVOICE PDF] Original logo_path: {logo_path}")
-        
-        normalized_path = logo_path
-        if normalized_path.startswith("uploads/"):
-            normalized_path = normalized_path[8:]  # Enlever "uploads/"
-        elif normalized_path.startswith("./uploads/"):
-            normalized_path = normalized_path[11:]  # Enlever "./uploads/"
-        
-        # Si logo_path est relatif, le rendre absolu depuis UPLOAD_DIR
-        upload_dir = Path(settings.UPLOAD_DIR).resolve()
-        if not Path(normalized_path).is_absolute():
-            logo_path = str((upload_dir / normalized_path).resolve())
-        else:
-            logo_path = str(Path(normalized_path).resolve())
-        
-        logger.info(f"[INVOICE PDF] Normalized logo_path: {logo_path}")
-    
     logo_loaded = False
-    if logo_path and Path(logo_path).exists():
-        try:
-            logo = Image(logo_path, width=40*mm, height=40*mm, kind='proportional')
-            logo.drawOn(c, width - 60*mm, height - 50*mm)
-            logo_loaded = True
-        except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.warning(f"Could not load logo for invoice: {e}")
-            logo_loaded = False
+    if logo_path:
+        logo_result = load_image_for_pdf(
+            image_path=logo_path,
+            width=40,
+            height=40,
+            upload_dir=Path(settings.UPLOAD_DIR).resolve(),
+            company_id=invoice.company_id,
+            kind='proportional'
+        )
+        if logo_result.loaded and logo_result.image:
+            try:
+                logo_result.image.drawOn(c, width - 60*mm, height - 50*mm)
+                logo_loaded = True
+            except Exception as e:
+                import logging
+                logger = logging.getLogger(__name__)
+                logger.warning(f"Could not load logo for invoice: {e}")
     
     # ========================================================================
     # EN-TÊTE : Titre et numéro
@@ -523,36 +510,23 @@ def generate_invoice_pdf(invoice: Invoice, client=None, company_info: Optional[d
     if design_config:
         signature_path = design_config.get("signature_path")
     
-    # Normaliser le chemin de la signature : enlever le préfixe "uploads" s'il existe déjà
     if signature_path:
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.info(f"[INVOICE PDF] Original signature_path: {signature_path}")
-        
-        normalized_path = signature_path
-        if normalized_path.startswith("uploads/"):
-            normalized_path = normalized_path[8:]  # Enlever "uploads/"
-        elif normalized_path.startswith("./uploads/"):
-            normalized_path = normalized_path[11:]  # Enlever "./uploads/"
-        
-        # Si signature_path est relatif, le rendre absolu depuis UPLOAD_DIR
-        upload_dir = Path(settings.UPLOAD_DIR).resolve()
-        if not Path(normalized_path).is_absolute():
-            signature_path = str((upload_dir / normalized_path).resolve())
-        else:
-            signature_path = str(Path(normalized_path).resolve())
-        
-        logger.info(f"[INVOICE PDF] Normalized signature_path: {signature_path}")
-    
-    if signature_path and Path(signature_path).exists():
-        try:
-            signature_img = Image(signature_path, width=70*mm, height=25*mm, kind='proportional')
-            signature_img.drawOn(c, margin, signature_y - 25*mm)
-            signature_y -= 30 * mm
-        except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.warning(f"Could not load signature for invoice: {e}")
+        signature_result = load_image_for_pdf(
+            image_path=signature_path,
+            width=70,
+            height=25,
+            upload_dir=Path(settings.UPLOAD_DIR).resolve(),
+            company_id=invoice.company_id,
+            kind='proportional'
+        )
+        if signature_result.loaded and signature_result.image:
+            try:
+                signature_result.image.drawOn(c, margin, signature_y - 25*mm)
+                signature_y -= 30 * mm
+            except Exception as e:
+                import logging
+                logger = logging.getLogger(__name__)
+                logger.warning(f"Could not load signature for invoice: {e}")
     
     # Label signature entreprise
     c.setFont("Helvetica", 9)
@@ -566,9 +540,14 @@ def generate_invoice_pdf(invoice: Invoice, client=None, company_info: Optional[d
     footer_y = 20 * mm
     c.setFont("Helvetica", 7)
     c.setFillColor(light_gray)
-    # Afficher "Avoir généré" pour les avoirs, "Facture générée" pour les factures
-    document_type = "Avoir généré" if invoice.invoice_type.value == "avoir" else "Facture générée"
-    c.drawString(margin, footer_y, f"{document_type} le {datetime.now().strftime('%d/%m/%Y à %H:%M')}")
+    # Date de dernière modification du document (fait partie de la clé du cache des PDF) plutôt
+    # que l'heure du rendu : un PDF servi depuis le cache affiche une date toujours exacte
+    edited_at = invoice.updated_at or invoice.created_at
+    if edited_at:
+        if edited_at.tzinfo is not None:
+            edited_at = edited_at.astimezone()
+        document_type = "Avoir mis à jour" if invoice.invoice_type.value == "avoir" else "Facture mise à jour"
+        c.drawString(margin, footer_y, f"{document_type} le {edited_at.strftime('%d/%m/%Y à %H:%M')}")
     
     # Finaliser le PDF
     c.save()
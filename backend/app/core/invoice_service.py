@@ -8,7 +8,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func, extract
 from app.db.models.billing import Invoice, InvoiceStatus, InvoiceType, InvoiceLine
 from app.core.numbering_service import (
-    get_numbering_config, format_document_number, parse_document_number, get_next_number
+    get_numbering_config, format_document_number, allocate_sequence_number, document_number_pattern
 )
 from app.db.models.company_settings import CompanySettings
 
@@ -143,8 +143,12 @@ def generate_invoice_number(db: Session, company_id: int, invoice_type: InvoiceT
     """
     Génère un numéro de facture séquentiel inviolable selon la configuration de l'entreprise.
     
-    Le numéro est généré de manière séquentielle pour chaque entreprise et chaque année,
-    sans rupture dans la séquence. Utilise la configuration personnalisable de numérotation si disponible.
+    Le numéro est attribué par la séquence de l'entreprise pour l'année et le type de document
+    (voir allocate_sequence_number), sans rupture dans la séquence : la facture doit être créée
+    dans la même transaction. Un numéro déjà porté par une facture de l'entreprise (émise hors
+    séquence : import, ancien format) est sauté, sans quoi l'insertion échouerait sur
+    uq_invoices_company_number à chaque tentative. Utilise la configuration personnalisable de
+    numérotation si disponible.
     
     Args:
         db: Session de base de données
@@ -164,76 +168,29 @@ def generate_invoice_number(db: Session, company_id: int, invoice_type: InvoiceT
     
     # Choisir le type de config selon le type de facture
     if invoice_type == InvoiceType.AVOIR:
-        config = get_numbering_config(company_settings, "credit_notes")
+        document_type = "credit_notes"
+        config = get_numbering_config(company_settings, document_type)
         suffix = config.get("suffix", "AVOIR")
     else:
-        config = get_numbering_config(company_settings, "invoices")
+        document_type = "invoices"
+        config = get_numbering_config(company_settings, document_type)
         suffix = None
     
-    # Construire le pattern pour chercher les numéros de cette année
-    prefix = config.get("prefix", "FAC")
-    separator = config.get("separator", "-")
-    year_format = config.get("year_format", "YYYY")
-    year_str = str(current_year) if year_format == "YYYY" else str(current_year)[-2:]
-    
-    pattern = f"{prefix}{separator}{year_str}{separator}%"
-    
-    # Récupérer tous les factures de cette année pour cette entreprise et ce type
-    invoices = db.query(Invoice).filter(
-        Invoice.company_id == company_id,
-        Invoice.invoice_type == invoice_type,
-        Invoice.deleted_at.is_(None),
-        Invoice.number.like(pattern)
-    ).all()
-    
-    invoice_numbers = [invoice.number for invoice in invoices]
-    
-    # Parser tous les numéros existants avec la config actuelle
-    parsed_numbers = []
-    for invoice_number in invoice_numbers:
-        parsed = parse_document_number(invoice_number, config)
-        if parsed is not None:
-            parsed_numbers.append(parsed)
-    
-    if parsed_numbers:
-        max_number = max(parsed_numbers)
-        start_number = config.get("start_number", 1)
-        next_number = get_next_number(max_number, start_number, parsed_numbers)
-    else:
-        # Aucune facture existante, utiliser le start_number
-        next_number = config.get("start_number", 1)
-    
-    # Boucle pour trouver un numéro disponible (gestion des race conditions)
-    max_attempts = 1000  # Limite de sécurité pour éviter les boucles infinies
-    attempt = 0
-    
-    while attempt < max_attempts:
-        # Générer le nouveau numéro avec la configuration
+    def existing_numbers():
+        pattern = document_number_pattern(current_year, config)
+        return [number for (number,) in db.query(Invoice.number).filter(
+            Invoice.company_id == company_id,
+            Invoice.invoice_type == invoice_type,
+            Invoice.number.like(pattern)
+        )]
+    
+    next_number = allocate_sequence_number(db, company_id, document_type, current_year, config, existing_numbers)
+    number = format_document_number(current_year, next_number, config, suffix=suffix)
+    while db.query(Invoice.id).filter(Invoice.company_id == company_id, Invoice.number == number).first() is not None:
+        next_number = allocate_sequence_number(
+            db, company_id, document_type, current_year, config, existing_numbers, at_least=next_number + 1
+        )
         number = format_document_number(current_year, next_number, config, suffix=suffix)
-        
-        # Vérifier l'unicité pour cette entreprise
-        existing = db.query(Invoice).filter(
-            Invoice.number == number,
-            Invoice.company_id == company_id
-        ).first()
-        
-        if not existing:
-            # Numéro disponible, on peut l'utiliser
-            return number
-        
-        # Numéro déjà utilisé, incrémenter et réessayer
-        next_number += 1
-        attempt += 1
-    
-    # Si on arrive ici, on a épuisé toutes les tentatives
-    # Générer un numéro avec timestamp pour éviter le conflit
-    timestamp = int(datetime.now().timestamp() * 1000) % 10000
-    # Utiliser le format par défaut en cas d'urgence
-    if invoice_type == InvoiceType.AVOIR:
-        number = f"{prefix}-{current_year}-{timestamp:04d}-{suffix}"
-    else:
-        number = f"{prefix}-{current_year}-{timestamp:04d}"
-    
     return number
 
 
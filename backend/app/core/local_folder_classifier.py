@@ -0,0 +1,292 @@
+"""
+Classifieur local des conversations dans les dossiers (avant l'appel IA).
+
+Pour chaque entreprise, un modèle "plus proche centroïde" est appris à partir des conversations
+déjà rangées (Conversation.folder_id) : chaque message est représenté par des n-grammes de mots
+(unigrammes + bigrammes du sujet et du contenu, chiffres ramenés à "0") et des jetons
+d'expéditeur (adresse, domaine), hachés dans un espace de 2^18 dimensions (vecteur creux,
+pondération log(1 + tf), norme L2). Le centroïde d'un dossier est la moyenne normalisée de ses
+exemples ; les conversations restées hors dossier forment une classe "aucun dossier".
+
+Un message est classé localement si sa similarité cosinus avec le meilleur centroïde atteint
+LOCAL_CLASSIFIER_MIN_SIMILARITY et dépasse le deuxième d'au moins LOCAL_CLASSIFIER_MIN_CONFIDENCE.
+Sinon (ou si la classe "aucun dossier" l'emporte), il part à l'IA : le coût OpenAI suit la
+nouveauté des messages plutôt que leur volume.
+
+Les modèles sont gardés en mémoire par processus et réappris quand les règles des dossiers
+changent (CompiledFolderRules.version) ou après LOCAL_CLASSIFIER_RETRAIN_SECONDS ; un seul
+apprentissage à la fois par entreprise, un échec n'est retenté qu'après
+LOCAL_CLASSIFIER_NEGATIVE_TTL_SECONDS. Seules les conversations rangées à la main servent
+d'exemples (pas celles classées automatiquement, ai_classified) : le modèle n'apprend pas
+de ses propres décisions.
+"""
+import logging
+import math
+import re
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+from sqlalchemy import func, select
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+HASH_DIMENSIONS = 1 << 18
+# Poids conservés par centroïde (les plus forts) pour borner la mémoire
+CENTROID_MAX_FEATURES = 5000
+# Classe des conversations restées hors dossier (garde-fou contre les faux positifs)
+NO_FOLDER = 0
+# Délai avant qu'une conversation hors dossier serve d'exemple "aucun dossier" (classification en cours)
+NO_FOLDER_MIN_AGE = timedelta(hours=1)
+# Contenu du premier message client lu pour l'apprentissage (tronqué en SQL)
+TRAINING_CONTENT_LENGTH = 500
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_DIGITS_RE = re.compile(r"\d+")
+
+SparseVector = Dict[int, float]
+
+
+def _bucket(feature: str) -> int:
+    return zlib.crc32(feature.encode("utf-8")) % HASH_DIMENSIONS
+
+
+def _normalize(vector: SparseVector) -> SparseVector:
+    norm = math.sqrt(sum(value * value for value in vector.values()))
+    if not norm:
+        return {}
+    return {index: value / norm for index, value in vector.items()}
+
+
+def featurize(subject: Optional[str], content: Optional[str], sender: Optional[str]) -> SparseVector:
+    """Vecteur creux normalisé (n-grammes hachés) d'un message."""
+    tokens = _TOKEN_RE.findall(_DIGITS_RE.sub("0", f"{subject or ''} {content or ''}".lower()))
+    counts: Dict[int, int] = {}
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    sender = (sender or "").strip().lower()
+    if sender:
+        features.append(f"from:{sender}")
+        if "@" in sender:
+            features.append(f"domain:{sender.rsplit('@', 1)[1]}")
+    for feature in features:
+        index = _bucket(feature)
+        counts[index] = counts.get(index, 0) + 1
+    return _normalize({index: 1.0 + math.log(count) for index, count in counts.items()})
+
+
+def _dot(vector: SparseVector, centroid: SparseVector) -> float:
+    return sum(value * centroid.get(index, 0.0) for index, value in vector.items())
+
+
+def _centroid(vectors: List[SparseVector]) -> SparseVector:
+    total: Dict[int, float] = {}
+    for vector in vectors:
+        for index, value in vector.items():
+            total[index] = total.get(index, 0.0) + value
+    if len(total) > CENTROID_MAX_FEATURES:
+        total = dict(sorted(total.items(), key=lambda item: item[1], reverse=True)[:CENTROID_MAX_FEATURES])
+    return _normalize(total)
+
+
+class LocalFolderModel:
+    """Centroïdes d'une entreprise : {folder_id (ou NO_FOLDER): vecteur creux normalisé}."""
+
+    def __init__(self, version: str, centroids: Dict[int, SparseVector], examples: Dict[int, int]):
+        self.version = version
+        self.centroids = centroids
+        self.examples = examples
+
+    def predict(self, vector: SparseVector) -> Tuple[Optional[int], float, float]:
+        """(classe la plus proche, similarité, écart avec la deuxième) ; (None, 0, 0) sans centroïde."""
+        if not vector or not self.centroids:
+            return None, 0.0, 0.0
+        scores = sorted(
+            ((_dot(vector, centroid), label) for label, centroid in self.centroids.items()),
+            reverse=True
+        )
+        best_score, best_label = scores[0]
+        runner_up = scores[1][0] if len(scores) > 1 else 0.0
+        return best_label, best_score, best_score - runner_up
+
+
+class LocalFolderClassifier:
+    """Modèles locaux par entreprise (appris à la demande) et compteurs par processus."""
+
+    def __init__(self, session_factory=None):
+        self._session_factory = session_factory
+        self._lock = threading.Lock()
+        self._models: Dict[int, Tuple[float, Optional[LocalFolderModel]]] = {}
+        self._training: Set[int] = set()
+        self._counters = {"predictions": 0, "local_hits": 0, "trainings": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return settings.LOCAL_CLASSIFIER_ENABLED
+
+    def _session(self):
+        if self._session_factory is None:
+            from app.db.session import SessionLocal
+            self._session_factory = SessionLocal
+        return self._session_factory()
+
+    def predict(self, company_id: Optional[int], rules, messages: List[Dict]) -> Dict[Hashable, int]:
+        """
+        `messages` : dicts conversation_id / subject / content / from_email / from_phone (format de
+        classify_messages_batch). Retourne {conversation_id: folder_id} des messages classés avec
+        une confiance suffisante ; les autres doivent partir à l'IA.
+        """
+        if not self.enabled or company_id is None or not messages or not rules.ai_folders:
+            return {}
+        model = self.get_model(company_id, rules)
+        if model is None:
+            return {}
+
+        results = {}
+        for msg_data in messages:
+            vector = featurize(
+                msg_data.get("subject"),
+                msg_data.get("content"),
+                msg_data.get("from_email") or msg_data.get("from_phone")
+            )
+            label, similarity, margin = model.predict(vector)
+            if (
+                label and label != NO_FOLDER
+                and similarity >= settings.LOCAL_CLASSIFIER_MIN_SIMILARITY
+                and margin >= settings.LOCAL_CLASSIFIER_MIN_CONFIDENCE
+            ):
+                results[msg_data.get("conversation_id")] = label
+
+        with self._lock:
+            self._counters["predictions"] += len(messages)
+            self._counters["local_hits"] += len(results)
+        return results
+
+    def get_model(self, company_id: int, rules) -> Optional[LocalFolderModel]:
+        """
+        Modèle de l'entreprise pour ces règles (appris si absent, périmé ou d'une autre version).
+        Pendant qu'un autre thread l'apprend, retourne le modèle précédent s'il est de la même
+        version, sinon None (messages envoyés à l'IA) : pas d'apprentissages concurrents.
+        """
+        now = time.monotonic()
+        with self._lock:
+            trained_at, model = self._models.get(company_id, (None, None))
+            if trained_at is not None:
+                if model is None:
+                    fresh = now - trained_at < settings.LOCAL_CLASSIFIER_NEGATIVE_TTL_SECONDS
+                else:
+                    fresh = now - trained_at < settings.LOCAL_CLASSIFIER_RETRAIN_SECONDS and model.version == rules.version
+                if fresh:
+                    return model
+            if company_id in self._training:
+                return model if model is not None and model.version == rules.version else None
+            self._training.add(company_id)
+
+        try:
+            try:
+                model = self.train(company_id, rules)
+            except Exception as e:
+                logger.warning(f"[LOCAL CLASSIFIER] Apprentissage impossible pour l'entreprise {company_id}: {e}")
+                model = None
+            with self._lock:
+                self._models[company_id] = (time.monotonic(), model)
+                self._counters["trainings"] += 1
+        finally:
+            with self._lock:
+                self._training.discard(company_id)
+        return model
+
+    def train(self, company_id: int, rules) -> Optional[LocalFolderModel]:
+        """
+        Apprend les centroïdes à partir des conversations rangées à la main (None si pas assez
+        d'exemples). Un exemple = premier message client de la conversation, tronqué.
+        """
+        from app.db.models.conversation import Conversation, InboxMessage
+
+        folder_ids = [folder["id"] for folder in rules.ai_folders]
+        max_examples = settings.LOCAL_CLASSIFIER_MAX_EXAMPLES
+        db = self._session()
+        try:
+            # Conversations les plus récentes de chaque dossier, puis hors dossier (classe "aucun")
+            labelled: Dict[int, List] = {}
+            for folder_id in folder_ids:
+                labelled[folder_id] = db.query(Conversation.id, Conversation.subject, Conversation.source).filter(
+                    Conversation.company_id == company_id,
+                    Conversation.folder_id == folder_id,
+                    Conversation.ai_classified == False
+                ).order_by(Conversation.id.desc()).limit(max_examples).all()
+            labelled[NO_FOLDER] = db.query(Conversation.id, Conversation.subject, Conversation.source).filter(
+                Conversation.company_id == company_id,
+                Conversation.folder_id.is_(None),
+                Conversation.created_at < datetime.utcnow() - NO_FOLDER_MIN_AGE
+            ).order_by(Conversation.id.desc()).limit(max_examples).all()
+
+            # Premier message client de chaque conversation (ROW_NUMBER, comme load_page_messages) :
+            # une ligne par conversation, contenu tronqué par la base
+            conversation_ids = [row.id for rows in labelled.values() for row in rows]
+            first_messages = {}
+            for i in range(0, len(conversation_ids), 500):
+                ranked = select(
+                    InboxMessage.conversation_id,
+                    func.substr(InboxMessage.content, 1, TRAINING_CONTENT_LENGTH).label("content"),
+                    InboxMessage.from_email,
+                    InboxMessage.from_phone,
+                    func.row_number().over(
+                        partition_by=InboxMessage.conversation_id,
+                        order_by=(InboxMessage.created_at.asc(), InboxMessage.id.asc())
+                    ).label("rank"),
+                ).where(
+                    InboxMessage.conversation_id.in_(conversation_ids[i:i + 500]),
+                    InboxMessage.is_from_client == True
+                ).subquery()
+                for message in db.execute(select(ranked).where(ranked.c.rank == 1)).all():
+                    first_messages[message.conversation_id] = message
+        finally:
+            db.close()
+
+        centroids, examples = {}, {}
+        for label, rows in labelled.items():
+            vectors = []
+            for row in rows:
+                message = first_messages.get(row.id)
+                if not message:
+                    continue
+                vector = featurize(
+                    row.subject if row.source == "email" else "",
+                    message.content,
+                    message.from_email or message.from_phone
+                )
+                if vector:
+                    vectors.append(vector)
+            if len(vectors) >= settings.LOCAL_CLASSIFIER_MIN_EXAMPLES:
+                centroids[label] = _centroid(vectors)
+                examples[label] = len(vectors)
+
+        if not any(label != NO_FOLDER for label in centroids):
+            return None
+        logger.info(
+            f"[LOCAL CLASSIFIER] Modèle appris pour l'entreprise {company_id}: "
+            f"{len([label for label in centroids if label != NO_FOLDER])} dossier(s), {sum(examples.values())} exemple(s)"
+        )
+        return LocalFolderModel(rules.version, centroids, examples)
+
+    def invalidate(self, company_id: Optional[int] = None) -> None:
+        """Oublie le modèle d'une entreprise (ou de toutes) : réapprentissage au prochain appel."""
+        with self._lock:
+            if company_id is None:
+                self._models.clear()
+            else:
+                self._models.pop(company_id, None)
+
+    def stats(self) -> Dict:
+        """Compteurs du processus : messages évalués, classés localement, apprentissages."""
+        with self._lock:
+            counters = dict(self._counters)
+        counters["local_hit_rate"] = (
+            round(counters["local_hits"] / counters["predictions"], 4) if counters["predictions"] else 0.0
+        )
+        return counters
+
+
+local_folder_classifier = LocalFolderClassifier()
@@ -1,9 +1,24 @@
 """
 Service pour la génération et le formatage de numéros de documents (devis, factures, avoirs).
 Gère la configuration personnalisable de la numérotation.
+
+Les numéros séquentiels sont attribués par une table de séquences (document_sequences) :
+une ligne par entreprise, type de document, année et version du format, incrémentée par un
+UPDATE ... RETURNING qui verrouille la ligne jusqu'au commit. Deux créations simultanées sont
+sérialisées sur cette ligne au lieu de se disputer le même numéro, et un rollback rend le
+numéro (numérotation continue, sans trou). Le coût ne dépend plus du nombre de documents émis :
+les numéros existants ne sont lus qu'une fois, à l'ouverture d'une séquence.
 """
-from typing import Dict, Any, Optional
+import hashlib
+import json
+from typing import Dict, Any, Callable, Iterable, Optional
 from datetime import datetime
+from sqlalchemy import and_, case, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
+from app.db.models.document_sequence import DocumentSequence
 
 
 def get_numbering_config(company_settings: Optional[Dict[str, Any]], document_type: str) -> Dict[str, Any]:
@@ -160,3 +175,90 @@ def get_next_number(
     
     return next_number
 
+
+
+def document_number_pattern(year: int, config: Dict[str, Any]) -> str:
+    """Motif LIKE des numéros d'une année selon la configuration (ex: "DEV-2025-%")."""
+    prefix = config.get("prefix", "DEV")
+    separator = config.get("separator", "-")
+    year_str = str(year)[-2:] if config.get("year_format", "YYYY") == "YY" else str(year)
+    return f"{prefix}{separator}{year_str}{separator}%"
+
+
+def numbering_config_version(config: Dict[str, Any]) -> str:
+    """
+    Empreinte des éléments du format qui délimitent une séquence (préfixe, séparateur, format
+    d'année, suffixe). Le padding et le numéro de départ n'en font pas partie.
+    """
+    key = [config.get("prefix"), config.get("separator"), config.get("year_format"), config.get("suffix")]
+    return hashlib.sha256(json.dumps(key).encode("utf-8")).hexdigest()[:32]
+
+
+def _increment_sequence(connection, statement, scope) -> Optional[int]:
+    """Exécute l'incrément et retourne la nouvelle valeur (None si la séquence n'existe pas encore)."""
+    table = DocumentSequence.__table__
+    if connection.dialect.update_returning:
+        return connection.execute(statement.returning(table.c.last_value)).scalar()
+    if not connection.execute(statement).rowcount:
+        return None
+    return connection.execute(select(table.c.last_value).where(scope)).scalar()
+
+
+def allocate_sequence_number(
+    db: Session,
+    company_id: int,
+    document_type: str,
+    year: int,
+    config: Dict[str, Any],
+    existing_numbers: Callable[[], Iterable[str]],
+    at_least: Optional[int] = None
+) -> int:
+    """
+    Attribue le prochain numéro séquentiel d'une séquence, dans la transaction de l'appelant.
+    
+    La ligne de la séquence reste verrouillée jusqu'au commit (ou au rollback, qui rend le numéro) :
+    le document doit être créé dans la même transaction.
+    
+    Args:
+        db: Session de base de données
+        company_id: ID de l'entreprise
+        document_type: Type de document ("quotes", "invoices", "credit_notes")
+        year: Année de la séquence
+        config: Configuration de numérotation
+        existing_numbers: Numéros déjà émis correspondant à document_number_pattern (appelé
+            seulement à l'ouverture de la séquence, pour repartir du plus grand)
+        at_least: Numéro minimal à attribuer (ex: après un conflit avec un numéro existant)
+        
+    Returns:
+        Numéro séquentiel attribué
+    """
+    table = DocumentSequence.__table__
+    version = numbering_config_version(config)
+    scope = and_(
+        table.c.company_id == company_id,
+        table.c.doc_type == document_type,
+        table.c.year == year,
+        table.c.config_version == version
+    )
+    # Respecter le numéro de départ configuré (get_next_number) et le minimum demandé
+    floor = max(config.get("start_number", 1), at_least or 0)
+    following = table.c.last_value + 1
+    statement = table.update().where(scope).values(
+        last_value=case((following < floor, floor), else_=following),
+        updated_at=func.now()
+    )
+
+    connection = db.connection()
+    value = _increment_sequence(connection, statement, scope)
+    if value is None:
+        # Ouverture de la séquence : repartir du plus grand numéro déjà émis pour ce format
+        parsed = [number for number in (parse_document_number(n, config) for n in existing_numbers()) if number is not None]
+        insert = pg_insert if connection.dialect.name == "postgresql" else sqlite_insert
+        connection.execute(
+            insert(table).values(
+                company_id=company_id, doc_type=document_type, year=year,
+                config_version=version, last_value=max(parsed, default=0)
+            ).on_conflict_do_nothing(index_elements=["company_id", "doc_type", "year", "config_version"])
+        )
+        value = _increment_sequence(connection, statement, scope)
+    return value
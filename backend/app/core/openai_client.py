@@ -0,0 +1,183 @@
+"""
+Client OpenAI asynchrone partagé, avec limitation de débit par seaux à jetons.
+
+Remplace l'ancien verrou global (openai_throttle) qui sérialisait tous les appels du processus
+et bloquait l'event loop avec time.sleep :
+- deux seaux : requêtes par minute (OPENAI_RPM_LIMIT) et tokens par minute (OPENAI_TPM_LIMIT) ;
+  la consommation de tokens est estimée avant l'appel puis corrigée avec l'usage réel ;
+- backend des seaux interchangeable : "memory" (par processus) ou "database" (table
+  rate_limit_buckets, partagée entre les workers) ;
+- les appels AsyncOpenAI s'exécutent sur un event loop dédié (thread "openai-loop") : les
+  routes async attendent sans bloquer leur loop, le code synchrone (threads de sync, scripts)
+  attend le résultat dans son propre thread. Les requêtes se chevauchent dans la limite des seaux.
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+RPM_BUCKET_KEY = "openai:rpm"
+TPM_BUCKET_KEY = "openai:tpm"
+
+
+class MemoryBucketBackend:
+    """Seaux à jetons en mémoire (un jeu de seaux par processus)."""
+
+    blocking = False
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, List[float]] = {}
+
+    def consume(self, key: str, amount: float, capacity: float, refill_per_second: float) -> float:
+        """
+        Retire `amount` jetons si disponibles et retourne 0, sinon retourne le délai d'attente (s).
+        Un `amount` négatif rend des jetons (dans la limite de la capacité).
+        """
+        with self._lock:
+            now = self._clock()
+            tokens, refilled_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - refilled_at) * refill_per_second)
+            if amount <= tokens:
+                self._buckets[key] = [min(capacity, tokens - amount), now]
+                return 0.0
+            self._buckets[key] = [tokens, now]
+            return (amount - tokens) / refill_per_second
+
+
+class DatabaseBucketBackend:
+    """Seaux à jetons en base (SELECT ... FOR UPDATE), partagés entre tous les workers."""
+
+    blocking = True
+
+    def __init__(self, session_factory=None):
+        if session_factory is None:
+            from app.db.session import SessionLocal
+            session_factory = SessionLocal
+        self._session_factory = session_factory
+
+    def consume(self, key: str, amount: float, capacity: float, refill_per_second: float) -> float:
+        from sqlalchemy.exc import IntegrityError
+        from app.db.models.rate_limit import RateLimitBucket
+
+        db = self._session_factory()
+        try:
+            now = time.time()
+            bucket = db.query(RateLimitBucket).filter(RateLimitBucket.key == key).with_for_update().first()
+            if bucket is None:
+                bucket = RateLimitBucket(key=key, tokens=capacity, refilled_at=now)
+                db.add(bucket)
+                try:
+                    db.flush()
+                except IntegrityError:
+                    # Créé en parallèle par un autre worker
+                    db.rollback()
+                    return self.consume(key, amount, capacity, refill_per_second)
+            tokens = min(capacity, bucket.tokens + max(0.0, now - bucket.refilled_at) * refill_per_second)
+            wait = 0.0
+            if amount <= tokens:
+                tokens = min(capacity, tokens - amount)
+            else:
+                wait = (amount - tokens) / refill_per_second
+            bucket.tokens = tokens
+            bucket.refilled_at = now
+            db.commit()
+            return wait
+        finally:
+            db.close()
+
+
+class OpenAIRateLimiter:
+    """Limiteur RPM + TPM au-dessus d'un backend de seaux à jetons."""
+
+    def __init__(self, backend, rpm: int, tpm: int):
+        self.backend = backend
+        self.rpm = max(1, rpm)
+        self.tpm = max(1, tpm)
+
+    async def _consume(self, key: str, amount: float, capacity: float) -> float:
+        refill_per_second = capacity / 60.0
+        if self.backend.blocking:
+            return await asyncio.to_thread(self.backend.consume, key, amount, capacity, refill_per_second)
+        return self.backend.consume(key, amount, capacity, refill_per_second)
+
+    async def _acquire_bucket(self, key: str, amount: float, capacity: float) -> None:
+        # Une demande plus grosse que le seau attendrait indéfiniment : plafonnée à la capacité
+        amount = min(amount, capacity)
+        while True:
+            wait = await self._consume(key, amount, capacity)
+            if wait <= 0:
+                return
+            logger.debug(f"[AI LIMITER] Attente de {wait:.2f}s ({key})")
+            await asyncio.sleep(wait)
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        """Attend (sans bloquer l'event loop) une requête et `estimated_tokens` tokens disponibles."""
+        await self._acquire_bucket(RPM_BUCKET_KEY, 1, self.rpm)
+        await self._acquire_bucket(TPM_BUCKET_KEY, estimated_tokens, self.tpm)
+
+    async def reconcile(self, estimated_tokens: int, actual_tokens: Optional[int]) -> None:
+        """Corrige le seau TPM avec l'usage réel (rend les tokens surestimés, retire le dépassement)."""
+        if actual_tokens is None or actual_tokens == estimated_tokens:
+            return
+        await self._consume(TPM_BUCKET_KEY, actual_tokens - estimated_tokens, self.tpm)
+
+
+def estimate_tokens(messages: List[Dict[str, Any]], max_tokens: Optional[int]) -> int:
+    """Estimation grossière avant l'appel : ~4 caractères par token + réponse maximale."""
+    prompt_chars = sum(len(str(message.get("content") or "")) for message in messages)
+    return prompt_chars // 4 + len(messages) * 4 + (max_tokens or 256)
+
+
+def _build_backend():
+    if (settings.OPENAI_RATE_LIMIT_BACKEND or "memory").lower() == "database":
+        return DatabaseBucketBackend()
+    return MemoryBucketBackend()
+
+
+rate_limiter = OpenAIRateLimiter(_build_backend(), settings.OPENAI_RPM_LIMIT, settings.OPENAI_TPM_LIMIT)
+
+# Event loop dédié aux appels OpenAI (les clients AsyncOpenAI y sont utilisés exclusivement)
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="openai-loop", daemon=True).start()
+        return _loop
+
+
+async def _create_chat_completion(client, params: Dict[str, Any]):
+    estimated = estimate_tokens(params.get("messages") or [], params.get("max_tokens"))
+    await rate_limiter.acquire(estimated)
+    response = await client.chat.completions.create(**params)
+    usage = getattr(response, "usage", None)
+    await rate_limiter.reconcile(estimated, getattr(usage, "total_tokens", None))
+    return response
+
+
+async def create_chat_completion(client, **params):
+    """
+    Appel chat.completions.create limité (RPM/TPM) pour un client AsyncOpenAI.
+    À attendre depuis n'importe quel event loop : l'appel s'exécute sur le loop OpenAI dédié.
+    """
+    future = asyncio.run_coroutine_threadsafe(_create_chat_completion(client, params), _get_loop())
+    return await asyncio.wrap_future(future)
+
+
+def create_chat_completion_sync(client, **params):
+    """
+    Version bloquante de create_chat_completion pour le code synchrone (threads de sync, scripts).
+    Ne bloque que le thread appelant ; ne pas appeler depuis une coroutine (utiliser create_chat_completion).
+    """
+    future = asyncio.run_coroutine_threadsafe(_create_chat_completion(client, params), _get_loop())
+    return future.result()
@@ -0,0 +1,343 @@
+"""
+Cache des PDF rendus (devis, factures), adressé par le contenu.
+
+La clé est l'empreinte de tout ce qui détermine le rendu : colonnes du document, de ses lignes
+et du client, paramètres de l'entreprise, configuration de design, empreinte des images
+(logo, signatures) et version du code de rendu. Toute modification produit une nouvelle clé :
+aucune invalidation explicite, les anciennes entrées sortent par éviction LRU.
+
+- Disque local (PDF_CACHE_DIR) borné à PDF_CACHE_MAX_BYTES : la date de modification sert de
+  date de dernier accès, les fichiers les plus anciens sont supprimés au dépassement.
+- Supabase Storage (si configuré, dossier pdf_cache/) borné à PDF_CACHE_REMOTE_MAX_BYTES :
+  survit aux redéploiements ; lecture en cas d'absence locale, écriture et éviction en arrière-plan.
+- La clé sert d'ETag : un If-None-Match identique est servi en 304 sans lire le cache.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from fastapi import Request, Response
+from sqlalchemy import inspect
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+REMOTE_FOLDER = "pdf_cache"
+# Éviction distante (listing du dossier) toutes les N écritures
+REMOTE_EVICT_EVERY = 50
+# Après éviction, le cache redescend à cette fraction de sa taille maximale
+EVICT_TARGET_RATIO = 0.9
+# Modules dont le code détermine le rendu (leur modification invalide tout le cache)
+_RENDERER_MODULES = ("quote_pdf_service.py", "invoice_pdf_service.py", "pdf_image_loader.py")
+
+
+def _renderer_version() -> str:
+    digest = hashlib.sha256()
+    for name in _RENDERER_MODULES:
+        try:
+            digest.update((Path(__file__).parent / name).read_bytes())
+        except OSError:
+            digest.update(name.encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+RENDERER_VERSION = _renderer_version()
+
+# Empreintes des images locales : (chemin absolu, mtime, taille) -> sha256
+_image_digests: Dict[Tuple[str, int, int], str] = {}
+_image_digests_lock = threading.Lock()
+
+
+def image_digest(image_path: Optional[str]) -> Optional[str]:
+    """
+    Empreinte d'une image référencée par un document : contenu du fichier local (mémorisé tant
+    que le fichier ne change pas), sinon son chemin (fichiers Supabase à nom unique).
+    """
+    if not image_path:
+        return None
+    from app.core.pdf_image_loader import normalize_image_path
+
+    normalized, absolute = normalize_image_path(image_path, Path(settings.UPLOAD_DIR).resolve())
+    try:
+        stat = os.stat(absolute)
+    except OSError:
+        return f"path:{normalized}"
+    key = (absolute, stat.st_mtime_ns, stat.st_size)
+    with _image_digests_lock:
+        digest = _image_digests.get(key)
+    if digest is None:
+        try:
+            digest = hashlib.sha256(Path(absolute).read_bytes()).hexdigest()
+        except OSError:
+            return f"path:{normalized}"
+        with _image_digests_lock:
+            _image_digests[key] = digest
+    return digest
+
+
+def model_snapshot(instance) -> Optional[Dict[str, Any]]:
+    """Valeurs des colonnes d'un objet ORM (None si absent)."""
+    if instance is None:
+        return None
+    return {attr.key: getattr(instance, attr.key) for attr in inspect(instance).mapper.column_attrs}
+
+
+def pdf_cache_key(kind: str, content: Any, images: Iterable[Optional[str]] = ()) -> str:
+    """Clé du PDF : empreinte du contenu (sérialisable en JSON), des images et du code de rendu."""
+    payload = {
+        "kind": kind,
+        "renderer": RENDERER_VERSION,
+        "content": content,
+        "images": [image_digest(path) for path in images],
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def quote_pdf_cache_key(
+    quote,
+    client,
+    company,
+    company_settings_data: Optional[Dict[str, Any]],
+    design_config: Dict[str, Any],
+    client_signature_path: Optional[str]
+) -> str:
+    """Clé du PDF d'un devis : tout ce que lit le rendu."""
+    return pdf_cache_key(
+        "quote",
+        {
+            "quote": model_snapshot(quote),
+            "lines": [model_snapshot(line) for line in quote.lines],
+            "client": model_snapshot(client),
+            "company": model_snapshot(company),
+            "settings": company_settings_data,
+            "design": design_config,
+            "client_signature_path": client_signature_path,
+        },
+        images=[design_config.get("logo_path"), design_config.get("signature_path"), client_signature_path]
+    )
+
+
+def invoice_pdf_cache_key(
+    invoice,
+    client,
+    company_info: Dict[str, Any],
+    design_config: Dict[str, Any],
+    quote=None
+) -> str:
+    """Clé du PDF d'une facture ou d'un avoir : tout ce que lit le rendu."""
+    return pdf_cache_key(
+        "invoice",
+        {
+            "invoice": model_snapshot(invoice),
+            "lines": [model_snapshot(line) for line in invoice.lines],
+            "client": model_snapshot(client),
+            "company": model_snapshot(invoice.company),
+            "company_info": company_info,
+            "design": design_config,
+            "quote": model_snapshot(quote),
+        },
+        images=[design_config.get("logo_path"), design_config.get("signature_path")]
+    )
+
+
+class PdfCache:
+    """Cache LRU borné des PDF sur disque, doublé de Supabase Storage si configuré."""
+
+    def __init__(self, directory: Path, max_bytes: int, remote_max_bytes: int = 0):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.remote_max_bytes = remote_max_bytes
+        self._size: Optional[int] = None  # Taille du cache disque, calculée au premier ajout
+        self._lock = threading.Lock()
+        self._remote_writes = 0
+        self._remote_executor: Optional[ThreadPoolExecutor] = None
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.pdf"
+
+    def _remote_enabled(self) -> bool:
+        from app.core.supabase_storage_service import is_supabase_storage_configured
+        return self.remote_max_bytes > 0 and is_supabase_storage_configured()
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)  # Dernier accès (ordre LRU)
+            return data
+        except OSError:
+            pass
+        if self._remote_enabled():
+            from app.core.supabase_storage_service import download_file
+            data = download_file(f"{REMOTE_FOLDER}/{key}.pdf")
+            if data:
+                self._store_local(key, data)
+                return data
+        return None
+
+    def put(self, key: str, data: bytes) -> None:
+        self._store_local(key, data)
+        if self._remote_enabled():
+            with self._lock:
+                if self._remote_executor is None:
+                    self._remote_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf-cache-upload")
+                executor = self._remote_executor
+            executor.submit(self._store_remote, key, data)
+
+    def _store_local(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"[PDF CACHE] Écriture impossible ({path}): {e}")
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._scan())
+            else:
+                self._size += len(data)
+            over = self._size > self.max_bytes
+        if over:
+            self._evict_local()
+
+    def _scan(self):
+        """[(chemin, taille, date de dernier accès)] des PDF du cache disque."""
+        entries = []
+        for path in self.directory.glob("*/*.pdf"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _evict_local(self) -> None:
+        with self._lock:
+            entries = sorted(self._scan(), key=lambda entry: entry[2])
+            total = sum(size for _, size, _ in entries)
+            target = self.max_bytes * EVICT_TARGET_RATIO
+            for path, size, _ in entries:
+                if total <= target:
+                    break
+                try:
+                    path.unlink()
+                    total -= size
+                except OSError:
+                    pass
+            self._size = total
+
+    def _store_remote(self, key: str, data: bytes) -> None:
+        from app.core.supabase_storage_service import upload_file
+        try:
+            upload_file(f"{REMOTE_FOLDER}/{key}.pdf", data, content_type="application/pdf")
+            with self._lock:
+                self._remote_writes += 1
+                evict = self._remote_writes % REMOTE_EVICT_EVERY == 0
+            if evict:
+                self._evict_remote()
+        except Exception as e:
+            logger.warning(f"[PDF CACHE] Écriture Supabase impossible ({key}): {e}")
+
+    def _evict_remote(self) -> None:
+        from app.core.supabase_storage_service import delete_files, list_files
+
+        def last_used(item):
+            return item.get("last_accessed_at") or item.get("updated_at") or item.get("created_at") or ""
+
+        items = sorted(list_files(REMOTE_FOLDER, limit=10000), key=last_used)
+        sizes = [((item.get("metadata") or {}).get("size") or 0) for item in items]
+        total = sum(sizes)
+        if total <= self.remote_max_bytes:
+            return
+        target = self.remote_max_bytes * EVICT_TARGET_RATIO
+        to_delete = []
+        for item, size in zip(items, sizes):
+            if total <= target:
+                break
+            to_delete.append(f"{REMOTE_FOLDER}/{item['name']}")
+            total -= size
+        if to_delete:
+            delete_files(to_delete)
+            logger.info(f"[PDF CACHE] {len(to_delete)} PDF supprimé(s) de Supabase Storage (LRU)")
+
+
+_pdf_cache: Optional[PdfCache] = None
+
+
+def get_pdf_cache() -> PdfCache:
+    global _pdf_cache
+    if _pdf_cache is None:
+        directory = settings.PDF_CACHE_DIR or str(Path(settings.UPLOAD_DIR) / "pdf_cache")
+        _pdf_cache = PdfCache(Path(directory), settings.PDF_CACHE_MAX_BYTES, settings.PDF_CACHE_REMOTE_MAX_BYTES)
+    return _pdf_cache
+
+
+def render_to_bytes(render_to_path: Callable[[str], Any]) -> bytes:
+    """Exécute un rendu qui écrit dans un fichier (generate_quote_pdf) et retourne son contenu, sans laisser de fichier."""
+    fd, tmp_path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    try:
+        render_to_path(tmp_path)
+        return Path(tmp_path).read_bytes()
+    finally:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
+def _etag_matches(request: Optional[Request], etag: str) -> bool:
+    if request is None:
+        return False
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = {value.strip().removeprefix("W/") for value in header.split(",")}
+    return etag in candidates or "*" in candidates
+
+
+def cached_pdf_response(
+    request: Optional[Request],
+    key: str,
+    render: Callable[[], bytes],
+    filename: str,
+    cache: Optional[PdfCache] = None
+) -> Response:
+    """
+    Réponse PDF servie depuis le cache (rendu et mise en cache en cas d'absence), avec ETag ;
+    304 si le client a déjà cette version. À appeler depuis une route synchrone (threadpool) :
+    lectures du cache et attente du rendu bloquent le thread, pas la boucle d'évènements.
+    Les erreurs de rendu sont propagées.
+    """
+    etag = f'"{key}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, no-cache",  # Revalidation à chaque ouverture (If-None-Match)
+        "Content-Disposition": f'inline; filename="{filename}"',
+    }
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": headers["Cache-Control"]})
+
+    if not settings.PDF_CACHE_ENABLED:
+        return Response(content=render(), media_type="application/pdf", headers=headers)
+    cache = cache or get_pdf_cache()
+    pdf_bytes = cache.get(key)
+    if pdf_bytes is None:
+        pdf_bytes = render()
+        if pdf_bytes:
+            cache.put(key, pdf_bytes)
+    else:
+        logger.debug(f"[PDF CACHE] {filename} servi depuis le cache")
+    return Response(content=pdf_bytes, media_type="application/pdf", headers=headers)
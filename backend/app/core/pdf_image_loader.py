@@ -1,23 +1,45 @@
 """
 Utilitaire centralisé pour charger les images (logos, signatures) pour la génération de PDFs.
 Gère automatiquement le stockage local et Supabase Storage avec une gestion d'erreur robuste.
+
+Les images sont conservées en mémoire (BrandingAssetCache), déjà décodées et redimensionnées à
+la taille d'affichage : clé (empreinte du contenu, taille), index par chemin et par entreprise,
+taille totale bornée par PDF_ASSET_CACHE_MAX_BYTES (éviction LRU). ReportLab les lit depuis la
+mémoire (BytesIO) : ni téléchargement Supabase ni fichier temporaire à chaque rendu.
+Un fichier local modifié est détecté (date de modification, taille). Les uploads de logo et de
+signature invalident les images de l'entreprise (invalidate_company_assets) : cache du processus
+vidé et marqueur UPLOAD_DIR/<company_id>/.assets_version réécrit. Les images Supabase sont
+validées contre ce marqueur à chaque lecture du cache (un os.stat) : les processus du pool de
+rendu, qui ne voient pas l'invalidation en mémoire, ne servent pas une ancienne version.
 """
+import hashlib
+import io
 import logging
+import math
 import os
+import threading
 import uuid
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Any, Dict, Optional, Tuple
 from reportlab.platypus import Image
 from reportlab.lib.units import mm
 
+from app.core.config import settings
+
 logger = logging.getLogger(__name__)
 
+# Résolution des images redimensionnées (points par pouce à la taille d'affichage)
+ASSET_DPI = 300
+REMOTE_STAMP = "supabase"
+# Marqueur de version des images d'une entreprise (réécrit à chaque invalidation)
+ASSETS_VERSION_FILE = ".assets_version"
+
 
 class ImageLoadResult:
     """Résultat du chargement d'une image."""
-    def __init__(self, image: Optional[Image] = None, temp_file_path: Optional[Path] = None, loaded: bool = False):
+    def __init__(self, image: Optional[Image] = None, loaded: bool = False):
         self.image = image
-        self.temp_file_path = temp_file_path  # Fichier temporaire créé (à nettoyer plus tard)
         self.loaded = loaded
 
 
@@ -61,22 +83,167 @@ def normalize_image_path(image_path: str, upload_dir: Path) -> Tuple[str, str]:
     return normalized, absolute_path
 
 
+def _company_of(normalized_path: str, company_id: Optional[int]) -> Optional[int]:
+    """Entreprise propriétaire d'une image (argument, sinon préfixe "company_id/" du chemin)."""
+    if company_id or "/" not in normalized_path:
+        return company_id
+    try:
+        return int(normalized_path.split("/")[0])
+    except ValueError:
+        return None
+
+
+def prepare_image_bytes(content: bytes, width: float, height: float) -> bytes:
+    """
+    Image réduite à sa boîte d'affichage (width x height en mm, à ASSET_DPI), proportions
+    conservées ; PNG si transparence, sinon JPEG. Contenu d'origine si Pillow échoue.
+    """
+    try:
+        from PIL import Image as PILImage
+
+        with PILImage.open(io.BytesIO(content)) as source:
+            source.load()
+            box = (math.ceil(width / 25.4 * ASSET_DPI), math.ceil(height / 25.4 * ASSET_DPI))
+            if source.width <= box[0] and source.height <= box[1] and source.format in ("PNG", "JPEG"):
+                return content
+            image = source.copy()
+        image.thumbnail(box, PILImage.Resampling.LANCZOS)
+        output = io.BytesIO()
+        if image.mode in ("RGBA", "LA", "P"):
+            image.save(output, format="PNG", optimize=True)
+        else:
+            image.convert("RGB").save(output, format="JPEG", quality=90)
+        return output.getvalue()
+    except Exception as e:
+        logger.warning(f"[IMAGE LOADER] ⚠️ Image not resized, using original content: {e}")
+        return content
+
+
+class BrandingAssetCache:
+    """Images de marque prêtes pour ReportLab, en mémoire, bornées en taille (LRU)."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        # Chemin normalisé -> (entreprise, tampon du fichier source, empreinte du contenu)
+        self._sources: Dict[str, Tuple[Optional[int], Any, str]] = {}
+        # (empreinte, largeur mm, hauteur mm) -> octets de l'image redimensionnée
+        self._images: "OrderedDict[Tuple[str, float, float], bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def lookup(self, normalized_path: str, stamp: Any, width: float, height: float) -> Optional[bytes]:
+        """Image en cache si la source n'a pas changé (même tampon)."""
+        with self._lock:
+            source = self._sources.get(normalized_path)
+            if source is None or source[1] != stamp:
+                return None
+            key = (source[2], width, height)
+            data = self._images.get(key)
+            if data is not None:
+                self._images.move_to_end(key)
+            return data
+
+    def store(
+        self,
+        normalized_path: str,
+        company_id: Optional[int],
+        stamp: Any,
+        content: bytes,
+        width: float,
+        height: float
+    ) -> bytes:
+        """Redimensionne le contenu source, le met en cache et retourne l'image prête."""
+        digest = hashlib.sha256(content).hexdigest()
+        key = (digest, width, height)
+        with self._lock:
+            self._sources[normalized_path] = (company_id, stamp, digest)
+            data = self._images.get(key)
+            if data is not None:
+                self._images.move_to_end(key)
+                return data
+        data = prepare_image_bytes(content, width, height)
+        if len(data) > self.max_bytes:
+            return data
+        with self._lock:
+            if key not in self._images:
+                self._images[key] = data
+                self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self._size -= len(evicted)
+        return data
+
+    def invalidate_company(self, company_id: int) -> None:
+        """Oublie les images d'une entreprise (nouveau logo, nouvelle signature)."""
+        with self._lock:
+            paths = [path for path, source in self._sources.items() if source[0] == company_id]
+            digests = {self._sources.pop(path)[2] for path in paths}
+            for key in [key for key in self._images if key[0] in digests]:
+                self._size -= len(self._images.pop(key))
+
+
+branding_asset_cache = BrandingAssetCache(settings.PDF_ASSET_CACHE_MAX_BYTES)
+
+
+def _assets_version_path(upload_dir: Path, company_id: int) -> Path:
+    return Path(upload_dir) / str(company_id) / ASSETS_VERSION_FILE
+
+
+def invalidate_company_assets(company_id: int, upload_dir: Optional[Path] = None) -> None:
+    """
+    Nouveau logo ou nouvelle signature : vide le cache de ce processus et réécrit le marqueur
+    de version lu par les autres processus (pool de rendu) avant de servir une image Supabase.
+    """
+    branding_asset_cache.invalidate_company(company_id)
+    marker = _assets_version_path(upload_dir or Path(settings.UPLOAD_DIR).resolve(), company_id)
+    try:
+        marker.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = marker.with_name(f"{ASSETS_VERSION_FILE}.{uuid.uuid4().hex}.tmp")
+        tmp_path.write_text(uuid.uuid4().hex)
+        os.replace(tmp_path, marker)
+    except OSError as e:
+        logger.warning(f"[IMAGE LOADER] ⚠️ Assets version marker not written for company {company_id}: {e}")
+
+
+def _remote_stamp(upload_dir: Path, company_id: Optional[int]) -> Tuple[str, Optional[Tuple[int, int]]]:
+    """Tampon d'une image Supabase : version des images de l'entreprise (inode et date du marqueur)."""
+    if company_id is None:
+        return (REMOTE_STAMP, None)
+    try:
+        stat = os.stat(_assets_version_path(upload_dir, company_id))
+    except OSError:
+        return (REMOTE_STAMP, None)
+    return (REMOTE_STAMP, (stat.st_ino, stat.st_mtime_ns))
+
+
+def _local_stamp(absolute_path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(absolute_path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
 def load_image_for_pdf(
     image_path: Optional[str],
     width: float,
     height: float,
     upload_dir: Path,
     company_id: Optional[int] = None,
-    temp_subdir: str = "temp_images",
-    kind: str = 'proportional'
+    kind: str = 'proportional',
+    cache: Optional[BrandingAssetCache] = None
 ) -> ImageLoadResult:
     """
     Charge une image pour l'utiliser dans un PDF ReportLab.
     
     Gère automatiquement:
+    - Cache mémoire des images redimensionnées (branding_asset_cache)
     - Chargement depuis le système de fichiers local
     - Téléchargement depuis Supabase Storage si non trouvé localement
-    - Création de fichiers temporaires pour Supabase (ReportLab nécessite des fichiers physiques)
     - Gestion d'erreur robuste avec logging détaillé
     
     Args:
@@ -84,41 +251,48 @@ def load_image_for_pdf(
         width: Largeur de l'image en millimètres
         height: Hauteur de l'image en millimètres
         upload_dir: Répertoire d'upload de base
-        company_id: ID de l'entreprise (pour organisation des fichiers temporaires)
-        temp_subdir: Sous-répertoire pour les fichiers temporaires
+        company_id: ID de l'entreprise (invalidation du cache)
         kind: Type de redimensionnement ('proportional', 'normal', 'bound')
+        cache: Cache à utiliser (défaut: branding_asset_cache)
     
     Returns:
-        ImageLoadResult avec l'image chargée et les informations de fichier temporaire
+        ImageLoadResult avec l'image chargée (lue depuis la mémoire)
     """
     if not image_path:
         logger.debug(f"[IMAGE LOADER] No image path provided")
         return ImageLoadResult(loaded=False)
     
-    logger.info(f"[IMAGE LOADER] Loading image: {image_path}")
-    
-    # Normaliser le chemin
+    cache = cache or branding_asset_cache
     normalized_path, absolute_path = normalize_image_path(image_path, upload_dir)
-    logger.info(f"[IMAGE LOADER] Normalized path: {normalized_path}, Absolute path: {absolute_path}")
+    company_id = _company_of(normalized_path, company_id)
     
-    # TENTATIVE 1: Charger depuis le système de fichiers local
-    if absolute_path:
-        if Path(absolute_path).exists():
-            try:
-                logger.info(f"[IMAGE LOADER] Attempting to load from local filesystem: {absolute_path}")
-                image = Image(absolute_path, width=width*mm, height=height*mm, kind=kind)
-                logger.info(f"[IMAGE LOADER] ✅ Image loaded successfully from local filesystem")
-                return ImageLoadResult(image=image, loaded=True)
-            except Exception as e:
-                logger.warning(f"[IMAGE LOADER] ⚠️ Failed to load image from local filesystem: {e}", exc_info=True)
-                # Continuer pour essayer Supabase Storage
-        else:
-            logger.info(f"[IMAGE LOADER] Local file does not exist: {absolute_path}, will try Supabase Storage")
-    else:
-        logger.info(f"[IMAGE LOADER] No absolute path computed, will try Supabase Storage")
+    def build(data: bytes) -> ImageLoadResult:
+        image = Image(io.BytesIO(data), width=width*mm, height=height*mm, kind=kind)
+        return ImageLoadResult(image=image, loaded=True)
     
-    # TENTATIVE 2: Charger depuis Supabase Storage
+    # TENTATIVE 1: Système de fichiers local (tampon : date de modification et taille)
+    stamp = _local_stamp(absolute_path) if absolute_path else None
+    if stamp is not None:
+        try:
+            data = cache.lookup(normalized_path, stamp, width, height)
+            if data is None:
+                logger.info(f"[IMAGE LOADER] Loading image from local filesystem: {absolute_path}")
+                content = Path(absolute_path).read_bytes()
+                data = cache.store(normalized_path, company_id, stamp, content, width, height)
+            return build(data)
+        except Exception as e:
+            logger.warning(f"[IMAGE LOADER] ⚠️ Failed to load image from local filesystem: {e}", exc_info=True)
+            # Continuer pour essayer Supabase Storage
+    
+    # TENTATIVE 2: Supabase Storage (tampon : marqueur de version des images de l'entreprise)
     if normalized_path:
+        remote_stamp = _remote_stamp(upload_dir, company_id)
+        data = cache.lookup(normalized_path, remote_stamp, width, height)
+        if data is not None:
+            try:
+                return build(data)
+            except Exception as e:
+                logger.warning(f"[IMAGE LOADER] ⚠️ Cached image unreadable: {e}")
         try:
             from app.core.supabase_storage_service import (
                 download_file as download_from_supabase,
@@ -137,107 +311,15 @@ def load_image_for_pdf(
                 return ImageLoadResult(loaded=False)
             
             logger.info(f"[IMAGE LOADER] Downloaded {len(file_content)} bytes from Supabase Storage")
-            
-            # CRITIQUE: ReportLab nécessite un fichier physique, pas un BytesIO
-            # Créer un fichier temporaire pour le stockage
-            temp_file_path = None
-            try:
-                # Extraire company_id du chemin si non fourni (format: "company_id/filename")
-                if not company_id and "/" in normalized_path:
-                    try:
-                        company_id = int(normalized_path.split("/")[0])
-                    except (ValueError, IndexError):
-                        company_id = None
-                
-                # Créer le répertoire temporaire
-                if company_id:
-                    temp_dir = upload_dir / str(company_id) / temp_subdir
-                else:
-                    temp_dir = upload_dir / "temp" / temp_subdir
-                
-                # Créer le répertoire avec gestion d'erreur robuste
-                try:
-                    temp_dir.mkdir(parents=True, exist_ok=True)
-                except PermissionError as perm_error:
-                    logger.error(f"[IMAGE LOADER] ❌ Permission denied creating temp directory {temp_dir}: {perm_error}")
-                    return ImageLoadResult(loaded=False)
-                except OSError as os_error:
-                    logger.error(f"[IMAGE LOADER] ❌ OS error creating temp directory {temp_dir}: {os_error}")
-                    return ImageLoadResult(loaded=False)
-                
-                # Générer un nom de fichier unique
-                file_ext = Path(normalized_path).suffix or ".png"
-                temp_file_path = temp_dir / f"img_{uuid.uuid4().hex[:8]}{file_ext}"
-                
-                # Sauvegarder le contenu téléchargé
-                with open(temp_file_path, "wb") as temp_file:
-                    temp_file.write(file_content)
-                
-                logger.info(f"[IMAGE LOADER] Saved temporary file: {temp_file_path}")
-                
-                # Créer l'objet Image ReportLab
-                image = Image(str(temp_file_path), width=width*mm, height=height*mm, kind=kind)
-                
-                logger.info(f"[IMAGE LOADER] ✅ Image loaded successfully from Supabase Storage")
-                return ImageLoadResult(image=image, temp_file_path=temp_file_path, loaded=True)
-                
-            except Exception as img_error:
-                logger.error(f"[IMAGE LOADER] ❌ Error creating image from Supabase content: {img_error}", exc_info=True)
-                # Nettoyer le fichier temporaire en cas d'erreur
-                if temp_file_path and temp_file_path.exists():
-                    try:
-                        temp_file_path.unlink()
-                    except Exception:
-                        pass
-                return ImageLoadResult(loaded=False)
-                
+            data = cache.store(normalized_path, company_id, remote_stamp, file_content, width, height)
+            return build(data)
         except ImportError:
             logger.debug(f"[IMAGE LOADER] Supabase Storage service not available")
             return ImageLoadResult(loaded=False)
         except Exception as e:
-            logger.error(f"[IMAGE LOADER] ❌ Error downloading from Supabase Storage: {e}", exc_info=True)
+            logger.error(f"[IMAGE LOADER] ❌ Error loading image from Supabase Storage: {e}", exc_info=True)
             return ImageLoadResult(loaded=False)
     
     # Si aucune tentative n'a réussi
     logger.warning(f"[IMAGE LOADER] ❌ Image not found: {image_path} (tried local and Supabase Storage)")
     return ImageLoadResult(loaded=False)
-
-
-def cleanup_temp_images(upload_dir: Path, max_age_seconds: int = 3600) -> None:
-    """
-    Nettoie les fichiers temporaires d'images plus anciens que max_age_seconds.
-    
-    Args:
-        upload_dir: Répertoire d'upload de base
-        max_age_seconds: Âge maximum en secondes (défaut: 1 heure)
-    """
-    import time
-    
-    try:
-        current_time = time.time()
-        temp_subdirs = ["temp_logos", "temp_signatures", "temp_images"]
-        
-        for company_dir in upload_dir.iterdir():
-            if not company_dir.is_dir():
-                continue
-            
-            for temp_subdir in temp_subdirs:
-                temp_dir = company_dir / temp_subdir
-                if not temp_dir.exists():
-                    continue
-                
-                for temp_file in temp_dir.iterdir():
-                    if not temp_file.is_file():
-                        continue
-                    
-                    try:
-                        file_age = current_time - temp_file.stat().st_mtime
-                        if file_age > max_age_seconds:
-                            temp_file.unlink()
-                            logger.debug(f"[IMAGE LOADER] Cleaned up old temp file: {temp_file}")
-                    except Exception as e:
-                        logger.warning(f"[IMAGE LOADER] Error cleaning up temp file {temp_file}: {e}")
-                        
-    except Exception as e:
-        logger.warning(f"[IMAGE LOADER] Error during temp files cleanup: {e}")
-
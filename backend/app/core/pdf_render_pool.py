@@ -0,0 +1,295 @@
+"""
+Pool de rendu des PDF (devis, factures) dans des processus dédiés.
+
+Le rendu ReportLab est du calcul Python pur : exécuté dans les handlers, il occupe les threads
+du serveur et le GIL, et ralentit toutes les autres routes pendant les pics de facturation.
+Les documents sont copiés en instantanés sérialisables (DocumentSnapshot : colonnes du document,
+de ses lignes, du client et de l'entreprise, paramètres de l'entreprise) puis rendus dans un
+ProcessPoolExecutor (PDF_RENDER_WORKERS processus, démarrage "spawn", aucun accès base côté
+processus de rendu) : le débit suit le nombre de cœurs.
+
+- Profondeur bornée : au-delà de PDF_RENDER_MAX_PENDING rendus en cours ou en attente,
+  PdfRenderQueueFull (les routes répondent 503 avec Retry-After).
+- Délai par rendu (PDF_RENDER_TIMEOUT_SECONDS) : PdfRenderTimeout ; la place n'est rendue
+  qu'à la fin effective du rendu, la borne reste exacte.
+- API asynchrone (render_quote_pdf, render_invoice_pdf) pour les routes async (envoi par email),
+  bloquante (render_quote_pdf_sync, render_invoice_pdf_sync) pour les routes synchrones exécutées
+  dans le threadpool (téléchargement : requêtes et cache hors de la boucle d'évènements) ;
+  soumission directe (submit_quote_pdf, submit_invoice_pdf) pour les traitements en lot (exports).
+- PDF_RENDER_WORKERS = 0 : rendu dans des threads du processus web (développement, tests).
+"""
+import asyncio
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool, ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.core.pdf_cache import model_snapshot, render_to_bytes
+
+logger = logging.getLogger(__name__)
+
+# Threads de rendu quand PDF_RENDER_WORKERS = 0
+IN_PROCESS_THREADS = 2
+
+
+class PdfRenderQueueFull(Exception):
+    """Trop de rendus en cours ou en attente."""
+
+
+class PdfRenderTimeout(Exception):
+    """Rendu non terminé dans le délai."""
+
+
+class DocumentSnapshot:
+    """Copie sérialisable des colonnes d'un objet ORM (accès par attribut, comme l'objet d'origine)."""
+
+    def __init__(self, **values):
+        self.__dict__.update(values)
+
+    @classmethod
+    def of(cls, instance, **relations) -> Optional["DocumentSnapshot"]:
+        if instance is None:
+            return None
+        return cls(**model_snapshot(instance), **relations)
+
+
+def _init_worker() -> None:
+    # Enregistre tous les modèles avant les services de rendu (imports circulaires de app.db.models)
+    import app.db.base  # noqa: F401
+
+
+def _render_quote(quote, client, company, design_config, client_signature_path, company_settings_data) -> bytes:
+    from app.core.quote_pdf_service import generate_quote_pdf
+    return render_to_bytes(lambda path: generate_quote_pdf(
+        quote, client, company, path,
+        design_config=design_config,
+        client_signature_path=client_signature_path,
+        company_settings_data=company_settings_data
+    ))
+
+
+def _render_invoice(invoice, client, company_info, quote, design_config) -> bytes:
+    from app.core.invoice_pdf_service import generate_invoice_pdf
+    return generate_invoice_pdf(invoice, client=client, company_info=company_info, quote=quote, design_config=design_config)
+
+
+class PdfRenderPool:
+    """Exécuteur de rendus à profondeur bornée (processus dédiés, ou threads si workers = 0)."""
+
+    def __init__(self, workers: int, max_pending: int, timeout: float):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.workers > 0:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=IN_PROCESS_THREADS, thread_name_prefix="pdf-render")
+        return self._executor
+
+    def _release(self, _future: Future) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def submit(self, fn: Callable[..., Any], *args) -> Future:
+        """Soumet un rendu ; PdfRenderQueueFull si la file est pleine."""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise PdfRenderQueueFull(f"{self._pending} rendu(s) PDF en cours")
+            self._pending += 1
+            try:
+                try:
+                    future = self._get_executor().submit(fn, *args)
+                except BrokenProcessPool:
+                    # Processus de rendu mort (crash, OOM) : nouveau pool
+                    logger.warning("[PDF RENDER] Pool de rendu cassé, redémarrage")
+                    self._executor = None
+                    future = self._get_executor().submit(fn, *args)
+            except BaseException:
+                self._pending -= 1
+                raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def wait(self, future: Future, timeout: Optional[float] = None) -> Any:
+        """Résultat d'un rendu soumis, attendu sans bloquer la boucle ; PdfRenderTimeout au-delà du délai."""
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise PdfRenderTimeout(f"Rendu PDF non terminé après {timeout or self.timeout:.0f}s")
+
+    def result(self, future: Future, timeout: Optional[float] = None) -> Any:
+        """Résultat d'un rendu soumis, en bloquant le thread appelant (voir wait)."""
+        try:
+            return future.result(timeout or self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise PdfRenderTimeout(f"Rendu PDF non terminé après {timeout or self.timeout:.0f}s")
+
+    async def run(self, fn: Callable[..., Any], *args, timeout: Optional[float] = None) -> Any:
+        """Soumet un rendu et l'attend (voir wait)."""
+        return await self.wait(self.submit(fn, *args), timeout)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+pdf_render_pool = PdfRenderPool(
+    settings.PDF_RENDER_WORKERS, settings.PDF_RENDER_MAX_PENDING, settings.PDF_RENDER_TIMEOUT_SECONDS
+)
+
+
+def quote_design_config(company_settings_data: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Configuration de design d'un devis à partir des paramètres de l'entreprise."""
+    if not company_settings_data:
+        return {}
+    quote_design = company_settings_data.get("billing", {}).get("quote_design", {})
+    return {
+        "primary_color": quote_design.get("primary_color", "#F97316"),
+        "secondary_color": quote_design.get("secondary_color", "#F0F0F0"),
+        # Toujours utiliser company_info.logo_path comme source unique de vérité
+        "logo_path": company_settings_data.get("company_info", {}).get("logo_path"),
+        "signature_path": quote_design.get("signature_path"),
+        "footer_text": quote_design.get("footer_text"),
+        "terms_text": quote_design.get("terms_text")
+    }
+
+
+def invoice_render_config(company_settings_data: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """(company_info, design_config) d'une facture à partir des paramètres de l'entreprise."""
+    if not company_settings_data:
+        return {}, {}
+    company_info_data = company_settings_data.get("company_info", {})
+    quote_design = company_settings_data.get("billing", {}).get("quote_design", {})
+    company_info = {
+        "address": company_info_data.get("address"),
+        "phone": company_info_data.get("phone"),
+        "email": company_info_data.get("email")
+    }
+    design_config = {
+        "logo_path": company_info_data.get("logo_path"),  # Logo depuis company_info
+        "signature_path": quote_design.get("signature_path")  # Signature depuis quote_design
+    }
+    return company_info, design_config
+
+
+def submit_quote_pdf(
+    quote,
+    client,
+    company,
+    design_config: Optional[Dict[str, Any]] = None,
+    client_signature_path: Optional[str] = None,
+    company_settings_data: Optional[Dict[str, Any]] = None,
+    pool: Optional[PdfRenderPool] = None
+) -> Future:
+    """Soumet le rendu d'un devis (instantané) ; Future des octets du PDF."""
+    return (pool or pdf_render_pool).submit(
+        _render_quote,
+        DocumentSnapshot.of(quote, lines=[DocumentSnapshot.of(line) for line in quote.lines]),
+        DocumentSnapshot.of(client),
+        DocumentSnapshot.of(company),
+        design_config or {},
+        client_signature_path,
+        company_settings_data or {}
+    )
+
+
+def submit_invoice_pdf(
+    invoice,
+    client=None,
+    company_info: Optional[Dict[str, Any]] = None,
+    quote=None,
+    design_config: Optional[Dict[str, Any]] = None,
+    pool: Optional[PdfRenderPool] = None
+) -> Future:
+    """Soumet le rendu d'une facture ou d'un avoir (instantané) ; Future des octets du PDF."""
+    return (pool or pdf_render_pool).submit(
+        _render_invoice,
+        DocumentSnapshot.of(
+            invoice,
+            lines=[DocumentSnapshot.of(line) for line in invoice.lines],
+            company=DocumentSnapshot.of(invoice.company)
+        ),
+        DocumentSnapshot.of(client),
+        company_info or {},
+        DocumentSnapshot.of(quote),
+        design_config or {}
+    )
+
+
+async def render_quote_pdf(
+    quote,
+    client,
+    company,
+    design_config: Optional[Dict[str, Any]] = None,
+    client_signature_path: Optional[str] = None,
+    company_settings_data: Optional[Dict[str, Any]] = None,
+    pool: Optional[PdfRenderPool] = None
+) -> bytes:
+    """PDF d'un devis (octets), rendu dans le pool à partir d'un instantané du devis."""
+    pool = pool or pdf_render_pool
+    return await pool.wait(submit_quote_pdf(
+        quote, client, company, design_config, client_signature_path, company_settings_data, pool=pool
+    ))
+
+
+async def render_invoice_pdf(
+    invoice,
+    client=None,
+    company_info: Optional[Dict[str, Any]] = None,
+    quote=None,
+    design_config: Optional[Dict[str, Any]] = None,
+    pool: Optional[PdfRenderPool] = None
+) -> bytes:
+    """PDF d'une facture ou d'un avoir (octets), rendu dans le pool à partir d'un instantané."""
+    pool = pool or pdf_render_pool
+    return await pool.wait(submit_invoice_pdf(invoice, client, company_info, quote, design_config, pool=pool))
+
+
+def render_quote_pdf_sync(
+    quote,
+    client,
+    company,
+    design_config: Optional[Dict[str, Any]] = None,
+    client_signature_path: Optional[str] = None,
+    company_settings_data: Optional[Dict[str, Any]] = None,
+    pool: Optional[PdfRenderPool] = None
+) -> bytes:
+    """Version bloquante de render_quote_pdf (routes synchrones, threadpool)."""
+    pool = pool or pdf_render_pool
+    return pool.result(submit_quote_pdf(
+        quote, client, company, design_config, client_signature_path, company_settings_data, pool=pool
+    ))
+
+
+def render_invoice_pdf_sync(
+    invoice,
+    client=None,
+    company_info: Optional[Dict[str, Any]] = None,
+    quote=None,
+    design_config: Optional[Dict[str, Any]] = None,
+    pool: Optional[PdfRenderPool] = None
+) -> bytes:
+    """Version bloquante de render_invoice_pdf (routes synchrones, threadpool)."""
+    pool = pool or pdf_render_pool
+    return pool.result(submit_invoice_pdf(invoice, client, company_info, quote, design_config, pool=pool))
@@ -19,7 +19,7 @@ from app.db.models.billing import Quote, QuoteLine
 from app.db.models.client import Client
 from app.db.models.company import Company
 from app.core.config import settings
-from app.core.pdf_image_loader import load_image_for_pdf, cleanup_temp_images
+from app.core.pdf_image_loader import load_image_for_pdf
 
 
 def draw_header_on_canvas(canvas_obj, doc, primary_color, secondary_color, logo_image=None, company_name=None):
@@ -152,13 +152,33 @@ def draw_footer_on_canvas(canvas_obj, doc, primary_color, footer_text=None):
     canvas_obj.restoreState()
 
 
+def load_company_settings_data(company_id: Optional[int]) -> Dict[str, Any]:
+    """Paramètres (JSON) de l'entreprise, {} si absents ou en cas d'erreur."""
+    if company_id is None:
+        return {}
+    try:
+        from app.db.models.company_settings import CompanySettings
+        from app.db.session import SessionLocal
+        db = SessionLocal()
+        try:
+            company_settings = db.query(CompanySettings).filter(
+                CompanySettings.company_id == company_id
+            ).first()
+            return (company_settings.settings if company_settings else None) or {}
+        finally:
+            db.close()
+    except Exception:
+        return {}
+
+
 def generate_quote_pdf(
     quote: Quote,
     client: Client,
     company: Company,
     output_path: str,
     design_config: Optional[Dict[str, Any]] = None,
-    client_signature_path: Optional[str] = None
+    client_signature_path: Optional[str] = None,
+    company_settings_data: Optional[Dict[str, Any]] = None
 ) -> str:
     """
     Génère un PDF moderne pour un devis.
@@ -169,6 +189,8 @@ def generate_quote_pdf(
         company: L'entreprise qui émet le devis
         output_path: Chemin où sauvegarder le PDF
         design_config: Configuration du design (couleurs, logo)
+        company_settings_data: Paramètres de l'entreprise (coordonnées, modalités de paiement) ;
+            relus en base si non fournis (le pool de rendu les fournit, sans accès base)
     
     Returns:
         Le chemin du fichier PDF généré
@@ -176,6 +198,8 @@ def generate_quote_pdf(
     # Configuration du design (valeurs par défaut si non fourni)
     if design_config is None:
         design_config = {}
+    if company_settings_data is None:
+        company_settings_data = load_company_settings_data(company.id if company else None)
     
     primary_color = design_config.get("primary_color", "#F97316")
     secondary_color = design_config.get("secondary_color", "#F0F0F0")
@@ -189,8 +213,7 @@ def generate_quote_pdf(
     logger = logging.getLogger(__name__)
     logger.info(f"[QUOTE PDF] Design config - logo_path: {logo_path}, signature_path: {signature_path}, company_id: {company.id if company else None}")
     
-    # PRÉCHARGER TOUTES LES IMAGES au début pour éviter les conflits de timing
-    # Cela garantit que tous les fichiers temporaires sont créés avant que ReportLab ne commence à les utiliser
+    # PRÉCHARGER TOUTES LES IMAGES au début (cache mémoire des images redimensionnées)
     upload_dir = Path(settings.UPLOAD_DIR).resolve()
     company_id = company.id if company else None
     
@@ -204,7 +227,6 @@ def generate_quote_pdf(
             height=35,
             upload_dir=upload_dir,
             company_id=company_id,
-            temp_subdir="temp_logos",
             kind='proportional'
         )
         if logo_result.loaded and logo_result.image:
@@ -223,7 +245,6 @@ def generate_quote_pdf(
             height=25,
             upload_dir=upload_dir,
             company_id=company_id,
-            temp_subdir="temp_signatures",
             kind='proportional'
         )
         if signature_result.loaded and signature_result.image:
@@ -242,7 +263,6 @@ def generate_quote_pdf(
             height=25,
             upload_dir=upload_dir,
             company_id=company_id,
-            temp_subdir="temp_signatures",
             kind='proportional'
         )
         if client_sig_result.loaded and client_sig_result.image:
@@ -325,21 +345,7 @@ def generate_quote_pdf(
     story.append(Spacer(1, -15*mm))
     
     # Récupérer les coordonnées de l'entreprise
-    company_info_data = {}
-    try:
-        from app.db.models.company_settings import CompanySettings
-        from app.db.session import SessionLocal
-        db = SessionLocal()
-        try:
-            company_settings = db.query(CompanySettings).filter(
-                CompanySettings.company_id == company.id
-            ).first()
-            if company_settings and company_settings.settings:
-                company_info_data = company_settings.settings.get("company_info", {})
-        finally:
-            db.close()
-    except Exception:
-        pass
+    company_info_data = company_settings_data.get("company_info", {}) or {}
     
     # Construire les coordonnées de l'entreprise
     company_coords = []
@@ -490,32 +496,20 @@ def generate_quote_pdf(
     # Construire le contenu de gauche comme un seul paragraphe
     # Récupérer les modalités de paiement depuis les settings
     payment_terms_text = None
-    try:
-        from app.db.models.company_settings import CompanySettings
-        from app.db.session import SessionLocal
-        db = SessionLocal()
-        try:
-            company_settings = db.query(CompanySettings).filter(
-                CompanySettings.company_id == company.id
-            ).first()
-            if company_settings and company_settings.settings:
-                billing_settings = company_settings.settings.get("billing", {})
-                payment_terms_text = billing_settings.get("payment_terms")
-                
-                # Si pas de modalités personnalisées, utiliser les infos bancaires de company_info
-                if not payment_terms_text:
-                    company_info = company_settings.settings.get("company_info", {})
-                    payment_info_items = []
-                    if company_info.get("iban"):
-                        payment_info_items.append(f"<b>Compte #</b> {company_info.get('iban')}")
-                    if company_info.get("bank_name"):
-                        payment_info_items.append(f"<b>Banque</b> {company_info.get('bank_name')}")
-                    if payment_info_items:
-                        payment_terms_text = "<br/>".join(payment_info_items)
-        finally:
-            db.close()
-    except Exception:
-        pass
+    if company_settings_data:
+        billing_settings = company_settings_data.get("billing", {}) or {}
+        payment_terms_text = billing_settings.get("payment_terms")
+        
+        # Si pas de modalités personnalisées, utiliser les infos bancaires de company_info
+        if not payment_terms_text:
+            company_info = company_settings_data.get("company_info", {}) or {}
+            payment_info_items = []
+            if company_info.get("iban"):
+                payment_info_items.append(f"<b>Compte #</b> {company_info.get('iban')}")
+            if company_info.get("bank_name"):
+                payment_info_items.append(f"<b>Banque</b> {company_info.get('bank_name')}")
+            if payment_info_items:
+                payment_terms_text = "<br/>".join(payment_info_items)
     
     # Construire le contenu de gauche
     left_content_html = f"<b>Informations de paiement</b><br/><br/>"
@@ -842,13 +836,4 @@ def generate_quote_pdf(
     # Générer le PDF avec les callbacks pour l'en-tête et le pied de page
     doc.build(story, onFirstPage=on_first_page, onLaterPages=on_later_pages)
     
-    # Nettoyage des fichiers temporaires après génération du PDF
-    # Utiliser la fonction utilitaire centralisée pour le nettoyage
-    try:
-        upload_dir = Path(settings.UPLOAD_DIR).resolve()
-        cleanup_temp_images(upload_dir, max_age_seconds=3600)
-    except Exception as cleanup_error:
-        # Ne pas faire échouer la génération du PDF si le nettoyage échoue
-        logger.warning(f"[CLEANUP] Error during temp files cleanup: {cleanup_error}")
-    
     return output_path
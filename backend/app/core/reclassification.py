@@ -0,0 +1,130 @@
+"""
+Moteur de reclassification en masse des conversations (par pages, ensembliste).
+
+Au lieu de charger toutes les conversations puis de faire une requête par conversation
+(message, re-fetch, dossier) et un commit par conversation, chaque page de PAGE_SIZE
+conversations coûte :
+- une requête de pagination par clé (id > dernier id vu, pas d'OFFSET),
+- une requête à fonctions de fenêtre pour le premier message client et le dernier message,
+- un UPDATE groupé (CASE id WHEN … THEN folder_id) et un commit.
+La mémoire reste constante quel que soit le nombre de conversations de l'entreprise.
+"""
+from typing import Dict, Iterator, List, Optional, Tuple
+from sqlalchemy import and_, case, func, or_, select
+from sqlalchemy.orm import Session
+from app.db.models.conversation import Conversation, InboxMessage
+from app.db.models.inbox_counter import count_folder_assignments
+from app.core.inbox_events import publish_folder_changed
+
+PAGE_SIZE = 500
+# Contenu chargé par message pour la classification IA (prompt tronqué pour économiser) ;
+# les filtres par mots-clés reçoivent le contenu complet, comme à l'ingestion
+CONTENT_PREFIX_LENGTH = 500
+
+
+def iter_conversation_pages(
+    db: Session,
+    company_id: int,
+    force: bool = False,
+    page_size: Optional[int] = None
+) -> Iterator[List]:
+    """
+    Parcourt les conversations de l'entreprise par pages (pagination par clé sur l'id).
+    Chaque ligne : id, subject, source, folder_id. Sans `force`, seulement celles sans dossier.
+    """
+    page_size = page_size or PAGE_SIZE
+    last_id = 0
+    while True:
+        query = db.query(
+            Conversation.id, Conversation.subject, Conversation.source, Conversation.folder_id
+        ).filter(
+            Conversation.company_id == company_id,
+            Conversation.id > last_id
+        )
+        if not force:
+            query = query.filter(Conversation.folder_id.is_(None))
+        page = query.order_by(Conversation.id.asc()).limit(page_size).all()
+        if not page:
+            return
+        yield page
+        last_id = page[-1].id
+
+
+def load_page_messages(
+    db: Session,
+    conversation_ids: List[int],
+    content_length: Optional[int] = CONTENT_PREFIX_LENGTH
+) -> Dict[int, Tuple[Optional[object], Optional[object]]]:
+    """
+    Premier message client et dernier message de chaque conversation, en une requête
+    (ROW_NUMBER par conversation). Retourne {conversation_id: (premier_client, dernier)} ;
+    chaque message : conversation_id, content (tronqué à `content_length`, complet si None),
+    from_email, from_phone, is_from_client.
+    """
+    if not conversation_ids:
+        return {}
+    content = InboxMessage.content if content_length is None else func.substr(InboxMessage.content, 1, content_length)
+    first_rank = func.row_number().over(
+        partition_by=(InboxMessage.conversation_id, InboxMessage.is_from_client),
+        order_by=(InboxMessage.created_at.asc(), InboxMessage.id.asc())
+    )
+    last_rank = func.row_number().over(
+        partition_by=InboxMessage.conversation_id,
+        order_by=(InboxMessage.created_at.desc(), InboxMessage.id.desc())
+    )
+    ranked = select(
+        InboxMessage.conversation_id,
+        content.label("content"),
+        InboxMessage.from_email,
+        InboxMessage.from_phone,
+        InboxMessage.is_from_client,
+        first_rank.label("first_rank"),
+        last_rank.label("last_rank"),
+    ).where(InboxMessage.conversation_id.in_(conversation_ids)).subquery()
+
+    messages: Dict[int, List] = {}
+    for row in db.execute(
+        select(ranked).where(or_(
+            and_(ranked.c.is_from_client == True, ranked.c.first_rank == 1),
+            ranked.c.last_rank == 1
+        ))
+    ).all():
+        pair = messages.setdefault(row.conversation_id, [None, None])
+        if row.is_from_client and row.first_rank == 1:
+            pair[0] = row
+        if row.last_rank == 1:
+            pair[1] = row
+    return {conversation_id: (pair[0], pair[1]) for conversation_id, pair in messages.items()}
+
+
+def bulk_assign_folders(db: Session, company_id: int, assignments: Dict[int, int]) -> int:
+    """
+    Applique {conversation_id: folder_id} en un seul UPDATE (sans commit). Retourne le nombre de lignes.
+    Les conversations sont marquées ai_classified (exclues de l'apprentissage du classifieur local).
+    """
+    if not assignments:
+        return 0
+    count_folder_assignments(db, company_id, assignments)
+    by_folder: Dict[int, List[int]] = {}
+    for conversation_id, folder_id in assignments.items():
+        by_folder.setdefault(folder_id, []).append(conversation_id)
+    for folder_id, conversation_ids in by_folder.items():
+        publish_folder_changed(db, company_id, conversation_ids, folder_id)
+    return db.query(Conversation).filter(
+        Conversation.company_id == company_id,
+        Conversation.id.in_(list(assignments))
+    ).update(
+        {"folder_id": case(assignments, value=Conversation.id), "ai_classified": True},
+        synchronize_session=False
+    )
+
+
+def message_payload(conversation, message) -> Dict:
+    """Message au format attendu par les classifieurs (classify_messages_batch, match_filters)."""
+    return {
+        "conversation_id": conversation.id,
+        "content": message.content or "",
+        "subject": (conversation.subject or "") if conversation.source == "email" else "",
+        "from_email": message.from_email or "",
+        "from_phone": message.from_phone or ""
+    }
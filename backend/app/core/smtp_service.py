@@ -24,6 +24,13 @@ except ImportError:
     logger.warning("SendGrid SDK non disponible. Utilisation de SMTP uniquement.")
 
 
+class EmailDeliveryUncertain(Exception):
+    """
+    La connexion SMTP a été perdue pendant la transmission du message : le serveur l'a peut-être
+    accepté. L'appelant ne doit pas renvoyer l'email automatiquement.
+    """
+
+
 def get_smtp_config(email_address: str) -> Dict[str, any]:
     """
     Détermine la configuration SMTP à partir de l'adresse email.
@@ -101,7 +108,10 @@ def send_email_smtp(
     use_tls: bool = True,
     attachments: Optional[List[Dict[str, any]]] = None,
     from_name: Optional[str] = None,
-    reply_to: Optional[str] = None
+    reply_to: Optional[str] = None,
+    message_id: Optional[str] = None,
+    in_reply_to: Optional[str] = None,
+    references: Optional[List[str]] = None
 ) -> bool:
     """
     Envoie un email via SMTP (avec fallback vers SendGrid API si configuré).
@@ -118,9 +128,19 @@ def send_email_smtp(
         attachments: Liste de pièces jointes [{"path": "...", "filename": "..."}]
         from_name: Nom de l'expéditeur (optionnel)
         reply_to: Email de réponse (optionnel)
+        message_id: En-tête Message-ID à utiliser (optionnel, pour le threading des réponses)
+        in_reply_to: Message-ID du message auquel on répond (optionnel)
+        references: Chaîne References du fil (optionnel)
     
     Returns:
         True si l'email a été envoyé avec succès, False sinon
+    
+    Raises:
+        EmailDeliveryUncertain: connexion perdue pendant sendmail (message peut-être accepté)
+        Exception: échec avant l'envoi (connexion, authentification, refus du serveur)
+    
+    Une fois sendmail réussi, l'email est considéré comme envoyé : une erreur de fermeture
+    de la connexion (QUIT) est seulement journalisée.
     """
     # Priorité 1 : Utiliser SendGrid API REST si configuré (évite les problèmes réseau sur Railway)
     if hasattr(settings, 'SENDGRID_API_KEY') and settings.SENDGRID_API_KEY and SENDGRID_AVAILABLE:
@@ -196,6 +216,13 @@ def send_email_smtp(
         msg['Subject'] = subject
         if reply_to:
             msg['Reply-To'] = reply_to
+        # En-têtes de threading : les réponses du client référenceront ce Message-ID
+        if message_id:
+            msg['Message-ID'] = message_id
+        if in_reply_to:
+            msg['In-Reply-To'] = in_reply_to
+        if references:
+            msg['References'] = " ".join(references)
         
         # Ajouter le contenu texte
         msg.attach(MIMEText(content, 'plain', 'utf-8'))
@@ -235,12 +262,26 @@ def send_email_smtp(
         
         logger.info(f"[SMTP] Envoi de l'email à {to_email}")
         text = msg.as_string()
-        server.sendmail(email_address, to_email, text)
-        server.quit()
+        try:
+            server.sendmail(email_address, to_email, text)
+        except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+            # Refus explicite du serveur (code d'erreur SMTP) : rien n'a été envoyé
+            raise
+        except (smtplib.SMTPServerDisconnected, OSError) as e:
+            raise EmailDeliveryUncertain(f"Connexion perdue pendant l'envoi à {to_email}: {e}") from e
+        
+        try:
+            server.quit()
+        except Exception as e:
+            logger.warning(f"[SMTP] Email envoyé à {to_email}, fermeture de la connexion en échec: {e}")
         
         logger.info(f"[SMTP] Email envoyé avec succès à {to_email}")
         return True
         
+    except EmailDeliveryUncertain as e:
+        logger.error(f"[SMTP] {e}")
+        raise
+        
     except smtplib.SMTPAuthenticationError as e:
         error_msg = f"Erreur d'authentification SMTP: {str(e)}"
         logger.error(f"[SMTP] {error_msg}")
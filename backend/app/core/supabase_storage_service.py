@@ -2,7 +2,7 @@
 Service pour gérer le stockage de fichiers sur Supabase Storage.
 Permet un stockage persistant des fichiers (logos, signatures, etc.) qui ne sont pas perdus lors des redéploiements.
 """
-from typing import Optional, BinaryIO
+from typing import Any, BinaryIO, Dict, List, Optional
 from pathlib import Path
 import logging
 from app.core.config import settings
@@ -207,6 +207,51 @@ def delete_file(file_path: str) -> bool:
         return False
 
 
+def delete_files(file_paths: List[str]) -> bool:
+    """
+    Supprime plusieurs fichiers depuis Supabase Storage (une requête).
+    
+    Args:
+        file_paths: Chemins des fichiers dans le bucket
+    
+    Returns:
+        True si succès, False sinon
+    """
+    client = get_supabase_client()
+    
+    if not client or not file_paths:
+        return False
+    
+    try:
+        response = client.storage.from_(settings.SUPABASE_STORAGE_BUCKET).remove(file_paths)
+        return bool(response)
+    except Exception:
+        return False
+
+
+def list_files(folder: str, limit: int = 1000) -> List[Dict[str, Any]]:
+    """
+    Liste les fichiers d'un dossier du bucket (avec leurs métadonnées : taille, dates).
+    
+    Args:
+        folder: Dossier dans le bucket (ex: "pdf_cache")
+        limit: Nombre maximal de fichiers retournés
+    
+    Returns:
+        Liste des fichiers ([] si Supabase n'est pas disponible)
+    """
+    client = get_supabase_client()
+    
+    if not client:
+        return []
+    
+    try:
+        return client.storage.from_(settings.SUPABASE_STORAGE_BUCKET).list(folder, {"limit": limit}) or []
+    except Exception as e:
+        logger.warning(f"Error listing files in Supabase Storage: {folder}, error: {e}")
+        return []
+
+
 def get_public_url(file_path: str, expires_in: int = 3600) -> Optional[str]:
     """
     Génère une URL publique signée pour accéder à un fichier.
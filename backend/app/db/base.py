@@ -11,9 +11,16 @@ from app.db.models.project import Project, ProjectHistory  # noqa
 from app.db.models.billing import Quote, Invoice, InvoicePayment  # noqa
 from app.db.models.document import Document, DocumentFolder, DocumentHistory  # noqa
 from app.db.models.followup import FollowUp, FollowUpHistory  # noqa
-from app.db.models.conversation import Conversation, InboxMessage, MessageAttachment, InboxFolder, InternalNote  # noqa
+from app.db.models.conversation import Conversation, InboxMessage, MessageAttachment, InboxFolder, InternalNote, EmailThreadKey, AttachmentBlob  # noqa
 from app.db.models.task import Task  # noqa
 from app.db.models.checklist import ChecklistTemplate, ChecklistInstance  # noqa
 from app.db.models.quote_otp import QuoteOTP  # noqa
 from app.db.models.chatbot import ChatbotConversation, ChatbotMessage, ChatbotContextCache  # noqa
+from app.db.models.rate_limit import RateLimitBucket  # noqa
+from app.db.models.classification_cache import ClassificationCacheEntry  # noqa
+from app.db.models.classification_job import ClassificationJob  # noqa
+from app.db.models.auto_reply_job import AutoReplyJob  # noqa
+from app.db.models.inbox_counter import InboxCounter  # noqa
+from app.db.models.document_sequence import DocumentSequence  # noqa
+from app.db.models.billing_export_job import BillingExportJob  # noqa
 
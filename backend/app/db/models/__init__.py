@@ -8,6 +8,8 @@ from app.db.models.conversation import (
     MessageAttachment,
     InboxFolder,
     InternalNote,
+    EmailThreadKey,
+    AttachmentBlob,
 )
 from app.db.models.task import Task, TaskStatus, TaskPriority, TaskType
 from app.db.models.checklist import ChecklistTemplate, ChecklistInstance
@@ -21,6 +23,13 @@ from app.db.models.chatbot import ChatbotConversation, ChatbotMessage, ChatbotCo
 from app.db.models.document import Document, DocumentFolder, DocumentHistory, DocumentType
 from app.db.models.project import Project, ProjectHistory, ProjectStatus
 from app.db.models.inbox_integration import InboxIntegration
+from app.db.models.rate_limit import RateLimitBucket
+from app.db.models.classification_cache import ClassificationCacheEntry
+from app.db.models.classification_job import ClassificationJob
+from app.db.models.auto_reply_job import AutoReplyJob
+from app.db.models.inbox_counter import InboxCounter
+from app.db.models.document_sequence import DocumentSequence
+from app.db.models.billing_export_job import BillingExportJob
 from app.db.models.subscription import (
     Subscription,
     SubscriptionStatus,
@@ -40,6 +49,8 @@ __all__ = [
     "MessageAttachment",
     "InboxFolder",
     "InternalNote",
+    "EmailThreadKey",
+    "AttachmentBlob",
     "Task",
     "TaskStatus",
     "TaskPriority",
@@ -80,6 +91,13 @@ __all__ = [
     "ProjectHistory",
     "ProjectStatus",
     "InboxIntegration",
+    "RateLimitBucket",
+    "ClassificationCacheEntry",
+    "ClassificationJob",
+    "AutoReplyJob",
+    "InboxCounter",
+    "DocumentSequence",
+    "BillingExportJob",
     "Subscription",
     "SubscriptionStatus",
     "SubscriptionPlan",
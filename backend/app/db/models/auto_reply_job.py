@@ -0,0 +1,34 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Index, UniqueConstraint
+from sqlalchemy.sql import func
+from app.db.base import Base
+
+
+class AutoReplyJob(Base):
+    """
+    Réponse automatique à générer et envoyer pour un message client (file de travail persistante).
+    L'éligibilité est décidée à l'ingestion (configuration du dossier en cache) et le job créé dans
+    la même transaction ; les workers génèrent la réponse (IA) puis l'envoient (SMTP / SMS).
+    La clé d'idempotence (conversation:message) garantit au plus une auto-réponse par message client.
+    Les jobs terminés sont conservés (leur clé empêche un second envoi).
+    """
+    __tablename__ = "auto_reply_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False)
+    message_id = Column(Integer, ForeignKey("inbox_messages.id", ondelete="CASCADE"), nullable=False)  # Message client auquel répondre
+    idempotency_key = Column(String(64), nullable=False)  # "conversation_id:message_id"
+    mode = Column(String(20), nullable=False)  # auto, approval (configuration du dossier à l'ingestion)
+    # pending, processing, sending, sent, awaiting_approval, skipped, failed
+    status = Column(String(20), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    available_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)  # Délai du dossier, backoff après échec
+    locked_at = Column(DateTime(timezone=True), nullable=True)  # Début du traitement / de l'envoi
+    reply_content = Column(Text, nullable=True)  # Réponse générée (réutilisée par les nouvelles tentatives)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("idempotency_key", name="uq_auto_reply_jobs_idempotency_key"),
+        Index("ix_auto_reply_jobs_status_available", "status", "available_at"),
+    )
@@ -0,0 +1,36 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, JSON, BigInteger, Index
+from sqlalchemy.sql import func
+from app.db.base import Base
+
+
+class BillingExportJob(Base):
+    """
+    Export en lot des PDF de factures ou de devis d'une période (archive ZIP + récapitulatif CSV/FEC).
+    La liste des documents est figée à la création ; les workers rendent les PDF en parallèle et
+    les écrivent un par un dans le répertoire de travail du job, puis assemblent l'archive.
+    Un job interrompu reprend là où il s'était arrêté (PDF déjà écrits conservés).
+    """
+    __tablename__ = "billing_export_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, ForeignKey("companies.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)  # Demandeur
+    document_type = Column(String(20), nullable=False)  # invoice, quote
+    filters = Column(JSON, nullable=False, default=dict)  # date_from, date_to, status, invoice_type
+    document_ids = Column(JSON, nullable=False, default=list)  # Documents à exporter, dans l'ordre de l'archive
+    # pending, running, completed, failed, expired
+    status = Column(String(20), nullable=False, default="pending")
+    total = Column(Integer, nullable=False, default=0)
+    processed = Column(Integer, nullable=False, default=0)  # PDF écrits (progression)
+    failed_documents = Column(JSON, nullable=False, default=list)  # Numéros dont le rendu a échoué
+    attempts = Column(Integer, nullable=False, default=0)
+    locked_at = Column(DateTime(timezone=True), nullable=True)  # Dernier signe de vie du worker (reprise si mort)
+    file_path = Column(String(500), nullable=True)  # Archive ZIP terminée
+    file_size = Column(BigInteger, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    completed_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_billing_export_jobs_status", "status", "locked_at"),
+    )
@@ -0,0 +1,30 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, BigInteger, Index
+from sqlalchemy.sql import func
+from app.db.base import Base
+
+
+class ClassificationCacheEntry(Base):
+    """
+    Résultat de classification IA mémorisé pour une "forme" de message :
+    (entreprise, type, version de la configuration, expéditeur, empreinte SimHash sujet + contenu).
+    Les messages quasi identiques d'un même expéditeur (notifications, newsletters) réutilisent
+    le résultat sans appel IA.
+    """
+    __tablename__ = "classification_cache_entries"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
+    kind = Column(String(20), nullable=False)  # folder, notification
+    config_version = Column(String(32), nullable=False)  # Empreinte des règles de dossiers (ou version du prompt)
+    sender = Column(String(255), nullable=False)
+    fingerprint = Column(BigInteger, nullable=False)  # SimHash 64 bits (signé)
+    result = Column(String(64), nullable=False)  # ID du dossier ("" = aucun), "notification" / "client"
+    hit_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    last_used_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)  # Éviction LRU
+    expires_at = Column(DateTime(timezone=True), nullable=False)  # TTL
+    
+    __table_args__ = (
+        Index("ix_classification_cache_lookup", "company_id", "kind", "config_version", "sender"),
+        Index("ix_classification_cache_company_last_used", "company_id", "last_used_at"),
+    )
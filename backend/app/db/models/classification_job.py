@@ -0,0 +1,29 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Index
+from sqlalchemy.sql import func
+from app.db.base import Base
+
+
+class ClassificationJob(Base):
+    """
+    Classification IA en attente d'une conversation (file de travail persistante).
+    L'ingestion crée le job dans sa transaction (conversation en folder_id NULL) ; les workers
+    le réclament, classent par lots multi-conversations puis enfilent l'auto-réponse.
+    Un job terminé est supprimé ; après CLASSIFICATION_JOB_MAX_ATTEMPTS échecs il reste en "failed".
+    """
+    __tablename__ = "classification_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False)
+    message_id = Column(Integer, ForeignKey("inbox_messages.id", ondelete="CASCADE"), nullable=True)  # Message à analyser
+    status = Column(String(20), nullable=False, default="pending")  # pending, processing, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    available_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)  # Backoff après échec
+    locked_at = Column(DateTime(timezone=True), nullable=True)  # Début du traitement (reprise si worker mort)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    
+    __table_args__ = (
+        Index("ix_classification_jobs_status_available", "status", "available_at"),
+        Index("ix_classification_jobs_conversation", "conversation_id"),
+    )
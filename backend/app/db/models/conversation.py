@@ -1,9 +1,19 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Boolean, JSON
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Boolean, JSON, Index, UniqueConstraint, event, select, update
 from sqlalchemy.orm import relationship
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.sql import func
 from app.db.base import Base
 
 
+def normalize_message_id(message_id: str) -> str:
+    """
+    Normalise un Message-ID en enlevant les chevrons < > et les espaces.
+    """
+    if not message_id:
+        return ""
+    return message_id.strip().strip("<>").strip()
+
+
 class Conversation(Base):
     __tablename__ = "conversations"
     
@@ -35,9 +45,19 @@ class Conversation(Base):
     unread_count = Column(Integer, default=0, nullable=False)
     last_message_at = Column(DateTime(timezone=True), nullable=True)
     
+    # Expéditeur du premier message client (dénormalisé, renseigné à l'insertion du message)
+    first_client_name = Column(String, nullable=True)
+    first_client_email = Column(String, nullable=True)
+    first_client_phone = Column(String, nullable=True)
+    
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
     
+    __table_args__ = (
+        # Liste de l'inbox : pagination par clé sur (last_message_at, id) dans l'entreprise
+        Index("ix_conversations_company_last_message", "company_id", "last_message_at", "id"),
+    )
+    
     # Relations
     company = relationship("Company", backref="conversations")
     client = relationship("Client", backref="conversations")
@@ -45,6 +65,7 @@ class Conversation(Base):
     assigned_to = relationship("User", foreign_keys=[assigned_to_id])
     messages = relationship("InboxMessage", back_populates="conversation", cascade="all, delete-orphan", order_by="InboxMessage.created_at")
     internal_notes = relationship("InternalNote", back_populates="conversation", cascade="all, delete-orphan")
+    thread_keys = relationship("EmailThreadKey", back_populates="conversation", cascade="all, delete-orphan", passive_deletes=True)
 
 
 class InboxMessage(Base):
@@ -68,11 +89,66 @@ class InboxMessage(Base):
     external_id = Column(String, nullable=True, index=True)  # ID du message dans le système externe (Gmail, WhatsApp, etc.)
     external_metadata = Column(JSON, nullable=True)  # Métadonnées supplémentaires (headers email, etc.)
     
+    # Dédoublonnage / threading email (renseignés automatiquement à l'insertion)
+    company_id = Column(Integer, ForeignKey("companies.id"), nullable=True, index=True)  # Dénormalisé depuis la conversation
+    message_id = Column(String, nullable=True)  # Message-ID normalisé (sans < >), emails uniquement
+    
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     
     # Relations
     conversation = relationship("Conversation", back_populates="messages")
     attachments = relationship("MessageAttachment", back_populates="message", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        # Un Message-ID n'est stocké qu'une fois par entreprise (recherche par égalité indexée)
+        Index("uq_inbox_messages_company_message_id", "company_id", "message_id", unique=True),
+    )
+
+
+@event.listens_for(InboxMessage, "before_insert")
+def _fill_message_dedup_keys(mapper, connection, target):
+    """Renseigne company_id (depuis la conversation) et le Message-ID normalisé des emails."""
+    if target.company_id is None:
+        # Pas de lazy-load pendant le flush : conversation déjà chargée, sinon requête directe
+        conversation = target.__dict__.get("conversation")
+        if conversation is not None:
+            target.company_id = conversation.company_id
+        elif target.conversation_id is not None:
+            target.company_id = connection.execute(
+                select(Conversation.company_id).where(Conversation.id == target.conversation_id)
+            ).scalar()
+    if target.message_id is None and target.source == "email" and target.external_id:
+        target.message_id = normalize_message_id(target.external_id) or None
+
+
+@event.listens_for(InboxMessage, "after_insert")
+def _fill_conversation_first_client(mapper, connection, target):
+    """
+    Le premier message client inséré fixe l'expéditeur dénormalisé de la conversation
+    (colonnes encore toutes vides : un premier message sans nom, SMS ou adresse seule, compte aussi).
+    """
+    if not target.is_from_client or target.conversation_id is None:
+        return
+    values = {
+        "first_client_name": target.from_name,
+        "first_client_email": target.from_email,
+        "first_client_phone": target.from_phone,
+    }
+    updated = connection.execute(
+        update(Conversation.__table__)
+        .where(
+            Conversation.__table__.c.id == target.conversation_id,
+            Conversation.__table__.c.first_client_name.is_(None),
+            Conversation.__table__.c.first_client_email.is_(None),
+            Conversation.__table__.c.first_client_phone.is_(None)
+        )
+        .values(**values)
+    ).rowcount
+    # Conversation déjà en session : aligner son état sans la marquer modifiée
+    conversation = target.__dict__.get("conversation")
+    if updated and conversation is not None:
+        for key, value in values.items():
+            set_committed_value(conversation, key, value)
 
 
 class MessageAttachment(Base):
@@ -88,10 +164,58 @@ class MessageAttachment(Base):
     file_size = Column(Integer, nullable=False)  # Taille en bytes
     mime_type = Column(String, nullable=True)  # MIME type (image/jpeg, application/pdf, etc.)
     
+    # Contenu dédoublonné (stockage adressé par hash) ; file_path reprend alors celui du blob
+    blob_id = Column(Integer, ForeignKey("attachment_blobs.id"), nullable=True, index=True)
+    
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     
     # Relations
     message = relationship("InboxMessage", back_populates="attachments")
+    blob = relationship("AttachmentBlob")
+
+
+class AttachmentBlob(Base):
+    """
+    Fichier de pièce jointe stocké une seule fois par entreprise, identifié par son SHA-256.
+    ref_count = nombre de MessageAttachment qui le référencent (tenu à jour à l'insertion / suppression) ;
+    un blob à 0 référence est supprimé (fichier compris) par purge_unreferenced_blobs.
+    """
+    __tablename__ = "attachment_blobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
+    sha256 = Column(String(64), nullable=False)
+    file_path = Column(String, nullable=False)  # Relatif à UPLOAD_DIR : <company_id>/attachments/<sha256><ext>
+    file_size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    
+    __table_args__ = (
+        UniqueConstraint("company_id", "sha256", name="uq_attachment_blobs_company_sha256"),
+    )
+
+
+def _adjust_blob_ref_count(connection, blob_id, delta: int) -> None:
+    connection.execute(
+        update(AttachmentBlob.__table__)
+        .where(AttachmentBlob.__table__.c.id == blob_id)
+        .values(ref_count=AttachmentBlob.__table__.c.ref_count + delta)
+    )
+
+
+@event.listens_for(MessageAttachment, "after_insert")
+def _acquire_attachment_blob(mapper, connection, target):
+    """Une référence de plus sur le blob de la pièce jointe."""
+    if target.blob_id is not None:
+        _adjust_blob_ref_count(connection, target.blob_id, 1)
+
+
+@event.listens_for(MessageAttachment, "after_delete")
+def _release_attachment_blob(mapper, connection, target):
+    """Une référence de moins (y compris via la cascade conversation -> messages -> pièces jointes)."""
+    if target.blob_id is not None:
+        _adjust_blob_ref_count(connection, target.blob_id, -1)
 
 
 class InboxFolder(Base):
@@ -120,6 +244,30 @@ class InboxFolder(Base):
     conversations = relationship("Conversation", back_populates="folder")
 
 
+class EmailThreadKey(Base):
+    """
+    Index de threading email : associe chaque Message-ID connu (reçu ou envoyé) et le hash
+    du sujet normalisé à une conversation. Une seule requête résout In-Reply-To + References.
+    """
+    __tablename__ = "email_thread_keys"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False, index=True)
+    
+    key_type = Column(String(16), nullable=False)  # message_id, subject
+    thread_key = Column(String, nullable=False)  # Message-ID normalisé ou hash SHA-256 du sujet normalisé
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    
+    # Relations
+    conversation = relationship("Conversation", back_populates="thread_keys")
+    
+    __table_args__ = (
+        UniqueConstraint("company_id", "key_type", "thread_key", name="uq_email_thread_keys_company_type_key"),
+    )
+
+
 class InternalNote(Base):
     __tablename__ = "internal_notes"
     
@@ -0,0 +1,25 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, UniqueConstraint
+from sqlalchemy.sql import func
+from app.db.base import Base
+
+
+class DocumentSequence(Base):
+    """
+    Dernier numéro attribué d'une séquence de documents (devis, factures, avoirs).
+    Une ligne par entreprise, type de document, année et version de la configuration de
+    numérotation (préfixe, séparateur, format d'année, suffixe). Incrémentée sous verrou de
+    ligne dans la transaction qui crée le document : numérotation continue et sans trou.
+    """
+    __tablename__ = "document_sequences"
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, ForeignKey("companies.id", ondelete="CASCADE"), nullable=False)
+    doc_type = Column(String(20), nullable=False)  # quotes, invoices, credit_notes
+    year = Column(Integer, nullable=False)
+    config_version = Column(String(32), nullable=False)  # Empreinte du format (un changement de préfixe ouvre une nouvelle séquence)
+    last_value = Column(Integer, nullable=False, default=0)  # Dernier numéro séquentiel attribué
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("company_id", "doc_type", "year", "config_version", name="uq_document_sequences_scope"),
+    )
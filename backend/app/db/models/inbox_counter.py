@@ -0,0 +1,227 @@
+from sqlalchemy import Column, Integer, DateTime, ForeignKey, UniqueConstraint, case, event, inspect, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
+from app.db.base import Base
+from app.db.models.company import Company
+from app.db.models.conversation import Conversation
+
+
+# folder_id des conversations sans dossier (pas de NULL dans la clé unique)
+NO_FOLDER = 0
+
+COUNTER_FIELDS = ("total", "unread", "urgent", "to_answer", "waiting", "pending_approval")
+
+
+class InboxCounter(Base):
+    """
+    Compteurs agrégés de l'inbox par entreprise et par dossier (badges).
+    Tenus à jour dans la transaction qui modifie les conversations (écouteur after_flush
+    ci-dessous) : total, conversations non lues, urgentes, à répondre, en attente et
+    réponses automatiques à valider.
+    """
+    __tablename__ = "inbox_counters"
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, ForeignKey("companies.id", ondelete="CASCADE"), nullable=False)
+    folder_id = Column(Integer, nullable=False, default=NO_FOLDER)  # NO_FOLDER = sans dossier
+
+    total = Column(Integer, nullable=False, default=0)
+    unread = Column(Integer, nullable=False, default=0)  # Conversations avec des messages non lus
+    urgent = Column(Integer, nullable=False, default=0)  # Statut "Urgent" ou marquées urgentes
+    to_answer = Column(Integer, nullable=False, default=0)  # Statut "À répondre"
+    waiting = Column(Integer, nullable=False, default=0)  # Statut "En attente"
+    pending_approval = Column(Integer, nullable=False, default=0)  # Auto-réponse en attente de validation
+
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("company_id", "folder_id", name="uq_inbox_counters_company_folder"),
+    )
+
+
+# Colonnes de Conversation qui déterminent sa contribution aux compteurs
+_TRACKED = ("company_id", "folder_id", "status", "is_urgent", "unread_count", "auto_reply_pending", "auto_reply_mode")
+_DEFAULTS = {"status": "À répondre", "is_urgent": False, "unread_count": 0, "auto_reply_pending": False}
+
+
+def _connection(bind):
+    """Session ou Connection -> Connection de la transaction en cours."""
+    return bind.connection() if isinstance(bind, Session) else bind
+
+
+def conversation_counters(values) -> dict:
+    """Contribution d'une conversation ({colonne: valeur}) à la ligne de compteurs de son dossier."""
+    status = values["status"]
+    return {
+        "total": 1,
+        "unread": 1 if (values["unread_count"] or 0) > 0 else 0,
+        "urgent": 1 if status == "Urgent" or values["is_urgent"] else 0,
+        "to_answer": 1 if status == "À répondre" else 0,
+        "waiting": 1 if status == "En attente" else 0,
+        "pending_approval": 1 if values["auto_reply_pending"] and values["auto_reply_mode"] == "approval" else 0,
+    }
+
+
+def recompute_inbox_counters(connection, company_id: int) -> None:
+    """
+    Recalcule les compteurs d'une entreprise depuis les conversations (une requête GROUP BY).
+    Pour les modifications en masse (UPDATE groupés) que l'écouteur ORM ne voit pas.
+    `connection` : Connection ou Session, dans la transaction en cours.
+    
+    Les lignes sont écrasées par upsert (ON CONFLICT DO UPDATE) plutôt que supprimées puis
+    réinsérées : deux recalculs simultanés de la même entreprise ne se heurtent pas à la clé unique.
+    """
+    connection = _connection(connection)
+    conversation = Conversation.__table__.c
+    status = conversation.status
+    counted = lambda condition: func.sum(case((condition, 1), else_=0))
+    rows = connection.execute(
+        select(
+            func.coalesce(conversation.folder_id, NO_FOLDER).label("folder_id"),
+            func.count().label("total"),
+            counted(conversation.unread_count > 0).label("unread"),
+            counted((status == "Urgent") | (conversation.is_urgent == True)).label("urgent"),
+            counted(status == "À répondre").label("to_answer"),
+            counted(status == "En attente").label("waiting"),
+            counted((conversation.auto_reply_pending == True) & (conversation.auto_reply_mode == "approval")).label("pending_approval"),
+        )
+        .where(conversation.company_id == company_id)
+        .group_by(func.coalesce(conversation.folder_id, NO_FOLDER))
+    ).all()
+    table = InboxCounter.__table__
+    insert = pg_insert if connection.dialect.name == "postgresql" else sqlite_insert
+    folder_ids = []
+    for row in rows:
+        values = {key: row._mapping[key] or 0 for key in COUNTER_FIELDS}
+        folder_ids.append(row._mapping["folder_id"])
+        statement = insert(table).values(company_id=company_id, folder_id=row._mapping["folder_id"], **values)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.company_id, table.c.folder_id],
+            set_={**values, "updated_at": func.now()},
+        ))
+    # Dossiers sans plus aucune conversation
+    connection.execute(table.delete().where(table.c.company_id == company_id, table.c.folder_id.notin_(folder_ids)))
+
+
+def _apply_counter_deltas(connection, deltas: dict) -> None:
+    """Ajoute {(company_id, folder_id): {compteur: delta}} aux lignes (créées au besoin)."""
+    table = InboxCounter.__table__
+    insert = pg_insert if connection.dialect.name == "postgresql" else sqlite_insert
+    for (company_id, folder_id), delta in sorted(deltas.items()):
+        changes = {key: value for key, value in delta.items() if value}
+        if not changes:
+            continue
+        statement = insert(table).values(
+            company_id=company_id, folder_id=folder_id, **{key: max(value, 0) for key, value in changes.items()}
+        )
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.company_id, table.c.folder_id],
+            set_={**{key: table.c[key] + value for key, value in changes.items()}, "updated_at": func.now()},
+        ))
+
+
+def count_folder_assignments(connection, company_id: int, assignments: dict) -> None:
+    """
+    Reporte sur les compteurs un déplacement en masse {conversation_id: folder_id} (à appeler
+    avant l'UPDATE groupé, que l'écouteur ORM ne voit pas). Une requête sur les conversations concernées.
+    """
+    if not assignments:
+        return
+    connection = _connection(connection)
+    conversation = Conversation.__table__.c
+    deltas = {}
+    rows = connection.execute(
+        select(*[conversation[key] for key in ("id", *_TRACKED)])
+        .where(conversation.company_id == company_id, conversation.id.in_(list(assignments)))
+    ).all()
+    for row in rows:
+        values = dict(row._mapping)
+        new_folder_id = assignments[values.pop("id")]
+        if (values["folder_id"] or NO_FOLDER) == (new_folder_id or NO_FOLDER):
+            continue
+        for folder_id, sign in ((values["folder_id"], -1), (new_folder_id, 1)):
+            delta = deltas.setdefault((company_id, folder_id or NO_FOLDER), dict.fromkeys(COUNTER_FIELDS, 0))
+            for name, value in conversation_counters(values).items():
+                delta[name] += sign * value
+    _apply_counter_deltas(connection, deltas)
+
+
+def merge_folder_counters(connection, company_id: int, folder_id: int) -> None:
+    """Dossier supprimé : ses compteurs passent aux conversations sans dossier."""
+    connection = _connection(connection)
+    table = InboxCounter.__table__
+    row = connection.execute(
+        select(*[table.c[field] for field in COUNTER_FIELDS])
+        .where(table.c.company_id == company_id, table.c.folder_id == folder_id)
+    ).first()
+    if row is None:
+        return
+    _apply_counter_deltas(connection, {(company_id, NO_FOLDER): dict(row._mapping)})
+    connection.execute(table.delete().where(table.c.company_id == company_id, table.c.folder_id == folder_id))
+
+
+def _previous_values(state):
+    """Valeurs suivies avant le flush, ou None si l'une n'était pas chargée (objet expiré)."""
+    values = {}
+    for key in _TRACKED:
+        history = state.attrs[key].history
+        if history.deleted:
+            values[key] = history.deleted[0]
+        elif history.unchanged:
+            values[key] = history.unchanged[0]
+        else:
+            return None
+    return values
+
+
+@event.listens_for(Session, "after_flush")
+def _maintain_inbox_counters(session, flush_context):
+    """Reporte les créations, modifications et suppressions de conversations sur inbox_counters."""
+    deltas, stale = {}, set()
+
+    def add(values, sign):
+        key = (values["company_id"], values["folder_id"] or NO_FOLDER)
+        row = deltas.setdefault(key, dict.fromkeys(COUNTER_FIELDS, 0))
+        for name, value in conversation_counters(values).items():
+            row[name] += sign * value
+
+    def current(conversation):
+        return {key: getattr(conversation, key) if getattr(conversation, key) is not None else _DEFAULTS.get(key) for key in _TRACKED}
+
+    for conversation in session.new:
+        if isinstance(conversation, Conversation):
+            add(current(conversation), 1)
+    for conversation in session.dirty:
+        if not isinstance(conversation, Conversation):
+            continue
+        state = inspect(conversation)
+        if not any(state.attrs[key].history.has_changes() for key in _TRACKED):
+            continue
+        previous = _previous_values(state)
+        if previous is None:
+            stale.add(conversation.company_id)
+            continue
+        add(previous, -1)
+        add(current(conversation), 1)
+    for conversation in session.deleted:
+        if not isinstance(conversation, Conversation):
+            continue
+        previous = _previous_values(inspect(conversation))
+        if previous is None:
+            stale.add(conversation.company_id)
+        else:
+            add(previous, -1)
+
+    if not deltas and not stale:
+        return
+    # Entreprise supprimée dans ce flush : ses compteurs partent en cascade
+    deleted_companies = {company.id for company in session.deleted if isinstance(company, Company)}
+    connection = _connection(session)
+    _apply_counter_deltas(connection, {
+        key: delta for key, delta in deltas.items()
+        if key[0] not in stale and key[0] not in deleted_companies
+    })
+    for company_id in stale - deleted_companies:
+        recompute_inbox_counters(connection, company_id)
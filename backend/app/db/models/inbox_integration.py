@@ -1,7 +1,7 @@
 """
 Modèles pour les intégrations Inbox (IMAP, API externes)
 """
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Text
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey, Boolean, Text, JSON
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.db.base import Base
@@ -46,6 +46,11 @@ class InboxIntegration(Base):
     last_sync_status = Column(String, nullable=True)  # "success", "error", etc.
     last_sync_error = Column(Text, nullable=True)  # Message d'erreur si échec
     
+    # Synchronisation IMAP incrémentale (high-water mark par boîte)
+    imap_uidvalidity = Column(BigInteger, nullable=True)  # UIDVALIDITY de INBOX lors de la dernière sync
+    imap_last_uid = Column(BigInteger, nullable=True)  # Plus grand UID déjà ingéré
+    imap_failed_uid_attempts = Column(JSON, nullable=True)  # {uid: échecs} des UIDs au-delà du high-water mark
+    
     # Métadonnées
     sync_interval_minutes = Column(Integer, default=5, nullable=False)  # Intervalle de synchronisation (minutes)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
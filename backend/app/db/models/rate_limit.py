@@ -0,0 +1,14 @@
+from sqlalchemy import Column, String, Float
+from app.db.base import Base
+
+
+class RateLimitBucket(Base):
+    """
+    Seau à jetons partagé entre les workers (backend "database" du limiteur OpenAI).
+    tokens = jetons disponibles à refilled_at (timestamp Unix) ; le remplissage est calculé à la lecture.
+    """
+    __tablename__ = "rate_limit_buckets"
+    
+    key = Column(String(64), primary_key=True)  # ex: openai:rpm, openai:tpm
+    tokens = Column(Float, nullable=False)
+    refilled_at = Column(Float, nullable=False)
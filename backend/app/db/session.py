@@ -136,6 +136,19 @@ def get_db():
         db.close()
 
 
+def _ensure_search_index():
+    """
+    Index plein texte de l'inbox pour SQLite (tables créées par create_all, hors migrations).
+    Sous PostgreSQL, la colonne et l'index GIN relèvent uniquement de la migration
+    add_inbox_search_index : pas de DDL au démarrage.
+    """
+    try:
+        from app.core.inbox_search import ensure_search_index
+        ensure_search_index(engine)
+    except Exception as e:
+        logger.warning(f"⚠️ Index de recherche plein texte non créé: {e}")
+
+
 def init_db():
     """
     Initialise la base de données en créant toutes les tables.
@@ -154,6 +167,7 @@ def init_db():
         # SQLite : pas besoin de retry
         try:
             Base.metadata.create_all(bind=engine)
+            _ensure_search_index()
             logger.info("✅ Base de données SQLite initialisée")
         except Exception as e:
             logger.warning(f"⚠️ Erreur lors de l'initialisation SQLite (tables peuvent exister déjà): {e}")
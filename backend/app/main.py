@@ -4,7 +4,7 @@ from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError, ResponseValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 import os
-from app.api.routes import auth, users, companies, clients, inbox, inbox_webhooks, inbox_integrations, tasks, checklists, projects, appointments, followups, invoices, quotes, billing_line_templates, notifications, chatbot, dashboard, stripe, contact, subscription, cron
+from app.api.routes import auth, users, companies, clients, inbox, inbox_webhooks, inbox_integrations, tasks, checklists, projects, appointments, followups, invoices, quotes, billing_line_templates, notifications, chatbot, dashboard, stripe, contact, subscription, cron, billing_exports
 from app.db.session import init_db
 from app.core.log_sanitizer import setup_sanitized_logging
 from app.core.config import settings
@@ -354,6 +354,7 @@ app.include_router(inbox_webhooks.router)
 app.include_router(inbox_integrations.router)
 app.include_router(invoices.router)
 app.include_router(quotes.router)
+app.include_router(billing_exports.router)
 app.include_router(billing_line_templates.router)
 app.include_router(notifications.router)
 app.include_router(chatbot.router)
@@ -441,9 +442,75 @@ async def startup_event():
     # Lancer l'initialisation Supabase Storage en arrière-plan (non-bloquant)
     asyncio.create_task(init_supabase_storage())
     
+    # Mode push IMAP IDLE (optionnel) : une sync est déclenchée dès qu'un email arrive
+    if settings.IMAP_IDLE_ENABLED:
+        async def start_imap_idle():
+            try:
+                from app.core.imap_connection_pool import start_idle_watchers, DebouncedSyncTrigger
+                from scripts.sync_emails_periodic import sync_integration_isolated
+                
+                trigger = DebouncedSyncTrigger(
+                    lambda integration_id: sync_integration_isolated(integration_id, settings.IMAP_SYNC_TIMEOUT_SECONDS)
+                )
+                # Un seul worker garde les connexions IDLE (verrou de leader), les autres prennent le relais s'il s'arrête
+                start_idle_watchers(trigger)
+            except Exception as e:
+                logger.warning(f"⚠️ Démarrage IMAP IDLE: {e}")
+        
+        asyncio.create_task(start_imap_idle())
+    
+    # Worker de la file de classification IA (dossiers + auto-réponse des emails ingérés)
+    if settings.CLASSIFICATION_WORKER_ENABLED:
+        try:
+            from app.core.classification_queue import start_classification_worker
+            start_classification_worker()
+        except Exception as e:
+            logger.warning(f"⚠️ Démarrage du worker de classification: {e}")
+    
+    # Workers de la file d'auto-réponse (génération IA + envoi SMTP/SMS hors de l'ingestion)
+    if settings.AUTO_REPLY_WORKERS > 0:
+        try:
+            from app.core.auto_reply_dispatcher import start_auto_reply_workers
+            start_auto_reply_workers()
+        except Exception as e:
+            logger.warning(f"⚠️ Démarrage des workers d'auto-réponse: {e}")
+    
+    # Worker des exports en lot des PDF (archives ZIP factures / devis)
+    if settings.BILLING_EXPORT_WORKER_ENABLED:
+        try:
+            from app.core.billing_export import start_billing_export_worker
+            start_billing_export_worker()
+        except Exception as e:
+            logger.warning(f"⚠️ Démarrage du worker des exports: {e}")
+    
+    # Évènements temps réel de l'inbox (écoute PostgreSQL avec le backend postgres)
+    try:
+        from app.core.inbox_events import start_inbox_events
+        start_inbox_events()
+    except Exception as e:
+        logger.warning(f"⚠️ Démarrage des évènements de l'inbox: {e}")
+    
     logger.info("✅ Application démarrée (startup non-bloquant)")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Ferme les connexions IMAP persistantes (pool et watchers IDLE), arrête les workers (classification, auto-réponse, exports, rendu PDF) et l'écoute des évènements."""
+    from app.core.imap_connection_pool import imap_pool, stop_idle_watchers
+    from app.core.classification_queue import stop_classification_worker
+    from app.core.auto_reply_dispatcher import stop_auto_reply_workers
+    from app.core.inbox_events import stop_inbox_events
+    from app.core.billing_export import stop_billing_export_worker
+    from app.core.pdf_render_pool import pdf_render_pool
+    stop_idle_watchers()
+    imap_pool.close_all()
+    stop_classification_worker()
+    stop_auto_reply_workers()
+    stop_billing_export_worker()
+    pdf_render_pool.shutdown()
+    stop_inbox_events()
+
+
 # Handler OPTIONS explicite pour gérer les requêtes preflight CORS
 
 
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Worker de la file d'auto-réponse (génération IA et envoi SMTP / SMS).
+
+Traite en continu les jobs d'auto-réponse enfilés à l'ingestion et après classification.
+Plusieurs workers peuvent tourner en parallèle (réclamation des jobs sans doublon). Le serveur
+web en démarre déjà AUTO_REPLY_WORKERS dans des threads : ce script permet d'en ajouter dans
+des processus dédiés.
+
+Usage:
+    python scripts/auto_reply_worker.py
+"""
+import sys
+import os
+
+# Ajouter le répertoire parent au path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+import signal
+import threading
+from app.core.auto_reply_dispatcher import run_auto_reply_worker
+
+# Configuration du logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+if __name__ == "__main__":
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    logger.info("[AUTO REPLY WORKER] Démarrage")
+    run_auto_reply_worker(stop_event)
+    logger.info("[AUTO REPLY WORKER] Arrêt")
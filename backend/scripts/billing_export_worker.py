@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Worker des exports en lot des PDF (archives ZIP des factures / devis d'une période).
+
+Exécute les exports demandés via POST /billing/exports : rendu des PDF dans le pool de rendu,
+assemblage de l'archive, reprise des exports interrompus. Le serveur web en démarre déjà un dans
+un thread (BILLING_EXPORT_WORKER_ENABLED) : ce script permet de l'exécuter dans un processus dédié
+(les archives sont écrites dans BILLING_EXPORT_DIR, qui doit être partagé avec le serveur web).
+
+Usage:
+    python scripts/billing_export_worker.py
+"""
+import sys
+import os
+
+# Ajouter le répertoire parent au path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+import signal
+import threading
+from app.core.billing_export import run_billing_export_worker
+from app.core.pdf_render_pool import pdf_render_pool
+
+# Configuration du logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+if __name__ == "__main__":
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    logger.info("[BILLING EXPORT WORKER] Démarrage")
+    try:
+        run_billing_export_worker(stop_event)
+    finally:
+        pdf_render_pool.shutdown()
+    logger.info("[BILLING EXPORT WORKER] Arrêt")
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Worker de la file de classification IA (dossiers, mise en file des auto-réponses).
+
+Traite en continu les jobs créés par l'ingestion des emails. Plusieurs workers peuvent tourner
+en parallèle (réclamation des jobs sans doublon). Le serveur web en démarre déjà un dans un
+thread (CLASSIFICATION_WORKER_ENABLED) : ce script permet d'en ajouter dans des processus dédiés.
+
+Usage:
+    python scripts/classification_worker.py
+"""
+import sys
+import os
+
+# Ajouter le répertoire parent au path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+import signal
+import threading
+from app.core.classification_queue import run_classification_worker
+
+# Configuration du logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+if __name__ == "__main__":
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    logger.info("[CLASSIFICATION WORKER] Démarrage")
+    run_classification_worker(stop_event)
+    logger.info("[CLASSIFICATION WORKER] Arrêt")
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Supprime les anciens fichiers de pièces jointes recopiés dans le stockage adressé par contenu
+par la migration add_attachment_blobs. À lancer une fois la migration appliquée (alembic upgrade) :
+un fichier encore référencé en base (migration annulée) est conservé.
+
+Usage:
+    python scripts/cleanup_legacy_attachments.py
+"""
+import sys
+import os
+
+# Ajouter le répertoire parent au path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+from app.db.session import SessionLocal
+from app.core.attachment_store import delete_migrated_legacy_files
+
+# Configuration du logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+if __name__ == "__main__":
+    db = SessionLocal()
+    try:
+        deleted = delete_migrated_legacy_files(db)
+        logger.info(f"[ATTACHMENTS] {deleted} ancien(s) fichier(s) supprimé(s)")
+    finally:
+        db.close()
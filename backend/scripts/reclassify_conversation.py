@@ -49,6 +49,7 @@ def reclassify_conversation(conversation_id: int):
         
         if folder_id:
             conversation.folder_id = folder_id
+            conversation.ai_classified = True
             db.commit()
             print(f"✅ Conversation classée dans le dossier ID: {folder_id}")
         else:
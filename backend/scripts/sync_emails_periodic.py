@@ -19,25 +19,21 @@ from app.db.session import SessionLocal
 from app.db.retry import execute_with_retry
 from app.db.models.inbox_integration import InboxIntegration
 from app.db.models.company import Company
-from app.core.imap_service import fetch_emails_async, get_message_ids_from_imap_async
+from app.core.imap_service import fetch_emails_incremental_async, apply_uid_failures
+from app.core.imap_sync_scheduler import run_integration_syncs, summarize_sync_results, EMPTY_SYNC_STATS
 from app.api.routes.inbox_integrations import (
-    normalize_message_id,
-    normalize_subject,
-    find_conversation_from_reply,
-    is_duplicate_message,
-    detect_newsletter_or_spam
+    detect_newsletter_or_spam,
+    make_known_message_ids_checker
 )
-from app.core.conversation_classifier import auto_classify_conversation_status
-from app.core.folder_ai_classifier import classify_conversation_to_folder
-from app.db.models.conversation import Conversation, InboxMessage, InboxFolder, MessageAttachment
-from app.db.models.client import Client
+from app.core.email_ingest import EmailIngestPipeline
+from app.core.attachment_store import AttachmentStore
 from datetime import datetime
-from pathlib import Path
-import uuid
 from app.core.config import settings
 from app.core.encryption_service import get_encryption_service
 import asyncio
 import logging
+import threading
+import time
 
 # Configuration du logging
 logging.basicConfig(
@@ -46,26 +42,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Répertoire de stockage des fichiers
-UPLOAD_DIR = Path(settings.UPLOAD_DIR)
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
-
-def get_file_type(filename: str) -> str:
-    """Détermine le type de fichier basé sur l'extension."""
-    ext = Path(filename).suffix.lower()
-    if ext in [".jpg", ".jpeg", ".png", ".gif", ".webp"]:
-        return "image"
-    elif ext == ".pdf":
-        return "pdf"
-    elif ext in [".doc", ".docx", ".xls", ".xlsx", ".txt", ".csv"]:
-        return "document"
-    else:
-        return "other"
-
-
-async def sync_integration(integration: InboxIntegration, db):
-    """Synchronise une intégration IMAP spécifique."""
+async def sync_integration(integration: InboxIntegration, db, should_stop=None):
+    """
+    Synchronise une intégration IMAP spécifique.
+    `should_stop` : annulation coopérative du fetch IMAP (voir sync_integration_isolated).
+    """
     try:
         logger.info(f"[SYNC PERIODIC] Synchronisation de {integration.email_address} (ID: {integration.id})")
         
@@ -103,202 +85,63 @@ async def sync_integration(integration: InboxIntegration, db):
             # Première sync, récupérer les 14 derniers jours
             logger.info(f"[SYNC PERIODIC] Première sync, récupération des 14 derniers jours")
         
-        # Récupérer les emails depuis IMAP
-        emails = await fetch_emails_async(
+        # Ingestion par lots : dédoublonnage, clients, threading et insertions groupés.
+        # La classification en dossiers et l'auto-réponse sont confiées à la file de classification
+        # (jobs créés dans la transaction de chaque lot) : la sync ne fait aucun appel IA.
+        pipeline = EmailIngestPipeline(
+            db,
+            company_id=company.id,
+            integration_id=integration.id,
+            email_filter=detect_newsletter_or_spam,
+            enqueue_classification=True
+        )
+        
+        # Le fetch tourne dans le thread IMAP : l'ingestion est renvoyée dans le thread de l'event loop
+        # (celui de la session DB) et le thread IMAP attend sa fin avant de parser l'email suivant
+        loop = asyncio.get_running_loop()
+        
+        async def _ingest_email(email_data):
+            pipeline.add(email_data)
+        
+        def _on_email(email_data):
+            asyncio.run_coroutine_threadsafe(_ingest_email(email_data), loop).result()
+        
+        # Récupérer les emails depuis IMAP (incrémental par UID si un high-water mark existe)
+        # en streaming : chaque email est ingéré par lots au fil du fetch, pièces jointes écrites sur disque
+        fetch_result = await fetch_emails_incremental_async(
             imap_server=integration.imap_server,
             imap_port=integration.imap_port or 993,
             email_address=integration.email_address,
             password=decrypted_password,
             company_code=company.code,
             use_ssl=integration.use_ssl if integration.use_ssl is not None else True,
-            since_hours=since_hours
+            since_hours=since_hours,
+            last_uid=integration.imap_last_uid,
+            uidvalidity=integration.imap_uidvalidity,
+            known_message_ids=make_known_message_ids_checker(company.id),
+            on_email=_on_email,
+            attachment_store=AttachmentStore(company.id),
+            should_stop=should_stop
         )
+        ingest_result = pipeline.flush()
         
-        logger.info(f"[SYNC PERIODIC] {len(emails)} email(s) récupéré(s)")
-        
-        stats = {"processed": 0, "created": 0, "errors": 0, "skipped": 0}
-        
-        # Traiter chaque email (même logique que inbox_integrations.py)
-        for email_data in emails:
-            try:
-                # Vérifier les doublons
-                message_id = email_data.get("message_id")
-                from_email = email_data.get("from", {}).get("email")
-                content = email_data.get("content", "")
-                email_date_str = email_data.get("date")
-                email_date = None
-                
-                if email_date_str:
-                    try:
-                        email_date = datetime.fromisoformat(email_date_str.replace('Z', '+00:00'))
-                    except:
-                        try:
-                            email_date = datetime.fromisoformat(email_date_str)
-                        except:
-                            pass
-                
-                if is_duplicate_message(db, company.id, message_id, from_email, content, email_date):
-                    logger.debug(f"[SYNC PERIODIC] Email ignoré (doublon): {email_data.get('subject', 'Sans sujet')[:50]} de {from_email}")
-                    stats["skipped"] += 1
-                    continue
-                
-                # Détecter newsletters/spam
-                is_filtered, filter_reason = detect_newsletter_or_spam(email_data)
-                if is_filtered:
-                    logger.info(f"[SYNC PERIODIC] Email filtré comme {filter_reason}: {email_data.get('subject', 'Sans sujet')[:50]} de {from_email}")
-                    stats["skipped"] += 1
-                    continue
-                
-                # Identifier ou créer le client
-                client = None
-                if from_email:
-                    def _get_client():
-                        return db.query(Client).filter(
-                            Client.company_id == company.id,
-                            Client.email == from_email
-                        ).first()
-                    client = execute_with_retry(db, _get_client, max_retries=3, initial_delay=0.5, max_delay=2.0)
-                    
-                    if not client:
-                        client = Client(
-                            company_id=company.id,
-                            name=email_data.get("from", {}).get("name", from_email.split("@")[0]),
-                            email=from_email,
-                            type="Client"
-                        )
-                        db.add(client)
-                        db.flush()
-                
-                # Chercher ou créer une conversation
-                subject = email_data.get("subject", "")
-                normalized_subject = normalize_subject(subject) if subject else ""
-                
-                in_reply_to = email_data.get("in_reply_to")
-                references = email_data.get("references", [])
-                
-                conversation = None
-                
-                # Chercher via In-Reply-To ou References
-                if in_reply_to or references:
-                    conversation = find_conversation_from_reply(
-                        db, company.id, in_reply_to, references, normalized_subject, from_email
-                    )
-                
-                # Sinon chercher par sujet
-                if not conversation:
-                    if normalized_subject:
-                        def _get_conversation_by_normalized_subject():
-                            return db.query(Conversation).filter(
-                                Conversation.company_id == company.id,
-                                Conversation.source == "email",
-                                Conversation.subject == normalized_subject
-                            ).first()
-                        conversation = execute_with_retry(db, _get_conversation_by_normalized_subject, max_retries=3, initial_delay=0.5, max_delay=2.0)
-                    
-                    if not conversation and subject:
-                        def _get_conversation_by_subject():
-                            return db.query(Conversation).filter(
-                                Conversation.company_id == company.id,
-                                Conversation.source == "email",
-                                Conversation.subject == subject
-                            ).first()
-                        conversation = execute_with_retry(db, _get_conversation_by_subject, max_retries=3, initial_delay=0.5, max_delay=2.0)
-                
-                # Créer une nouvelle conversation si nécessaire
-                conversation_subject = normalized_subject if normalized_subject else subject
-                if not conversation:
-                    conversation = Conversation(
-                        company_id=company.id,
-                        client_id=client.id if client else None,
-                        subject=conversation_subject,
-                        status="À répondre",
-                        source="email",
-                        unread_count=1,
-                        last_message_at=datetime.utcnow(),
-                    )
-                    db.add(conversation)
-                    db.flush()
-                    logger.info(f"[SYNC PERIODIC] ✅ Nouvelle conversation créée: ID={conversation.id}")
-                
-                # Créer le message
-                normalized_message_id = normalize_message_id(message_id) if message_id else None
-                message = InboxMessage(
-                    conversation_id=conversation.id,
-                    from_name=email_data.get("from", {}).get("name", from_email or "Inconnu"),
-                    from_email=from_email,
-                    content=content,
-                    source="email",
-                    is_from_client=True,
-                    read=False,
-                    external_id=normalized_message_id,
-                    external_metadata={
-                        "to": email_data.get("to"),
-                        "imap_uid": email_data.get("imap_uid"),
-                        "integration_id": integration.id,
-                    }
-                )
-                db.add(message)
-                db.flush()
-                
-                # Traiter les pièces jointes
-                attachments_data = email_data.get("attachments", [])
-                if attachments_data:
-                    company_upload_dir = UPLOAD_DIR / str(company.id)
-                    company_upload_dir.mkdir(parents=True, exist_ok=True)
-                    
-                    for att_data in attachments_data:
-                        if not att_data.get("content"):
-                            continue
-                        
-                        filename = att_data.get("filename", "attachment")
-                        file_type = get_file_type(filename)
-                        unique_filename = f"{uuid.uuid4()}_{filename}"
-                        file_path = company_upload_dir / unique_filename
-                        
-                        with open(file_path, "wb") as f:
-                            f.write(att_data["content"])
-                        
-                        attachment = MessageAttachment(
-                            message_id=message.id,
-                            name=filename,
-                            file_type=file_type,
-                            file_path=str(file_path.relative_to(UPLOAD_DIR)),
-                            file_size=len(att_data["content"]),
-                            mime_type=att_data.get("mime_type")
-                        )
-                        db.add(attachment)
-                
-                # Classification automatique
-                conversation.status = auto_classify_conversation_status(db, conversation, message)
-                
-                # Classification dans un dossier
-                old_folder_id = conversation.folder_id
-                folder_id = classify_conversation_to_folder(
-                    db=db,
-                    conversation=conversation,
-                    message=message,
-                    company_id=company.id
-                )
-                if folder_id:
-                    conversation.folder_id = folder_id
-                
-                db.commit()
-                stats["created"] += 1
-                stats["processed"] += 1
-                
-                # Traiter la réponse automatique si configurée
-                # IMPORTANT: Déclencher l'auto-réponse dès qu'un message entre dans un dossier avec auto-réponse activée
-                if conversation.folder_id and message.is_from_client:
-                    from app.core.auto_reply_service import trigger_auto_reply_if_needed
-                    trigger_auto_reply_if_needed(db, conversation, message)
-                
-            except Exception as e:
-                db.rollback()
-                stats["errors"] += 1
-                logger.error(f"[SYNC PERIODIC] Erreur lors du traitement d'un email: {e}", exc_info=True)
+        logger.info(
+            f"[SYNC PERIODIC] {ingest_result['processed'] + ingest_result['skipped'] + ingest_result['errors']} email(s) récupéré(s) "
+            f"({'incrémental depuis UID ' + str(integration.imap_last_uid) if fetch_result['incremental'] else 'fenêtre de dates'})"
+        )
+        stats = {key: ingest_result[key] for key in ("processed", "created", "errors", "skipped")}
+        failed_uids = fetch_result["failed_uids"] + ingest_result["failed_uids"]
         
-        # Mettre à jour last_sync_at après une sync réussie
+        # Mettre à jour last_sync_at et le high-water mark UID après une sync réussie
+        # (les emails en échec restent au-delà du high-water mark pour être retentés, dans la limite
+        # de IMAP_UID_MAX_ATTEMPTS échecs par UID)
         integration.last_sync_at = datetime.utcnow()
+        if fetch_result["uidvalidity"] is not None:
+            integration.imap_uidvalidity = fetch_result["uidvalidity"]
+            integration.imap_last_uid, integration.imap_failed_uid_attempts = apply_uid_failures(
+                fetch_result["max_uid"], failed_uids,
+                integration.imap_failed_uid_attempts if fetch_result["incremental"] else None
+            )
         db.commit()
         
         logger.info(f"[SYNC PERIODIC] ✅ Synchronisation terminée: {stats['created']} créé(s), {stats['skipped']} ignoré(s), {stats['errors']} erreur(s)")
@@ -309,14 +152,71 @@ async def sync_integration(integration: InboxIntegration, db):
         return {"processed": 0, "created": 0, "errors": 1, "skipped": 0}
 
 
+def sync_integration_isolated(integration_id: int, timeout_seconds: float) -> dict:
+    """
+    Synchronise une intégration dans le thread courant, avec sa propre session DB
+    et son propre event loop. Appelée par le scheduler (une tâche = une session).
+    
+    Au délai, wait_for annule la coroutine mais pas le thread IMAP qui télécharge : le fetch
+    consulte l'échéance avant chaque lot et chaque email, s'arrête et libère sa connexion
+    (au lieu de continuer à télécharger et d'appeler l'ingestion sur un event loop fermé).
+    """
+    db = SessionLocal()
+    stop_event = threading.Event()
+    deadline = time.monotonic() + timeout_seconds
+    
+    def should_stop() -> bool:
+        return stop_event.is_set() or time.monotonic() >= deadline
+    
+    try:
+        integration = execute_with_retry(
+            db,
+            lambda: db.query(InboxIntegration).filter(InboxIntegration.id == integration_id).first(),
+            max_retries=3
+        )
+        if not integration:
+            logger.warning(f"[SYNC PERIODIC] Intégration {integration_id} introuvable, ignorée")
+            return dict(EMPTY_SYNC_STATS)
+        
+        try:
+            return asyncio.run(asyncio.wait_for(
+                sync_integration(integration, db, should_stop=should_stop), timeout=timeout_seconds
+            ))
+        except asyncio.TimeoutError:
+            logger.error(f"[SYNC PERIODIC] ⏱️ Délai dépassé ({timeout_seconds}s) pour {integration.email_address} (ID: {integration_id})")
+            db.rollback()
+            integration.last_sync_status = "error"
+            integration.last_sync_error = f"Synchronisation interrompue après {timeout_seconds}s"
+            db.commit()
+            return dict(EMPTY_SYNC_STATS, errors=1, timed_out=True)
+    except Exception as e:
+        logger.error(f"[SYNC PERIODIC] Erreur lors de la synchronisation de l'intégration {integration_id}: {e}", exc_info=True)
+        db.rollback()
+        return dict(EMPTY_SYNC_STATS, errors=1)
+    finally:
+        stop_event.set()
+        db.close()
+
+
 async def sync_all_integrations():
-    """Synchronise toutes les intégrations IMAP actives."""
+    """
+    Synchronise toutes les intégrations IMAP actives en parallèle.
+    
+    Returns:
+        Dict avec les totaux et les stats/durées par intégration.
+    """
     db = SessionLocal()
+    result = {"totals": dict(EMPTY_SYNC_STATS), "integrations": []}
     try:
         logger.info("[SYNC PERIODIC] 🔄 Démarrage de la synchronisation périodique")
         
         # Récupérer toutes les intégrations IMAP actives avec retry pour gérer les erreurs SSL
-        query = db.query(InboxIntegration).filter(
+        # (uniquement les colonnes utiles au scheduler : chaque tâche recharge son intégration)
+        query = db.query(
+            InboxIntegration.id,
+            InboxIntegration.imap_server,
+            InboxIntegration.email_address
+        ).filter(
             InboxIntegration.integration_type == "imap",
             InboxIntegration.is_active == True
         )
@@ -328,80 +228,27 @@ async def sync_all_integrations():
         
         logger.info(f"[SYNC PERIODIC] {len(integrations)} intégration(s) IMAP active(s)")
         
-        total_stats = {"processed": 0, "created": 0, "errors": 0, "skipped": 0}
-        
-        for integration in integrations:
-            stats = await sync_integration(integration, db)
-            total_stats["processed"] += stats["processed"]
-            total_stats["created"] += stats["created"]
-            total_stats["errors"] += stats["errors"]
-            total_stats["skipped"] += stats["skipped"]
-        
-        logger.info(f"[SYNC PERIODIC] ✅ Synchronisation globale terminée: {total_stats['created']} conversation(s) créée(s)")
+        integration_results = await run_integration_syncs(
+            [
+                {"id": row.id, "imap_server": row.imap_server, "email_address": row.email_address}
+                for row in integrations
+            ],
+            sync_integration_isolated
+        )
+        total_stats = summarize_sync_results(integration_results)
+        result = {"totals": total_stats, "integrations": integration_results}
         
-        # Reclassifier les conversations sans dossier après la synchronisation
-        # Cela permet de classer les conversations dans les bons dossiers même si les dossiers ont été créés/modifiés après
-        logger.info(f"[SYNC PERIODIC] Reclassification des conversations sans dossier...")
-        try:
-            from app.core.folder_ai_classifier import reclassify_all_conversations
-            from app.core.auto_reply_service import trigger_auto_reply_if_needed
-            from datetime import timedelta
-            
-            # Reclassifier pour toutes les entreprises qui ont des intégrations actives
-            companies_query = db.query(Company).join(InboxIntegration).filter(
-                InboxIntegration.integration_type == "imap",
-                InboxIntegration.is_active == True
-            ).distinct()
-            companies_with_integrations = execute_with_retry(
-                db,
-                lambda: companies_query.all(),
-                max_retries=3
-            )
-            
-            total_classified = 0
-            total_auto_reply = 0
-            
-            for company in companies_with_integrations:
-                stats = reclassify_all_conversations(db=db, company_id=company.id, force=False)
-                classified_count = stats.get('classified', 0)
-                total_classified += classified_count
-                
-                if classified_count > 0:
-                    logger.info(f"[SYNC PERIODIC] {classified_count} conversation(s) classée(s) pour l'entreprise {company.id}")
-                    
-                    # Déclencher l'auto-réponse pour les conversations nouvellement classées
-                    recently_classified_query = db.query(Conversation).filter(
-                        Conversation.company_id == company.id,
-                        Conversation.folder_id.isnot(None),
-                        Conversation.updated_at >= datetime.utcnow() - timedelta(minutes=5)
-                    )
-                    recently_classified = execute_with_retry(
-                        db,
-                        lambda: recently_classified_query.all(),
-                        max_retries=3
-                    )
-                    
-                    for conv in recently_classified:
-                        def _get_last_message():
-                            return db.query(InboxMessage).filter(
-                                InboxMessage.conversation_id == conv.id,
-                                InboxMessage.is_from_client == True
-                            ).order_by(InboxMessage.created_at.desc()).first()
-                        last_message = execute_with_retry(db, _get_last_message, max_retries=3, initial_delay=0.5, max_delay=2.0)
-                        
-                        if last_message:
-                            trigger_auto_reply_if_needed(db, conv, last_message)
-                            total_auto_reply += 1
-            
-            logger.info(f"[SYNC PERIODIC] Reclassification terminée: {total_classified} conversation(s) classée(s), {total_auto_reply} auto-réponse(s) déclenchée(s)")
-        except Exception as e:
-            logger.error(f"[SYNC PERIODIC] Erreur lors de la reclassification: {e}", exc_info=True)
-            # Ne pas faire échouer la synchronisation si la reclassification échoue
+        logger.info(
+            f"[SYNC PERIODIC] ✅ Synchronisation globale terminée: {total_stats['created']} conversation(s) créée(s), "
+            f"{total_stats['timed_out']} intégration(s) hors délai, plus lente: {total_stats['slowest_seconds']}s"
+        )
         
     except Exception as e:
         logger.error(f"[SYNC PERIODIC] ❌ Erreur globale: {e}", exc_info=True)
     finally:
         db.close()
+    
+    return result
 
 
 if __name__ == "__main__":
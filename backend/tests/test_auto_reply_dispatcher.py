@@ -0,0 +1,175 @@
+"""
+Tests de la file d'auto-réponse (éligibilité à l'ingestion, idempotence, génération unique, envoi au plus une fois).
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db.base import Base  # importe aussi tous les modèles
+from app.db.models.auto_reply_job import AutoReplyJob
+from app.db.models.company import Company
+from app.db.models.conversation import Conversation, InboxFolder, InboxMessage
+from app.core import auto_reply_service
+from app.core.auto_reply_dispatcher import claim_jobs, enqueue_auto_reply, process_auto_reply_batch
+from app.core.config import settings
+from app.core.folder_rules import invalidate_folder_rules
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine, autoflush=False)()
+    session.add(Company(name="A", slug="a", code="AAAAAA"))
+    session.add_all([
+        InboxFolder(company_id=1, name="Devis", auto_reply={"enabled": True, "mode": "auto"}),
+        InboxFolder(company_id=1, name="Validation", auto_reply={"enabled": True, "mode": "approval"}),
+        InboxFolder(company_id=1, name="Sans réponse", auto_reply={"enabled": False, "mode": "auto"}),
+    ])
+    session.commit()
+    yield session
+    session.close()
+    invalidate_folder_rules()
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """
+    Génération et envoi simulés ; `calls["fail_sends"]` envois échouent avant le premier succès,
+    `calls["fail_records"]` envois réussissent mais leur enregistrement échoue.
+    """
+    calls = {"generate": 0, "deliver": 0, "fail_sends": 0, "fail_records": 0}
+
+    def generate(db, conversation, folder, config):
+        calls["generate"] += 1
+        return f"Réponse pour {folder.name}"
+
+    def deliver(db, conversation, reply_content):
+        calls["deliver"] += 1
+        if calls["fail_sends"]:
+            calls["fail_sends"] -= 1
+            return None
+        if calls["fail_records"]:
+            calls["fail_records"] -= 1
+            raise auto_reply_service.AutoReplySentNotRecorded("flush en échec")
+        message = InboxMessage(conversation_id=conversation.id, from_name="Entreprise", content=reply_content, source="email", is_from_client=False)
+        db.add(message)
+        db.flush()
+        return message
+
+    monkeypatch.setattr(auto_reply_service, "generate_auto_reply_content", generate)
+    monkeypatch.setattr(auto_reply_service, "deliver_auto_reply", deliver)
+    return calls
+
+
+def _incoming(db, folder_id, content="Bonjour"):
+    conversation = Conversation(company_id=1, subject="Demande", source="email", folder_id=folder_id)
+    message = InboxMessage(from_name="Client", from_email="client@example.com", content=content, source="email", is_from_client=True)
+    conversation.messages.append(message)
+    db.add(conversation)
+    db.commit()
+    return conversation, message
+
+
+def _make_available(db):
+    db.query(AutoReplyJob).update({"available_at": datetime.utcnow() - timedelta(seconds=1)})
+    db.commit()
+
+
+class TestAutoReplyQueue:
+    def test_enqueue_decides_from_cached_folder_config_and_is_idempotent(self, db):
+        conversation, message = _incoming(db, folder_id=1)
+        assert enqueue_auto_reply(db, conversation, message)
+        assert enqueue_auto_reply(db, conversation, message)  # même clé : ignoré
+        db.commit()
+        assert db.query(AutoReplyJob).count() == 1
+
+        for folder_id in (3, None):
+            other, other_message = _incoming(db, folder_id=folder_id)
+            assert not enqueue_auto_reply(db, other, other_message)
+        db.commit()
+        assert db.query(AutoReplyJob).one().idempotency_key == f"{conversation.id}:{message.id}"
+
+    def test_approval_mode_stores_reply_for_validation(self, db, calls):
+        conversation, message = _incoming(db, folder_id=2)
+        enqueue_auto_reply(db, conversation, message)
+        db.commit()
+
+        assert process_auto_reply_batch(db)["awaiting_approval"] == 1
+        db.refresh(conversation)
+        assert conversation.auto_reply_pending and conversation.auto_reply_mode == "approval"
+        assert conversation.pending_auto_reply_content == "Réponse pour Validation"
+        assert calls == {"generate": 1, "deliver": 0, "fail_sends": 0, "fail_records": 0}
+
+    def test_failed_send_is_retried_without_regenerating(self, db, calls):
+        conversation, message = _incoming(db, folder_id=1)
+        enqueue_auto_reply(db, conversation, message)
+        db.commit()
+        calls["fail_sends"] = 1
+
+        assert process_auto_reply_batch(db)["failed"] == 1
+        job = db.query(AutoReplyJob).one()
+        assert job.status == "pending" and job.reply_content == "Réponse pour Devis"
+        assert job.available_at > datetime.utcnow()
+
+        _make_available(db)
+        assert process_auto_reply_batch(db)["sent"] == 1
+        assert calls["generate"] == 1 and calls["deliver"] == 2
+        assert db.query(InboxMessage).filter(InboxMessage.is_from_client == False).count() == 1
+
+        # Ré-enfilage du même message après envoi : aucun second envoi
+        enqueue_auto_reply(db, conversation, message)
+        db.commit()
+        assert process_auto_reply_batch(db)["claimed"] == 0
+
+    def test_superseded_and_interrupted_jobs_are_not_sent(self, db, calls):
+        conversation, first = _incoming(db, folder_id=1)
+        enqueue_auto_reply(db, conversation, first)
+        second = InboxMessage(conversation_id=conversation.id, from_name="Client", content="Autre chose", source="email", is_from_client=True)
+        db.add(second)
+        db.commit()
+        enqueue_auto_reply(db, conversation, second)
+        db.commit()
+
+        stats = process_auto_reply_batch(db)
+        assert stats["skipped"] == 1 and stats["sent"] == 1
+        assert calls["deliver"] == 1
+
+        # Worker mort pendant l'envoi : le job passe en "failed" sans nouvel envoi
+        other, message = _incoming(db, folder_id=1)
+        enqueue_auto_reply(db, other, message)
+        db.query(AutoReplyJob).filter(AutoReplyJob.conversation_id == other.id).update({
+            "status": "sending",
+            "locked_at": datetime.utcnow() - timedelta(seconds=settings.AUTO_REPLY_JOB_LOCK_TIMEOUT + 1)
+        })
+        db.commit()
+        assert claim_jobs(db, 10) == []
+        assert db.query(AutoReplyJob).filter(AutoReplyJob.conversation_id == other.id).one().status == "failed"
+        assert calls["deliver"] == 1
+
+    def test_auto_reply_disabled_elsewhere_is_not_sent(self, db, calls):
+        conversation, message = _incoming(db, folder_id=1)
+        enqueue_auto_reply(db, conversation, message)
+        db.commit()
+        # Désactivation par un autre processus : le cache des règles de celui-ci n'est pas invalidé
+        db.query(InboxFolder).filter(InboxFolder.id == 1).update({"auto_reply": {"enabled": False, "mode": "auto"}})
+        db.commit()
+
+        assert process_auto_reply_batch(db)["skipped"] == 1
+        assert calls["generate"] == 0 and calls["deliver"] == 0
+
+    def test_failure_after_send_is_not_retried(self, db, calls):
+        conversation, message = _incoming(db, folder_id=1)
+        enqueue_auto_reply(db, conversation, message)
+        db.commit()
+        calls["fail_records"] = 1
+
+        assert process_auto_reply_batch(db)["failed"] == 1
+        job = db.query(AutoReplyJob).one()
+        assert job.status == "failed" and job.attempts == 1
+
+        _make_available(db)
+        assert process_auto_reply_batch(db)["claimed"] == 0
+        assert calls["deliver"] == 1
@@ -0,0 +1,140 @@
+"""
+Tests des exports en lot des PDF (sélection par filtres, archive ZIP, reprise d'un export interrompu).
+"""
+import csv
+import io
+import zipfile
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db.base import Base  # importe aussi tous les modèles
+from app.db.models.billing import Invoice, InvoiceLine, InvoiceStatus, InvoiceType
+from app.db.models.billing_export_job import BillingExportJob
+from app.db.models.client import Client
+from app.db.models.company import Company
+from app.core.billing_export import ExportLease, _release_job, claim_export_job, create_export_job, process_next_export
+from app.core.config import settings
+from app.core.pdf_render_pool import PdfRenderPool
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "BILLING_EXPORT_DIR", str(tmp_path / "exports"))
+    monkeypatch.setattr(settings, "PDF_CACHE_ENABLED", False)
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine, autoflush=False)()
+    session.add(Company(name="A", slug="a", code="AAAAAA"))
+    session.add(Client(company_id=1, name="Client A", email="client@example.com"))
+    session.commit()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def pool():
+    pool = PdfRenderPool(workers=0, max_pending=4, timeout=60)
+    yield pool
+    pool.shutdown()
+
+
+def _invoice(db, number, issued, status=InvoiceStatus.PAYEE, invoice_type=InvoiceType.FACTURE, sign=1):
+    invoice = Invoice(
+        company_id=1, client_id=1, number=number, invoice_type=invoice_type, status=status,
+        issue_date=issued, amount=Decimal("120.00") * sign,
+        subtotal_ht=Decimal("100.00") * sign, total_tax=Decimal("20.00") * sign, total_ttc=Decimal("120.00") * sign
+    )
+    invoice.lines.append(InvoiceLine(
+        description="Prestation", quantity=Decimal(sign), unit_price_ht=Decimal("100.00"), tax_rate=Decimal("20"),
+        subtotal_ht=Decimal("100.00") * sign, tax_amount=Decimal("20.00") * sign, total_ttc=Decimal("120.00") * sign, order=0
+    ))
+    db.add(invoice)
+    db.flush()
+    return invoice
+
+
+class TestBillingExport:
+    def test_export_zips_filtered_invoices_with_summary_and_fec(self, db, pool):
+        _invoice(db, "FAC-2026-0001", datetime(2026, 1, 15))
+        _invoice(db, "FAC-2026-0002", datetime(2026, 3, 31, 18))
+        _invoice(db, "AVO-2026-0001", datetime(2026, 2, 1), invoice_type=InvoiceType.AVOIR, sign=-1)
+        _invoice(db, "FAC-2026-0003", datetime(2026, 4, 1))
+        _invoice(db, "FAC-2026-0004", datetime(2026, 2, 10), status=InvoiceStatus.BROUILLON)
+        db.commit()
+
+        with pytest.raises(ValueError):
+            create_export_job(db, 1, None, "invoice", status="inconnu")
+        job = create_export_job(db, 1, None, "invoice", date(2026, 1, 1), date(2026, 3, 31), status="payée")
+        db.commit()
+        assert job.total == 3
+
+        assert process_next_export(db, pool=pool)
+        db.refresh(job)
+        assert job.status == "completed" and job.processed == 3 and job.failed_documents == []
+        assert [path.name for path in Path(job.file_path).parent.iterdir()] == [Path(job.file_path).name]
+
+        with zipfile.ZipFile(job.file_path) as archive:
+            names = archive.namelist()
+            assert sorted(name for name in names if name.endswith(".pdf")) == [
+                "avoirs/AVO-2026-0001.pdf", "factures/FAC-2026-0001.pdf", "factures/FAC-2026-0002.pdf"
+            ]
+            assert archive.read("factures/FAC-2026-0001.pdf").startswith(b"%PDF")
+            summary = list(csv.reader(io.StringIO(archive.read("recapitulatif.csv").decode("utf-8-sig")), delimiter=";"))
+            fec = list(csv.reader(io.StringIO(archive.read("FEC_ventes.txt").decode("utf-8")), delimiter="\t"))
+        assert [row[1] for row in summary[1:]] == ["FAC-2026-0001", "AVO-2026-0001", "FAC-2026-0002"]
+        assert summary[2][0] == "Avoir" and summary[2][7] == "-120,00"
+        # 3 écritures par facture (client, ventes, TVA), équilibrées ; avoir au crédit du client
+        assert len(fec) == 1 + 9
+        amount = lambda value: Decimal(value.replace(",", "."))
+        assert sum(amount(row[11]) for row in fec[1:]) == sum(amount(row[12]) for row in fec[1:])
+        credit_note_client = next(row for row in fec[1:] if row[2] == "AVO-2026-0001" and row[4] == "411000")
+        assert credit_note_client[11] == "0,00" and credit_note_client[12] == "120,00"
+
+    def test_interrupted_export_resumes_without_rendering_written_pdfs(self, db, pool, monkeypatch):
+        first = _invoice(db, "FAC-2026-0001", datetime(2026, 1, 15))
+        _invoice(db, "FAC-2026-0002", datetime(2026, 1, 20))
+        job = create_export_job(db, 1, None, "invoice")
+        db.commit()
+
+        # Worker mort après avoir écrit le premier PDF
+        assert claim_export_job(db).id == job.id
+        parts = Path(settings.BILLING_EXPORT_DIR) / "1" / f"export_{job.id}" / "parts"
+        parts.mkdir(parents=True)
+        (parts / f"{first.id}.pdf").write_bytes(b"%PDF deja rendu")
+        db.query(BillingExportJob).update({"locked_at": datetime.utcnow() - timedelta(seconds=settings.BILLING_EXPORT_JOB_LOCK_TIMEOUT + 1)})
+        db.commit()
+
+        renders = []
+        submit = pool.submit
+        monkeypatch.setattr(pool, "submit", lambda fn, *args: renders.append(args[0].number) or submit(fn, *args))
+        assert process_next_export(db, pool=pool)
+        db.refresh(job)
+        assert job.status == "completed" and job.attempts == 2
+        assert renders == ["FAC-2026-0002"]
+        with zipfile.ZipFile(job.file_path) as archive:
+            assert archive.read("factures/FAC-2026-0001.pdf") == b"%PDF deja rendu"
+            assert archive.read("factures/FAC-2026-0002.pdf").startswith(b"%PDF")
+        assert not process_next_export(db, pool=pool)
+
+    def test_worker_does_not_release_an_export_taken_over(self, db):
+        job = create_export_job(db, 1, None, "invoice")
+        db.commit()
+        claimed = claim_export_job(db)
+        lease = ExportLease(claimed.locked_at)
+
+        # Un autre worker a repris l'export (verrou expiré puis réclamé à nouveau)
+        taken_over = datetime.utcnow() + timedelta(seconds=5)
+        db.query(BillingExportJob).update({"locked_at": taken_over})
+        db.commit()
+        _release_job(db, job.id, lease, RuntimeError("échec"))
+        db.refresh(job)
+        assert (job.status, job.locked_at, job.last_error) == ("running", taken_over, None)
+
+        _release_job(db, job.id, ExportLease(taken_over))
+        db.refresh(job)
+        assert (job.status, job.locked_at) == ("pending", None)
@@ -0,0 +1,94 @@
+"""
+Tests du cache des classifications IA (empreintes SimHash, TTL, éviction LRU, compteurs).
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db.base import Base  # importe aussi tous les modèles
+from app.db.models.company import Company
+from app.db.models.classification_cache import ClassificationCacheEntry
+from app.core.classification_cache import ClassificationCache, KIND_FOLDER, hamming_distance, simhash
+from app.core.config import settings
+
+
+ORDER_EMAIL = (
+    "Votre commande n° {order} a été expédiée\n"
+    "Bonjour, votre colis contenant {count} article(s) sera livré le {day}/10. "
+    "Suivez votre livraison depuis votre espace client. Merci pour votre achat."
+)
+
+
+@pytest.fixture
+def session_factory():
+    engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    db = factory()
+    db.add(Company(name="A", slug="a", code="AAAAAA"))
+    db.commit()
+    db.close()
+    return factory
+
+
+class TestSimhash:
+    def test_numbers_do_not_change_the_fingerprint(self):
+        first = simhash(ORDER_EMAIL.format(order="402-123", count=2, day=12))
+        second = simhash(ORDER_EMAIL.format(order="171-999", count=1, day=14))
+        assert hamming_distance(first, second) == 0
+
+    def test_different_messages_are_far_apart(self):
+        first = simhash(ORDER_EMAIL.format(order="1", count=1, day=1))
+        other = simhash("Bonjour, je souhaiterais un devis pour la rénovation de ma salle de bain.")
+        assert hamming_distance(first, other) > settings.CLASSIFICATION_CACHE_MAX_DISTANCE
+
+
+class TestClassificationCache:
+    def test_repeated_shape_from_same_sender_hits(self, session_factory):
+        cache = ClassificationCache(session_factory=session_factory)
+        cache.store(1, KIND_FOLDER, "v1", [("ship@amazon.fr", ORDER_EMAIL.format(order="1", count=1, day=1), "7")])
+
+        hits = cache.lookup(1, KIND_FOLDER, "v1", [
+            ("a", "Ship@Amazon.fr", ORDER_EMAIL.format(order="2", count=3, day=5)),
+            ("b", "autre@exemple.fr", ORDER_EMAIL.format(order="2", count=3, day=5)),
+        ])
+        assert hits == {"a": "7"}
+        # Autre version de configuration des dossiers : pas de hit
+        assert cache.lookup(1, KIND_FOLDER, "v2", [("a", "ship@amazon.fr", ORDER_EMAIL)]) == {}
+
+        stats = cache.stats()
+        assert stats["lookups"] == 3
+        assert stats["hits"] == 1
+
+        db = session_factory()
+        assert db.query(ClassificationCacheEntry).one().hit_count == 1
+        db.close()
+
+    def test_expired_entries_are_ignored(self, session_factory):
+        cache = ClassificationCache(session_factory=session_factory)
+        cache.store(1, KIND_FOLDER, "v1", [("ship@amazon.fr", ORDER_EMAIL, "7")])
+        db = session_factory()
+        db.query(ClassificationCacheEntry).update({"expires_at": datetime.utcnow() - timedelta(seconds=1)})
+        db.commit()
+        db.close()
+        assert cache.lookup(1, KIND_FOLDER, "v1", [("a", "ship@amazon.fr", ORDER_EMAIL)]) == {}
+
+    def test_least_recently_used_entries_are_evicted(self, session_factory, monkeypatch):
+        monkeypatch.setattr(settings, "CLASSIFICATION_CACHE_MAX_ENTRIES", 2)
+        cache = ClassificationCache(session_factory=session_factory)
+        cache.store(1, KIND_FOLDER, "v1", [("a@x.fr", "premier message de a", "1")])
+        cache.store(1, KIND_FOLDER, "v1", [("b@x.fr", "premier message de b", "2")])
+        db = session_factory()
+        db.query(ClassificationCacheEntry).filter(ClassificationCacheEntry.sender == "b@x.fr").update(
+            {"last_used_at": datetime.utcnow() - timedelta(days=1)}
+        )
+        db.commit()
+        db.close()
+
+        cache.store(1, KIND_FOLDER, "v1", [("c@x.fr", "premier message de c", "3")])
+
+        db = session_factory()
+        assert sorted(entry.sender for entry in db.query(ClassificationCacheEntry).all()) == ["a@x.fr", "c@x.fr"]
+        db.close()
@@ -0,0 +1,138 @@
+"""
+Tests de la file de classification IA (jobs créés à l'ingestion, traitement par lots, reprises).
+"""
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db.base import Base  # importe aussi tous les modèles
+from app.db.models.company import Company
+from app.db.models.classification_job import ClassificationJob
+from app.db.models.conversation import Conversation, InboxFolder
+from app.core import ai_classifier_service, folder_ai_classifier
+from app.core.classification_queue import claim_jobs, process_classification_batch
+from app.core.config import settings
+from app.core.email_ingest import EmailIngestPipeline
+from app.core.folder_rules import invalidate_folder_rules
+
+
+class FakeClassifier:
+    enabled = True
+
+    def __init__(self, folder_id=None):
+        self.folder_id = folder_id
+        self.calls = []
+
+    def classify_messages_batch(self, messages, folders, company_context=None, rules=None, company_id=None, raise_errors=False):
+        self.calls.append([message["conversation_id"] for message in messages])
+        return {message["conversation_id"]: self.folder_id for message in messages}
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine, autoflush=False)()
+    yield session
+    session.close()
+    invalidate_folder_rules()
+
+
+@pytest.fixture
+def company(db):
+    company = Company(name="A", slug="a", code="AAAAAA")
+    db.add(company)
+    db.commit()
+    return company
+
+
+@pytest.fixture
+def folder(db, company):
+    folder = InboxFolder(company_id=company.id, name="Devis", ai_rules={"autoClassify": True, "context": "Demandes de devis"})
+    db.add(folder)
+    db.commit()
+    return folder
+
+
+def _email(i, in_reply_to=None):
+    return {
+        "message_id": f"<m{i}@mail.example>",
+        "from": {"email": f"client{i}@example.com", "name": f"Client {i}"},
+        "subject": f"Devis {i}",
+        "content": f"Message {i}",
+        "in_reply_to": in_reply_to,
+        "references": [in_reply_to] if in_reply_to else [],
+        "imap_uid": str(i),
+        "attachments": [],
+    }
+
+
+class TestClassificationQueue:
+    def test_ingest_commits_unclassified_and_enqueues_one_job_per_conversation(self, db, company, folder):
+        pipeline = EmailIngestPipeline(db, company_id=company.id, enqueue_classification=True)
+        pipeline.ingest([_email(1), _email(2)])
+        pipeline.ingest([_email(3, in_reply_to="<m1@mail.example>")])
+
+        assert db.query(Conversation).filter(Conversation.folder_id.isnot(None)).count() == 0
+        jobs = db.query(ClassificationJob).all()
+        assert len(jobs) == 2
+        # La réponse rejoint le job encore en attente de sa conversation
+        assert {job.message_id for job in jobs} == {2, 3}
+
+    def test_worker_classifies_across_companies_and_deletes_jobs(self, db, company, folder, monkeypatch):
+        other = Company(name="B", slug="b", code="BBBBBB")
+        db.add(other)
+        db.commit()
+        other_folder = InboxFolder(company_id=other.id, name="Devis", ai_rules={"autoClassify": True})
+        db.add(other_folder)
+        db.commit()
+        EmailIngestPipeline(db, company_id=company.id, enqueue_classification=True).ingest([_email(1), _email(2)])
+        EmailIngestPipeline(db, company_id=other.id, enqueue_classification=True).ingest([_email(3)])
+
+        classifier = FakeClassifier(folder_id=folder.id)
+        monkeypatch.setattr(folder_ai_classifier, "get_ai_classifier_service", lambda: classifier)
+        stats = process_classification_batch(db)
+
+        assert stats["claimed"] == 3
+        assert db.query(ClassificationJob).count() == 0
+        assert len(classifier.calls) == 2  # un lot par entreprise
+        by_company = {c.company_id: c.folder_id for c in db.query(Conversation).all()}
+        # Le dossier renvoyé n'appartient pas à la 2e entreprise : conversation laissée sans dossier
+        assert by_company == {company.id: folder.id, other.id: None}
+
+    def test_failure_is_retried_with_backoff_then_marked_failed(self, db, company, folder, monkeypatch):
+        EmailIngestPipeline(db, company_id=company.id, enqueue_classification=True).ingest([_email(1)])
+
+        # Vrai service de classification : l'erreur de l'appel IA doit remonter jusqu'à la file
+        def create_chat_completion_sync(client, **params):
+            raise RuntimeError("API down")
+
+        service = ai_classifier_service.AIClassifierService.__new__(ai_classifier_service.AIClassifierService)
+        service.enabled, service.client = True, object()
+        monkeypatch.setattr(ai_classifier_service, "create_chat_completion_sync", create_chat_completion_sync)
+        monkeypatch.setattr(folder_ai_classifier, "get_ai_classifier_service", lambda: service)
+        monkeypatch.setattr(settings, "CLASSIFICATION_JOB_MAX_ATTEMPTS", 2)
+
+        assert process_classification_batch(db)["failed"] == 1
+        job = db.query(ClassificationJob).one()
+        assert (job.status, job.attempts, job.last_error) == ("pending", 1, "API down")
+        assert job.available_at > datetime.utcnow()
+        assert claim_jobs(db, 10) == []  # pas avant la fin du backoff
+
+        job.available_at = datetime.utcnow()
+        db.commit()
+        process_classification_batch(db)
+        db.refresh(job)
+        assert (job.status, job.attempts) == ("failed", 2)
+
+    def test_stale_processing_job_is_reclaimed(self, db, company, folder):
+        EmailIngestPipeline(db, company_id=company.id, enqueue_classification=True).ingest([_email(1)])
+        assert len(claim_jobs(db, 10)) == 1
+        assert claim_jobs(db, 10) == []  # déjà réclamé par un worker
+
+        job = db.query(ClassificationJob).one()
+        job.locked_at = datetime(2000, 1, 1)
+        db.commit()
+        assert [j.id for j in claim_jobs(db, 10)] == [job.id]
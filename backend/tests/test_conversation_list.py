@@ -0,0 +1,104 @@
+"""
+Tests de la liste des conversations (pagination par clé, projection, premier expéditeur dénormalisé).
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.db.base import Base  # importe aussi tous les modèles
+from app.db.models.company import Company
+from app.db.models.conversation import Conversation, InboxFolder, InboxMessage
+from app.core.conversation_list import (
+    InvalidCursorError,
+    conversation_list_query,
+    fetch_page,
+    parse_fields,
+    row_to_dict,
+)
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def db(engine):
+    session = sessionmaker(bind=engine, autoflush=False)()
+    session.add_all([Company(name="A", slug="a", code="AAAAAA"), Company(name="B", slug="b", code="BBBBBB")])
+    session.commit()
+    yield session
+    session.close()
+
+
+class TestConversationList:
+    def test_cursor_pages_cover_every_conversation_once(self, engine, db):
+        start = datetime(2026, 1, 1)
+        for i in range(12):
+            # Dates en double (même last_message_at) et conversations sans date
+            last = None if i % 4 == 0 else start + timedelta(hours=i // 2)
+            db.add(Conversation(company_id=1, subject=f"S{i}", source="email", last_message_at=last))
+        db.add(Conversation(company_id=2, subject="Autre", source="email", last_message_at=start))
+        db.commit()
+        expected = [c.id for c in sorted(
+            db.query(Conversation).filter(Conversation.company_id == 1),
+            key=lambda c: (c.last_message_at is not None, c.last_message_at or start, c.id), reverse=True
+        )]
+
+        statements = []
+        event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        seen, cursor = [], None
+        while True:
+            rows, cursor = fetch_page(conversation_list_query(db, 1, ["subject"]), 5, cursor)
+            seen += [row.id for row in rows]
+            if cursor is None:
+                break
+
+        assert seen == expected
+        # Au plus deux requêtes par page (conversations datées puis sans date)
+        assert len(statements) <= 6
+
+    def test_projection_reads_only_requested_columns(self, engine, db):
+        db.add(InboxFolder(company_id=1, name="Devis"))
+        db.add(Conversation(company_id=1, subject="Sujet", source="email", folder_id=1))
+        db.commit()
+
+        statements = []
+        event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        rows, _ = fetch_page(conversation_list_query(db, 1, parse_fields("subject,folder_name")), 10)
+
+        assert row_to_dict(rows[0], ["subject", "folder_name"]) == {"subject": "Sujet", "folder_name": "Devis"}
+        assert "JOIN inbox_folders" in statements[0] and "clients" not in statements[0]
+        with pytest.raises(ValueError):
+            parse_fields("subject,pending_auto_reply_content")
+        with pytest.raises(InvalidCursorError):
+            fetch_page(conversation_list_query(db, 1), 10, "pas-un-curseur")
+
+    def test_first_client_sender_is_denormalized_at_insert(self, db):
+        conversation = Conversation(company_id=1, subject="Sujet", source="email")
+        db.add(conversation)
+        db.flush()
+        db.add(InboxMessage(conversation_id=conversation.id, from_name="Entreprise", content="Bonjour", source="email", is_from_client=False))
+        db.add(InboxMessage(conversation_id=conversation.id, from_name="Jean", from_email="jean@example.com", content="Devis ?", source="email"))
+        db.commit()
+        db.add(InboxMessage(conversation_id=conversation.id, from_name="Autre", from_email="autre@example.com", content="Relance", source="email"))
+        db.commit()
+
+        rows, _ = fetch_page(conversation_list_query(db, 1, ["client_name", "client_email"]), 10)
+        assert row_to_dict(rows[0], ["client_name", "client_email"]) == {"client_name": "Jean", "client_email": "jean@example.com"}
+        assert conversation.first_client_email == "jean@example.com"
+
+    def test_first_client_without_name_is_kept(self, db):
+        # Premier expéditeur connu par son seul numéro (SMS, données historiques sans nom)
+        conversation = Conversation(company_id=1, subject="SMS", source="sms", first_client_phone="+33600000001")
+        db.add(conversation)
+        db.commit()
+        db.add(InboxMessage(conversation_id=conversation.id, from_name="Autre", from_phone="+33600000002", content="Relance", source="sms"))
+        db.commit()
+
+        db.refresh(conversation)
+        assert (conversation.first_client_name, conversation.first_client_phone) == (None, "+33600000001")
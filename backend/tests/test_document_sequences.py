@@ -0,0 +1,86 @@
+"""
+Tests des séquences de numérotation des documents (devis, factures, avoirs).
+"""
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db.base import Base  # importe aussi tous les modèles
+from app.db.models.billing import Invoice, InvoiceType, Quote
+from app.db.models.company import Company
+from app.db.models.company_settings import CompanySettings
+from app.db.models.document_sequence import DocumentSequence
+from app.api.routes.quotes import generate_quote_number
+from app.core.invoice_service import generate_invoice_number
+
+YEAR = datetime.now().year
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine, autoflush=False)()
+    session.add(Company(name="A", slug="a", code="AAAAAA"))
+    session.commit()
+    yield session
+    session.close()
+
+
+def _quote(db, number):
+    db.add(Quote(company_id=1, client_id=1, number=number, amount=0))
+    db.flush()
+
+
+class TestDocumentSequences:
+    def test_sequence_starts_after_existing_numbers_and_reads_them_once(self, db):
+        _quote(db, f"DEV-{YEAR}-007")
+        _quote(db, f"DEV-{YEAR}-003")
+        _quote(db, f"DEV-{YEAR - 1}-050")
+        db.commit()
+
+        assert generate_quote_number(db, 1) == f"DEV-{YEAR}-008"
+        # Les devis existants ne sont plus lus : seule la séquence compte
+        db.query(Quote).delete()
+        assert generate_quote_number(db, 1) == f"DEV-{YEAR}-009"
+        db.commit()
+        assert db.query(DocumentSequence).one().last_value == 9
+
+    def test_rollback_returns_the_number(self, db):
+        assert generate_quote_number(db, 1) == f"DEV-{YEAR}-001"
+        db.rollback()
+        assert generate_quote_number(db, 1) == f"DEV-{YEAR}-001"
+        # Numéro déjà pris hors séquence : la reprise repart au-delà
+        assert generate_quote_number(db, 1, last_failed_number=f"DEV-{YEAR}-004") == f"DEV-{YEAR}-005"
+
+    def test_invoices_and_credit_notes_have_their_own_sequences(self, db):
+        db.add(Invoice(
+            company_id=1, client_id=1, number=f"FAC-{YEAR}-0041", invoice_type=InvoiceType.FACTURE, amount=0
+        ))
+        db.commit()
+
+        assert generate_invoice_number(db, 1, InvoiceType.FACTURE) == f"FAC-{YEAR}-0042"
+        assert generate_invoice_number(db, 1, InvoiceType.AVOIR) == f"AVO-{YEAR}-0001-AVOIR"
+        assert generate_invoice_number(db, 1, InvoiceType.FACTURE) == f"FAC-{YEAR}-0043"
+
+        # Nouveau format : nouvelle séquence ; numéro de départ relevé : respecté
+        db.add(CompanySettings(company_id=1, settings={"billing": {"numbering": {"invoices": {"prefix": "F", "start_number": 100}}}}))
+        db.flush()
+        assert generate_invoice_number(db, 1, InvoiceType.FACTURE) == f"F-{YEAR}-0100"
+        assert generate_invoice_number(db, 1, InvoiceType.FACTURE) == f"F-{YEAR}-0101"
+        assert db.query(DocumentSequence).count() == 3
+
+    def test_invoice_numbers_taken_out_of_sequence_are_skipped(self, db):
+        assert generate_invoice_number(db, 1, InvoiceType.FACTURE) == f"FAC-{YEAR}-0001"
+        db.commit()
+        for number in (2, 3):
+            db.add(Invoice(
+                company_id=1, client_id=1, number=f"FAC-{YEAR}-{number:04d}", invoice_type=InvoiceType.FACTURE, amount=0
+            ))
+        db.commit()
+
+        assert generate_invoice_number(db, 1, InvoiceType.FACTURE) == f"FAC-{YEAR}-0004"
+        db.commit()
+        assert db.query(DocumentSequence).one().last_value == 4
@@ -0,0 +1,165 @@
+"""
+Tests de l'ingestion par lots des emails parsés (dédoublonnage, clients, threading, requêtes).
+"""
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.db.base import Base  # importe aussi tous les modèles
+from app.db.models.client import Client
+from app.db.models.company import Company
+from app.db.models.conversation import Conversation, InboxMessage, MessageAttachment, AttachmentBlob
+from app.core.attachment_store import (
+    LEGACY_FILES_MANIFEST,
+    AttachmentStore,
+    acquire_blobs,
+    delete_migrated_legacy_files,
+    purge_unreferenced_blobs,
+)
+from app.core.config import settings
+from app.core.email_ingest import EmailIngestPipeline
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def db(engine):
+    session = sessionmaker(bind=engine, autoflush=False)()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def company(db):
+    company = Company(name="A", slug="a", code="AAAAAA")
+    db.add(company)
+    db.commit()
+    return company
+
+
+def _email(i, subject="Devis", in_reply_to=None, sender=None, attachments=None):
+    return {
+        "message_id": f"<m{i}@mail.example>",
+        "from": {"email": sender or f"client{i}@example.com", "name": f"Client {i}"},
+        "subject": subject,
+        "content": f"Message {i}",
+        "in_reply_to": in_reply_to,
+        "references": [in_reply_to] if in_reply_to else [],
+        "imap_uid": str(i),
+        "attachments": attachments or [],
+    }
+
+
+class TestEmailIngestPipeline:
+    """Tests du pipeline d'ingestion par lots."""
+
+    def test_threads_dedups_and_reuses_clients(self, db, company, tmp_path):
+        db.add(Client(company_id=company.id, name="Connu", email="known@example.com", type="Client"))
+        db.commit()
+        emails = [
+            _email(1, subject="Devis cuisine", sender="known@example.com",
+                   attachments=[{"filename": "plan.pdf", "content": b"%PDF", "content_type": "application/pdf"}]),
+            _email(2, subject="Re: autre sujet", in_reply_to="<m1@mail.example>"),
+            _email(1, subject="Devis cuisine", sender="known@example.com"),  # doublon dans le lot
+            _email(3, subject="RE: Devis cuisine"),
+            _email(4, subject="Facture"),
+        ]
+
+        pipeline = EmailIngestPipeline(db, company_id=company.id, integration_id=7)
+        pipeline.attachment_store = AttachmentStore(company.id, upload_dir=str(tmp_path))
+        result = pipeline.ingest(emails)
+
+        assert result["created"] == 4
+        assert result["skipped"] == 1
+        assert result["errors"] == 0
+        conversations = db.query(Conversation).order_by(Conversation.id).all()
+        assert [c.subject for c in conversations] == ["Devis cuisine", "Facture"]
+        assert conversations[0].unread_count == 3
+        assert db.query(Client).filter(Client.email == "known@example.com").count() == 1
+        assert db.query(MessageAttachment).count() == 1
+
+        # Deuxième passage : tout est déjà en base
+        again = pipeline.ingest(emails)
+        assert again["created"] == 0
+        assert again["skipped"] == 5
+
+    def test_round_trips_do_not_grow_with_batch_size(self, engine, db, company, tmp_path):
+        statements = []
+        event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+        pipeline = EmailIngestPipeline(db, company_id=company.id, chunk_size=500)
+        pipeline.attachment_store = AttachmentStore(company.id, upload_dir=str(tmp_path))
+        result = pipeline.ingest([_email(i, subject=f"Sujet {i}") for i in range(200)])
+
+        assert result["created"] == 200
+        # Lectures groupées (IN) + insertions groupées : pas une requête par email
+        selects = [s for s in statements if s.lstrip().upper().startswith("SELECT")]
+        assert len(selects) < 10
+        assert db.query(InboxMessage).count() == 200
+
+    def test_identical_attachments_share_one_blob(self, db, company, tmp_path):
+        logo = {"filename": "logo.png", "content": b"\x89PNG signature", "content_type": "image/png"}
+        pipeline = EmailIngestPipeline(db, company_id=company.id)
+        pipeline.attachment_store = AttachmentStore(company.id, upload_dir=str(tmp_path))
+        pipeline.ingest([
+            _email(1, subject="Devis", attachments=[dict(logo)]),
+            _email(2, subject="Facture", attachments=[dict(logo)]),
+        ])
+
+        blob = db.query(AttachmentBlob).one()
+        db.refresh(blob)
+        assert blob.ref_count == 2
+        assert {a.file_path for a in db.query(MessageAttachment).all()} == {blob.file_path}
+        assert len(list((tmp_path / str(company.id) / "attachments").iterdir())) == 1
+
+        # Suppression d'une conversation (cascade) : une référence de moins
+        db.delete(db.query(Conversation).filter(Conversation.subject == "Devis").one())
+        db.commit()
+        db.refresh(blob)
+        assert blob.ref_count == 1
+
+
+class TestAttachmentBlobs:
+    def test_restored_orphan_blob_is_kept_by_the_purge(self, db, company, tmp_path, monkeypatch):
+        monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path))
+        store = AttachmentStore(company.id, upload_dir=str(tmp_path))
+        stored = store.store("devis.pdf", "application/pdf", b"%PDF devis")
+        blob = acquire_blobs(db, company.id, [stored])[stored["sha256"]]
+        blob.created_at = datetime.utcnow() - timedelta(days=1)
+        db.commit()
+        file_path = tmp_path / stored["file_path"]
+        os.utime(file_path, (0, 0))
+
+        # Même contenu reçu à nouveau : le fichier est rafraîchi, la purge attend le délai de grâce
+        store.store("copie.pdf", "application/pdf", b"%PDF devis")
+        assert purge_unreferenced_blobs(db, company.id) == 0
+        assert file_path.exists()
+
+        os.utime(file_path, (0, 0))
+        assert purge_unreferenced_blobs(db, company.id) == 1
+        assert not file_path.exists()
+
+    def test_legacy_files_are_deleted_only_once_unreferenced(self, db, company, tmp_path, monkeypatch):
+        monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path))
+        for name in ("migrated.pdf", "still_used.pdf"):
+            (tmp_path / name).write_bytes(b"%PDF")
+        conversation = Conversation(company_id=company.id, subject="S", source="email")
+        message = InboxMessage(from_name="Client", content="Bonjour", source="email")
+        message.attachments.append(MessageAttachment(name="still_used.pdf", file_path="still_used.pdf", file_type="pdf", file_size=4))
+        conversation.messages.append(message)
+        db.add(conversation)
+        db.commit()
+        (tmp_path / LEGACY_FILES_MANIFEST).write_text("migrated.pdf\nstill_used.pdf\nmissing.pdf\n")
+
+        assert delete_migrated_legacy_files(db) == 1
+        assert not (tmp_path / "migrated.pdf").exists()
+        assert (tmp_path / "still_used.pdf").exists()
+        assert not (tmp_path / LEGACY_FILES_MANIFEST).exists()
@@ -0,0 +1,63 @@
+"""
+Tests de la résolution des fils email via la table email_thread_keys.
+"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db.base import Base  # importe aussi tous les modèles
+from app.db.models.company import Company
+from app.db.models.conversation import Conversation
+from app.core.email_threading import find_thread_conversation, register_thread_keys
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def _thread(db, company, subject, message_ids):
+    conversation = Conversation(company_id=company.id, subject=subject, source="email")
+    db.add(conversation)
+    db.flush()
+    register_thread_keys(db, company.id, conversation.id, message_ids, subject)
+    return conversation
+
+
+class TestEmailThreading:
+    """Tests de find_thread_conversation (Message-IDs puis hash du sujet)."""
+
+    def _company(self, db):
+        company = Company(name="A", slug="a", code="AAAAAA")
+        db.add(company)
+        db.flush()
+        return company
+
+    def test_resolves_deep_reference(self, db):
+        company = self._company(db)
+        conversation = _thread(db, company, "Devis cuisine", ["<root@mail.example>"])
+
+        found = find_thread_conversation(
+            db, company.id, "<unknown@mail.example>",
+            ["<root@mail.example>", "<other@mail.example>"], "Autre sujet"
+        )
+
+        assert found.id == conversation.id
+
+    def test_matches_normalized_subject(self, db):
+        company = self._company(db)
+        conversation = _thread(db, company, "Devis  Cuisine", [])
+
+        found = find_thread_conversation(db, company.id, None, None, "RE: Fwd: devis cuisine")
+
+        assert found.id == conversation.id
+
+    def test_ignores_subject_substring(self, db):
+        company = self._company(db)
+        _thread(db, company, "Devis", [])
+
+        assert find_thread_conversation(db, company.id, None, None, "Devis cuisine") is None
@@ -0,0 +1,119 @@
+"""
+Tests des règles de dossiers compilées (automate d'Aho-Corasick, filtres, contexte IA, cache).
+"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db.base import Base  # importe aussi tous les modèles
+from app.db.models.company import Company
+from app.db.models.conversation import InboxFolder
+from app.core.folder_rules import (
+    CompiledFolderRules,
+    KeywordAutomaton,
+    get_folder_rules,
+    invalidate_folder_rules,
+)
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    invalidate_folder_rules()
+
+
+def _folder(folder_id, name, **ai_rules):
+    return {"id": folder_id, "name": name, "folder_type": "general", "ai_rules": {"autoClassify": True, **ai_rules}}
+
+
+class TestKeywordAutomaton:
+    def test_finds_overlapping_keywords_in_one_pass(self):
+        automaton = KeywordAutomaton(["he", "she", "his", "hers"])
+        found = {automaton.keywords[i] for i in automaton.search("ushers")}
+        assert found == {"he", "she", "hers"}
+
+    def test_reports_fields_containing_each_keyword(self):
+        automaton = KeywordAutomaton(["amazon", "facture"])
+        found = automaton.search_fields(["commande amazon", "votre facture", "noreply@amazon.fr"])
+        assert found[automaton.id_of("amazon")] == {0, 2}
+        assert found[automaton.id_of("facture")] == {1}
+
+    def test_compiled_rules_build_their_automata_up_front(self):
+        rules = CompiledFolderRules([_folder(1, "Factures", filters={"keywords": ["facture"]})])
+        with pytest.raises(RuntimeError):
+            rules._filter_keywords.add("devis")
+
+
+class TestFilterRules:
+    def test_priority_order_and_keyword_location(self):
+        rules = CompiledFolderRules([
+            _folder(1, "Factures", priority=5, filters={"keywords": ["facture"], "keywords_location": "subject"}),
+            _folder(2, "Urgent", priority=1, filters={"keywords": ["urgent"]}),
+        ])
+        assert rules.match_filters("Facture urgente", "", "a@b.fr", "") == 2
+        assert rules.match_filters("Votre facture", "rien", "a@b.fr", "") == 1
+        # Mot-clé limité au sujet : absent du sujet, pas de correspondance
+        assert rules.match_filters("Bonjour", "voici la facture", "a@b.fr", "") is None
+
+    def test_sender_addresses_domains_and_fragments(self):
+        rules = CompiledFolderRules([
+            _folder(1, "Banque", filters={"sender_domain": ["Banque.fr"]}),
+            _folder(2, "Compta", filters={"sender_email": ["compta@cabinet.fr"]}),
+            _folder(3, "Amazon", filters={"sender_email": ["@amazon"]}),
+        ])
+        assert rules.match_filters("", "", "alerte@banque.fr", "") == 1
+        assert rules.match_filters("", "", "Compta@Cabinet.fr", "") == 2
+        assert rules.match_filters("", "", "x.compta@cabinet.fr", "") is None
+        assert rules.match_filters("", "", "ship@amazon.fr", "") == 3
+
+    def test_match_all_requires_every_condition(self):
+        rules = CompiledFolderRules([
+            _folder(1, "Devis", filters={
+                "keywords": ["devis", "chantier"],
+                "sender_domain": ["client.fr"],
+                "match_type": "all",
+            }),
+        ])
+        assert rules.match_filters("Devis", "pour le chantier", "a@client.fr", "") == 1
+        assert rules.match_filters("Devis", "pour la maison", "a@client.fr", "") is None
+        assert rules.match_filters("Devis", "pour le chantier", "a@autre.fr", "") is None
+
+
+class TestContextRules:
+    def test_sender_match_from_context_words(self):
+        rules = CompiledFolderRules([
+            _folder(1, "Général", context="Demandes des clients"),
+            _folder(2, "Lokario", context="expéditeur contenant lokario"),
+        ])
+        assert rules.match_sender("notifications@lokario.fr") == 2
+        assert rules.match_sender("jean@exemple.fr") is None
+
+    def test_keyword_match_requires_all_fields_when_stated(self):
+        rules = CompiledFolderRules([
+            _folder(1, "Amazon", context="tous les messages avec 'amazon' dans le contenu et l'objet et l'expéditeur"),
+        ])
+        assert rules.match_keywords("commande amazon", "amazon : expédition", "ship@amazon.fr") == 1
+        assert rules.match_keywords("commande amazon", "expédition", "ship@amazon.fr") is None
+
+
+class TestFolderRulesCache:
+    def test_cached_until_invalidated(self, db):
+        company = Company(name="A", slug="a", code="AAAAAA")
+        db.add(company)
+        db.flush()
+        db.add(InboxFolder(company_id=company.id, name="Devis", ai_rules={"autoClassify": True}))
+        db.commit()
+
+        rules = get_folder_rules(db, company.id)
+        assert [f["name"] for f in rules.ai_folders] == ["Devis"]
+
+        db.add(InboxFolder(company_id=company.id, name="Factures", ai_rules={"autoClassify": True}))
+        db.commit()
+        assert get_folder_rules(db, company.id) is rules
+
+        invalidate_folder_rules(company.id)
+        assert [f["name"] for f in get_folder_rules(db, company.id).ai_folders] == ["Devis", "Factures"]
@@ -0,0 +1,171 @@
+"""
+Tests du pool de connexions IMAP persistantes (réutilisation, NOOP, éviction) et des watchers IDLE.
+"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import app.core.encryption_service as encryption_service
+import app.core.imap_connection_pool as imap_connection_pool
+import app.core.imap_service as imap_service
+from app.db.base import Base  # importe aussi tous les modèles
+from app.db.models.company import Company
+from app.db.models.inbox_integration import InboxIntegration
+from app.core.imap_connection_pool import ImapConnectionPool, ImapIdleWatcher, reconcile_idle_watchers
+
+
+class _FakeImap:
+    """Connexion IMAP factice (état AUTH, NOOP configurable)."""
+
+    def __init__(self):
+        self.state = "AUTH"
+        self.noop_ok = True
+        self.logged_out = False
+
+    def noop(self):
+        if not self.noop_ok:
+            raise OSError("connexion perdue")
+        return "OK", [b"NOOP completed"]
+
+    def logout(self):
+        self.logged_out = True
+        self.state = "LOGOUT"
+
+
+def _patch_connect(monkeypatch):
+    opened = []
+
+    def fake_connect(imap_server, imap_port, email_address, password, use_ssl=True):
+        mail = _FakeImap()
+        opened.append(mail)
+        return mail
+
+    monkeypatch.setattr(imap_service, "connect_imap", fake_connect)
+    return opened
+
+
+class TestImapConnectionPool:
+    """Tests du pool de connexions IMAP."""
+
+    def test_connection_is_reused(self, monkeypatch):
+        opened = _patch_connect(monkeypatch)
+        pool = ImapConnectionPool(idle_timeout_seconds=600, noop_after_seconds=60, max_connections=10)
+
+        first = pool.acquire("imap.example.com", 993, "a@example.com", "secret")
+        pool.release(first)
+        second = pool.acquire("IMAP.example.com", 993, "A@example.com", "secret")
+        pool.release(second)
+
+        assert first is second
+        assert len(opened) == 1
+        assert pool.stats["reused"] == 1
+
+    def test_discard_and_dead_connection_reopen(self, monkeypatch):
+        opened = _patch_connect(monkeypatch)
+        pool = ImapConnectionPool(idle_timeout_seconds=600, noop_after_seconds=0.000001, max_connections=10)
+
+        mail = pool.acquire("imap.example.com", 993, "a@example.com", "secret")
+        pool.release(mail, discard=True)
+        assert mail.logged_out
+
+        mail = pool.acquire("imap.example.com", 993, "a@example.com", "secret")
+        mail.noop_ok = False
+        pool.release(mail)
+        fresh = pool.acquire("imap.example.com", 993, "a@example.com", "secret")
+        pool.release(fresh)
+
+        assert fresh is not mail
+        assert len(opened) == 3
+
+    def test_password_change_opens_new_session(self, monkeypatch):
+        opened = _patch_connect(monkeypatch)
+        pool = ImapConnectionPool(idle_timeout_seconds=600, noop_after_seconds=60, max_connections=10)
+
+        pool.release(pool.acquire("imap.example.com", 993, "a@example.com", "old"))
+        pool.release(pool.acquire("imap.example.com", 993, "a@example.com", "new"))
+
+        assert len(opened) == 2
+
+    def test_close_all_does_not_wait_for_connections_in_use(self, monkeypatch):
+        _patch_connect(monkeypatch)
+        pool = ImapConnectionPool(idle_timeout_seconds=600, noop_after_seconds=60, max_connections=10)
+        idle = pool.acquire("imap.example.com", 993, "a@example.com", "secret")
+        pool.release(idle)
+        busy = pool.acquire("imap.example.com", 993, "b@example.com", "secret")
+
+        pool.close_all()
+        assert idle.logged_out and not busy.logged_out
+
+        # La connexion retirée du pool pendant son utilisation est fermée à sa restitution
+        pool.release(busy)
+        assert busy.logged_out
+        fresh = pool.acquire("imap.example.com", 993, "b@example.com", "secret")
+        pool.release(fresh)
+        assert fresh is not busy
+
+
+class _PlainEncryption:
+    def decrypt(self, value):
+        return value
+
+
+@pytest.fixture
+def idle_db(monkeypatch):
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine, autoflush=False)()
+    session.add(Company(name="A", slug="a", code="AAAAAA"))
+    session.commit()
+
+    # Watchers sans connexion réseau : ils attendent seulement leur arrêt
+    monkeypatch.setattr(ImapIdleWatcher, "run", lambda self: self._stop_event.wait(5))
+    monkeypatch.setattr(encryption_service, "get_encryption_service", lambda: _PlainEncryption())
+    monkeypatch.setattr(imap_connection_pool, "_idle_watchers", {})
+    monkeypatch.setattr(imap_connection_pool, "_idle_callback", lambda integration_id: None)
+    yield session
+    for watcher in imap_connection_pool._idle_watchers.values():
+        watcher.stop()
+    session.close()
+
+
+def _imap_integration(db, email_address):
+    integration = InboxIntegration(
+        company_id=1, integration_type="imap", name=email_address, imap_server="imap.example.com",
+        imap_port=993, email_address=email_address, email_password="secret"
+    )
+    db.add(integration)
+    db.commit()
+    return integration
+
+
+class TestIdleWatchers:
+    """Tests du réalignement des watchers IDLE sur les intégrations actives."""
+
+    def test_watchers_follow_created_updated_and_removed_integrations(self, idle_db):
+        first = _imap_integration(idle_db, "a@example.com")
+        second = _imap_integration(idle_db, "b@example.com")
+        assert reconcile_idle_watchers(idle_db) == 2
+        assert reconcile_idle_watchers(idle_db) == 0
+        watchers = dict(imap_connection_pool._idle_watchers)
+
+        second.email_password = "nouveau"
+        third = _imap_integration(idle_db, "c@example.com")
+        first.is_active = False
+        idle_db.commit()
+        assert reconcile_idle_watchers(idle_db) == 2
+
+        current = imap_connection_pool._idle_watchers
+        assert set(current) == {second.id, third.id}
+        assert current[second.id] is not watchers[second.id] and current[second.id].password == "nouveau"
+        assert watchers[first.id]._stop_event.is_set() and watchers[second.id]._stop_event.is_set()
+
+        idle_db.delete(third)
+        idle_db.commit()
+        reconcile_idle_watchers(idle_db)
+        assert set(imap_connection_pool._idle_watchers) == {second.id}
+
+    def test_no_watcher_outside_the_leader_process(self, idle_db, monkeypatch):
+        monkeypatch.setattr(imap_connection_pool, "_idle_callback", None)
+        _imap_integration(idle_db, "a@example.com")
+        assert reconcile_idle_watchers(idle_db) == 0
+        assert imap_connection_pool._idle_watchers == {}
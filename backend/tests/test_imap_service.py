@@ -0,0 +1,204 @@
+"""
+Tests des utilitaires de récupération IMAP par lots (message-sets UID, réponses FETCH).
+"""
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import pytest
+
+from app.core.attachment_store import AttachmentStore
+from app.core.config import settings
+from app.core.imap_service import (
+    build_uid_sets,
+    expand_uid_set,
+    fetch_emails_incremental,
+    ImapFetchCancelled,
+    build_size_bounded_uid_sets,
+    parse_uid_fetch_response,
+    parse_email_message,
+    compute_uid_high_water_mark,
+    apply_uid_failures,
+    imap_pool,
+)
+
+
+class TestUidSets:
+    """Tests du découpage des UIDs en message-sets IMAP."""
+
+    def test_contiguous_uids_become_ranges(self):
+        assert build_uid_sets([1, 2, 3, 5, 7, 8], batch_size=200) == ["1:3,5,7:8"]
+
+    def test_batches_are_bounded(self):
+        uid_sets = build_uid_sets(list(range(1, 451)), batch_size=200)
+        assert uid_sets == ["1:200", "201:400", "401:450"]
+
+    def test_unsorted_and_duplicated_uids(self):
+        assert build_uid_sets([9, 3, 3, 4], batch_size=10) == ["3:4,9"]
+
+    def test_empty(self):
+        assert build_uid_sets([], batch_size=10) == []
+
+
+class TestSizeBoundedUidSets:
+    """Tests des lots de corps bornés en octets (mode streaming)."""
+
+    def test_batches_respect_byte_budget(self):
+        sizes = {1: 400, 2: 400, 3: 400, 4: 5000, 5: 100}
+        assert build_size_bounded_uid_sets([1, 2, 3, 4, 5], sizes, 1000, 25) == ["1:2", "3", "4", "5"]
+
+    def test_unknown_size_is_isolated(self):
+        assert build_size_bounded_uid_sets([1, 2], {}, 1000, 25) == ["1", "2"]
+
+
+class TestFetchResponseParsing:
+    """Tests du parsing des réponses UID FETCH multi-messages."""
+
+    def test_uid_before_literal(self):
+        msg_data = [
+            (b'1 (UID 42 RFC822 {5}', b'hello'),
+            b')',
+            (b'2 (UID 43 RFC822 {5}', b'world'),
+            b')',
+        ]
+        assert parse_uid_fetch_response(msg_data) == {42: b'hello', 43: b'world'}
+
+    def test_uid_after_literal(self):
+        msg_data = [
+            (b'1 (BODY[HEADER.FIELDS (MESSAGE-ID)] {20}', b'Message-ID: <a@b>\r\n'),
+            b' UID 7)',
+        ]
+        assert parse_uid_fetch_response(msg_data) == {7: b'Message-ID: <a@b>\r\n'}
+
+
+class TestHighWaterMark:
+    """Tests du calcul du high-water mark UID persisté après ingestion."""
+
+    def test_no_failure_keeps_fetched_mark(self):
+        assert compute_uid_high_water_mark(120, []) == 120
+
+    def test_failure_holds_mark_below_failed_uid(self):
+        assert compute_uid_high_water_mark(120, ["110", "115", None]) == 109
+
+    def test_no_fetched_mark(self):
+        assert compute_uid_high_water_mark(None, ["3"]) is None
+
+    def test_uid_set_expansion(self):
+        assert expand_uid_set("3:5,9") == [3, 4, 5, 9]
+
+    def test_uid_failing_too_often_no_longer_holds_the_mark(self):
+        assert apply_uid_failures(120, ["110", "115"], {"110": 1}, max_attempts=3) == (109, {"110": 2, "115": 1})
+        # Troisième échec de l'UID 110 : abandonné, le mark ne s'arrête plus qu'avant 115
+        assert apply_uid_failures(120, ["110", "115"], {"110": 2, "115": 1}, max_attempts=3) == (114, {"115": 2})
+        assert apply_uid_failures(120, [], {"115": 2}, max_attempts=3) == (120, {})
+
+
+class _FailingBatchMailbox:
+    """Boîte IMAP factice : UIDs 11 à 14, le FETCH du lot contenant l'UID 12 échoue."""
+
+    def select(self, folder):
+        return "OK", [b"4"]
+
+    def response(self, code):
+        return "OK", [b"1"]
+
+    def uid(self, command, uid_set, criteria):
+        if command == "SEARCH":
+            return "OK", [b"11 12 13 14"]
+        if "12" in uid_set.replace(":", ",").split(","):
+            raise OSError("connexion interrompue")
+        msg_data = []
+        for uid in expand_uid_set(uid_set):
+            body = f"Message-ID: <{uid}@example.com>\r\nSubject: {uid}\r\n\r\nBonjour".encode()
+            msg_data.extend([(f"1 (UID {uid} RFC822 {{{len(body)}}}".encode(), body), b")"])
+        return "OK", msg_data
+
+
+class _PartialResponseMailbox(_FailingBatchMailbox):
+    """UIDs 11 à 14 : le lot 11:12 répond NO, l'UID 14 manque à la réponse du lot 13:14."""
+
+    def uid(self, command, uid_set, criteria):
+        if command == "SEARCH":
+            return "OK", [b"11 12 13 14"]
+        if uid_set == "11:12":
+            return "NO", [b"Server busy"]
+        status, msg_data = super().uid(command, "13", criteria)
+        return status, msg_data
+
+
+class TestIncrementalFetchFailures:
+    """Un lot de corps en échec ne doit pas faire avancer le high-water mark au-delà."""
+
+    def test_failed_batch_holds_high_water_mark(self, monkeypatch):
+        monkeypatch.setattr(imap_pool, "acquire", lambda *args, **kwargs: _FailingBatchMailbox())
+        monkeypatch.setattr(imap_pool, "release", lambda mail, discard=False: None)
+        monkeypatch.setattr(settings, "IMAP_FETCH_BODY_BATCH_SIZE", 2)
+
+        result = fetch_emails_incremental(
+            "imap.example.com", 993, "a@example.com", "secret", "AAAAAA", last_uid=10, uidvalidity=1
+        )
+        assert [email["imap_uid"] for email in result["emails"]] == ["13", "14"]
+        assert result["failed_uids"] == ["11", "12"]
+        assert result["last_uid"] == 10
+
+    def test_refused_batch_and_missing_uids_are_failed(self, monkeypatch):
+        monkeypatch.setattr(imap_pool, "acquire", lambda *args, **kwargs: _PartialResponseMailbox())
+        monkeypatch.setattr(imap_pool, "release", lambda mail, discard=False: None)
+        monkeypatch.setattr(settings, "IMAP_FETCH_BODY_BATCH_SIZE", 2)
+
+        result = fetch_emails_incremental(
+            "imap.example.com", 993, "a@example.com", "secret", "AAAAAA", last_uid=10, uidvalidity=1
+        )
+        assert [email["imap_uid"] for email in result["emails"]] == ["13"]
+        assert result["failed_uids"] == ["11", "12", "14"]
+        assert result["last_uid"] == 10 and result["max_uid"] == 14
+
+    def test_should_stop_interrupts_fetch_and_releases_connection(self, monkeypatch):
+        released = []
+        monkeypatch.setattr(imap_pool, "acquire", lambda *args, **kwargs: _FailingBatchMailbox())
+        monkeypatch.setattr(imap_pool, "release", lambda mail, discard=False: released.append(discard))
+        monkeypatch.setattr(settings, "IMAP_FETCH_BODY_BATCH_SIZE", 2)
+        ingested = []
+
+        with pytest.raises(ImapFetchCancelled):
+            fetch_emails_incremental(
+                "imap.example.com", 993, "a@example.com", "secret", "AAAAAA", last_uid=12, uidvalidity=1,
+                on_email=ingested.append, should_stop=lambda: len(ingested) >= 1
+            )
+        assert [email["imap_uid"] for email in ingested] == ["13"]
+        assert released == [True]
+
+
+def _email_with_attachment(payload: bytes, filename: str = "devis.pdf"):
+    msg = MIMEMultipart()
+    msg["Subject"] = "Devis"
+    msg["From"] = "Client <client@example.com>"
+    msg["Message-ID"] = "<abc@example.com>"
+    msg.attach(MIMEText("Bonjour", "plain"))
+    attachment = MIMEApplication(payload, Name=filename)
+    attachment["Content-Disposition"] = f'attachment; filename="{filename}"'
+    msg.attach(attachment)
+    return msg
+
+
+class TestStreamedAttachments:
+    """Tests de l'écriture des pièces jointes pendant le parsing (AttachmentStore)."""
+
+    def test_same_content_is_written_once(self, tmp_path):
+        store = AttachmentStore(1, upload_dir=str(tmp_path), max_size=1024)
+        first = parse_email_message(_email_with_attachment(b"%PDF-1.4 devis"), attachment_store=store)
+        second = parse_email_message(_email_with_attachment(b"%PDF-1.4 devis", "copie.pdf"), attachment_store=store)
+
+        first_att, second_att = first["attachments"][0], second["attachments"][0]
+        assert first_att["content"] is None
+        assert first_att["file_path"] == second_att["file_path"]
+        assert (tmp_path / first_att["file_path"]).read_bytes() == b"%PDF-1.4 devis"
+        assert len(list((tmp_path / "1" / "attachments").iterdir())) == 1
+
+    def test_oversized_attachment_is_not_written(self, tmp_path):
+        store = AttachmentStore(1, upload_dir=str(tmp_path), max_size=100)
+        parsed = parse_email_message(_email_with_attachment(b"x" * 1000), attachment_store=store)
+
+        assert parsed["attachments"][0]["too_large"] is True
+        assert "file_path" not in parsed["attachments"][0]
+        assert not (tmp_path / "1").exists()
@@ -0,0 +1,98 @@
+"""
+Tests du scheduler de synchronisation IMAP multi-entreprises.
+Vérifie le parallélisme, les plafonds global / par serveur et l'agrégation des stats.
+"""
+import asyncio
+import threading
+import time
+
+from app.core.imap_sync_scheduler import run_integration_syncs, summarize_sync_results
+
+
+class _ConcurrencyProbe:
+    """Fonction de sync factice qui mesure la concurrence atteinte (globale et par hôte)."""
+
+    def __init__(self, hosts_by_id, delay=0.05):
+        self.hosts_by_id = hosts_by_id
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.running_per_host = {}
+        self.max_per_host = {}
+
+    def __call__(self, integration_id, timeout_seconds):
+        host = self.hosts_by_id[integration_id]
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            self.running_per_host[host] = self.running_per_host.get(host, 0) + 1
+            self.max_per_host[host] = max(self.max_per_host.get(host, 0), self.running_per_host[host])
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+            self.running_per_host[host] -= 1
+        return {"processed": 1, "created": 1, "errors": 0, "skipped": 0}
+
+
+def _integrations(count, hosts):
+    return [
+        {"id": i, "imap_server": hosts[i % len(hosts)], "email_address": f"box{i}@example.com"}
+        for i in range(count)
+    ]
+
+
+class TestSyncScheduler:
+    """Tests du scheduler de synchronisation."""
+
+    def test_runs_in_parallel_within_global_cap(self):
+        """Les intégrations tournent en parallèle sans dépasser le plafond global."""
+        integrations = _integrations(8, ["imap.a.com", "imap.b.com", "imap.c.com", "imap.d.com"])
+        probe = _ConcurrencyProbe({i["id"]: i["imap_server"] for i in integrations})
+
+        started = time.monotonic()
+        results = asyncio.run(run_integration_syncs(
+            integrations, probe, max_concurrency=4, max_per_host=4, timeout_seconds=5
+        ))
+        elapsed = time.monotonic() - started
+
+        assert len(results) == 8
+        assert probe.max_running <= 4
+        assert probe.max_running > 1
+        # 8 tâches de 50 ms avec 4 en parallèle : bien moins que la somme séquentielle (400 ms)
+        assert elapsed < 0.35
+
+    def test_per_host_cap(self):
+        """Un même serveur IMAP ne reçoit jamais plus de max_per_host connexions simultanées."""
+        integrations = _integrations(6, ["imap.gmail.com"])
+        probe = _ConcurrencyProbe({i["id"]: i["imap_server"] for i in integrations})
+
+        asyncio.run(run_integration_syncs(
+            integrations, probe, max_concurrency=6, max_per_host=2, timeout_seconds=5
+        ))
+
+        assert probe.max_per_host["imap.gmail.com"] <= 2
+
+    def test_errors_and_timeouts_are_reported(self):
+        """Une exception ou un dépassement de délai n'interrompt pas les autres intégrations."""
+        def sync_func(integration_id, timeout_seconds):
+            if integration_id == 0:
+                raise RuntimeError("boom")
+            if integration_id == 1:
+                return {"processed": 0, "created": 0, "errors": 1, "skipped": 0, "timed_out": True}
+            return {"processed": 2, "created": 1, "errors": 0, "skipped": 1}
+
+        results = asyncio.run(run_integration_syncs(
+            _integrations(3, ["imap.a.com"]), sync_func, max_concurrency=3, max_per_host=3, timeout_seconds=5
+        ))
+        by_id = {r["integration_id"]: r for r in results}
+
+        assert by_id[0]["errors"] == 1
+        assert by_id[1]["timed_out"] is True
+        assert by_id[2]["created"] == 1
+        assert all("duration_seconds" in r and "queued_seconds" in r for r in results)
+
+        totals = summarize_sync_results(results)
+        assert totals["errors"] == 2
+        assert totals["timed_out"] == 1
+        assert totals["processed"] == 2
@@ -0,0 +1,141 @@
+"""
+Tests des compteurs de l'inbox (maintenus au flush, déplacements en masse, flux SSE).
+"""
+import asyncio
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.db.base import Base  # importe aussi tous les modèles
+from app.db.models.company import Company
+from app.db.models.conversation import Conversation, InboxFolder, InboxMessage
+from app.db.models.inbox_counter import InboxCounter, merge_folder_counters, recompute_inbox_counters
+from app.core import inbox_counters
+from app.core.config import settings
+from app.core.inbox_counters import get_inbox_counters, stream_inbox_counters
+from app.core.reclassification import bulk_assign_folders
+
+
+@pytest.fixture
+def session_factory():
+    engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine, autoflush=False)
+    db = factory()
+    db.add(Company(name="A", slug="a", code="AAAAAA"))
+    db.add(InboxFolder(company_id=1, name="Devis"))
+    db.commit()
+    db.close()
+    return factory
+
+
+@pytest.fixture
+def db(session_factory):
+    session = session_factory()
+    yield session
+    session.close()
+
+
+def _snapshot(db):
+    """Compteurs maintenus, comparés à un recalcul complet."""
+    maintained = get_inbox_counters(db, 1)
+    recompute_inbox_counters(db, 1)
+    assert get_inbox_counters(db, 1) == maintained
+    db.rollback()
+    return maintained
+
+
+class TestInboxCounters:
+    def test_counters_follow_inserts_updates_and_deletes(self, db):
+        first = Conversation(company_id=1, subject="A", source="email", unread_count=1)
+        second = Conversation(company_id=1, subject="B", source="email", folder_id=1, status="Urgent")
+        db.add_all([first, second])
+        db.commit()
+        assert _snapshot(db)["totals"] == {"total": 2, "unread": 1, "urgent": 1, "to_answer": 1, "waiting": 0, "pending_approval": 0}
+
+        # Anciennes valeurs chargées : deltas ; objet expiré : recalcul de l'entreprise
+        assert first.unread_count == 1
+        first.unread_count = 0
+        first.folder_id = 1
+        db.expire(second)
+        second.status = "En attente"
+        db.commit()
+        counters = _snapshot(db)
+        assert "none" not in counters["folders"] or counters["folders"]["none"]["total"] == 0
+        assert counters["folders"]["1"] == {"total": 2, "unread": 0, "urgent": 0, "to_answer": 1, "waiting": 1, "pending_approval": 0}
+
+        db.delete(second)
+        db.commit()
+        assert _snapshot(db)["totals"]["total"] == 1
+
+    def test_bulk_moves_keep_counters_exact(self, db):
+        conversations = [Conversation(company_id=1, subject=f"S{i}", source="email", unread_count=i % 2) for i in range(4)]
+        db.add_all(conversations)
+        db.commit()
+
+        bulk_assign_folders(db, 1, {conversations[0].id: 1, conversations[1].id: 1})
+        db.commit()
+        assert _snapshot(db)["folders"]["1"]["total"] == 2
+
+        db.query(Conversation).filter(Conversation.folder_id == 1).update({"folder_id": None})
+        merge_folder_counters(db, 1, 1)
+        db.commit()
+        counters = _snapshot(db)
+        assert counters["folders"] == {"none": {"total": 4, "unread": 2, "urgent": 0, "to_answer": 4, "waiting": 0, "pending_approval": 0}}
+
+    def test_message_on_new_conversation_in_one_flush(self, db):
+        conversation = Conversation(company_id=1, subject="S", source="email", unread_count=1)
+        conversation.messages.append(InboxMessage(from_name="Client", content="Bonjour", source="email"))
+        db.add(conversation)
+        db.commit()
+        assert db.query(InboxCounter).one().unread == 1
+
+    def test_recompute_overwrites_rows_in_place(self, db):
+        db.add_all([
+            Conversation(company_id=1, subject="A", source="email", unread_count=1),
+            Conversation(company_id=1, subject="B", source="email", folder_id=1),
+        ])
+        db.commit()
+        row_id = db.query(InboxCounter).filter(InboxCounter.folder_id == 0).one().id
+        db.query(Conversation).filter(Conversation.folder_id == 1).update({"folder_id": None})
+        db.query(InboxCounter).update({"unread": 7})
+
+        recompute_inbox_counters(db, 1)
+        recompute_inbox_counters(db, 1)
+        db.commit()
+        row = db.query(InboxCounter).one()
+        assert (row.id, row.folder_id, row.total, row.unread) == (row_id, 0, 2, 1)
+
+    def test_drifted_counters_are_reconciled_on_read(self, db, monkeypatch):
+        db.add(Conversation(company_id=1, subject="S", source="email", unread_count=1))
+        db.commit()
+        assert get_inbox_counters(db, 1)["totals"]["unread"] == 1
+
+        # Deux transactions concurrentes ont chacune appliqué leur delta
+        db.query(InboxCounter).update({"unread": 2})
+        db.commit()
+        assert get_inbox_counters(db, 1)["totals"]["unread"] == 2  # intervalle non écoulé
+
+        monkeypatch.setattr(inbox_counters, "_reconciled_at", {1: time.monotonic() - 301})
+        monkeypatch.setattr(settings, "INBOX_COUNTERS_RECONCILE_SECONDS", 300)
+        assert get_inbox_counters(db, 1)["totals"]["unread"] == 1
+
+    def test_stream_rereads_on_inbox_events(self, session_factory):
+        async def scenario():
+            stream = stream_inbox_counters(1, session_factory=session_factory, heartbeat_seconds=0.05)
+            first = await stream.__anext__()
+            db = session_factory()
+            db.add(Conversation(company_id=1, subject="S", source="email"))
+            db.commit()
+            db.close()
+            events = [await stream.__anext__() for _ in range(2)]
+            await stream.aclose()
+            return first, events
+
+        first, events = asyncio.run(scenario())
+        assert first.startswith("event: counters\n") and '"total":0' in first
+        assert events[0].startswith("event: counters\n") and '"total":1' in events[0]
+        assert events[1] == ": keepalive\n\n"
@@ -0,0 +1,146 @@
+"""
+Tests des évènements temps réel de l'inbox (publiés au commit, hub par entreprise, flux SSE).
+"""
+import asyncio
+import json
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.db.base import Base  # importe aussi tous les modèles
+from app.db.models.company import Company
+from app.db.models.conversation import Conversation, InboxFolder, InboxMessage
+from app.core import inbox_events
+from app.core.inbox_events import (
+    NOTIFY_PAYLOAD_LIMIT,
+    InboxEventHub,
+    PostgresEventBackend,
+    batch_notifications,
+    inbox_event_hub,
+    stream_inbox_events,
+    unpack_notification,
+)
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine, autoflush=False)()
+    session.add_all([Company(name="A", slug="a", code="AAAAAA"), Company(name="B", slug="b", code="BBBBBB")])
+    session.add(InboxFolder(company_id=1, name="Devis"))
+    session.commit()
+    yield session
+    session.close()
+
+
+def _received(scenario):
+    """Exécute scenario(db) pendant qu'un abonné de l'entreprise 1 écoute ; retourne les évènements reçus."""
+    async def run():
+        subscription = inbox_event_hub.subscribe(1)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, scenario)
+            events = []
+            while (payload := await subscription.get(0.05)) is not None:
+                events.append(payload)
+            return events
+        finally:
+            inbox_event_hub.unsubscribe(subscription)
+    return asyncio.run(run())
+
+
+class TestInboxEvents:
+    def test_events_are_published_on_commit_only(self, db):
+        def scenario():
+            conversation = Conversation(company_id=1, subject="S", source="email")
+            conversation.messages.append(InboxMessage(from_name="Client", content="Bonjour", source="email"))
+            db.add(conversation)
+            db.commit()
+            db.add(Conversation(company_id=1, subject="Annulée", source="email"))
+            db.flush()
+            db.rollback()
+            db.add(Conversation(company_id=2, subject="Autre entreprise", source="email"))
+            db.commit()
+
+        events = _received(scenario)
+
+        assert [event["type"] for event in events] == ["conversation.created", "message.added"]
+        assert events[1]["conversation_id"] == events[0]["conversation_id"]
+
+    def test_folder_and_status_changes(self, db):
+        conversation = Conversation(company_id=1, subject="S", source="email")
+        db.add(conversation)
+        db.commit()
+
+        def scenario():
+            conversation.folder_id = 1
+            conversation.status = "Urgent"
+            db.commit()
+
+        events = {event["type"]: event for event in _received(scenario)}
+
+        assert events["conversation.folder_changed"]["conversation_ids"] == [conversation.id]
+        assert events["conversation.folder_changed"]["folder_id"] == 1
+        assert events["conversation.updated"]["fields"] == ["status"]
+
+    def test_notifications_are_grouped_per_company_under_the_size_limit(self):
+        payloads = [
+            {"type": "message.added", "company_id": 1, "conversation_id": i, "message_id": i, "is_from_client": True}
+            for i in range(300)
+        ] + [{"type": "conversation.created", "company_id": 2, "conversation_id": 1, "folder_id": None, "source": "email"}]
+
+        notifications = batch_notifications(payloads)
+
+        assert 1 < len(notifications) < 10
+        assert all(len(notification.encode()) < NOTIFY_PAYLOAD_LIMIT for notification in notifications)
+        unpacked = [payload for notification in notifications for payload in unpack_notification(notification)]
+        assert unpacked == payloads
+        assert json.loads(notifications[-1]) == {
+            "company_id": 2, "events": [{"type": "conversation.created", "conversation_id": 1, "folder_id": None, "source": "email"}]
+        }
+
+    def test_postgres_backend_sends_one_notification_per_company_and_flush(self, db, monkeypatch):
+        sent = []
+
+        class RecordingBackend(PostgresEventBackend):
+            def send_staged(self, session):
+                payloads = session.info.pop(inbox_events._PENDING_KEY, None)
+                if payloads:
+                    sent.extend(batch_notifications(payloads))
+
+        monkeypatch.setattr(inbox_events, "inbox_event_backend", RecordingBackend())
+        for i in range(20):
+            conversation = Conversation(company_id=1, subject=f"S{i}", source="email")
+            conversation.messages.append(InboxMessage(from_name="Client", content="Bonjour", source="email"))
+            db.add(conversation)
+        db.add(Conversation(company_id=2, subject="Autre", source="email"))
+        db.flush()
+        by_company = {json.loads(notification)["company_id"]: unpack_notification(notification) for notification in sent}
+        assert len(sent) == 2 and len(by_company[1]) == 40 and len(by_company[2]) == 1
+
+        inbox_events.publish_event(db, 1, "folder.deleted", folder_id=1)
+        db.commit()
+        assert len(sent) == 3 and unpack_notification(sent[2])[0]["type"] == "folder.deleted"
+
+    def test_sse_stream_formats_events_and_keepalive(self):
+        hub = InboxEventHub()
+
+        async def scenario():
+            stream = stream_inbox_events(1, hub=hub, heartbeat_seconds=0.05)
+            assert await stream.__anext__() == "retry: 3000\n\n"
+            pending = asyncio.ensure_future(stream.__anext__())
+            await asyncio.sleep(0.01)
+            hub.dispatch({"type": "message.added", "company_id": 1, "conversation_id": 7})
+            hub.dispatch({"type": "message.added", "company_id": 2, "conversation_id": 8})
+            first = await pending
+            keepalive = await stream.__anext__()
+            await stream.aclose()
+            return first, keepalive, hub.subscriber_count()
+
+        first, keepalive, remaining = asyncio.run(scenario())
+        assert first.startswith("event: message.added\n")
+        assert json.loads(first.split("data: ")[1]) == {"conversation_id": 7}
+        assert keepalive == ": keepalive\n\n"
+        assert remaining == 0
@@ -0,0 +1,74 @@
+"""
+Tests de la recherche plein texte de l'inbox (index FTS5 SQLite : triggers, pertinence, extraits).
+"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db.base import Base  # importe aussi tous les modèles
+from app.db.models.company import Company
+from app.db.models.conversation import Conversation, InboxMessage
+from app.core.inbox_search import ensure_search_index, search_conversations
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine, autoflush=False)()
+    session.add_all([Company(name="A", slug="a", code="AAAAAA"), Company(name="B", slug="b", code="BBBBBB")])
+    session.commit()
+    # Index créé après des données existantes : reconstruit depuis les tables
+    session.add(Conversation(company_id=1, subject="Ancienne facture", source="email"))
+    session.commit()
+    ensure_search_index(engine)
+    yield session
+    session.close()
+
+
+def _conversation(db, subject, *contents, company_id=1, status="À répondre"):
+    conversation = Conversation(company_id=company_id, subject=subject, source="email", status=status)
+    db.add(conversation)
+    db.flush()
+    for content in contents:
+        db.add(InboxMessage(conversation_id=conversation.id, company_id=company_id, from_name="X", content=content, source="email"))
+    db.commit()
+    return conversation
+
+
+class TestInboxSearch:
+    def test_ranks_subject_and_message_matches_with_highlighted_snippets(self, db):
+        in_subject = _conversation(db, "Devis rénovation", "Bonjour, voici ma demande")
+        in_body = _conversation(db, "Question", "Pouvez-vous m'envoyer un devis <b>rapide</b> ?")
+        _conversation(db, "Autre", "Rien à voir")
+        _conversation(db, "Devis", "devis", company_id=2)
+
+        hits = search_conversations(db, 1, "devis")
+
+        assert [hit.conversation_id for hit in hits] == [in_subject.id, in_body.id]
+        assert "<mark>Devis</mark>" in hits[0].snippet
+        # Contenu de l'email échappé, seuls les termes trouvés sont balisés
+        assert "<mark>devis</mark> &lt;b&gt;rapide&lt;/b&gt;" in hits[1].snippet
+
+    def test_prefix_accents_and_filters(self, db):
+        urgent = _conversation(db, "Sujet", "Intervention électricité demain", status="Urgent")
+        _conversation(db, "Sujet", "Intervention electricien", status="Résolu")
+
+        assert len(search_conversations(db, 1, "interv elec")) == 2
+        hits = search_conversations(db, 1, "electricite", status="Urgent")
+        assert [hit.conversation_id for hit in hits] == [urgent.id]
+        assert search_conversations(db, 1, "!!!") == []
+
+    def test_index_follows_updates_deletes_and_backfill(self, db):
+        conversation = _conversation(db, "Sujet", "ancien texte")
+        message = db.query(InboxMessage).filter(InboxMessage.conversation_id == conversation.id).one()
+        message.content = "nouveau contenu"
+        db.commit()
+
+        assert search_conversations(db, 1, "ancien texte") == []
+        assert [hit.conversation_id for hit in search_conversations(db, 1, "nouveau")] == [conversation.id]
+        db.delete(message)
+        db.commit()
+        assert search_conversations(db, 1, "nouveau") == []
+        # Conversation créée avant l'index
+        assert len(search_conversations(db, 1, "facture")) == 1
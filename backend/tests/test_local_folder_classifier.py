@@ -0,0 +1,134 @@
+"""
+Tests du classifieur local des dossiers (n-grammes hachés, plus proche centroïde, seuil de confiance).
+"""
+from datetime import datetime, timedelta
+
+import threading
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.db.base import Base  # importe aussi tous les modèles
+from app.db.models.company import Company
+from app.db.models.conversation import Conversation, InboxFolder, InboxMessage
+from app.core.folder_rules import CompiledFolderRules, auto_classify_folders
+from app.core.config import settings
+from app.core.local_folder_classifier import LocalFolderClassifier, featurize
+
+
+QUOTE = "Bonjour, pourriez-vous m'envoyer un devis pour la rénovation de ma cuisine ({n} m2) ? Merci"
+INVOICE = "Veuillez trouver ci-joint la facture n° {n} à régler avant échéance. Service comptabilité"
+
+
+@pytest.fixture
+def session_factory():
+    engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+
+@pytest.fixture
+def folders(session_factory):
+    db = session_factory()
+    db.add(Company(name="A", slug="a", code="AAAAAA"))
+    db.commit()
+    rows = [
+        InboxFolder(company_id=1, name="Devis", ai_rules={"autoClassify": True}),
+        InboxFolder(company_id=1, name="Factures", ai_rules={"autoClassify": True}),
+    ]
+    db.add_all(rows)
+    db.commit()
+    rules = CompiledFolderRules(auto_classify_folders(rows))
+    db.close()
+    return rules
+
+
+def _file(session_factory, folder_id, template, count, sender, ai_classified=False):
+    db = session_factory()
+    old = datetime.utcnow() - timedelta(days=2)
+    for n in range(count):
+        conversation = Conversation(
+            company_id=1, subject="Demande", source="email", folder_id=folder_id, created_at=old, ai_classified=ai_classified
+        )
+        db.add(conversation)
+        db.flush()
+        db.add(InboxMessage(
+            conversation_id=conversation.id, company_id=1, from_name="Client", from_email=sender.format(n=n),
+            content=template.format(n=n), source="email", is_from_client=True
+        ))
+    db.commit()
+    db.close()
+
+
+class TestLocalFolderClassifier:
+    def test_featurize_is_normalized_and_ignores_numbers(self):
+        first, second = featurize("Facture", INVOICE.format(n=12), "a@b.fr"), featurize("Facture", INVOICE.format(n=98), "a@b.fr")
+        assert first == second
+        assert abs(sum(value * value for value in first.values()) - 1.0) < 1e-9
+
+    def test_confident_messages_are_classified_locally(self, session_factory, folders):
+        _file(session_factory, 1, QUOTE, 25, "client{n}@gmail.com")
+        _file(session_factory, 2, INVOICE, 25, "compta@fournisseur.fr")
+        classifier = LocalFolderClassifier(session_factory=session_factory)
+
+        results = classifier.predict(1, folders, [
+            {"conversation_id": 10, "subject": "Demande", "content": QUOTE.format(n=40), "from_email": "new@gmail.com"},
+            {"conversation_id": 11, "subject": "Demande", "content": INVOICE.format(n=7), "from_email": "compta@fournisseur.fr"},
+            {"conversation_id": 12, "subject": "Bonjour", "content": "Le match de samedi est reporté", "from_email": "ami@club.fr"},
+        ])
+
+        # Message sans ressemblance : laissé à l'IA
+        assert results == {10: 1, 11: 2}
+        assert classifier.stats()["local_hits"] == 2
+
+    def test_no_model_without_enough_examples(self, session_factory, folders):
+        _file(session_factory, 1, QUOTE, 5, "client{n}@gmail.com")
+        classifier = LocalFolderClassifier(session_factory=session_factory)
+
+        assert classifier.get_model(1, folders) is None
+        assert classifier.predict(1, folders, [{"conversation_id": 1, "content": QUOTE.format(n=1)}]) == {}
+
+    def test_rules_change_retrains(self, session_factory, folders):
+        _file(session_factory, 1, QUOTE, 25, "client{n}@gmail.com")
+        classifier = LocalFolderClassifier(session_factory=session_factory)
+        model = classifier.get_model(1, folders)
+        assert model is not None and classifier.get_model(1, folders) is model
+
+        only_invoices = CompiledFolderRules([folder for folder in folders.ai_folders if folder["id"] == 2])
+        assert classifier.get_model(1, only_invoices) is None
+
+    def test_auto_classified_conversations_are_not_examples(self, session_factory, folders, monkeypatch):
+        _file(session_factory, 1, QUOTE, 25, "client{n}@gmail.com", ai_classified=True)
+        classifier = LocalFolderClassifier(session_factory=session_factory)
+        assert classifier.get_model(1, folders) is None
+
+        # Modèle absent : nouvel essai après le TTL négatif (court), sans attendre le réapprentissage
+        _file(session_factory, 1, QUOTE, 25, "client{n}@gmail.com")
+        assert classifier.get_model(1, folders) is None
+        monkeypatch.setattr(settings, "LOCAL_CLASSIFIER_NEGATIVE_TTL_SECONDS", 0)
+        model = classifier.get_model(1, folders)
+        assert model is not None and model.examples[1] == 25
+
+    def test_training_is_single_flight(self, session_factory, folders, monkeypatch):
+        _file(session_factory, 1, QUOTE, 25, "client{n}@gmail.com")
+        classifier = LocalFolderClassifier(session_factory=session_factory)
+        started, release = threading.Event(), threading.Event()
+        train = classifier.train
+
+        def slow_train(company_id, rules):
+            started.set()
+            release.wait(5)
+            return train(company_id, rules)
+
+        monkeypatch.setattr(classifier, "train", slow_train)
+        results = []
+        worker = threading.Thread(target=lambda: results.append(classifier.get_model(1, folders)))
+        worker.start()
+        assert started.wait(5)
+        # Apprentissage déjà en cours : pas de second apprentissage, messages laissés à l'IA
+        assert classifier.get_model(1, folders) is None
+        release.set()
+        worker.join(5)
+        assert results[0] is not None and classifier.stats()["trainings"] == 1
@@ -0,0 +1,81 @@
+"""
+Tests du dédoublonnage des emails par Message-ID normalisé (index (company_id, message_id)).
+"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+from app.db.base import Base  # importe aussi tous les modèles
+from app.db.models.company import Company
+from app.db.models.conversation import Conversation, InboxMessage
+from app.api.routes.inbox_integrations import is_duplicate_message, find_conversation_from_reply
+from app.core.email_threading import register_thread_keys
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def _email(db, company, external_id):
+    conversation = Conversation(company_id=company.id, subject="Devis", source="email")
+    db.add(conversation)
+    db.flush()
+    message = InboxMessage(
+        conversation_id=conversation.id,
+        from_name="Client",
+        content="Bonjour",
+        source="email",
+        external_id=external_id,
+    )
+    db.add(message)
+    db.flush()
+    return conversation, message
+
+
+class TestMessageIdDedup:
+    """Tests des recherches par égalité sur le Message-ID normalisé."""
+
+    def _companies(self, db):
+        first = Company(name="A", slug="a", code="AAAAAA")
+        second = Company(name="B", slug="b", code="BBBBBB")
+        db.add_all([first, second])
+        db.flush()
+        return first, second
+
+    def test_insert_fills_company_and_normalized_id(self, db):
+        company, _ = self._companies(db)
+        _, message = _email(db, company, " <abc@mail.example> ")
+
+        assert message.company_id == company.id
+        assert message.message_id == "abc@mail.example"
+
+    def test_duplicate_is_scoped_to_company(self, db):
+        first, second = self._companies(db)
+        _email(db, first, "abc@mail.example")
+
+        assert is_duplicate_message(db, first.id, "<abc@mail.example>", "x@y.z", "")
+        assert not is_duplicate_message(db, second.id, "abc@mail.example", "x@y.z", "")
+        # Plus de correspondance partielle (ancien LIKE '%id%')
+        assert not is_duplicate_message(db, first.id, "abc@mail", "x@y.z", "")
+
+    def test_unique_index_rejects_second_copy(self, db):
+        company, _ = self._companies(db)
+        _email(db, company, "abc@mail.example")
+
+        with pytest.raises(IntegrityError):
+            _email(db, company, "<abc@mail.example>")
+
+    def test_reply_threading_uses_message_id(self, db):
+        company, _ = self._companies(db)
+        conversation, message = _email(db, company, "abc@mail.example")
+        # Les chemins d'ingestion enregistrent le Message-ID dans email_thread_keys
+        register_thread_keys(db, company.id, conversation.id, [message.external_id])
+
+        found = find_conversation_from_reply(db, company.id, "<abc@mail.example>", None, "", None)
+        assert found.id == conversation.id
@@ -0,0 +1,96 @@
+"""
+Tests du limiteur de débit OpenAI (seaux à jetons RPM/TPM) et de l'appel limité.
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db.base import Base  # importe aussi tous les modèles
+from app.core import openai_client
+from app.core.openai_client import (
+    DatabaseBucketBackend,
+    MemoryBucketBackend,
+    OpenAIRateLimiter,
+    TPM_BUCKET_KEY,
+    create_chat_completion_sync,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestMemoryBucketBackend:
+    def test_consumes_up_to_capacity_then_waits(self):
+        clock = FakeClock()
+        backend = MemoryBucketBackend(clock=clock)
+        for _ in range(3):
+            assert backend.consume("k", 1, 3, 1.0) == 0
+        assert backend.consume("k", 1, 3, 1.0) == pytest.approx(1.0)
+
+    def test_refills_over_time(self):
+        clock = FakeClock()
+        backend = MemoryBucketBackend(clock=clock)
+        assert backend.consume("k", 3, 3, 0.5) == 0
+        clock.now += 2
+        assert backend.consume("k", 1, 3, 0.5) == 0
+        assert backend.consume("k", 1, 3, 0.5) == pytest.approx(2.0)
+
+    def test_negative_amount_refunds(self):
+        backend = MemoryBucketBackend(clock=FakeClock())
+        assert backend.consume("k", 10, 10, 1.0) == 0
+        backend.consume("k", -4, 10, 1.0)
+        assert backend.consume("k", 4, 10, 1.0) == 0
+        assert backend.consume("k", 1, 10, 1.0) > 0
+
+
+class TestDatabaseBucketBackend:
+    def test_shares_bucket_state_through_the_table(self):
+        engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(engine)
+        backend = DatabaseBucketBackend(session_factory=sessionmaker(bind=engine))
+        assert backend.consume("openai:rpm", 2, 2, 0.0001) == 0
+        assert backend.consume("openai:rpm", 1, 2, 0.0001) > 0
+
+
+class TestOpenAIRateLimiter:
+    def test_acquire_and_reconcile_adjust_token_bucket(self):
+        backend = MemoryBucketBackend(clock=FakeClock())
+        limiter = OpenAIRateLimiter(backend, rpm=10, tpm=1000)
+
+        async def scenario():
+            await limiter.acquire(900)
+            # Usage réel bien inférieur à l'estimation : les tokens sont rendus
+            await limiter.reconcile(900, 100)
+
+        asyncio.run(scenario())
+        assert backend.consume(TPM_BUCKET_KEY, 900, 1000, 1000 / 60.0) == 0
+
+
+class TestCreateChatCompletion:
+    def test_sync_call_goes_through_limiter(self, monkeypatch):
+        backend = MemoryBucketBackend(clock=FakeClock())
+        monkeypatch.setattr(openai_client, "rate_limiter", OpenAIRateLimiter(backend, rpm=10, tpm=10000))
+        calls = []
+
+        async def create(**params):
+            calls.append(params)
+            return SimpleNamespace(choices=[], usage=SimpleNamespace(total_tokens=42))
+
+        client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+        response = create_chat_completion_sync(
+            client, model="gpt-4o-mini", messages=[{"role": "user", "content": "Bonjour"}], max_tokens=50
+        )
+
+        assert response.usage.total_tokens == 42
+        assert calls[0]["model"] == "gpt-4o-mini"
+        # Une requête consommée sur le seau RPM
+        assert backend.consume(openai_client.RPM_BUCKET_KEY, 9, 10, 10 / 60.0) == 0
+        assert backend.consume(openai_client.RPM_BUCKET_KEY, 1, 10, 10 / 60.0) > 0
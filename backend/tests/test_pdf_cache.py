@@ -0,0 +1,68 @@
+"""
+Tests du cache des PDF rendus (clé par contenu, éviction LRU sur disque, ETag / If-None-Match).
+"""
+import os
+import time
+
+from starlette.requests import Request
+
+from app.core.config import settings
+from app.core.pdf_cache import PdfCache, cached_pdf_response, pdf_cache_key
+
+
+def _request(if_none_match=None):
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+class TestPdfCache:
+    def test_key_follows_content_and_image_bytes(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path))
+        logo = tmp_path / "1" / "logo.png"
+        logo.parent.mkdir()
+        logo.write_bytes(b"logo v1")
+
+        content = {"quote": {"number": "DEV-2026-001", "total_ttc": "120.00"}}
+        key = pdf_cache_key("quote", content, images=["1/logo.png"])
+        assert pdf_cache_key("quote", dict(content), images=["uploads/1/logo.png"]) == key
+        assert pdf_cache_key("invoice", content, images=["1/logo.png"]) != key
+        assert pdf_cache_key("quote", {"quote": {"number": "DEV-2026-001", "total_ttc": "130.00"}}, images=["1/logo.png"]) != key
+
+        logo.write_bytes(b"logo version 2")
+        assert pdf_cache_key("quote", content, images=["1/logo.png"]) != key
+
+    def test_disk_cache_evicts_least_recently_used(self, tmp_path):
+        cache = PdfCache(tmp_path, max_bytes=250)
+        now = time.time()
+        for index, key in enumerate(("aa1", "bb2", "cc3")):
+            cache.put(key, b"x" * 100)
+            os.utime(cache._path(key), (now - 100 + index, now - 100 + index))
+        # Premier ajout au-delà de la limite : les plus anciens partent
+        assert cache.get("aa1") is None
+        assert cache.get("cc3") == b"x" * 100
+        os.utime(cache._path("bb2"), (now - 200, now - 200))
+        cache.put("dd4", b"y" * 100)
+        assert cache.get("bb2") is None
+        assert cache.get("dd4") == b"y" * 100
+
+    def test_response_renders_once_and_honours_if_none_match(self, tmp_path):
+        cache = PdfCache(tmp_path, max_bytes=10_000)
+        renders = []
+
+        def render():
+            renders.append(1)
+            return b"%PDF-1.4 contenu"
+
+        def respond(if_none_match=None):
+            return cached_pdf_response(_request(if_none_match), "abc123", render, "devis.pdf", cache=cache)
+
+        first = respond()
+        second = respond()
+        assert first.body == second.body == b"%PDF-1.4 contenu"
+        assert first.headers["etag"] == '"abc123"'
+        assert len(renders) == 1
+
+        not_modified = respond('W/"abc123"')
+        assert not_modified.status_code == 304 and not_modified.body == b""
+        assert respond('"other"').status_code == 200
+        assert len(renders) == 1
@@ -0,0 +1,82 @@
+"""
+Tests du chargement des images des PDF (cache mémoire des logos et signatures redimensionnés).
+"""
+import io
+import os
+
+from PIL import Image as PILImage
+
+import app.core.supabase_storage_service as supabase_storage_service
+from app.core.pdf_image_loader import BrandingAssetCache, invalidate_company_assets, load_image_for_pdf
+
+
+def _png(width, height, color=(255, 0, 0, 255)):
+    output = io.BytesIO()
+    PILImage.new("RGBA", (width, height), color).save(output, format="PNG")
+    return output.getvalue()
+
+
+class TestBrandingAssetCache:
+    def test_local_image_is_scaled_once_and_reloaded_when_changed(self, tmp_path):
+        cache = BrandingAssetCache(max_bytes=10 * 1024 * 1024)
+        logo = tmp_path / "1" / "logo.png"
+        logo.parent.mkdir()
+        logo.write_bytes(_png(4000, 2000))
+
+        result = load_image_for_pdf("1/logo.png", 35, 35, tmp_path, cache=cache)
+        assert result.loaded
+        # Réduit à la boîte d'affichage (35 mm à 300 dpi), proportions conservées
+        cached = cache.lookup("1/logo.png", (os.stat(logo).st_mtime_ns, os.stat(logo).st_size), 35, 35)
+        with PILImage.open(io.BytesIO(cached)) as scaled:
+            assert scaled.size == (414, 207)
+        assert abs(result.image.drawWidth / result.image.drawHeight - 2) < 0.01
+
+        logo.write_bytes(_png(100, 100, color=(0, 0, 255, 255)))
+        os.utime(logo, ns=(0, 10**9))
+        reloaded_result = load_image_for_pdf("uploads/1/logo.png", 35, 35, tmp_path, cache=cache)
+        assert reloaded_result.image.drawWidth == reloaded_result.image.drawHeight
+        with PILImage.open(io.BytesIO(cache.lookup("1/logo.png", (10**9, logo.stat().st_size), 35, 35))) as reloaded:
+            assert reloaded.size == (100, 100)
+
+    def test_remote_image_is_downloaded_once_until_company_invalidation(self, tmp_path, monkeypatch):
+        cache = BrandingAssetCache(max_bytes=10 * 1024 * 1024)
+        downloads = []
+
+        def download_file(path):
+            downloads.append(path)
+            return _png(200, 100)
+
+        monkeypatch.setattr(supabase_storage_service, "is_supabase_storage_configured", lambda: True)
+        monkeypatch.setattr(supabase_storage_service, "download_file", download_file)
+
+        for _ in range(3):
+            assert load_image_for_pdf("7/signature_abc.png", 70, 25, tmp_path, cache=cache).loaded
+        assert downloads == ["7/signature_abc.png"]
+
+        cache.invalidate_company(8)
+        assert load_image_for_pdf("7/signature_abc.png", 70, 25, tmp_path, cache=cache).loaded
+        assert len(downloads) == 1
+
+        cache.invalidate_company(7)
+        assert cache.size == 0
+        assert load_image_for_pdf("7/signature_abc.png", 70, 25, tmp_path, cache=cache).loaded
+        assert len(downloads) == 2
+
+        # Invalidation faite par un autre processus (route d'upload) : vue via le marqueur de version
+        invalidate_company_assets(7, tmp_path)
+        assert load_image_for_pdf("7/signature_abc.png", 70, 25, tmp_path, cache=cache).loaded
+        assert load_image_for_pdf("7/signature_abc.png", 70, 25, tmp_path, cache=cache).loaded
+        assert len(downloads) == 3
+
+    def test_memory_is_bounded_least_recently_used_first(self):
+        first, second, third = _png(50, 50), _png(60, 60), _png(70, 70)
+        cache = BrandingAssetCache(max_bytes=len(first) + len(second) + len(third) - 1)
+        cache.store("1/a.png", 1, "s", first, 35, 35)
+        cache.store("1/b.png", 1, "s", second, 35, 35)
+        assert cache.lookup("1/a.png", "s", 35, 35) == first
+        cache.store("1/c.png", 1, "s", third, 35, 35)
+
+        assert cache.lookup("1/b.png", "s", 35, 35) is None
+        assert cache.lookup("1/a.png", "s", 35, 35) == first
+        assert cache.lookup("1/c.png", "s", 35, 35) == third
+        assert cache.size <= cache.max_bytes
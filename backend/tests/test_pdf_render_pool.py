@@ -0,0 +1,109 @@
+"""
+Tests du pool de rendu des PDF (profondeur bornée, délai, rendu à partir d'instantanés).
+"""
+import asyncio
+import pickle
+import threading
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db.base import Base  # importe aussi tous les modèles
+from app.db.models.billing import Quote, QuoteLine
+from app.db.models.client import Client
+from app.db.models.company import Company
+from app.core.pdf_render_pool import (
+    DocumentSnapshot,
+    PdfRenderPool,
+    PdfRenderQueueFull,
+    PdfRenderTimeout,
+    render_quote_pdf,
+)
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine, autoflush=False)()
+    session.add(Company(name="A", slug="a", code="AAAAAA"))
+    session.add(Client(company_id=1, name="Client A", email="client@example.com"))
+    session.commit()
+    yield session
+    session.close()
+
+
+class TestPdfRenderPool:
+    def test_pending_renders_are_bounded(self):
+        pool = PdfRenderPool(workers=0, max_pending=1, timeout=5)
+        release = threading.Event()
+        try:
+            first = pool.submit(release.wait, 5)
+            with pytest.raises(PdfRenderQueueFull):
+                pool.submit(release.wait, 5)
+            release.set()
+            first.result(timeout=5)
+            # La place est rendue à la fin du rendu
+            assert pool.submit(pow, 2, 3).result(timeout=5) == 8
+        finally:
+            release.set()
+            pool.shutdown()
+
+    def test_timeout_keeps_the_slot_until_the_render_ends(self):
+        pool = PdfRenderPool(workers=0, max_pending=1, timeout=0.1)
+        release = threading.Event()
+        try:
+            with pytest.raises(PdfRenderTimeout):
+                asyncio.run(pool.run(release.wait, 5))
+            assert pool.pending == 1
+            release.set()
+            assert asyncio.run(pool.run(pow, 3, 2, timeout=5)) == 9
+        finally:
+            release.set()
+            pool.shutdown()
+
+    def test_blocking_wait_for_sync_routes(self):
+        pool = PdfRenderPool(workers=0, max_pending=2, timeout=0.1)
+        release = threading.Event()
+        try:
+            with pytest.raises(PdfRenderTimeout):
+                pool.result(pool.submit(release.wait, 5))
+            release.set()
+            assert pool.result(pool.submit(pow, 2, 5), timeout=5) == 32
+        finally:
+            release.set()
+            pool.shutdown()
+
+    def test_process_pool_runs_renders_out_of_process(self):
+        pool = PdfRenderPool(workers=1, max_pending=4, timeout=60)
+        try:
+            assert asyncio.run(pool.run(pow, 2, 10)) == 1024
+        finally:
+            pool.shutdown()
+
+    def test_quote_is_rendered_from_a_picklable_snapshot(self, db):
+        quote = Quote(
+            company_id=1, client_id=1, number="DEV-2026-001", amount=Decimal("120.00"),
+            subtotal_ht=Decimal("100.00"), total_tax=Decimal("20.00"), total_ttc=Decimal("120.00")
+        )
+        quote.lines.append(QuoteLine(
+            description="Prestation", quantity=Decimal("1"), unit_price_ht=Decimal("100.00"),
+            tax_rate=Decimal("20"), subtotal_ht=Decimal("100.00"), tax_amount=Decimal("20.00"),
+            total_ttc=Decimal("120.00"), order=0
+        ))
+        db.add(quote)
+        db.commit()
+
+        snapshot = pickle.loads(pickle.dumps(DocumentSnapshot.of(quote, lines=[DocumentSnapshot.of(line) for line in quote.lines])))
+        assert snapshot.number == "DEV-2026-001" and snapshot.lines[0].description == "Prestation"
+
+        pool = PdfRenderPool(workers=0, max_pending=2, timeout=60)
+        try:
+            pdf_bytes = asyncio.run(render_quote_pdf(
+                quote, db.get(Client, 1), db.get(Company, 1), company_settings_data={}, pool=pool
+            ))
+        finally:
+            pool.shutdown()
+        assert pdf_bytes.startswith(b"%PDF")
@@ -0,0 +1,102 @@
+"""
+Tests de la reclassification en masse (pagination par clé, messages par fonctions de fenêtre, UPDATE groupé).
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.db.base import Base  # importe aussi tous les modèles
+from app.db.models.company import Company
+from app.db.models.conversation import Conversation, InboxFolder, InboxMessage
+from app.core import folder_ai_classifier, reclassification
+from app.core.folder_filter_service import reclassify_all_conversations_with_filters
+from app.core.folder_rules import invalidate_folder_rules
+from app.core.reclassification import load_page_messages
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def db(engine):
+    session = sessionmaker(bind=engine, autoflush=False)()
+    session.add(Company(name="A", slug="a", code="AAAAAA"))
+    session.commit()
+    yield session
+    session.close()
+    invalidate_folder_rules()
+
+
+def _conversation(db, messages, folder_id=None):
+    conversation = Conversation(company_id=1, subject="Sujet", source="email", folder_id=folder_id)
+    db.add(conversation)
+    db.flush()
+    start = datetime(2026, 1, 1)
+    for i, (content, from_client) in enumerate(messages):
+        db.add(InboxMessage(
+            conversation_id=conversation.id, company_id=1, from_name="X", from_email="client@example.com",
+            content=content, source="email", is_from_client=from_client, created_at=start + timedelta(minutes=i)
+        ))
+    return conversation
+
+
+class TestReclassification:
+    def test_window_query_returns_first_client_and_last_message(self, db):
+        conversation = _conversation(db, [("réponse", False), ("question 1", True), ("question 2", True), ("merci", False)])
+        only_company = _conversation(db, [("newsletter", False)])
+        db.commit()
+
+        messages = load_page_messages(db, [conversation.id, only_company.id])
+
+        first_client, last = messages[conversation.id]
+        assert (first_client.content, last.content) == ("question 1", "merci")
+        assert messages[only_company.id][0] is None
+        assert messages[only_company.id][1].content == "newsletter"
+
+        long_conversation = _conversation(db, [("x" * 600, True)])
+        db.commit()
+        assert len(load_page_messages(db, [long_conversation.id])[long_conversation.id][0].content) == 500
+        assert len(load_page_messages(db, [long_conversation.id], content_length=None)[long_conversation.id][0].content) == 600
+
+    def test_filters_reclassify_pages_with_constant_queries(self, engine, db, monkeypatch):
+        db.add(InboxFolder(company_id=1, name="Factures", ai_rules={"autoClassify": True, "filters": {"keywords": ["facture"]}}))
+        for i in range(30):
+            # Mot-clé au-delà du préfixe de contenu envoyé à l'IA
+            _conversation(db, [(f"{'x' * 600} facture {i}" if i % 2 else f"bonjour {i}", True)])
+        db.commit()
+        monkeypatch.setattr(reclassification, "PAGE_SIZE", 10)
+
+        statements = []
+        event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        stats = reclassify_all_conversations_with_filters(db, 1)
+
+        assert stats == {"total": 30, "classified": 15, "not_classified": 15, "errors": 0}
+        assert db.query(Conversation).filter(Conversation.folder_id == 1).count() == 15
+        # Par page : pagination + messages + UPDATE + report sur les compteurs (pas de requête par conversation)
+        updates = [s for s in statements if s.lstrip().upper().startswith("UPDATE")]
+        assert len(updates) == 3
+        assert len(statements) < 25
+
+    def test_ai_reclassify_applies_only_valid_folders_in_bulk(self, db, monkeypatch):
+        db.add(InboxFolder(company_id=1, name="Devis", ai_rules={"autoClassify": True}))
+        first = _conversation(db, [("devis cuisine", True)])
+        second = _conversation(db, [("autre", True)])
+        db.commit()
+
+        class FakeClassifier:
+            enabled = True
+
+            def classify_messages_batch(self, messages, folders, company_context=None, rules=None, company_id=None):
+                return {first.id: 1, second.id: 99}
+
+        monkeypatch.setattr(folder_ai_classifier, "get_ai_classifier_service", lambda: FakeClassifier())
+        stats = folder_ai_classifier.reclassify_all_conversations(db, 1)
+
+        assert stats == {"total": 2, "classified": 1, "not_classified": 0, "errors": 1}
+        assert {c.id: c.folder_id for c in db.query(Conversation).all()} == {first.id: 1, second.id: None}
@@ -0,0 +1,65 @@
+"""
+Tests de l'envoi SMTP (un email transmis n'est jamais signalé comme non envoyé).
+"""
+import smtplib
+
+import pytest
+
+from app.core.config import settings
+from app.core.smtp_service import EmailDeliveryUncertain, send_email_smtp
+
+
+class _FakeSmtp:
+    """Serveur SMTP factice ; `fail` : méthode qui lève l'exception associée."""
+    fail = {}
+    sent = []
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def _maybe_fail(self, method):
+        if method in self.fail:
+            raise self.fail[method]
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        self._maybe_fail("sendmail")
+        self.sent.append(to_addrs)
+
+    def quit(self):
+        self._maybe_fail("quit")
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    monkeypatch.setattr(settings, "SENDGRID_API_KEY", None, raising=False)
+    monkeypatch.setattr(smtplib, "SMTP", _FakeSmtp)
+    _FakeSmtp.fail, _FakeSmtp.sent = {}, []
+    return _FakeSmtp
+
+
+def _send():
+    return send_email_smtp("smtp.example.com", 587, "a@example.com", "secret", "client@example.com", "Re: Devis", "Bonjour")
+
+
+class TestSendEmailSmtp:
+    def test_quit_failure_after_sendmail_counts_as_sent(self, smtp):
+        smtp.fail = {"quit": smtplib.SMTPServerDisconnected("connexion fermée")}
+        assert _send() is True
+        assert smtp.sent == ["client@example.com"]
+
+    def test_connection_lost_during_sendmail_is_uncertain(self, smtp):
+        smtp.fail = {"sendmail": smtplib.SMTPServerDisconnected("connexion perdue")}
+        with pytest.raises(EmailDeliveryUncertain):
+            _send()
+
+    def test_explicit_refusal_is_a_plain_failure(self, smtp):
+        smtp.fail = {"sendmail": smtplib.SMTPDataError(554, b"Rejected")}
+        with pytest.raises(Exception) as error:
+            _send()
+        assert not isinstance(error.value, EmailDeliveryUncertain)